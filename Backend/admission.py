@@ -0,0 +1,233 @@
+"""
+Admission control for inbound gesture traffic
+Every update (HTTP status/batch/gesture request, WebSocket message) passes
+two checks before it is applied:
+  - per client: a token bucket refilled at rate updates/s holding up to burst,
+    keyed by the client's address plus the id it names itself by (X-Client-Id
+    header, or the session of a WebSocket hello), if any. Ids are the
+    client's choice, so each address gets buckets for at most
+    max_ids_per_address of them; further ids share the address's own bucket,
+    and a client cannot escape the limit by sending a new id every time. An
+    empty bucket means 429 (or a WebSocket throttle message) with the time
+    until the next token.
+  - global backpressure: while connected to the broker, the outbound backlog
+    (MQTT messages queued or awaiting their PUBACK) and how long the oldest
+    of them has waited. Past max_backlog or max_latency the server counts as
+    overloaded and answers every update with 503 until both are back under
+    half. A broker outage is not overload: the journal absorbs that.
+Stop/resume updates (ones that flip stopped) are never refused nor charged;
+ones that would have been are counted as exempt.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+from event_log import events
+
+REASON_RATE = 'rate_limited'
+REASON_OVERLOAD = 'overloaded'
+
+MESSAGES = {
+    REASON_RATE: 'Too many updates from this client; slow down',
+    REASON_OVERLOAD: 'Server overloaded; retry later',
+}
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated = now
+
+
+class AdmissionController:
+    """Per-client token buckets plus a backlog-driven overload switch; thread-safe"""
+
+    def __init__(self, rate, burst, max_backlog, max_latency, retry_after=1.0, max_clients=10000,
+                 check_interval=0.1, max_ids_per_address=16):
+        # rate 0 turns the per-client limit off
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.max_backlog = max_backlog
+        self.max_latency = max_latency
+        self.retry_after = retry_after
+        self.max_clients = max_clients
+        self.check_interval = check_interval
+        self.max_ids_per_address = max_ids_per_address
+        # (address, client id or None) -> TokenBucket, least recently seen first
+        self._buckets = OrderedDict()
+        # address -> number of buckets it has under client ids
+        self._ids = {}
+        self._lock = threading.Lock()
+        # () -> (backlog depth, oldest age in seconds), or None when it does not apply
+        self._backlog = None
+        self._overloaded = False
+        self._checked_at = -math.inf
+        self.admitted = 0
+        self.shed = {REASON_RATE: 0, REASON_OVERLOAD: 0}
+        self.exempt = 0
+
+    def set_backlog(self, backlog):
+        self._backlog = backlog
+
+    def admit(self, transport, key, urgent=False, now=None):
+        """None if the update may be applied, else (reason, retry_after seconds)
+
+        key is (client address, client id or None); urgent (stop/resume)
+        updates are always admitted.
+        """
+        now = time.monotonic() if now is None else now
+        overloaded = self.overloaded(now)
+        with self._lock:
+            if overloaded:
+                decision = (REASON_OVERLOAD, self.retry_after)
+            else:
+                decision = self._take(key, now, charge=not urgent)
+            if decision is None:
+                self.admitted += 1
+                return None
+            if urgent:
+                self.exempt += 1
+            else:
+                self.shed[decision[0]] += 1
+        if urgent:
+            metrics.ADMISSION_EXEMPT.inc(transport)
+            return None
+        metrics.ADMISSION_SHED.inc(transport, decision[0])
+        return decision
+
+    def count_shed(self, transport, reason):
+        with self._lock:
+            self.shed[reason] += 1
+        metrics.ADMISSION_SHED.inc(transport, reason)
+
+    def _take(self, key, now, charge):
+        # Caller holds the lock
+        if not self.rate:
+            return None
+        key = self._bucket_key(key)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.burst, now)
+            if key[1] is not None:
+                self._ids[key[0]] = self._ids.get(key[0], 0) + 1
+            if len(self._buckets) > self.max_clients:
+                # The least recently seen client; a refilled bucket is as good as a new one
+                self._forget(self._buckets.popitem(last=False)[0])
+        else:
+            self._buckets.move_to_end(key)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+        if bucket.tokens >= 1.0:
+            if charge:
+                bucket.tokens -= 1.0
+            return None
+        return REASON_RATE, (1.0 - bucket.tokens) / self.rate
+
+    def _bucket_key(self, key):
+        # Caller holds the lock
+        address, client_id = key
+        if client_id is None or key in self._buckets or self._ids.get(address, 0) < self.max_ids_per_address:
+            return key
+        return address, None
+
+    def _forget(self, key):
+        # Caller holds the lock
+        address, client_id = key
+        if client_id is not None:
+            if self._ids[address] <= 1:
+                del self._ids[address]
+            else:
+                self._ids[address] -= 1
+
+    def overloaded(self, now=None):
+        """Whether the outbound backlog is past its limits (re-evaluated every check_interval)"""
+        now = time.monotonic() if now is None else now
+        if now - self._checked_at < self.check_interval:
+            return self._overloaded
+        self._checked_at = now
+        backlog = self._backlog() if self._backlog is not None else None
+        if backlog is None:
+            overloaded = False
+        elif self._overloaded:
+            # Hysteresis: stay overloaded until both are back under half
+            overloaded = backlog[0] > self.max_backlog / 2 or backlog[1] > self.max_latency / 2
+        else:
+            overloaded = backlog[0] >= self.max_backlog or backlog[1] >= self.max_latency
+        if overloaded != self._overloaded:
+            self._overloaded = overloaded
+            metrics.BACKPRESSURE.set(int(overloaded))
+            if overloaded:
+                events.warning('admission.overloaded', "🚦 Outbound backlog too deep; shedding non-stop updates",
+                               backlog=backlog[0], oldest_ms=round(backlog[1] * 1000, 1))
+            else:
+                events.info('admission.recovered', "🟢 Outbound backlog drained; accepting updates again")
+        return overloaded
+
+    def stats(self):
+        backlog = self._backlog() if self._backlog is not None else None
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'clients': len(self._buckets),
+                'max_ids_per_address': self.max_ids_per_address,
+                'overloaded': self._overloaded,
+                'backlog': backlog,
+                'max_backlog': self.max_backlog,
+                'max_latency': self.max_latency,
+                'admitted': self.admitted,
+                'shed': dict(self.shed),
+                'exempt': self.exempt
+            }
+
+
+class SocketThrottle:
+    """Admission for one WebSocket: once a message is shed, the rest are dropped until retry_after has passed
+
+    key is (client address, client id or None), as for AdmissionController.admit.
+    """
+
+    def __init__(self, controller, key):
+        self.controller = controller
+        self.key = key
+        self.until = 0.0
+        self.reason = None
+
+    def admit(self, urgent, now=None):
+        """(admitted, notice): notice is the (reason, retry_after) to tell the client, once per window"""
+        now = time.monotonic() if now is None else now
+        if not urgent and now < self.until:
+            self.controller.count_shed('ws', self.reason)
+            return False, None
+        decision = self.controller.admit('ws', self.key, urgent, now)
+        if decision is None:
+            return True, None
+        self.reason = decision[0]
+        self.until = now + decision[1]
+        return False, decision
+
+
+def shed_response(decision):
+    """(HTTP status, JSON body dict, Retry-After header value) for a refused update"""
+    reason, retry_after = decision
+    body = {'error': MESSAGES[reason], 'reason': reason, 'retry_after_ms': math.ceil(retry_after * 1000)}
+    return (429 if reason == REASON_RATE else 503), body, str(max(1, math.ceil(retry_after)))
+
+
+def is_urgent(data, stopped):
+    """Whether a status payload (or a list of frames) flips stopped away from its current value
+
+    Clients send stopped with every full state, so only a change counts as a
+    stop/resume transition.
+    """
+    if isinstance(data, dict):
+        return 'stopped' in data and data['stopped'] != stopped
+    if isinstance(data, list):
+        return any(isinstance(frame, dict) and 'stopped' in frame and frame['stopped'] != stopped
+                   for frame in data)
+    return False
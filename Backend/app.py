@@ -1,35 +1,78 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response
 from flask_sock import Sock
 from datetime import datetime
+import argparse
 import json
+import os
 import paho.mqtt.client as mqtt
 import ssl
 import time
 import threading
+from mqtt_publisher import MQTTPublisher
+from outbound_journal import OutboundJournal
+from mqtt_supervisor import MQTTSupervisor, Backoff
+from config import (HIVEMQ_HOST, HIVEMQ_PORT, MQTT_TOPIC, HIVEMQ_USERNAME, HIVEMQ_PASSWORD,
+                    MQTT_USE_TLS, MQTT_QOS, MQTT_STOP_TOPIC, MQTT_STOP_QOS,
+                    WS_SEND_POLICY, WS_MAX_QUEUE, WS_SLOW_CLIENT_TIMEOUT, SERVER_HOST, SERVER_PORT,
+                    LONG_POLL_MAX_WAIT, SSE_KEEPALIVE_INTERVAL, CONTROL_RATE_HZ,
+                    LOG_LEVEL, LOG_FORMAT, LOG_BUFFER_SIZE, LOG_SAMPLE_RATES, MAX_ROBOTS,
+                    MQTT_JOURNAL_PATH, MQTT_JOURNAL_SIZE, MQTT_JOURNAL_COMPACTION, MQTT_REPLAY_RATE,
+                    MQTT_RECONNECT_MIN, MQTT_RECONNECT_MAX, MQTT_WIRE_FORMAT, GESTURE_CLASSIFIER,
+                    BATCH_MAX_FRAMES, WS_ACK_EVERY, WS_ACK_MS, RECORD_PATH, RECORD_MAX_BYTES,
+                    ADMISSION_RATE, ADMISSION_BURST, ADMISSION_MAX_BACKLOG, ADMISSION_MAX_LATENCY,
+                    ADMISSION_RETRY_AFTER, ADMISSION_IDS_PER_ADDRESS, CLUSTER_BACKPLANE, CLUSTER_NODE_ID,
+                    CLUSTER_CHANNEL, CLUSTER_HEARTBEAT, CLUSTER_LEASE, LOCAL_MQTT, ROBOT_UDP, ROBOT_UDP_PORT,
+                    ROBOT_TRANSPORT, UDP_COPIES, UDP_RETRIES,
+                    TRANSPORT_PROBE_INTERVAL, TRANSPORT_PROBE_TOPIC, TRANSPORT_SWITCH_MARGIN, MQTT_VERSION,
+                    MQTT5_MESSAGE_EXPIRY, MQTT5_MAX_AGE, MQTT5_STAMP, MQTT_MAX_INFLIGHT)
+from state_store import ValidationError, version_from_etag
+from robots import RobotRegistry, FleetControlLoop, UnknownRobot, InvalidRobotId, FleetFull
+from ws_hub import WebSocketHub
+from wire_format import WireFormats, capability_subscriptions
+from gesture_classifier import GestureClassifier, is_gesture_event
+from batch_ingest import parse_batch, ingest_batch
+from ws_protocol import IngestStream, is_hello, throttle_message
+from admission import AdmissionController, SocketThrottle, shed_response, is_urgent
+from recorder import recording
+from cluster import ClusterNode, open_backplane, default_node_id, ORIGIN_CLUSTER
+from transports import MQTTTransport, TransportRouter, open_transports, TRANSPORT_CLOUD
+from mqtt5 import MQTT5Session, new_client, PROTOCOL_V5
+import metrics
+from metrics import observe_stage
+from event_log import events, parse_level, DEBUG
 
 app = Flask(__name__)
 sock = Sock(app)
 
-# MQTT Configuration for HiveMQ Cloud
-HIVEMQ_HOST = "a2016a11d3614243aeb27bda75dd2204.s1.eu.hivemq.cloud"
-HIVEMQ_PORT = 8883
-MQTT_TOPIC = "robot"
-HIVEMQ_USERNAME = "kushal"
-HIVEMQ_PASSWORD = "Hackthenorth25"
+# Structured event log: written by a background thread, recent events kept for /debug/recent-events
+events.configure(level=LOG_LEVEL, sample_rates=LOG_SAMPLE_RATES, fmt=LOG_FORMAT, capacity=LOG_BUFFER_SIZE)
 
 # Global variables for MQTT status
 mqtt_connected = False
 mqtt_client = None
+mqtt_supervisor = None
+# MQTT5Session when MQTT_VERSION is 5 (see mqtt5.py)
+mqtt_session = None
+mqtt_connections = 0
+# Set when running as one node of a cluster (see start_cluster)
+cluster = None
 
 def on_connect(client, userdata, flags, rc):
     """Callback when MQTT client connects"""
-    global mqtt_connected
+    global mqtt_connected, mqtt_connections
     if rc == 0:
         mqtt_connected = True
-        print(f"✅ Connected to HiveMQ Cloud! Result code: {rc}")
+        mqtt_connections += 1
+        if mqtt_connections > 1:
+            metrics.MQTT_RECONNECTS.inc()
+        events.info('mqtt.connected', "✅ Connected to HiveMQ Cloud!", rc=rc)
+        # Robots announce the wire formats they decode as retained messages on <topic>/format
+        client.subscribe([(topic, 1) for topic in capability_subscriptions(MQTT_TOPIC)])
+        # Flush whatever queued up while we were away without waiting out the retry backoff
+        mqtt_publisher.resume()
     else:
         mqtt_connected = False
-        print(f"❌ Failed to connect to HiveMQ, return code: {rc}")
+        events.error('mqtt.connect_failed', "❌ Failed to connect to HiveMQ", rc=rc)
         # Connection result codes:
         # 0: Connection successful
         # 1: Connection refused - incorrect protocol version
@@ -40,143 +83,294 @@ def on_connect(client, userdata, flags, rc):
 
 def on_publish(client, userdata, mid):
     """Callback when message is published"""
-    print(f"📡 Message published successfully! Message ID: {mid}")
+    events.debug('mqtt.puback', "📡 Message published successfully!", mid=mid)
+    # Probe round trips, and stop-lane messages matched to their PUBACK for latency tracking
+    cloud_transport.acknowledge(mid)
+
+def on_message(client, userdata, msg):
+    """Callback for subscribed topics (wire format announcements)"""
+    wire_formats.on_capability(msg.topic, msg.payload)
 
 def on_disconnect(client, userdata, rc):
     """Callback when MQTT client disconnects"""
     global mqtt_connected
     mqtt_connected = False
-    print(f"🔌 Disconnected from HiveMQ Cloud. Result code: {rc}")
+    events.warning('mqtt.disconnected', "🔌 Disconnected from HiveMQ Cloud", rc=rc)
+    # Messages still waiting for their PUBACK try the other robot transports
+    cloud_transport.disconnected()
 
 def on_log(client, userdata, level, buf):
     """Callback for MQTT client logging"""
-    print(f"🔍 MQTT Log: {buf}")
+    events.debug('mqtt.paho', buf, level=level)
 
 def init_mqtt():
-    """Initialize MQTT client with proper configuration"""
-    global mqtt_client
+    """Set up the MQTT client and start connecting in the background (returns immediately)"""
+    global mqtt_client, mqtt_supervisor, mqtt_session
+    
+    # Outbound publishes are handled off the request path
+    mqtt_publisher.start()
     
     try:
         # Create client with unique ID
-        client_id = f"flask_robot_{int(time.time())}"
-        mqtt_client = mqtt.Client(client_id=client_id, clean_session=True)
+        client_id = f"flask_robot_{int(time.time())}_{os.getpid()}"
+        mqtt_client = new_client(client_id, MQTT_VERSION)
+        if MQTT_VERSION == PROTOCOL_V5:
+            # Topic aliases, message expiry, seq/ts properties and the broker's receive maximum
+            mqtt_session = MQTT5Session(mqtt_client, MQTT5_MESSAGE_EXPIRY, MQTT5_MAX_AGE, MQTT_MAX_INFLIGHT,
+                                        stamp=MQTT5_STAMP)
+        else:
+            mqtt_client.max_inflight_messages_set(MQTT_MAX_INFLIGHT)
         
-        # Set callbacks
-        mqtt_client.on_connect = on_connect
+        # Set callbacks (connect/disconnect go through the supervisor)
         mqtt_client.on_publish = on_publish
-        mqtt_client.on_disconnect = on_disconnect
-        mqtt_client.on_log = on_log  # Enable logging for debugging
+        mqtt_client.on_message = on_message
+        if events.enabled(DEBUG):
+            # paho formats every log line before the callback; only hook it up when wanted
+            mqtt_client.on_log = on_log
         
         # Set credentials
         mqtt_client.username_pw_set(HIVEMQ_USERNAME, HIVEMQ_PASSWORD)
         
         # Configure TLS for secure connection
-        context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
-        context.check_hostname = False
-        context.verify_mode = ssl.CERT_NONE
-        mqtt_client.tls_set_context(context)
+        if MQTT_USE_TLS:
+            context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            mqtt_client.tls_set_context(context)
         
         # Alternative TLS setup (try this if above doesn't work)
         # mqtt_client.tls_set(ca_certs=None, certfile=None, keyfile=None,
         #                    cert_reqs=ssl.CERT_REQUIRED, tls_version=ssl.PROTOCOL_TLS,
         #                    ciphers=None)
         
-        print(f"🔄 Attempting to connect to {HIVEMQ_HOST}:{HIVEMQ_PORT}")
+        events.info('mqtt.connecting', "🔄 Attempting to connect", host=HIVEMQ_HOST, port=HIVEMQ_PORT)
         
-        # Connect with timeout
-        mqtt_client.connect(HIVEMQ_HOST, HIVEMQ_PORT, 60)
-        mqtt_client.loop_start()
+        # Connects, drives the network loop and reconnects with jittered backoff
+        mqtt_supervisor = MQTTSupervisor(mqtt_client, HIVEMQ_HOST, HIVEMQ_PORT, keepalive=60,
+                                         backoff=Backoff(MQTT_RECONNECT_MIN, MQTT_RECONNECT_MAX),
+                                         on_connect=on_connect, on_disconnect=on_disconnect,
+                                         session=mqtt_session).start()
         
-        # Wait a bit for connection
-        time.sleep(2)
-        
-        if mqtt_connected:
-            print(f"✅ MQTT initialization successful")
-        else:
-            print(f"⚠️ MQTT connection may still be in progress...")
+        # LAN broker / UDP link (when configured) and round-trip probes for all of them
+        transport_router.start()
             
     except Exception as e:
-        print(f"❌ MQTT initialization failed: {e}")
+        events.error('mqtt.init_failed', "❌ MQTT initialization failed", error=str(e))
         return False
     
     return True
 
-# Store current robot state
-robot_state = {
-    'stopped': False,
-    'hand': {
-        'right': {
-            'horizontal': 'not active',
-            'active': True
-        },
-        'left': {
-            'horizontal': 'not active', 
-            'vertical': 'not active',
-            'active': True
-        }
-    }
-}
+def _send_to_mqtt(topic, payload, qos=MQTT_QOS):
+    """Publish a serialized payload to HiveMQ Cloud (the cloud transport; runs on the publisher worker)
 
-# Track connected websocket clients
-clients = set()
-
-def publish_to_mqtt(data):
-    """Publish robot state to HiveMQ Cloud"""
-    global mqtt_client, mqtt_connected
-    
+    Returns the MQTT message id on success so acks can be matched, False otherwise.
+    """
     if not mqtt_client:
-        print("❌ MQTT client not initialized")
+        events.error('mqtt.not_initialized', "❌ MQTT client not initialized")
         return False
     
     try:
-        # Check if connected
+        # Reconnecting is the supervisor's job; the publisher retries (or journals) this one
         if not mqtt_connected:
-            print("❌ MQTT not connected, attempting reconnect...")
-            try:
-                mqtt_client.reconnect()
-                time.sleep(1)  # Give it a moment
-            except Exception as e:
-                print(f"❌ Reconnection failed: {e}")
-                return False
-        
-        # Prepare payload
-        payload = json.dumps(data, indent=2)
+            events.debug('mqtt.not_connected', "⏳ MQTT not connected, publish deferred", topic=topic)
+            return False
         
         # Publish with QoS 1 for guaranteed delivery
-        result = mqtt_client.publish(MQTT_TOPIC, payload, qos=1, retain=False)
+        publish = mqtt_session.publish if mqtt_session else mqtt_client.publish
+        result = publish(topic, payload, qos=qos, retain=False)
         
         if result.rc == mqtt.MQTT_ERR_SUCCESS:
-            print(f"📡 Published to MQTT topic '{MQTT_TOPIC}':")
-            print(f"    {payload}")
-            return True
+            events.info('mqtt.published', "📡 Published to MQTT", topic=topic, mid=result.mid, payload=payload)
+            return result.mid
         else:
-            print(f"❌ MQTT publish failed with return code: {result.rc}")
+            events.error('mqtt.publish_failed', "❌ MQTT publish failed", topic=topic, rc=result.rc)
             return False
             
     except Exception as e:
-        print(f"❌ MQTT publish exception: {e}")
+        events.error('mqtt.publish_failed', "❌ MQTT publish exception", topic=topic, error=str(e))
         return False
 
+# Delivery paths to the robot: the cloud broker plus a LAN broker and/or direct UDP
+# link when configured; each message takes the fastest healthy one (see transports.py)
+cloud_transport = MQTTTransport(TRANSPORT_CLOUD, _send_to_mqtt, lambda: mqtt_connected,
+                                probe_topic=TRANSPORT_PROBE_TOPIC)
+transport_router = TransportRouter(
+    open_transports(cloud_transport, LOCAL_MQTT, ROBOT_UDP, ROBOT_TRANSPORT,
+                    client_id=f"flask_robot_local_{os.getpid()}", udp_port=ROBOT_UDP_PORT, copies=UDP_COPIES,
+                    retries=UDP_RETRIES, probe_topic=TRANSPORT_PROBE_TOPIC, protocol=MQTT_VERSION,
+                    max_inflight=MQTT_MAX_INFLIGHT, message_expiry=MQTT5_MESSAGE_EXPIRY, max_age=MQTT5_MAX_AGE,
+                    stamp=MQTT5_STAMP),
+    probe_interval=TRANSPORT_PROBE_INTERVAL, switch_margin=TRANSPORT_SWITCH_MARGIN)
+
+# Latest-wins outbound queue (plus stop priority lane) drained by a background worker
+# (one pending slot per robot topic); unsent messages go to the on-disk journal during outages
+mqtt_publisher = MQTTPublisher(
+    transport_router.send, qos=MQTT_QOS, max_topics=MAX_ROBOTS + 16, replay_rate=MQTT_REPLAY_RATE,
+    journal=OutboundJournal(MQTT_JOURNAL_PATH, MQTT_JOURNAL_SIZE, MQTT_JOURNAL_COMPACTION) if MQTT_JOURNAL_PATH else None)
+transport_router.on_ack = mqtt_publisher.acknowledge
+
+# Per-topic wire format (JSON or compact binary), negotiated with each robot
+wire_formats = WireFormats(default=MQTT_WIRE_FORMAT)
+
+def publish_to_mqtt(data, topic=MQTT_TOPIC, ingest_time=None):
+    """Queue robot state for the robot (over the fastest transport) without blocking"""
+    # Callers normally pass an already encoded payload; plain dicts are encoded in the topic's format here
+    payload = data if isinstance(data, (bytes, str)) else wire_formats.encode(topic, data)
+    queued = mqtt_publisher.submit(topic, payload, ingest_time=ingest_time)
+    if not queued:
+        events.warning('mqtt.queue_full', "⚠️ MQTT outbound queue full, dropped update", topic=topic)
+    return queued
+
+def _publishing():
+    # In cluster mode only the owner publishes to the robot topics
+    return cluster is None or cluster.is_owner
+
+def publish_robot_state(session, payload, ingest_time=None):
+    """Queue a robot's state snapshot on its own topic, in the format that robot negotiated"""
+    if not _publishing():
+        return False
+    payload = wire_formats.state_payload(session.topic, session.state_store, payload)
+    recording.outbound('state', session.topic, payload)
+    return publish_to_mqtt(payload, session.topic, ingest_time)
+
+def publish_stop_transition(session, version, changes, ingest_time=None):
+    """Send a stop/resume transition on the priority lane, ahead of any queued state"""
+    if not _publishing():
+        return False
+    payload = wire_formats.stop_payload(session.topic, session.robot_id, changes['stopped'], version)
+    recording.outbound('stop', session.stop_topic, payload)
+    return mqtt_publisher.submit_priority(session.stop_topic, payload, qos=MQTT_STOP_QOS, ingest_time=ingest_time)
+
+def _new_ws_hub():
+    # Per-robot set of websocket clients, each with its own outbound queue
+    return WebSocketHub(max_queue=WS_MAX_QUEUE, policy=WS_SEND_POLICY, slow_client_timeout=WS_SLOW_CLIENT_TIMEOUT)
+
+# Per-robot state (versioned, updated atomically under that robot's own lock),
+# websocket clients and MQTT topics
+robots = RobotRegistry(_new_ws_hub, publish_robot_state, publish_stop_transition,
+                       MQTT_TOPIC, MQTT_STOP_TOPIC, max_robots=MAX_ROBOTS,
+                       gesture_factory=lambda: GestureClassifier(**GESTURE_CLASSIFIER))
+
+# The default robot behind the original single-robot routes and topics
+default_robot = robots.default
+state_store = default_robot.state_store
+ws_hub = default_robot.ws_hub
+
+# Publishes every robot's latest state at a fixed rate; stop/resume transitions go out immediately
+control_loop = FleetControlLoop(robots, rate_hz=CONTROL_RATE_HZ)
+
+metrics.MQTT_CONNECTED.set_function(lambda: int(mqtt_connected))
+metrics.MQTT_QUEUE_DEPTH.set_function(lambda: mqtt_publisher.stats()['queue_depth'])
+metrics.MQTT_JOURNAL_PENDING.set_function(lambda: (mqtt_publisher.stats()['journal'] or {}).get('pending', 0))
+metrics.WS_CLIENTS.set_function(robots.ws_clients)
+metrics.ROBOTS.set_function(lambda: len(robots))
+
+# Admission control: per-client rate limit, and shedding while the outbound backlog is too deep
+admission = AdmissionController(ADMISSION_RATE, ADMISSION_BURST, ADMISSION_MAX_BACKLOG, ADMISSION_MAX_LATENCY,
+                                retry_after=ADMISSION_RETRY_AFTER, max_ids_per_address=ADMISSION_IDS_PER_ADDRESS)
+admission.set_backlog(lambda: mqtt_publisher.backlog() if transport_router.available() else None)
+
+def _robot_or_404(robot_id, create=False):
+    """Session for robot_id, or an (error response, status) tuple"""
+    try:
+        return robots.get(robot_id, create=create), None
+    except InvalidRobotId:
+        return None, (jsonify({'error': f'Invalid robot id: {robot_id}'}), 400)
+    except UnknownRobot:
+        return None, (jsonify({'error': f'Unknown robot: {robot_id}'}), 404)
+    except FleetFull:
+        return None, (jsonify({'error': 'Robot limit reached'}), 503)
+
+def _mqtt_ready():
+    # Ready once the broker connection is up (or when running without MQTT)
+    return mqtt_connected or mqtt_supervisor is None
+
 @app.route('/health')
 def health_check():
-    """Simple health check endpoint"""
-    return jsonify({
+    """Liveness (always 200 while serving); ?ready=1 answers 503 until MQTT is connected"""
+    ready = _mqtt_ready()
+    body = jsonify({
         'status': 'ok', 
         'message': 'Robot control server is running',
-        'mqtt_connected': mqtt_connected
+        'ready': ready,
+        'mqtt_connected': mqtt_connected,
+        'mqtt_state': mqtt_supervisor.state if mqtt_supervisor else 'disabled'
     })
+    if request.args.get('ready') and not ready:
+        return body, 503
+    return body
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Stage latency histograms, counters and gauges in Prometheus text format"""
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/recent-events')
+def recent_events():
+    """Most recent log events from the in-memory ring buffer"""
+    limit = request.args.get('limit', 100, type=int)
+    return jsonify({
+        'events': events.recent(limit, event=request.args.get('event'),
+                                min_level=parse_level(request.args.get('level', 'debug'))),
+        'log': events.stats()
+    })
+
+@app.route('/debug/recording')
+def recording_status():
+    """Traffic recorder state (see recorder.py)"""
+    return jsonify(recording.stats())
+
+@app.route('/debug/admission')
+def admission_status():
+    """Rate limiting and backpressure state (see admission.py)"""
+    return jsonify(admission.stats())
+
+@app.route('/debug/cluster')
+def cluster_status():
+    """Cluster membership, publishing owner and replication counters (see cluster.py)"""
+    return jsonify(cluster.stats() if cluster else {'enabled': False})
 
 @app.route('/mqtt-status')
 def mqtt_status():
     """Check MQTT connection status"""
     return jsonify({
         'connected': mqtt_connected,
+        'ready': _mqtt_ready(),
         'client_initialized': mqtt_client is not None,
+        'connection': mqtt_supervisor.stats() if mqtt_supervisor else None,
         'host': HIVEMQ_HOST,
         'port': HIVEMQ_PORT,
-        'topic': MQTT_TOPIC
+        'topic': MQTT_TOPIC,
+        'stop_topic': MQTT_STOP_TOPIC,
+        'robots': len(robots),
+        'publisher': mqtt_publisher.stats(),
+        'transports': transport_router.stats(),
+        'wire_format': wire_formats.stats()
     })
 
+@app.route('/debug/transports')
+def transports_status():
+    """Robot transports: which one is active, probe round trips and failovers (see transports.py)"""
+    return jsonify(transport_router.stats())
+
+@app.route('/control-status')
+def control_status():
+    """Control loop rate, tick overruns and jitter"""
+    return jsonify(control_loop.stats())
+
+@app.route('/ws-status')
+def ws_status():
+    """Per-client WebSocket queue depth and lag (default robot, or ?robot=<id>)"""
+    session, error = _robot_or_404(request.args.get('robot', default_robot.robot_id))
+    if error:
+        return error
+    return jsonify(session.ws_hub.metrics())
+
+@app.route('/api/robots', methods=['GET'])
+def list_robots():
+    """Robots known to this server with their topics, state version and client count"""
+    return jsonify({'robots': robots.summary(), 'max_robots': robots.max_robots})
+
 @app.route('/test-publish')
 def test_publish():
     """Test MQTT publishing"""
@@ -195,67 +389,234 @@ def test_publish():
     })
 
 # Get current robot state
+# Supports conditional requests (ETag = state version, 304 when unchanged) and
+# long-polling: /api/state?since=<version>&wait=<seconds> holds the request
+# until the state moves past <version> or the wait runs out.
 @app.route('/api/state', methods=['GET'])
 def get_robot_state():
-    return jsonify(robot_state)
+    return _state_response(default_robot)
+
+@app.route('/api/robots/<robot_id>/state', methods=['GET'])
+def get_fleet_robot_state(robot_id):
+    session, error = _robot_or_404(robot_id)
+    return error or _state_response(session)
+
+def _state_response(session):
+    state_store = session.state_store
+    known = request.args.get('since', type=int)
+    if known is None:
+        known = version_from_etag(request.headers.get('If-None-Match'))
+    wait = min(request.args.get('wait', 0.0, type=float), LONG_POLL_MAX_WAIT)
+
+    if known is not None and wait > 0 and known == state_store.version:
+        state_store.wait_for_change(known, wait)
+
+    version, payload = state_store.serialized_bytes()
+    if known == version:
+        response = Response(status=304)
+    else:
+        response = Response(payload, mimetype='application/json')
+    response.headers['ETag'] = f'"{version}"'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# Server-Sent Events stream for dashboards: one snapshot, then only deltas
+@app.route('/api/stream', methods=['GET'])
+def stream_robot_state():
+    return _state_stream(default_robot)
+
+@app.route('/api/robots/<robot_id>/stream', methods=['GET'])
+def stream_fleet_robot_state(robot_id):
+    session, error = _robot_or_404(robot_id)
+    return error or _state_stream(session)
+
+def _state_stream(session):
+    state_store = session.state_store
+    last_seen = version_from_etag(request.headers.get('Last-Event-ID'))
+
+    def stream():
+        version = -1 if last_seen is None else last_seen
+        while True:
+            current, changes, is_full = state_store.changes_since(version)
+            if is_full:
+                changes['version'] = current
+                yield f"event: snapshot\nid: {current}\ndata: {json.dumps(changes)}\n\n"
+            elif current != version:
+                changes['version'] = current
+                yield f"event: delta\nid: {current}\ndata: {json.dumps(changes)}\n\n"
+            version = current
+            if state_store.wait_for_change(version, SSE_KEEPALIVE_INTERVAL) == version:
+                # Idle: a comment line keeps proxies from closing the stream
+                yield ": keepalive\n\n"
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 # Receive robot status from GestureController (HTTP POST)
 @app.route('/api/robot-status', methods=['POST'])
 def update_robot_status():
+    return _update_status(default_robot, time.monotonic())
+
+@app.route('/api/robots/<robot_id>/status', methods=['POST'])
+def update_fleet_robot_status(robot_id):
+    received_at = time.monotonic()
+    session, error = _robot_or_404(robot_id, create=True)
+    return error or _update_status(session, received_at)
+
+def _update_status(session, received_at):
+    metrics.UPDATES.inc('http')
+    recording.inbound('http', session.robot_id, request.get_data())
     try:
         data = request.get_json(force=True)
         if not data:
+            metrics.UPDATE_ERRORS.inc('http')
             return jsonify({'error': 'No data received'}), 400
+        shed = _admit('http', session, data)
+        if shed:
+            return shed
 
-        print(f"📨 Received robot status: {json.dumps(data, indent=2)}")
-
-        # Validate and update stopped state
-        if 'stopped' in data:
-            robot_state['stopped'] = bool(data['stopped'])
-
-        # Validate and update hand directions
-        if 'hand' in data:
-            hand = data['hand']
-            if 'right' in hand:
-                if isinstance(hand['right'], dict):
-                    if 'horizontal' in hand['right']:
-                        robot_state['hand']['right']['horizontal'] = str(hand['right']['horizontal'])
-                    if 'active' in hand['right']:
-                        robot_state['hand']['right']['active'] = bool(hand['right']['active'])
-                else:
-                    # Legacy support
-                    robot_state['hand']['right']['horizontal'] = str(hand['right'])
-                    
-            if 'left' in hand:
-                if isinstance(hand['left'], dict):
-                    if 'horizontal' in hand['left']:
-                        robot_state['hand']['left']['horizontal'] = str(hand['left']['horizontal'])
-                    if 'vertical' in hand['left']:
-                        robot_state['hand']['left']['vertical'] = str(hand['left']['vertical'])
-                    if 'active' in hand['left']:
-                        robot_state['hand']['left']['active'] = bool(hand['left']['active'])
-                else:
-                    # Legacy support
-                    robot_state['hand']['left']['horizontal'] = str(hand['left'])
-
-        print(f"🤖 Updated robot state: {json.dumps(robot_state, indent=2)}")
+        observe_stage('parse', received_at, time.monotonic())
+        # Validated against the state schema and merged in one pass
+        version, delta = session.state_store.apply(data)
+        observe_stage('merge', received_at, time.monotonic())
+        events.info('robot.update', "🤖 Updated robot state", robot=session.robot_id, version=version,
+                    delta=delta, data=data)
 
-        # Publish to MQTT
-        mqtt_success = publish_to_mqtt(robot_state)
+        # Published on the next control tick (immediately for stop/resume)
+        mqtt_success = session.control_loop.notify(delta, version, received_at)
 
-        # Broadcast to dashboard clients
-        broadcast_state()
+        # Broadcast to this robot's dashboard clients
+        broadcast_state(session)
 
         return jsonify({
             'status': 'ok',
             'mqtt_published': mqtt_success,
-            'mqtt_connected': mqtt_connected
+            'mqtt_connected': mqtt_connected,
+            'version': version
         }), 200
 
+    except ValidationError as e:
+        metrics.UPDATE_ERRORS.inc('http')
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        print(f"❌ Error updating robot status: {str(e)}")
+        metrics.UPDATE_ERRORS.inc('http')
+        events.error('robot.update_failed', "❌ Error updating robot status", error=str(e))
         return jsonify({'error': str(e)}), 500
 
+# Batched frames (JSON array, {"frames": [...]} or NDJSON) from clients that buffer:
+# applied in timestamp order, stale seqs rejected, published and broadcast once
+@app.route('/api/robot-status/batch', methods=['POST'])
+def update_robot_status_batch():
+    return _update_batch(default_robot, time.monotonic())
+
+@app.route('/api/robots/<robot_id>/batch', methods=['POST'])
+def update_fleet_robot_batch(robot_id):
+    received_at = time.monotonic()
+    session, error = _robot_or_404(robot_id, create=True)
+    return error or _update_batch(session, received_at)
+
+def _admit(transport, session, data):
+    """None if an update may go ahead, else the 429/503 response (stop/resume always goes ahead)"""
+    decision = admission.admit(transport, _client_key(), is_urgent(data, session.state_store.peek('stopped')))
+    if decision is None:
+        return None
+    status, body, retry_after = shed_response(decision)
+    response = jsonify(body)
+    response.headers['Retry-After'] = retry_after
+    return response, status
+
+def _client_key():
+    """Who an update counts against: its address, plus the id the client sends (if any)"""
+    return request.remote_addr, request.headers.get('X-Client-Id')
+
+def _update_batch(session, received_at):
+    metrics.UPDATES.inc('batch')
+    recording.inbound('batch', session.robot_id, request.get_data())
+    try:
+        frames = parse_batch(request.get_data(), BATCH_MAX_FRAMES)
+    except ValueError as e:
+        metrics.UPDATE_ERRORS.inc('batch')
+        return jsonify({'error': str(e)}), 400
+    shed = _admit('batch', session, frames)
+    if shed:
+        return shed
+    observe_stage('parse', received_at, time.monotonic())
+
+    created, report = ingest_batch(session, frames, time.time())
+    observe_stage('merge', received_at, time.monotonic())
+    for result in ('applied', 'stale', 'invalid'):
+        if report[result]:
+            metrics.BATCH_FRAMES.inc(result, amount=report[result])
+
+    mqtt_success = False
+    if created:
+        events.info('robot.update', "🤖 Updated robot state", robot=session.robot_id, versions=report['versions'],
+                    frames=report['frames'], stale=report['stale'], source='batch')
+        # One version per stop/resume transition (priority lane), the rest coalesced into the next tick
+        for version, delta in created:
+            mqtt_success = session.control_loop.notify(delta, version, received_at) or mqtt_success
+        broadcast_state(session)
+
+    return jsonify(dict(report, status='ok', mqtt_published=mqtt_success,
+                        version=session.state_store.version)), 200
+
+# Raw gesture events (hand, confidence, rayDirection, ...) classified on the server;
+# only real direction changes reach the robot state
+@app.route('/api/gesture', methods=['POST'])
+def update_gesture():
+    return _update_gesture(default_robot, time.monotonic())
+
+@app.route('/api/robots/<robot_id>/gesture', methods=['POST'])
+def update_fleet_gesture(robot_id):
+    received_at = time.monotonic()
+    session, error = _robot_or_404(robot_id, create=True)
+    return error or _update_gesture(session, received_at)
+
+@app.route('/api/gesture', methods=['GET'])
+def gesture_status():
+    return jsonify(default_robot.gestures.stats(request.args.get('recent', 0, type=int)))
+
+@app.route('/api/robots/<robot_id>/gesture', methods=['GET'])
+def fleet_gesture_status(robot_id):
+    """Labels, filtered ray and sample counters (?recent=N adds the last N raw samples)"""
+    session, error = _robot_or_404(robot_id)
+    return error or jsonify(session.gestures.stats(request.args.get('recent', 0, type=int)))
+
+def _update_gesture(session, received_at):
+    metrics.UPDATES.inc('gesture')
+    recording.inbound('gesture', session.robot_id, request.get_data())
+    data = request.get_json(force=True, silent=True)
+    shed = _admit('gesture', session, None)
+    if shed:
+        return shed
+    try:
+        changes, samples = session.gestures.changes_from_events(data)
+    except (TypeError, ValueError) as e:
+        metrics.UPDATE_ERRORS.inc('gesture')
+        return jsonify({'error': f'Invalid gesture event: {e}'}), 400
+    observe_stage('parse', received_at, time.monotonic())
+
+    mqtt_success = False
+    version = session.state_store.version
+    if changes:
+        version, delta = session.state_store.apply(changes)
+        observe_stage('merge', received_at, time.monotonic())
+        events.info('robot.update', "🤖 Updated robot state", robot=session.robot_id, version=version,
+                    delta=delta, source='gesture')
+        mqtt_success = session.control_loop.notify(delta, version, received_at)
+        broadcast_state(session)
+
+    return jsonify({
+        'status': 'ok',
+        'samples': samples,
+        'changed': bool(changes),
+        'classification': session.gestures.labels(),
+        'mqtt_published': mqtt_success,
+        'version': version
+    }), 200
+
 @app.route('/')
 def dashboard():
     return render_template('dashboard.html')
@@ -263,77 +624,206 @@ def dashboard():
 @sock.route('/ws')
 def ws_route(ws):
     """Handle websocket clients from Lens Studio and dashboard"""
-    print("WebSocket client connected")
-    clients.add(ws)
+    _serve_ws(ws, default_robot)
+
+@sock.route('/ws/<robot_id>')
+def ws_fleet_route(ws, robot_id):
+    """Websocket clients scoped to a single robot: they only see (and drive) that robot"""
+    try:
+        session = robots.get(robot_id)
+    except (UnknownRobot, FleetFull):
+        ws.close(reason=1008, message='Unknown robot or robot limit reached')
+        return
+    _serve_ws(ws, session)
+
+def _serve_ws(ws, session):
+    conn = session.ws_hub.register(ws, request.remote_addr)
+    events.info('ws.connected', "WebSocket client connected", robot=session.robot_id, client=conn.client_id,
+                remote_addr=conn.remote_addr)
     
     # Send current state on connect
+    stream = None
+    throttle = SocketThrottle(admission, _client_key())
     try:
-        ws.send(json.dumps(robot_state))
+        version, payload = session.state_store.serialized()
+        conn.send(payload)
         
         while True:
-            data = ws.receive()
+            # With acks outstanding, wake up in time to send the next batched one
+            data = ws.receive(timeout=stream.ack_timeout() if stream else None)
             if data is None:
-                break
+                if stream is None or not ws.connected:
+                    break
+                conn.send_control(stream.ack(session.state_store.version), replace=True)
+                continue
+            received_at = time.monotonic()
+            metrics.UPDATES.inc('ws')
+            recording.inbound('ws' if isinstance(data, str) else 'ws_binary', session.robot_id, data, conn.client_id)
+            if stream is not None:
+                _receive_frame(session, conn, stream, data, received_at)
+                continue
             try:
                 received_data = json.loads(data)
+                if is_hello(received_data):
+                    # Switch this socket to the sequenced ingestion protocol (ws_protocol.py)
+                    stream = IngestStream(received_data, WS_ACK_EVERY, WS_ACK_MS)
+                    stream.throttle = throttle
+                    if stream.client_session is not None:
+                        throttle.key = (throttle.key[0], stream.client_session)
+                    conn.subscribed = stream.subscribe
+                    conn.send_control(stream.welcome(session))
+                    events.info('ws.hello', "🤝 WebSocket client switched to the ingestion protocol",
+                                robot=session.robot_id, client=conn.client_id, session=stream.client_session,
+                                last_seq=stream.last_seq)
+                    continue
+
+                admitted, notice = throttle.admit(is_urgent(received_data, session.state_store.peek('stopped')),
+                                                  received_at)
+                if not admitted:
+                    if notice is not None:
+                        conn.send_control(throttle_message(notice))
+                    continue
                 
-                # Update robot state with received data
-                if 'stopped' in received_data:
-                    robot_state['stopped'] = received_data['stopped']
-                
-                if 'hand' in received_data:
-                    if 'right' in received_data['hand']:
-                        robot_state['hand']['right'] = received_data['hand']['right']
-                    if 'left' in received_data['hand']:
-                        robot_state['hand']['left'] = received_data['hand']['left']
+                # Update robot state with received data (raw rays go through the classifier)
+                if is_gesture_event(received_data):
+                    changes, _ = session.gestures.changes_from_events(received_data)
+                    if not changes:
+                        continue
+                else:
+                    # Validated by the store against the state schema
+                    changes = received_data
+                observe_stage('parse', received_at, time.monotonic())
                 
-                print(f"🤖 Robot State Updated via WebSocket: {json.dumps(robot_state, indent=2)}")
+                version, delta = session.state_store.apply(changes)
+                observe_stage('merge', received_at, time.monotonic())
+                events.info('ws.update', "🤖 Robot State Updated via WebSocket", robot=session.robot_id,
+                            client=conn.client_id, version=version, delta=delta)
                 
-                # Publish to MQTT
-                publish_to_mqtt(robot_state)
+                # Published on the next control tick (immediately for stop/resume)
+                session.control_loop.notify(delta, version, received_at)
                 
-                # Broadcast updated state to all connected clients
-                broadcast_state()
+                # Broadcast updated state to this robot's connected clients
+                broadcast_state(session)
                 
-            except json.JSONDecodeError:
+            except (TypeError, ValueError):
+                metrics.UPDATE_ERRORS.inc('ws')
                 continue
             except Exception as e:
-                print(f"Error processing WebSocket message: {e}")
+                metrics.UPDATE_ERRORS.inc('ws')
+                events.error('ws.update_failed', "Error processing WebSocket message", client=conn.client_id,
+                             error=str(e))
     except Exception as e:
-        print(f"WebSocket error: {e}")
+        events.error('ws.error', "WebSocket error", client=conn.client_id, error=str(e))
     finally:
-        clients.discard(ws)
-        print("WebSocket client disconnected")
+        session.ws_hub.unregister(conn)
+        events.info('ws.disconnected', "WebSocket client disconnected", robot=session.robot_id,
+                    client=conn.client_id)
 
-def broadcast_state():
-    """Broadcast current robot state to all connected clients"""
-    payload = json.dumps(robot_state)
-    to_remove = []
-    
-    for client in list(clients):
-        try:
-            client.send(payload)
-        except Exception:
-            to_remove.append(client)
-    
-    for client in to_remove:
-        clients.discard(client)
+def _receive_frame(session, conn, stream, data, received_at):
+    """One sequenced protocol frame: apply, publish, broadcast and ack when due"""
+    try:
+        created = stream.receive(session, data, time.time())
+    except Exception as e:
+        metrics.UPDATE_ERRORS.inc('ws')
+        events.error('ws.update_failed', "Error processing WebSocket message", client=conn.client_id, error=str(e))
+        return
+    if stream.notice is not None:
+        conn.send_control(stream.notice)
+        stream.notice = None
+    observe_stage('merge', received_at, time.monotonic())
+    if created:
+        events.info('ws.update', "🤖 Robot State Updated via WebSocket", robot=session.robot_id,
+                    client=conn.client_id, version=created[-1][0], seq=stream.last_seq)
+        for version, delta in created:
+            session.control_loop.notify(delta, version, received_at)
+        broadcast_state(session)
+    if stream.ack_timeout() == 0:
+        conn.send_control(stream.ack(session.state_store.version), replace=True)
+
+def broadcast_state(session=None):
+    """Broadcast a robot's current state to its connected clients"""
+    session = session or default_robot
+    version, payload = session.state_store.serialized()
+    session.ws_hub.broadcast(payload)
+
+def apply_replicated(robot_id, changes):
+    """A delta from another cluster node: merge, publish if this node owns publishing, fan out locally"""
+    session = robots.get(robot_id)
+    version, delta = session.state_store.apply(changes, origin=ORIGIN_CLUSTER)
+    if delta:
+        session.control_loop.notify(delta, version)
+        broadcast_state(session)
+
+def start_cluster(backplane, node_id):
+    """Join the other server processes sharing robot state over the backplane (see cluster.py)"""
+    global cluster
+    cluster = ClusterNode(open_backplane(backplane, node_id, CLUSTER_CHANNEL), node_id, robots, apply_replicated,
+                          heartbeat=CLUSTER_HEARTBEAT, lease=CLUSTER_LEASE).start()
+    return cluster
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Robot control server')
+    parser.add_argument('--server', choices=['flask', 'asgi'], default='flask',
+                        help='flask: threaded Flask dev server (default); asgi: asyncio server via uvicorn')
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--no-mqtt', action='store_true', help='run without connecting to the MQTT broker')
+    parser.add_argument('--control-rate', type=float, default=CONTROL_RATE_HZ,
+                        help='fixed MQTT publish rate in Hz (default: %(default)s)')
+    parser.add_argument('--record', default=RECORD_PATH, metavar='PATH',
+                        help='record inbound frames and outbound commands to PATH (see recorder.py)')
+    parser.add_argument('--cluster', default=CLUSTER_BACKPLANE, metavar='URL',
+                        help='share state with other server processes over this backplane: mqtt://host:port '
+                             'or loopback (see cluster.py)')
+    parser.add_argument('--node-id', default=CLUSTER_NODE_ID,
+                        help='name of this process in the cluster (default: <hostname>-<port>)')
+    parser.add_argument('--log-level', default=LOG_LEVEL, choices=['debug', 'info', 'warning', 'error'],
+                        help='event log level (default: %(default)s)')
+    return parser.parse_args(argv)
 
 if __name__ == '__main__':
-    print("🚀 Starting Robot Control Server...")
-    print("🔄 Initializing MQTT connection...")
-    
-    # Initialize MQTT
-    init_mqtt()
-    
-    # Give MQTT a moment to connect
-    time.sleep(3)
+    args = parse_args()
+    events.configure(level=args.log_level)
+    if args.record:
+        recording.open(args.record, max_bytes=RECORD_MAX_BYTES)
+    print(f"🚀 Starting Robot Control Server ({args.server})...")
     
     print("\n📋 Available endpoints:")
-    print("  - Dashboard: http://localhost:5000")
-    print("  - Health check: http://localhost:5000/health")
-    print("  - MQTT status: http://localhost:5000/mqtt-status")
-    print("  - Test publish: http://localhost:5000/test-publish")
+    print(f"  - Dashboard: http://localhost:{args.port}")
+    print(f"  - Health check: http://localhost:{args.port}/health")
+    print(f"  - MQTT status: http://localhost:{args.port}/mqtt-status")
+    print(f"  - Test publish: http://localhost:{args.port}/test-publish")
+    print(f"  - WebSocket status: http://localhost:{args.port}/ws-status")
+    print(f"  - Control loop status: http://localhost:{args.port}/control-status")
+    print(f"  - State stream (SSE): http://localhost:{args.port}/api/stream")
+    print(f"  - Metrics: http://localhost:{args.port}/metrics")
+    print(f"  - Recent events: http://localhost:{args.port}/debug/recent-events")
+    print(f"  - Recording: http://localhost:{args.port}/debug/recording")
+    print(f"  - Admission: http://localhost:{args.port}/debug/admission")
+    print(f"  - Cluster: http://localhost:{args.port}/debug/cluster")
+    print(f"  - Robot transports: http://localhost:{args.port}/debug/transports")
     print("  - WebSocket endpoint: /ws")
+    print(f"  - Robots: http://localhost:{args.port}/api/robots (per robot: /api/robots/<id>/..., /ws/<id>)")
+    
+    node_id = args.node_id or default_node_id(args.port)
+    if args.cluster:
+        print(f"🧩 Cluster node {node_id} on {args.cluster}")
     
-    app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False)
\ No newline at end of file
+    if args.server == 'asgi':
+        # The asyncio server owns its own MQTT bridge, started with the event loop
+        import asgi_app
+        asgi_app.run(args.host, args.port, mqtt_enabled=not args.no_mqtt, control_rate=args.control_rate,
+                     log_level=args.log_level, cluster=args.cluster or None, node_id=node_id)
+    else:
+        if args.cluster:
+            start_cluster(args.cluster, node_id)
+        
+        if not args.no_mqtt:
+            # Connects in the background; /health?ready=1 reports when it is up
+            print("🔄 Initializing MQTT connection...")
+            init_mqtt()
+        
+        control_loop.set_rate(args.control_rate)
+        control_loop.start()
+        
+        app.run(host=args.host, port=args.port, debug=False, use_reloader=False, threaded=True)
@@ -0,0 +1,774 @@
+"""
+Asyncio (ASGI) serving mode for the robot control backend
+Serves the same routes as app.py from a single event loop, so each WebSocket
+client costs a couple of small tasks instead of an OS thread.
+Start it with: python app.py --server asgi
+"""
+
+import asyncio
+import json
+import os
+import time
+from datetime import datetime
+from urllib.parse import parse_qs
+
+import metrics
+from async_mqtt import AsyncMQTTBridge
+from outbound_journal import OutboundJournal
+from mqtt_supervisor import Backoff
+from robots import RobotRegistry, FleetControlLoop, UnknownRobot, InvalidRobotId, FleetFull
+from config import (HIVEMQ_HOST, HIVEMQ_PORT, MQTT_TOPIC, HIVEMQ_USERNAME, HIVEMQ_PASSWORD,
+                    MQTT_USE_TLS, MQTT_QOS, MQTT_STOP_TOPIC, MQTT_STOP_QOS,
+                    WS_SEND_POLICY, WS_MAX_QUEUE, WS_SLOW_CLIENT_TIMEOUT,
+                    LONG_POLL_MAX_WAIT, SSE_KEEPALIVE_INTERVAL, CONTROL_RATE_HZ,
+                    LOG_LEVEL, LOG_FORMAT, LOG_BUFFER_SIZE, LOG_SAMPLE_RATES, MAX_ROBOTS,
+                    MQTT_JOURNAL_PATH, MQTT_JOURNAL_SIZE, MQTT_JOURNAL_COMPACTION, MQTT_REPLAY_RATE,
+                    MQTT_RECONNECT_MIN, MQTT_RECONNECT_MAX, MQTT_WIRE_FORMAT, GESTURE_CLASSIFIER,
+                    BATCH_MAX_FRAMES, WS_ACK_EVERY, WS_ACK_MS, ADMISSION_RATE, ADMISSION_BURST,
+                    ADMISSION_MAX_BACKLOG, ADMISSION_MAX_LATENCY, ADMISSION_RETRY_AFTER, ADMISSION_IDS_PER_ADDRESS,
+                    CLUSTER_CHANNEL, CLUSTER_HEARTBEAT, CLUSTER_LEASE, LOCAL_MQTT, ROBOT_UDP, ROBOT_UDP_PORT,
+                    ROBOT_TRANSPORT, UDP_COPIES, UDP_RETRIES, TRANSPORT_PROBE_INTERVAL, TRANSPORT_PROBE_TOPIC,
+                    TRANSPORT_SWITCH_MARGIN, MQTT_VERSION, MQTT5_MESSAGE_EXPIRY, MQTT5_MAX_AGE, MQTT5_STAMP,
+                    MQTT_MAX_INFLIGHT)
+from state_store import ValidationError, version_from_etag
+from metrics import observe_stage
+from event_log import events, parse_level
+from ws_hub import AsyncWebSocketHub
+from wire_format import WireFormats, capability_subscriptions
+from gesture_classifier import GestureClassifier, is_gesture_event
+from batch_ingest import parse_batch, ingest_batch
+from ws_protocol import IngestStream, is_hello, throttle_message
+from admission import AdmissionController, SocketThrottle, shed_response, is_urgent
+from recorder import recording
+from cluster import ClusterNode, open_backplane, default_node_id, ORIGIN_CLUSTER
+from transports import MQTTTransport, TransportRouter, open_transports, TRANSPORT_CLOUD
+
+DASHBOARD_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'dashboard.html')
+MAX_BODY_SIZE = 64 * 1024
+MAX_BATCH_BODY_SIZE = 1024 * 1024
+
+JSON_TYPE = b'application/json'
+HTML_TYPE = b'text/html; charset=utf-8'
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class RobotControlASGI:
+    """ASGI application with the Flask app's routes and shared state semantics"""
+
+    def __init__(self, mqtt_enabled=True, control_rate=CONTROL_RATE_HZ, cluster=None, node_id=None):
+        events.configure(sample_rates=LOG_SAMPLE_RATES, fmt=LOG_FORMAT, capacity=LOG_BUFFER_SIZE)
+        self.robots = RobotRegistry(
+            lambda: AsyncWebSocketHub(max_queue=WS_MAX_QUEUE, policy=WS_SEND_POLICY,
+                                      slow_client_timeout=WS_SLOW_CLIENT_TIMEOUT),
+            self._publish, self._publish_stop_transition, MQTT_TOPIC, MQTT_STOP_TOPIC, max_robots=MAX_ROBOTS,
+            gesture_factory=lambda: GestureClassifier(**GESTURE_CLASSIFIER))
+        # The default robot behind the original single-robot routes and topics
+        self.state_store = self.robots.default.state_store
+        self.ws_hub = self.robots.default.ws_hub
+        # Per-topic wire format (JSON or compact binary), negotiated with each robot
+        self.wire_formats = WireFormats(default=MQTT_WIRE_FORMAT)
+        self.mqtt = None
+        if mqtt_enabled:
+            self.mqtt = AsyncMQTTBridge(HIVEMQ_HOST, HIVEMQ_PORT, HIVEMQ_USERNAME, HIVEMQ_PASSWORD,
+                                        use_tls=MQTT_USE_TLS, qos=MQTT_QOS, max_topics=MAX_ROBOTS + 16,
+                                        replay_rate=MQTT_REPLAY_RATE,
+                                        backoff=Backoff(MQTT_RECONNECT_MIN, MQTT_RECONNECT_MAX),
+                                        subscriptions=capability_subscriptions(MQTT_TOPIC),
+                                        on_message=self.wire_formats.on_capability,
+                                        protocol=MQTT_VERSION, max_inflight=MQTT_MAX_INFLIGHT,
+                                        message_expiry=MQTT5_MESSAGE_EXPIRY, max_age=MQTT5_MAX_AGE,
+                                        stamp=MQTT5_STAMP,
+                                        journal=OutboundJournal(MQTT_JOURNAL_PATH, MQTT_JOURNAL_SIZE,
+                                                                MQTT_JOURNAL_COMPACTION) if MQTT_JOURNAL_PATH else None)
+            # Commands take the fastest of this connection, a LAN broker and a direct UDP link (transports.py)
+            cloud = MQTTTransport(TRANSPORT_CLOUD, self.mqtt.publish_now, lambda: self.mqtt.connected,
+                                  probe_topic=TRANSPORT_PROBE_TOPIC)
+            router = TransportRouter(
+                open_transports(cloud, LOCAL_MQTT, ROBOT_UDP, ROBOT_TRANSPORT,
+                                client_id=f"asgi_robot_local_{os.getpid()}", udp_port=ROBOT_UDP_PORT,
+                                copies=UDP_COPIES, retries=UDP_RETRIES, probe_topic=TRANSPORT_PROBE_TOPIC,
+                                protocol=MQTT_VERSION, max_inflight=MQTT_MAX_INFLIGHT,
+                                message_expiry=MQTT5_MESSAGE_EXPIRY, max_age=MQTT5_MAX_AGE, stamp=MQTT5_STAMP),
+                probe_interval=TRANSPORT_PROBE_INTERVAL, switch_margin=TRANSPORT_SWITCH_MARGIN)
+            self.mqtt.use_transports(router, cloud)
+        self.control_loop = FleetControlLoop(self.robots, rate_hz=control_rate)
+        self._dashboard = None
+        self._loop = None
+        # One node of a cluster sharing state over a backplane (see cluster.py), started with the event loop
+        self.cluster = None
+        if cluster:
+            node_id = node_id or f"asgi-{os.getpid()}-{id(self):x}"
+            self.cluster = ClusterNode(open_backplane(cluster, node_id, CLUSTER_CHANNEL), node_id, self.robots,
+                                       self._replicated, heartbeat=CLUSTER_HEARTBEAT, lease=CLUSTER_LEASE)
+
+        metrics.MQTT_CONNECTED.set_function(lambda: int(self.mqtt_connected))
+        metrics.MQTT_QUEUE_DEPTH.set_function(lambda: self.mqtt.stats()['queue_depth'] if self.mqtt else 0)
+        metrics.MQTT_JOURNAL_PENDING.set_function(
+            lambda: (self.mqtt.stats()['journal'] or {}).get('pending', 0) if self.mqtt else 0)
+        metrics.WS_CLIENTS.set_function(self.robots.ws_clients)
+        metrics.ROBOTS.set_function(lambda: len(self.robots))
+
+        # Admission control: per-client rate limit, and shedding while the outbound backlog is too deep
+        self.admission = AdmissionController(ADMISSION_RATE, ADMISSION_BURST, ADMISSION_MAX_BACKLOG,
+                                             ADMISSION_MAX_LATENCY, retry_after=ADMISSION_RETRY_AFTER,
+                                             max_ids_per_address=ADMISSION_IDS_PER_ADDRESS)
+        self.admission.set_backlog(lambda: self.mqtt.backlog() if self.mqtt and self.mqtt.can_send() else None)
+
+        self.routes = {
+            ('GET', '/'): self.dashboard,
+            ('GET', '/health'): self.health_check,
+            ('GET', '/metrics'): self.metrics_endpoint,
+            ('GET', '/debug/recent-events'): self.recent_events,
+            ('GET', '/debug/recording'): self.recording_status,
+            ('GET', '/debug/admission'): self.admission_status,
+            ('GET', '/debug/cluster'): self.cluster_status,
+            ('GET', '/debug/transports'): self.transports_status,
+            ('GET', '/mqtt-status'): self.mqtt_status,
+            ('GET', '/ws-status'): self.ws_status,
+            ('GET', '/control-status'): self.control_status,
+            ('GET', '/test-publish'): self.test_publish,
+            ('GET', '/api/state'): self.get_robot_state,
+            ('POST', '/api/robot-status'): self.update_robot_status,
+            ('GET', '/api/robots'): self.list_robots,
+            ('GET', '/api/robots/{id}/state'): self.get_robot_state,
+            ('POST', '/api/robots/{id}/status'): self.update_robot_status,
+            ('POST', '/api/robot-status/batch'): self.update_robot_status_batch,
+            ('POST', '/api/robots/{id}/batch'): self.update_robot_status_batch,
+            ('GET', '/api/gesture'): self.gesture_status,
+            ('POST', '/api/gesture'): self.update_gesture,
+            ('GET', '/api/robots/{id}/gesture'): self.gesture_status,
+            ('POST', '/api/robots/{id}/gesture'): self.update_gesture,
+        }
+        # Routes that write their own (streaming) response
+        self.stream_routes = {
+            ('GET', '/api/stream'): self.stream_robot_state,
+            ('GET', '/api/robots/{id}/stream'): self.stream_robot_state,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self._handle_http(scope, receive, send)
+        elif scope['type'] == 'websocket':
+            path = _route_path(scope)
+            if path in ('/ws', '/ws/{id}'):
+                await self.ws_route(scope, receive, send)
+            else:
+                await send({'type': 'websocket.close', 'code': 1008})
+        elif scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+
+    @property
+    def mqtt_connected(self):
+        return self.mqtt is not None and self.mqtt.connected
+
+    @property
+    def publishing(self):
+        # In cluster mode only the owner publishes to the robot topics
+        return self.mqtt is not None and (self.cluster is None or self.cluster.is_owner)
+
+    @property
+    def mqtt_ready(self):
+        # Ready once the broker connection is up (or when running without MQTT)
+        return self.mqtt is None or self.mqtt.connected
+
+    # -- plumbing --------------------------------------------------------------
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self._loop = asyncio.get_running_loop()
+                if self.mqtt:
+                    await self.mqtt.start()
+                if self.cluster:
+                    self.cluster.start()
+                self.control_loop.start_async()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.cluster:
+                    self.cluster.stop()
+                self.control_loop.stop()
+                if self.mqtt:
+                    await self.mqtt.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _handle_http(self, scope, receive, send):
+        method = scope['method']
+        if method == 'HEAD':
+            method = 'GET'
+        path = _route_path(scope)
+        stream_handler = self.stream_routes.get((method, path))
+        if stream_handler is not None:
+            await stream_handler(scope, receive, send)
+            return
+
+        handler = self.routes.get((method, path))
+        extra_headers = []
+        try:
+            if handler is None:
+                raise HTTPError(404, 'Not found')
+            response = await handler(scope, receive)
+            status, body, content_type = response[:3]
+            if len(response) > 3:
+                extra_headers = response[3]
+        except HTTPError as e:
+            status, body, content_type = e.status, _json({'error': e.message}), JSON_TYPE
+        except Exception as e:
+            status, body, content_type = 500, _json({'error': str(e)}), JSON_TYPE
+
+        headers = [(b'content-length', str(len(body)).encode())]
+        if content_type:
+            headers.append((b'content-type', content_type))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers + extra_headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _read_body(self, receive, limit=MAX_BODY_SIZE):
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise HTTPError(400, 'Client disconnected')
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > limit:
+                raise HTTPError(413, 'Request body too large')
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    def _session(self, scope, create=False):
+        """The robot a request is for: /api/robots/<id>/... and /ws/<id>, else the default robot"""
+        robot_id = scope.get('robot_id')
+        if robot_id is None:
+            return self.robots.default
+        try:
+            return self.robots.get(robot_id, create=create)
+        except InvalidRobotId:
+            raise HTTPError(400, f'Invalid robot id: {robot_id}')
+        except UnknownRobot:
+            raise HTTPError(404, f'Unknown robot: {robot_id}')
+        except FleetFull:
+            raise HTTPError(503, 'Robot limit reached')
+
+    async def _wait_for_change(self, session, version, timeout):
+        """Wait until the robot's state moves past `version` or timeout; returns the current version"""
+        if session.state_store.version == version:
+            if session.state_changed is None:
+                session.state_changed = asyncio.Event()
+            try:
+                await asyncio.wait_for(session.state_changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return session.state_store.version
+
+    def _publish(self, session, payload, ingest_time=None):
+        if not self.publishing:
+            return False
+        payload = self.wire_formats.state_payload(session.topic, session.state_store, payload)
+        recording.outbound('state', session.topic, payload)
+        return self.mqtt.submit(session.topic, payload, ingest_time=ingest_time)
+
+    def _publish_stop_transition(self, session, version, changes, ingest_time=None):
+        """Send a stop/resume transition on the priority lane (see app.publish_stop_transition)"""
+        if not self.publishing:
+            return False
+        payload = self.wire_formats.stop_payload(session.topic, session.robot_id, changes['stopped'], version)
+        recording.outbound('stop', session.stop_topic, payload)
+        return self.mqtt.submit_priority(session.stop_topic, payload, qos=MQTT_STOP_QOS, ingest_time=ingest_time)
+
+    def _apply_update(self, session, changes, ingest_time=None):
+        """Merge, schedule for MQTT and fan out to the robot's clients; returns (version, delta, mqtt_queued)"""
+        observe_stage('parse', ingest_time, time.monotonic())
+        version, delta = session.state_store.apply(changes)
+        observe_stage('merge', ingest_time, time.monotonic())
+        if delta and session.state_changed is not None:
+            # Wake long-polls and SSE streams, then arm a fresh event for the next change
+            session.state_changed.set()
+            session.state_changed = asyncio.Event()
+        # Published on the next control tick (immediately for stop/resume)
+        queued = session.control_loop.notify(delta, version, ingest_time) if self.mqtt else False
+        version, text = session.state_store.serialized()
+        session.ws_hub.broadcast(text)
+        return version, delta, queued
+
+    def _notify_batch(self, session, created, ingest_time=None):
+        """Wake waiters, schedule MQTT for every version a batch created, then broadcast once"""
+        if session.state_changed is not None:
+            # Wake long-polls and SSE streams, then arm a fresh event for the next change
+            session.state_changed.set()
+            session.state_changed = asyncio.Event()
+        # One version per stop/resume transition (priority lane), the rest coalesced into the next tick
+        queued = False
+        for version, delta in created:
+            queued = (session.control_loop.notify(delta, version, ingest_time) if self.mqtt else False) or queued
+        version, text = session.state_store.serialized()
+        session.ws_hub.broadcast(text)
+        return queued
+
+    def _replicated(self, robot_id, changes):
+        # Backplane thread -> event loop, in arrival order
+        self._loop.call_soon_threadsafe(self._apply_replicated, robot_id, changes)
+
+    def _apply_replicated(self, robot_id, changes):
+        """A delta from another cluster node (see app.apply_replicated)"""
+        try:
+            session = self.robots.get(robot_id)
+            version, delta = session.state_store.apply(changes, origin=ORIGIN_CLUSTER)
+        except (UnknownRobot, FleetFull, ValidationError) as e:
+            events.warning('cluster.apply_failed', "⚠️ Could not apply replicated update", robot=robot_id,
+                           error=repr(e))
+            return
+        if delta:
+            self._notify_batch(session, [(version, delta)])
+
+    # -- routes ----------------------------------------------------------------
+
+    async def dashboard(self, scope, receive):
+        if self._dashboard is None:
+            with open(DASHBOARD_PATH, 'rb') as f:
+                self._dashboard = f.read()
+        return 200, self._dashboard, HTML_TYPE
+
+    async def health_check(self, scope, receive):
+        # Liveness (always 200 while serving); ?ready=1 answers 503 until MQTT is connected
+        ready = self.mqtt_ready
+        query = parse_qs(scope.get('query_string', b'').decode())
+        status = 503 if query.get('ready') and not ready else 200
+        return status, _json({
+            'status': 'ok',
+            'message': 'Robot control server is running',
+            'ready': ready,
+            'mqtt_connected': self.mqtt_connected,
+            'mqtt_state': self.mqtt.state if self.mqtt else 'disabled'
+        }), JSON_TYPE
+
+    async def metrics_endpoint(self, scope, receive):
+        return 200, metrics.REGISTRY.render().encode(), b'text/plain; version=0.0.4'
+
+    async def recent_events(self, scope, receive):
+        query = parse_qs(scope.get('query_string', b'').decode())
+        limit = _int_arg(query, 'limit')
+        return 200, _json({
+            'events': events.recent(100 if limit is None else limit, event=query.get('event', [None])[0],
+                                    min_level=parse_level(query.get('level', ['debug'])[0])),
+            'log': events.stats()
+        }), JSON_TYPE
+
+    async def recording_status(self, scope, receive):
+        return 200, _json(recording.stats()), JSON_TYPE
+
+    async def admission_status(self, scope, receive):
+        return 200, _json(self.admission.stats()), JSON_TYPE
+
+    async def cluster_status(self, scope, receive):
+        return 200, _json(self.cluster.stats() if self.cluster else {'enabled': False}), JSON_TYPE
+
+    async def transports_status(self, scope, receive):
+        return 200, _json(self.mqtt.router.stats() if self.mqtt else {'active': None, 'transports': []}), JSON_TYPE
+
+    async def mqtt_status(self, scope, receive):
+        return 200, _json({
+            'connected': self.mqtt_connected,
+            'ready': self.mqtt_ready,
+            'client_initialized': self.mqtt is not None,
+            'connection': self.mqtt.connection_stats() if self.mqtt else None,
+            'host': HIVEMQ_HOST,
+            'port': HIVEMQ_PORT,
+            'topic': MQTT_TOPIC,
+            'stop_topic': MQTT_STOP_TOPIC,
+            'robots': len(self.robots),
+            'publisher': self.mqtt.stats() if self.mqtt else None,
+            'transports': self.mqtt.router.stats() if self.mqtt else None,
+            'wire_format': self.wire_formats.stats()
+        }), JSON_TYPE
+
+    async def control_status(self, scope, receive):
+        return 200, _json(self.control_loop.stats()), JSON_TYPE
+
+    async def ws_status(self, scope, receive):
+        query = parse_qs(scope.get('query_string', b'').decode())
+        robot_id = query.get('robot', [None])[0]
+        session = self._session(dict(scope, robot_id=robot_id))
+        return 200, _json(session.ws_hub.metrics()), JSON_TYPE
+
+    async def list_robots(self, scope, receive):
+        return 200, _json({'robots': self.robots.summary(), 'max_robots': self.robots.max_robots}), JSON_TYPE
+
+    async def test_publish(self, scope, receive):
+        test_data = {
+            'test': True,
+            'timestamp': datetime.now().isoformat(),
+            'message': 'Test message from ASGI app'
+        }
+        success = self.mqtt.submit(MQTT_TOPIC, self.wire_formats.encode(MQTT_TOPIC, test_data)) if self.mqtt else False
+        return 200, _json({
+            'success': success,
+            'mqtt_connected': self.mqtt_connected,
+            'test_data': test_data
+        }), JSON_TYPE
+
+    async def get_robot_state(self, scope, receive):
+        """Current state with ETag / long-poll support (see app.get_robot_state)"""
+        query = parse_qs(scope.get('query_string', b'').decode())
+        known = _int_arg(query, 'since')
+        if known is None:
+            known = version_from_etag(_header(scope, b'if-none-match'))
+        wait = min(_float_arg(query, 'wait') or 0.0, LONG_POLL_MAX_WAIT)
+        session = self._session(scope)
+
+        if known is not None and wait > 0 and known == session.state_store.version:
+            await self._wait_for_change(session, known, wait)
+
+        version, payload = session.state_store.serialized_bytes()
+        headers = [(b'etag', f'"{version}"'.encode()), (b'cache-control', b'no-cache')]
+        if known == version:
+            return 304, b'', None, headers
+        return 200, payload, JSON_TYPE, headers
+
+    async def stream_robot_state(self, scope, receive, send):
+        """Server-Sent Events: one snapshot, then only deltas"""
+        try:
+            session = self._session(scope)
+        except HTTPError as e:
+            body = _json({'error': e.message})
+            await send({'type': 'http.response.start', 'status': e.status,
+                        'headers': [(b'content-length', str(len(body)).encode()), (b'content-type', JSON_TYPE)]})
+            await send({'type': 'http.response.body', 'body': body})
+            return
+
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                        (b'x-accel-buffering', b'no')]
+        })
+
+        disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+        last_seen = version_from_etag(_header(scope, b'last-event-id'))
+        version = -1 if last_seen is None else last_seen
+        try:
+            while not disconnected.done():
+                current, changes, is_full = session.state_store.changes_since(version)
+                if is_full or current != version:
+                    changes['version'] = current
+                    event = 'snapshot' if is_full else 'delta'
+                    chunk = f"event: {event}\nid: {current}\ndata: {json.dumps(changes)}\n\n"
+                    await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+                version = current
+
+                waiter = asyncio.ensure_future(self._wait_for_change(session, version, SSE_KEEPALIVE_INTERVAL))
+                await asyncio.wait({waiter, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if not waiter.done():
+                    waiter.cancel()
+                    break
+                if waiter.result() == version:
+                    # Idle: a comment line keeps proxies from closing the stream
+                    await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+        finally:
+            disconnected.cancel()
+
+    async def update_robot_status(self, scope, receive):
+        received_at = time.monotonic()
+        metrics.UPDATES.inc('http')
+        session = self._session(scope, create=True)
+        body = await self._read_body(receive)
+        recording.inbound('http', session.robot_id, body)
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            metrics.UPDATE_ERRORS.inc('http')
+            raise HTTPError(400, 'Invalid JSON')
+        if not data:
+            metrics.UPDATE_ERRORS.inc('http')
+            raise HTTPError(400, 'No data received')
+        shed = self._admit('http', scope, session, data)
+        if shed:
+            return shed
+
+        try:
+            # Validated against the state schema and merged in one pass
+            version, delta, queued = self._apply_update(session, data, received_at)
+        except ValidationError as e:
+            metrics.UPDATE_ERRORS.inc('http')
+            raise HTTPError(400, str(e))
+        events.info('robot.update', "🤖 Updated robot state", robot=session.robot_id, version=version, delta=delta,
+                    data=data)
+
+        return 200, _json({
+            'status': 'ok',
+            'mqtt_published': queued,
+            'mqtt_connected': self.mqtt_connected,
+            'version': version
+        }), JSON_TYPE
+
+    def _admit(self, transport, scope, session, data):
+        """None if an update may go ahead, else the 429/503 response (see app._admit)"""
+        decision = self.admission.admit(transport, _client_key(scope),
+                                        is_urgent(data, session.state_store.peek('stopped')))
+        if decision is None:
+            return None
+        status, body, retry_after = shed_response(decision)
+        return status, _json(body), JSON_TYPE, [(b'retry-after', retry_after.encode())]
+
+    async def update_robot_status_batch(self, scope, receive):
+        """Batched frames, applied in timestamp order and published once (see batch_ingest)"""
+        received_at = time.monotonic()
+        metrics.UPDATES.inc('batch')
+        session = self._session(scope, create=True)
+        body = await self._read_body(receive, MAX_BATCH_BODY_SIZE)
+        recording.inbound('batch', session.robot_id, body)
+        try:
+            frames = parse_batch(body, BATCH_MAX_FRAMES)
+        except ValueError as e:
+            metrics.UPDATE_ERRORS.inc('batch')
+            raise HTTPError(400, str(e))
+        shed = self._admit('batch', scope, session, frames)
+        if shed:
+            return shed
+        observe_stage('parse', received_at, time.monotonic())
+
+        created, report = ingest_batch(session, frames, time.time())
+        observe_stage('merge', received_at, time.monotonic())
+        for result in ('applied', 'stale', 'invalid'):
+            if report[result]:
+                metrics.BATCH_FRAMES.inc(result, amount=report[result])
+
+        queued = False
+        if created:
+            events.info('robot.update', "🤖 Updated robot state", robot=session.robot_id,
+                        versions=report['versions'], frames=report['frames'], stale=report['stale'], source='batch')
+            queued = self._notify_batch(session, created, received_at)
+
+        return 200, _json(dict(report, status='ok', mqtt_published=queued,
+                               version=session.state_store.version)), JSON_TYPE
+
+    async def update_gesture(self, scope, receive):
+        """Raw gesture events classified on the server (see app.update_gesture)"""
+        received_at = time.monotonic()
+        metrics.UPDATES.inc('gesture')
+        session = self._session(scope, create=True)
+        body = await self._read_body(receive)
+        recording.inbound('gesture', session.robot_id, body)
+        shed = self._admit('gesture', scope, session, None)
+        if shed:
+            return shed
+        try:
+            changes, samples = session.gestures.changes_from_events(json.loads(body) if body else None)
+        except (TypeError, ValueError) as e:
+            metrics.UPDATE_ERRORS.inc('gesture')
+            raise HTTPError(400, f'Invalid gesture event: {e}')
+
+        queued = False
+        version = session.state_store.version
+        if changes:
+            version, delta, queued = self._apply_update(session, changes, received_at)
+            events.info('robot.update', "🤖 Updated robot state", robot=session.robot_id, version=version,
+                        delta=delta, source='gesture')
+
+        return 200, _json({
+            'status': 'ok',
+            'samples': samples,
+            'changed': bool(changes),
+            'classification': session.gestures.labels(),
+            'mqtt_published': queued,
+            'version': version
+        }), JSON_TYPE
+
+    async def gesture_status(self, scope, receive):
+        query = parse_qs(scope.get('query_string', b'').decode())
+        session = self._session(scope)
+        return 200, _json(session.gestures.stats(_int_arg(query, 'recent') or 0)), JSON_TYPE
+
+    async def ws_route(self, scope, receive, send):
+        """Handle websocket clients from Lens Studio and dashboard"""
+        message = await receive()
+        if message['type'] != 'websocket.connect':
+            return
+        try:
+            session = self._session(scope, create=True)
+        except HTTPError:
+            await send({'type': 'websocket.close', 'code': 1008})
+            return
+        await send({'type': 'websocket.accept'})
+
+        client = scope.get('client')
+        conn = session.ws_hub.register(send, client[0] if client else None)
+        events.info('ws.connected', "WebSocket client connected", robot=session.robot_id, client=conn.client_id,
+                    remote_addr=conn.remote_addr)
+
+        # Send current state on connect
+        version, payload = session.state_store.serialized()
+        conn.send(payload)
+
+        closed = asyncio.ensure_future(conn.closed_event.wait())
+        pending_receive = None
+        stream = None
+        throttle = SocketThrottle(self.admission, _client_key(scope))
+        try:
+            while True:
+                if pending_receive is None:
+                    pending_receive = asyncio.ensure_future(receive())
+                # With acks outstanding, wake up in time to send the next batched one
+                done, _ = await asyncio.wait({pending_receive, closed}, return_when=asyncio.FIRST_COMPLETED,
+                                             timeout=stream.ack_timeout() if stream else None)
+                if closed in done:
+                    # The hub dropped us (slow client); hang up
+                    break
+                if not done:
+                    conn.send_control(stream.ack(session.state_store.version), replace=True)
+                    continue
+                message = pending_receive.result()
+                pending_receive = None
+                received_at = time.monotonic()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                metrics.UPDATES.inc('ws')
+
+                data = message.get('text')
+                if data is None:
+                    data = message.get('bytes')
+                recording.inbound('ws' if isinstance(data, str) else 'ws_binary', session.robot_id, data,
+                                  conn.client_id)
+                if stream is not None:
+                    self._receive_frame(session, conn, stream, data, received_at)
+                    continue
+                try:
+                    received_data = json.loads(data)
+                    if is_hello(received_data):
+                        # Switch this socket to the sequenced ingestion protocol (ws_protocol.py)
+                        stream = IngestStream(received_data, WS_ACK_EVERY, WS_ACK_MS)
+                        stream.throttle = throttle
+                        if stream.client_session is not None:
+                            throttle.key = (throttle.key[0], stream.client_session)
+                        conn.subscribed = stream.subscribe
+                        conn.send_control(stream.welcome(session))
+                        events.info('ws.hello', "🤝 WebSocket client switched to the ingestion protocol",
+                                    robot=session.robot_id, client=conn.client_id, session=stream.client_session,
+                                    last_seq=stream.last_seq)
+                        continue
+                    admitted, notice = throttle.admit(
+                        is_urgent(received_data, session.state_store.peek('stopped')), received_at)
+                    if not admitted:
+                        if notice is not None:
+                            conn.send_control(throttle_message(notice))
+                        continue
+                    # Raw rays go through the classifier
+                    if is_gesture_event(received_data):
+                        changes, _ = session.gestures.changes_from_events(received_data)
+                        if not changes:
+                            continue
+                    else:
+                        # Validated by the store against the state schema
+                        changes = received_data
+                    version, delta, _ = self._apply_update(session, changes, received_at)
+                    events.info('ws.update', "🤖 Robot State Updated via WebSocket", robot=session.robot_id,
+                                client=conn.client_id, version=version, delta=delta)
+                except (TypeError, ValueError):
+                    metrics.UPDATE_ERRORS.inc('ws')
+                    continue
+                except Exception as e:
+                    metrics.UPDATE_ERRORS.inc('ws')
+                    events.error('ws.update_failed', "Error processing WebSocket message", client=conn.client_id,
+                                 error=str(e))
+        finally:
+            if pending_receive is not None:
+                pending_receive.cancel()
+            closed.cancel()
+            session.ws_hub.unregister(conn)
+            events.info('ws.disconnected', "WebSocket client disconnected", robot=session.robot_id,
+                        client=conn.client_id)
+
+
+    def _receive_frame(self, session, conn, stream, data, received_at):
+        """One sequenced protocol frame: apply, publish, broadcast and ack when due"""
+        try:
+            created = stream.receive(session, data, time.time())
+        except Exception as e:
+            metrics.UPDATE_ERRORS.inc('ws')
+            events.error('ws.update_failed', "Error processing WebSocket message", client=conn.client_id,
+                         error=str(e))
+            return
+        if stream.notice is not None:
+            conn.send_control(stream.notice)
+            stream.notice = None
+        observe_stage('merge', received_at, time.monotonic())
+        if created:
+            events.info('ws.update', "🤖 Robot State Updated via WebSocket", robot=session.robot_id,
+                        client=conn.client_id, version=created[-1][0], seq=stream.last_seq)
+            self._notify_batch(session, created, received_at)
+        if stream.ack_timeout() == 0:
+            conn.send_control(stream.ack(session.state_store.version), replace=True)
+
+
+def _json(data):
+    return json.dumps(data).encode('utf-8')
+
+
+def _route_path(scope):
+    """Route key for a request path; robot-scoped paths put the robot id in scope['robot_id']"""
+    path = scope['path']
+    if path.startswith('/api/robots/'):
+        parts = path.split('/')
+        if len(parts) == 5 and parts[3]:
+            scope['robot_id'] = parts[3]
+            return f'/api/robots/{{id}}/{parts[4]}'
+    elif path.startswith('/ws/'):
+        robot_id = path[4:]
+        if robot_id and '/' not in robot_id:
+            scope['robot_id'] = robot_id
+            return '/ws/{id}'
+    return path
+
+
+def _client_key(scope):
+    """Who an update counts against: its address, plus the id the client sends (if any)"""
+    client = scope.get('client')
+    return (client[0] if client else None), _header(scope, b'x-client-id')
+
+
+def _header(scope, name):
+    for key, value in scope.get('headers', []):
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+def _int_arg(query, name):
+    try:
+        return int(query[name][0])
+    except (KeyError, ValueError):
+        return None
+
+
+def _float_arg(query, name):
+    try:
+        return float(query[name][0])
+    except (KeyError, ValueError):
+        return None
+
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+def run(host, port, mqtt_enabled=True, control_rate=CONTROL_RATE_HZ, log_level=LOG_LEVEL, cluster=None,
+        node_id=None):
+    """Serve the ASGI app with uvicorn"""
+    import uvicorn
+
+    events.configure(level=log_level)
+
+    uvicorn.run(RobotControlASGI(mqtt_enabled=mqtt_enabled, control_rate=control_rate, cluster=cluster,
+                                 node_id=node_id or default_node_id(port)), host=host, port=port,
+                log_level='warning', lifespan='on')
@@ -0,0 +1,314 @@
+"""
+Asyncio MQTT bridge
+Drives a paho client from the asyncio event loop (no network thread) and
+publishes through the same OutboundLanes as MQTTPublisher (latest-wins per
+topic, the stop priority lane and the optional on-disk journal for outages).
+With use_transports() messages go out over the fastest robot transport
+(see transports.py), of which this connection is the cloud one. With
+protocol='5' it publishes through an MQTT5Session (see mqtt5.py).
+"""
+
+import asyncio
+import os
+import ssl
+import time
+
+import paho.mqtt.client as mqtt
+
+import metrics
+from metrics import observe_stage, LANE_STOP
+from event_log import events
+from outbound_lanes import OutboundLanes
+from mqtt_supervisor import (Backoff, STATE_IDLE, STATE_CONNECTING, STATE_CONNECTED, STATE_BACKOFF,
+                             STATE_STOPPED)
+from mqtt5 import MQTT5Session, new_client, PROTOCOL_V311, PROTOCOL_V5
+
+
+class AsyncMQTTBridge:
+    """paho-mqtt client whose socket I/O runs on an asyncio loop"""
+
+    def __init__(self, host, port, username=None, password=None, use_tls=True,
+                 client_id=None, qos=1, max_topics=64, max_priority=1024, retry_interval=0.5, journal=None,
+                 replay_rate=200.0, replay_window=32, ack_timeout=5.0, backoff=None, subscriptions=(), on_message=None,
+                 protocol=PROTOCOL_V311, max_inflight=20, message_expiry=1, max_age=0.3, stamp=True):
+        self.host = host
+        self.port = port
+        self.connected = False
+        # Connection supervision (same states and backoff as MQTTSupervisor)
+        self.state = STATE_IDLE
+        self.backoff = backoff or Backoff()
+        self.attempts = 0
+        self.last_error = None
+        self.time_to_first_connect = None
+        self._started_at = None
+        self._connected_at = None
+        self._next_attempt_at = None
+        self._loop = None
+        self._connection_task = None
+        self._worker_task = None
+        self._lanes = OutboundLanes(qos, max_topics, max_priority, retry_interval, journal, replay_rate,
+                                    replay_window, ack_timeout)
+        # Set by submits, acks and (re)connects; the worker otherwise sleeps until the lanes come due
+        self._wakeup = None
+        self._connections = 0
+
+        # Topic filters (re)subscribed on every connect; on_message(topic, payload) runs on the loop
+        self._subscriptions = list(subscriptions)
+        self._message_callback = on_message
+
+        # TransportRouter messages go through instead of self.client (see use_transports)
+        self.router = None
+        self._cloud_transport = None
+
+        client_id = client_id or f"asgi_robot_{int(time.time())}_{os.getpid()}"
+        self.client = new_client(client_id, protocol)
+        self.session = None
+        if protocol == PROTOCOL_V5:
+            self.session = MQTT5Session(self.client, message_expiry, max_age, max_inflight, stamp=stamp)
+        else:
+            self.client.max_inflight_messages_set(max_inflight)
+        if username:
+            self.client.username_pw_set(username, password)
+        if use_tls:
+            context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            self.client.tls_set_context(context)
+
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_publish = self._on_publish
+        self.client.on_message = self._on_message
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    # -- lifecycle -----------------------------------------------------------
+
+    async def start(self):
+        """Connect in the background and start the publish worker"""
+        self._loop = asyncio.get_running_loop()
+        self._started_at = time.monotonic()
+        self._wakeup = asyncio.Event()
+        self._lanes.open_journal()
+        self._worker_task = self._loop.create_task(self._publish_worker())
+        self._connection_task = self._loop.create_task(self._connection_loop())
+        if self.router is not None:
+            self.router.start()
+
+    async def stop(self):
+        for task in (self._worker_task, self._connection_task):
+            if task:
+                task.cancel()
+        if self.router is not None:
+            self.router.stop()
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+        self.state = STATE_STOPPED
+        if not self.can_send():
+            # Whatever is still queued survives the restart
+            self._lanes.journal_queued()
+        self._lanes.close_journal()
+
+    async def _connection_loop(self):
+        """(Re)connect with jittered backoff whenever there is no socket, otherwise run keepalive housekeeping"""
+        while True:
+            if self.client.socket() is not None:
+                self.client.loop_misc()
+                await asyncio.sleep(1 if self.connected else 0.05)
+                continue
+            if self.attempts:
+                # Failed attempt, refused CONNACK or dropped connection (reset by a good CONNACK)
+                delay = self.backoff.next()
+                self.state = STATE_BACKOFF
+                self._next_attempt_at = time.monotonic() + delay
+                events.info('mqtt.backoff', "🔄 Retrying MQTT connection", delay=round(delay, 2),
+                            attempt=self.backoff.attempts)
+                await asyncio.sleep(delay)
+                self._next_attempt_at = None
+            self.state = STATE_CONNECTING
+            self.attempts += 1
+            events.info('mqtt.connecting', "🔄 Attempting to connect", host=self.host, port=self.port)
+            try:
+                # DNS, TCP and TLS handshake block, so keep them off the event loop
+                connect_args = self.session.connect_args() if self.session else {}
+                await self._loop.run_in_executor(
+                    None, lambda: self.client.connect(self.host, self.port, 60, **connect_args))
+            except Exception as e:
+                self.last_error = str(e)
+                events.warning('mqtt.connect_failed', "❌ MQTT connection failed", error=str(e),
+                               attempt=self.attempts)
+
+    # -- paho callbacks --------------------------------------------------------
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        self.connected = rc == 0
+        if rc == 0:
+            if self.session is not None:
+                self.session.connected(properties)
+            events.info('mqtt.connected', "✅ Connected to MQTT broker!", rc=rc)
+            self.state = STATE_CONNECTED
+            self.last_error = None
+            self._connected_at = time.time()
+            if self.time_to_first_connect is None:
+                self.time_to_first_connect = time.monotonic() - self._started_at
+            self.backoff.reset()
+            self._connections += 1
+            if self._connections > 1:
+                metrics.MQTT_RECONNECTS.inc()
+            if self._subscriptions:
+                client.subscribe([(topic, 1) for topic in self._subscriptions])
+            # Flush whatever queued up while we were away without waiting out the retry backoff
+            self._lanes.resume()
+            self._wakeup.set()
+        else:
+            self.last_error = mqtt.connack_string(rc)
+            events.error('mqtt.connect_failed', "❌ Failed to connect to MQTT broker", rc=rc)
+
+    def _on_disconnect(self, client, userdata, rc, properties=None):
+        self.connected = False
+        if self.state == STATE_CONNECTED:
+            self.state = STATE_CONNECTING
+        if rc != 0:
+            self.last_error = mqtt.error_string(rc)
+        events.warning('mqtt.disconnected', "🔌 Disconnected from MQTT broker", rc=rc)
+        if self._cloud_transport is not None:
+            # Messages still waiting for their PUBACK try the other robot transports
+            self._cloud_transport.disconnected()
+
+    def _on_publish(self, client, userdata, mid):
+        if self._cloud_transport is not None:
+            # A probe, or a routed message the router acknowledges by its own tag
+            self._cloud_transport.acknowledge(mid)
+            return
+        self._acknowledge(mid)
+
+    def _acknowledge(self, mid):
+        # Runs on the loop thread (inside loop_read, or scheduled by a transport thread)
+        if self._lanes.acknowledge(mid, time.monotonic()):
+            self._wakeup.set()
+
+    def _on_message(self, client, userdata, msg):
+        if self._message_callback is not None:
+            self._message_callback(msg.topic, msg.payload)
+
+    def _on_socket_open(self, client, userdata, sock):
+        # May be called from the executor thread during connect()
+        self._loop.call_soon_threadsafe(self._watch_socket, sock)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._loop.call_soon_threadsafe(self._unwatch_socket, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._loop.call_soon_threadsafe(self._loop.add_writer, sock, self._do_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._loop.call_soon_threadsafe(self._loop.remove_writer, sock)
+
+    def _watch_socket(self, sock):
+        self._loop.add_reader(sock, self._do_read)
+
+    def _unwatch_socket(self, sock):
+        self._loop.remove_reader(sock)
+        self._loop.remove_writer(sock)
+
+    def _do_read(self):
+        self.client.loop_read()
+        # TLS can hold decrypted bytes that never make the socket readable again
+        sock = self.client.socket()
+        while sock is not None and hasattr(sock, 'pending') and sock.pending():
+            self.client.loop_read()
+            sock = self.client.socket()
+
+    def _do_write(self):
+        self.client.loop_write()
+
+    # -- publishing ------------------------------------------------------------
+
+    def use_transports(self, router, cloud):
+        """Send through router; cloud is its transport for this connection (an MQTTTransport over publish_now)"""
+        self.router = router
+        self._cloud_transport = cloud
+        # Acks come from transport threads; handle them on the loop like PUBACKs
+        router.on_ack = lambda tag: self._loop.call_soon_threadsafe(self._acknowledge, tag)
+
+    def publish_now(self, topic, payload, qos):
+        """Publish straight to this broker; the mid, or None if not connected or refused"""
+        if not self.connected:
+            return None
+        publish = self.session.publish if self.session else self.client.publish
+        result = publish(topic, payload, qos=qos, retain=False)
+        return result.mid if result.rc == mqtt.MQTT_ERR_SUCCESS else None
+
+    def can_send(self):
+        """Connected - or, with a router, any of its transports is"""
+        return self.router.available() if self.router is not None else self.connected
+
+    def _send(self, topic, payload, qos):
+        # Message id (router tag when routed) to match the ack with, None on failure
+        if self.router is not None:
+            return self.router.send(topic, payload, qos)
+        return self.publish_now(topic, payload, qos)
+
+    def submit(self, topic, payload, ingest_time=None):
+        """Queue payload for topic; newest payload per topic wins (see MQTTPublisher.submit)"""
+        queued, ingest_time = self._lanes.submit(topic, payload, ingest_time)
+        if not queued:
+            return False
+        observe_stage('enqueue', ingest_time, time.monotonic())
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return True
+
+    def submit_priority(self, topic, payload, qos=1, ingest_time=None):
+        """Queue an urgent message ahead of all pending snapshots; never coalesced"""
+        now = time.monotonic()
+        if not self._lanes.submit_priority(topic, payload, qos, ingest_time, now):
+            return False
+        observe_stage('enqueue', ingest_time, now, LANE_STOP)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return True
+
+    async def _publish_worker(self):
+        while True:
+            now = time.monotonic()
+            outgoing = self._lanes.next_send(now)
+            if outgoing is None:
+                # Nothing due: sleep until a lane is (backoff, replay pacing, ack timeout) or something arrives
+                due = self._lanes.next_due(now)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), max(0.0, due - now) if due is not None else None)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            topic, payload, qos, _ = outgoing[1]
+            mid = self._send(topic, payload, qos)
+            self._lanes.sent(outgoing, mid, time.monotonic())
+
+    def connection_stats(self):
+        """Same shape as MQTTSupervisor.stats()"""
+        next_attempt = self._next_attempt_at
+        return {
+            'state': self.state,
+            'connected': self.connected,
+            'attempts': self.attempts,
+            'connections': self._connections,
+            'last_error': self.last_error,
+            'connected_since': self._connected_at if self.connected else None,
+            'next_attempt_in': round(max(0.0, next_attempt - time.monotonic()), 3) if next_attempt else None,
+            'time_to_first_connect': (round(self.time_to_first_connect, 3)
+                                      if self.time_to_first_connect is not None else None),
+            'mqtt5': self.session.stats() if self.session else None
+        }
+
+    def stats(self):
+        return {'running': self._worker_task is not None and not self._worker_task.done(), **self._lanes.stats()}
+
+    def backlog(self):
+        """Same as MQTTPublisher.backlog()"""
+        return self._lanes.backlog(time.monotonic())
@@ -0,0 +1,169 @@
+"""
+Batched gesture frame ingestion
+Clients on a poor network can buffer frames and send them in one request to
+/api/robot-status/batch (or /api/robots/<id>/batch): a JSON array, an object
+{"frames": [...]}, or NDJSON (one frame per line). Each frame is an
+/api/robot-status payload or a raw gesture event, optionally with
+  - seq: client sequence number; frames at or below the highest seq applied
+    for their session are rejected as stale (retries, duplicates, reordering)
+  - session: client session id; each session has its own seq numbering, so
+    several clients (or an app that restarted) can drive one robot
+  - timestamp: epoch seconds/milliseconds or ISO 8601; frames are applied
+    in timestamp order, and one older than the newest frame already applied
+    from its own session is rejected as stale (clocks of different devices
+    are never compared; frames that carry stopped are never dropped for
+    their timestamp)
+The whole batch is merged under one store lock into as few state versions
+as possible (stop/resume transitions keep their own version so the priority
+lane still sees every one), then published once and broadcast once.
+"""
+
+import json
+import math
+import threading
+from collections import OrderedDict
+
+from gesture_classifier import is_gesture_event, parse_timestamp
+from state_store import validate_state
+
+SEQ_KEY = 'seq'
+SESSION_KEY = 'session'
+TIMESTAMP_KEY = 'timestamp'
+
+# Client sessions remembered per robot; the least recently active one goes first
+MAX_SESSIONS = 64
+
+
+class BatchError(ValueError):
+    pass
+
+
+def parse_batch(body, max_frames):
+    """List of frame dicts from a JSON array, {"frames": [...]} or NDJSON body"""
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+    if not body.strip():
+        raise BatchError("No frames received")
+    try:
+        data = json.loads(body)
+    except ValueError:
+        # NDJSON: one frame per non-empty line
+        try:
+            data = [json.loads(line) for line in body.splitlines() if line.strip()]
+        except ValueError as e:
+            raise BatchError(f"Invalid JSON: {e}") from None
+    if isinstance(data, dict):
+        data = data['frames'] if 'frames' in data else [data]
+    if not isinstance(data, list) or not all(isinstance(frame, dict) for frame in data):
+        raise BatchError("Expected a list of frame objects")
+    if len(data) > max_frames:
+        raise BatchError(f"Too many frames ({len(data)} > {max_frames})")
+    return data
+
+
+class SequenceTracker:
+    """Highest applied client sequence number and newest frame timestamp per client session for one robot
+
+    Sessions are kept in LRU order, at most max_sessions of them; one that was
+    evicted starts over. Frames without a session id share the None session.
+    Callers hold lock.
+    """
+
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.lock = threading.Lock()
+        self.max_sessions = max_sessions
+        # session -> [last seq or None, newest timestamp]
+        self._sessions = OrderedDict()
+
+    def last_seq_for(self, session):
+        """Highest seq applied for a client session (None until one with a seq was applied)"""
+        entry = self._sessions.get(session)
+        return entry[0] if entry is not None else None
+
+    def is_stale(self, session, seq, timestamp=None, urgent=False):
+        """A repeated or reordered frame; urgent (stop/resume) frames are judged by seq only"""
+        entry = self._sessions.get(session)
+        if entry is None:
+            return False
+        last_seq, newest_time = entry
+        if seq is not None and last_seq is not None and seq <= last_seq:
+            return True
+        return not urgent and timestamp is not None and timestamp < newest_time
+
+    def applied(self, session, seq, timestamp=None):
+        entry = self._sessions.get(session)
+        if entry is None:
+            entry = self._sessions[session] = [None, -math.inf]
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(session)
+        if seq is not None:
+            entry[0] = seq
+        if timestamp is not None and timestamp > entry[1]:
+            entry[1] = timestamp
+
+
+def ingest_batch(session, frames, now, split_on=('stopped',)):
+    """Apply frames to session's store; returns (created [(version, delta)], report dict)
+
+    Frames are ordered by timestamp (frames without one keep their place
+    after the previous timestamped frame), stale sequence numbers are
+    dropped, and everything else is merged in one apply_batch call.
+    """
+    ordered = []
+    last_time = -math.inf
+    invalid = 0
+    for index, frame in enumerate(frames):
+        try:
+            timestamp = parse_timestamp(frame.get(TIMESTAMP_KEY), None)
+            seq = frame.get(SEQ_KEY)
+            if seq is not None:
+                seq = int(seq)
+        except (TypeError, ValueError):
+            invalid += 1
+            continue
+        if timestamp is not None:
+            last_time = timestamp
+        ordered.append((last_time, index, seq, frame))
+    ordered.sort(key=lambda item: (item[0], item[1]))
+
+    tracker = session.sequence
+    stale = 0
+    applied = 0
+    last_seq = None
+    with tracker.lock:
+        changes = []
+        for timestamp, _, seq, frame in ordered:
+            client_session = frame.get(SESSION_KEY)
+            if timestamp == -math.inf:
+                timestamp = None
+            if tracker.is_stale(client_session, seq, timestamp, 'stopped' in frame):
+                stale += 1
+                continue
+            try:
+                if is_gesture_event(frame):
+                    frame_changes, _ = session.gestures.changes_from_events(
+                        frame, now if timestamp is None else timestamp)
+                else:
+                    frame_changes = validate_state(frame)
+            except (TypeError, ValueError, AttributeError):
+                invalid += 1
+                continue
+            applied += 1
+            tracker.applied(client_session, seq, timestamp)
+            if frame_changes:
+                changes.append(frame_changes)
+        created = session.state_store.apply_batch(changes, split_on=split_on)
+        if ordered:
+            # Reported for the (last) client session in the batch
+            last_seq = tracker.last_seq_for(ordered[-1][3].get(SESSION_KEY))
+
+    return created, {
+        'frames': len(frames),
+        'applied': applied,
+        'stale': stale,
+        'invalid': invalid,
+        'last_seq': last_seq,
+        'versions': [version for version, _ in created]
+    }
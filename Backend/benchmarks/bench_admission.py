@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Admission control benchmark
+1. rate: with the per-client limit off and on (--no-mqtt), a well-behaved
+   Lens client posts at 30 Hz (X-Client-Id: lens) while --flood-workers
+   post to another robot as fast as they can (X-Client-Id: flood) and a
+   WebSocket protocol client streams unpaced frames. The flooding client also
+   toggles stop every --stop-interval; those must always be accepted. Reported: the Lens client's
+   latency and errors, flood requests accepted per second, 429s and the
+   Retry-After they carried, stops accepted, and throttle messages and
+   throttled frames on the socket.
+2. overload: against the local broker with --broker-delay-ms per PUBLISH
+   (a broker that cannot keep up), --robots clients post changing states at
+   30 Hz each and one stop toggle goes to a random robot every
+   --stop-interval. With backpressure off the outbound backlog keeps
+   growing; with it on (--max-backlog, --max-latency), updates get 503 once
+   the backlog is that deep or its oldest message that old. Reported: accepted/503 counts, the
+   deepest backlog and oldest age seen on /debug/admission, and
+   POST -> broker latency of the stop commands (which are never shed).
+
+Usage: python benchmarks/bench_admission.py --server asgi --duration 10
+       python benchmarks/bench_admission.py --scenarios overload --robots 10 --broker-delay-ms 20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+import websockets
+
+from bench_server_modes import BACKEND_DIR, free_port, percentile, wait_until_ready
+from local_broker import LocalBroker
+
+sys.path.insert(0, BACKEND_DIR)
+from config import MQTT_TOPIC
+
+HORIZONTAL = ('left', 'straight', 'right')
+VERTICAL = ('down', 'neutral', 'up')
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+async def request(port, method, path, body=b'', client_id=None):
+    """(status, headers dict, body) for one HTTP/1.1 request"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    extra = f"X-Client-Id: {client_id}\r\n" if client_id else ''
+    writer.write((f"{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n{extra}"
+                  f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n").encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return int(lines[0].split(' ', 2)[1]), headers, payload
+
+
+def random_state(rng):
+    return {'hand': {'right': {'horizontal': rng.choice(HORIZONTAL)},
+                     'left': {'vertical': rng.choice(VERTICAL)}}}
+
+
+def start_server(args, port, env, mqtt_enabled):
+    command = [sys.executable, 'app.py', '--server', args.server, '--host', '127.0.0.1', '--port', str(port)]
+    if not mqtt_enabled:
+        command.append('--no-mqtt')
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=dict(os.environ, LOG_LEVEL='warning', **env),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(5)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+# -- 1. per-client rate limit ----------------------------------------------------
+
+async def lens_client(port, deadline, latencies, totals):
+    rng = random.Random(1)
+    started = time.perf_counter()
+    n = 0
+    while time.perf_counter() < deadline:
+        delay = started + n / 30.0 - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        n += 1
+        sent = time.perf_counter()
+        status, _, _ = await request(port, 'POST', '/api/robots/lens/status', json.dumps(random_state(rng)).encode(),
+                                     client_id='lens')
+        latencies.append((time.perf_counter() - sent) * 1000)
+        if status != 200:
+            totals['lens_errors'] += 1
+
+
+async def flood_worker(port, worker, deadline, totals, retry_after):
+    rng = random.Random(100 + worker)
+    while time.perf_counter() < deadline:
+        status, headers, _ = await request(port, 'POST', '/api/robots/flood/status',
+                                           json.dumps(random_state(rng)).encode(), client_id='flood')
+        if status == 200:
+            totals['flood_ok'] += 1
+        elif status == 429:
+            totals['flood_429'] += 1
+            retry_after.append(int(headers.get('retry-after', 0)))
+        else:
+            totals['flood_other'] += 1
+
+
+async def flood_stops(port, deadline, interval, totals):
+    """Stop toggles from the flooding client itself, one at a time so none arrives out of order"""
+    stopped = False
+    while time.perf_counter() + interval < deadline:
+        await asyncio.sleep(interval)
+        stopped = not stopped
+        status, _, _ = await request(port, 'POST', '/api/robots/flood/status',
+                                     json.dumps({'stopped': stopped}).encode(), client_id='flood')
+        totals['stops'] += 1
+        totals['stops_ok'] += status == 200
+
+
+async def ws_flood(port, deadline, totals):
+    ws = await websockets.connect(f'ws://127.0.0.1:{port}/ws/wsflood', ping_interval=None, max_queue=None)
+    await ws.recv()
+    await ws.send(json.dumps({'op': 'hello', 'session': 'ws-flood', 'subscribe': False}))
+    await ws.recv()
+    last_ack = {}
+
+    async def reader():
+        async for message in ws:
+            message = json.loads(message)
+            if message.get('op') == 'throttle':
+                totals['ws_throttle_msgs'] += 1
+            elif message.get('op') == 'ack':
+                last_ack.update(message)
+
+    reading = asyncio.ensure_future(reader())
+    rng = random.Random(7)
+    seq = 0
+    while time.perf_counter() < deadline:
+        seq += 1
+        await ws.send(json.dumps(dict(random_state(rng), op='delta', seq=seq)))
+        if seq % 20 == 0:
+            await asyncio.sleep(0)
+    await asyncio.sleep(0.3)
+    reading.cancel()
+    await ws.close()
+    totals['ws_frames'] = seq
+    totals['ws_throttled'] = last_ack.get('throttled')
+
+
+async def run_rate(args, limited):
+    port = free_port()
+    env = {'ADMISSION_RATE': str(args.rate if limited else 0), 'ADMISSION_BURST': str(args.rate * 2)}
+    server = start_server(args, port, env, mqtt_enabled=False)
+    result = {'scenario': 'rate', 'limit': f'{args.rate}/s' if limited else 'off'}
+    try:
+        if not await wait_until_ready(port, timeout=30):
+            result['error'] = 'server did not start'
+            return result
+        totals = dict.fromkeys(('lens_errors', 'flood_ok', 'flood_429', 'flood_other', 'stops', 'stops_ok',
+                                'ws_throttle_msgs'), 0)
+        latencies, retry_after = [], []
+        deadline = time.perf_counter() + args.duration
+        await asyncio.gather(lens_client(port, deadline, latencies, totals),
+                             ws_flood(port, deadline, totals),
+                             flood_stops(port, deadline, args.stop_interval, totals),
+                             *(flood_worker(port, n, deadline, totals, retry_after) for n in range(args.flood_workers)))
+        _, _, body = await request(port, 'GET', '/debug/admission')
+        result.update({
+            'lens_p50_ms': _round(percentile(latencies, 50)),
+            'lens_p99_ms': _round(percentile(latencies, 99)),
+            'lens_errors': totals['lens_errors'],
+            'flood_ok_per_s': round(totals['flood_ok'] / args.duration, 1),
+            'flood_429': totals['flood_429'],
+            'flood_other': totals['flood_other'],
+            'retry_after_s': sorted(set(retry_after)),
+            'stops_ok': f"{totals['stops_ok']}/{totals['stops']}",
+            'ws_frames': totals['ws_frames'],
+            'ws_throttle_msgs': totals['ws_throttle_msgs'],
+            'ws_throttled': totals['ws_throttled'],
+            'server': json.loads(body)
+        })
+    finally:
+        stop_server(server)
+    return result
+
+
+# -- 2. backpressure ---------------------------------------------------------------
+
+class StopTimer:
+    """POST -> arrival at the broker for stop commands, matched by robot topic"""
+
+    def __init__(self):
+        self.sent = {}
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def record_send(self, robot_id):
+        with self._lock:
+            self.sent[f"{MQTT_TOPIC}/{robot_id}/stop"] = time.perf_counter()
+
+    def on_message(self, client, userdata, message):
+        now = time.perf_counter()
+        with self._lock:
+            started = self.sent.pop(message.topic, None)
+            if started is not None:
+                self.latencies.append((now - started) * 1000)
+
+
+async def overload_poster(port, robot_id, deadline, totals):
+    rng = random.Random(robot_id)
+    started = time.perf_counter()
+    n = 0
+    while time.perf_counter() < deadline:
+        delay = started + n / 30.0 - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        n += 1
+        status, _, _ = await request(port, 'POST', f'/api/robots/{robot_id}/status',
+                                     json.dumps(random_state(rng)).encode(), client_id=robot_id)
+        totals[status] = totals.get(status, 0) + 1
+
+
+async def stop_poster(port, robots, deadline, interval, timer, totals):
+    rng = random.Random(3)
+    stopped = dict.fromkeys(robots, False)
+    while time.perf_counter() + interval < deadline:
+        await asyncio.sleep(interval)
+        robot_id = rng.choice(robots)
+        stopped[robot_id] = not stopped[robot_id]
+        timer.record_send(robot_id)
+        status, _, _ = await request(port, 'POST', f'/api/robots/{robot_id}/status',
+                                     json.dumps({'stopped': stopped[robot_id]}).encode(), client_id='operator')
+        totals['stops'] += 1
+        totals['stops_ok'] += status == 200
+
+
+async def watch_backlog(port, deadline, seen):
+    while time.perf_counter() < deadline:
+        _, _, body = await request(port, 'GET', '/debug/admission')
+        backlog = json.loads(body).get('backlog')
+        if backlog:
+            seen['depth'] = max(seen['depth'], backlog[0])
+            seen['oldest_ms'] = max(seen['oldest_ms'], backlog[1] * 1000)
+        await asyncio.sleep(0.1)
+
+
+async def run_overload(args, shedding):
+    broker = LocalBroker(port=0, delay_ms=args.broker_delay_ms).start()
+    timer = StopTimer()
+    subscriber = mqtt.Client(client_id=f"admission_bench_{os.getpid()}", clean_session=True)
+    ready = threading.Event()
+    subscriber.on_connect = lambda c, userdata, flags, rc: c.subscribe(f"{MQTT_TOPIC}/+/stop", qos=0)
+    subscriber.on_subscribe = lambda *a: ready.set()
+    subscriber.on_message = timer.on_message
+    subscriber.connect('127.0.0.1', broker.port, 60)
+    subscriber.loop_start()
+    ready.wait(5)
+
+    port = free_port()
+    env = {'MQTT_HOST': '127.0.0.1', 'MQTT_PORT': str(broker.port), 'MQTT_TLS': '0', 'MQTT_JOURNAL': '',
+           'ADMISSION_RATE': '0'}
+    if shedding:
+        env.update(ADMISSION_MAX_BACKLOG=str(args.max_backlog), ADMISSION_MAX_LATENCY=str(args.max_latency))
+    else:
+        env.update(ADMISSION_MAX_BACKLOG='inf', ADMISSION_MAX_LATENCY='inf')
+    server = start_server(args, port, env, mqtt_enabled=True)
+    result = {'scenario': 'overload', 'backpressure': 'on' if shedding else 'off',
+              'broker_delay_ms': args.broker_delay_ms}
+    try:
+        if not await wait_until_ready(port, timeout=30):
+            result['error'] = 'server did not start'
+            return result
+        robots = [f'r{n}' for n in range(args.robots)]
+        totals = {'stops': 0, 'stops_ok': 0}
+        seen = {'depth': 0, 'oldest_ms': 0.0}
+        deadline = time.perf_counter() + args.duration
+        await asyncio.gather(*(overload_poster(port, robot_id, deadline, totals) for robot_id in robots),
+                             stop_poster(port, robots, deadline, args.stop_interval, timer, totals),
+                             watch_backlog(port, deadline, seen))
+        await asyncio.sleep(1.0)
+        result.update({
+            'accepted': totals.get(200, 0),
+            'shed_503': totals.get(503, 0),
+            'max_backlog': seen['depth'],
+            'max_oldest_ms': round(seen['oldest_ms'], 1),
+            'stops_ok': f"{totals['stops_ok']}/{totals['stops']}",
+            'stops_delivered': len(timer.latencies),
+            'stop_p50_ms': _round(percentile(timer.latencies, 50)),
+            'stop_max_ms': _round(max(timer.latencies) if timer.latencies else None),
+            'broker_received': broker.received
+        })
+    finally:
+        stop_server(server)
+        subscriber.loop_stop()
+        subscriber.disconnect()
+        broker.stop()
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=['flask', 'asgi'], default='flask')
+    parser.add_argument('--scenarios', nargs='+', default=['rate', 'overload'], choices=['rate', 'overload'])
+    parser.add_argument('--duration', type=float, default=8.0, help='seconds per run')
+    parser.add_argument('--rate', type=float, default=60.0, help='per-client limit (updates/s) for the limited run')
+    parser.add_argument('--flood-workers', type=int, default=8, help='concurrent flooding HTTP requests')
+    parser.add_argument('--robots', type=int, default=10, help='robots posting at 30 Hz in the overload run')
+    parser.add_argument('--broker-delay-ms', type=float, default=20.0, help='broker delay per PUBLISH')
+    parser.add_argument('--max-backlog', type=int, default=64, help='ADMISSION_MAX_BACKLOG for the shedding run')
+    parser.add_argument('--max-latency', type=float, default=0.25, help='ADMISSION_MAX_LATENCY for the shedding run')
+    parser.add_argument('--stop-interval', type=float, default=0.5, help='seconds between stop toggles')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    for scenario in args.scenarios:
+        for enabled in (False, True):
+            print(f"🔄 {args.server} {scenario} ({'on' if enabled else 'off'})...")
+            if scenario == 'rate':
+                result = await run_rate(args, enabled)
+            else:
+                result = await run_overload(args, enabled)
+            print(json.dumps(result))
+            results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'admission', 'args': vars(args), 'results': results}, f, indent=2)
+        print(f"📄 Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Batched ingestion benchmark (runs fully offline)
+Starts app.py against the local MQTT broker stand-in and sends the same
+stream of gesture frames from --clients simulated Lens clients (one robot
+each) in two ways:
+  - per-frame: one POST /api/robots/<id>/status per frame
+  - batched: frames buffered client-side and sent --batch at a time to
+    POST /api/robots/<id>/batch (alternating JSON array and NDJSON bodies)
+--rtt-ms adds a delay before every request to model a slow mobile link,
+where the number of round trips rather than server time sets the rate.
+
+For each it reports frames/s, requests, state versions created and MQTT
+messages that reached the broker. Afterwards every batched client resends
+its last batch, which must come back entirely stale.
+
+Usage: python benchmarks/bench_batch_ingest.py --clients 10 --frames 600 --batch 1 10 50 --rtt-ms 0 50
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+from bench_server_modes import BACKEND_DIR, free_port, http_request, wait_until_ready
+from bench_fleet import start_topic_counter
+from local_broker import LocalBroker
+
+sys.path.insert(0, BACKEND_DIR)
+from config import MQTT_TOPIC
+
+HORIZONTAL = ('left', 'straight', 'right')
+VERTICAL = ('down', 'neutral', 'up')
+
+
+def client_frames(count, seed):
+    """Gesture frames with seq and timestamp; a stop/resume pair every 200 frames"""
+    rng = random.Random(seed)
+    frames = []
+    t = 1700000000.0
+    for seq in range(1, count + 1):
+        t += 1 / 30
+        frame = {'seq': seq, 'timestamp': round(t, 4)}
+        if seq % 200 in (100, 101):
+            frame['stopped'] = seq % 200 == 100
+        else:
+            frame['hand'] = {'right': {'horizontal': rng.choice(HORIZONTAL)},
+                             'left': {'vertical': rng.choice(VERTICAL)}}
+        frames.append(frame)
+    return frames
+
+
+def encode_batch(frames, ndjson):
+    if ndjson:
+        return '\n'.join(json.dumps(frame) for frame in frames).encode()
+    return json.dumps(frames).encode()
+
+
+async def run_client(port, robot_id, frames, batch, rtt, totals):
+    last_body = None
+    for n in range(0, len(frames), batch):
+        chunk = frames[n:n + batch]
+        if batch == 1:
+            path, body = f'/api/robots/{robot_id}/status', json.dumps(chunk[0]).encode()
+        else:
+            path, body = f'/api/robots/{robot_id}/batch', encode_batch(chunk, ndjson=(n // batch) % 2 == 1)
+            last_body = body
+        if rtt:
+            await asyncio.sleep(rtt)
+        status, response = await http_request(port, 'POST', path, body)
+        totals['requests'] += 1
+        if status != 200:
+            totals['errors'] += 1
+        elif batch > 1:
+            report = json.loads(response)
+            totals['versions'] += len(report['versions'])
+            totals['stale'] += report['stale']
+    return last_body
+
+
+async def run_mode(args, batch, rtt_ms):
+    broker = LocalBroker(port=0).start()
+    port = free_port()
+    env = dict(os.environ, MQTT_HOST='127.0.0.1', MQTT_PORT=str(broker.port), MQTT_TLS='0', LOG_LEVEL='warning',
+               MQTT_JOURNAL='')
+    server = subprocess.Popen(
+        [sys.executable, 'app.py', '--server', args.server, '--host', '127.0.0.1', '--port', str(port)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    mqtt_client = None
+    result = {'mode': 'per-frame' if batch == 1 else f'batch={batch}', 'rtt_ms': rtt_ms}
+    try:
+        if not await wait_until_ready(port, timeout=30):
+            result['error'] = 'server did not start'
+            return result
+        mqtt_client, counter = start_topic_counter(broker.port)
+        robot_ids = [f"batch{n}" for n in range(args.clients)]
+        streams = [client_frames(args.frames, seed=n) for n in range(args.clients)]
+        for robot_id in robot_ids:
+            await http_request(port, 'POST', f'/api/robots/{robot_id}/status', b'{}')
+
+        totals = {'requests': 0, 'errors': 0, 'versions': 0, 'stale': 0}
+        started = time.perf_counter()
+        last_bodies = await asyncio.gather(*(run_client(port, robot_id, frames, batch, rtt_ms / 1000.0, totals)
+                                             for robot_id, frames in zip(robot_ids, streams)))
+        elapsed = time.perf_counter() - started
+        await asyncio.sleep(0.5)
+
+        if batch > 1:
+            # Retries after a lost response: everything in them is a duplicate
+            resent, stale = 0, 0
+            for robot_id, body in zip(robot_ids, last_bodies):
+                _, response = await http_request(port, 'POST', f'/api/robots/{robot_id}/batch', body)
+                report = json.loads(response)
+                resent += report['frames']
+                stale += report['stale']
+            result['resend_stale'] = f"{stale}/{resent}"
+        else:
+            for robot_id in robot_ids:
+                _, response = await http_request(port, 'GET', f'/api/robots/{robot_id}/state')
+                totals['versions'] += json.loads(response)['version']
+
+        frames = args.clients * args.frames
+        result.update({
+            'frames': frames,
+            'frames_per_s': round(frames / elapsed, 1),
+            'requests': totals['requests'],
+            'errors': totals['errors'],
+            'state_versions': totals['versions'],
+            'mqtt_messages': sum(count for topic, count in counter.topics.items()
+                                 if topic.startswith(f"{MQTT_TOPIC}/batch")),
+            'elapsed_s': round(elapsed, 2)
+        })
+    finally:
+        if mqtt_client:
+            mqtt_client.loop_stop()
+            mqtt_client.disconnect()
+        server.terminate()
+        try:
+            server.wait(5)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        broker.stop()
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=['flask', 'asgi'], default='flask')
+    parser.add_argument('--clients', type=int, default=10, help='simulated clients, one robot each')
+    parser.add_argument('--frames', type=int, default=600, help='frames per client')
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 10, 50], help='frames per request (1 = per-frame)')
+    parser.add_argument('--rtt-ms', type=float, nargs='+', default=[0, 50], help='delay before each request')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    for rtt_ms in args.rtt_ms:
+        for batch in args.batch:
+            print(f"🔄 {args.server}: {args.clients} clients x {args.frames} frames, batch {batch}, rtt {rtt_ms}ms...")
+            result = await run_mode(args, batch, rtt_ms)
+            print(json.dumps(result))
+            results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'batch_ingest', 'args': vars(args), 'results': results}, f, indent=2)
+        print(f"📄 Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
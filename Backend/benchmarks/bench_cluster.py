@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Cluster scale-out benchmark
+For each worker count, starts that many app.py processes in cluster mode on
+their own ports (as a load balancer would spread them), with the local broker
+stand-in as both the backplane and the robot broker, and waits until they
+agree on one owner. Then, for a growing number of dashboard WebSocket
+clients spread round-robin over the workers (opened by --client-procs helper
+processes), a driver posts --rate updates/s with unique tokens to the
+workers in turn and every client timestamps each broadcast it gets.
+
+A step passes when every connection opened, at least --min-delivery of the
+broadcasts arrived and their p99 latency stayed under --slo-ms; capacity is
+the largest passing step. Also reported per worker count: how many workers
+published to MQTT (must be 1), robot messages seen at the broker, and
+whether every worker ended with the same state.
+
+Capacity grows with workers only as far as there are cores for them: on a
+single core the workers share one CPU with the clients and the driver.
+
+Usage: python benchmarks/bench_cluster.py --workers 1 2 4 --steps 250 500 1000 2000 4000
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+import websockets
+
+from bench_server_modes import BACKEND_DIR, TOKEN_APP, free_port, http_request, wait_until_ready, process_stats
+from bench_fleet import start_topic_counter
+from local_broker import LocalBroker
+
+# Latency histogram resolution and range (ms)
+BUCKET_MS = 1
+MAX_MS = 10000
+
+
+# -- client helper processes -------------------------------------------------------
+
+async def _hold_clients(ports, count, offset, ready, stop, histogram):
+    semaphore = asyncio.Semaphore(100)
+    sockets = []
+    failed = 0
+
+    async def connect(n):
+        nonlocal failed
+        async with semaphore:
+            try:
+                ws = await websockets.connect(f'ws://127.0.0.1:{ports[n % len(ports)]}/ws', open_timeout=30,
+                                              ping_interval=None, max_queue=None)
+                await ws.recv()  # initial state
+                sockets.append(ws)
+            except Exception:
+                failed += 1
+
+    async def receive(ws):
+        try:
+            async for message in ws:
+                now = time.time()
+                token = json.loads(message)['hand']['right']['horizontal']
+                if token.startswith('t'):
+                    latency = (now - float(token.split(':')[1])) * 1000
+                    bucket = min(MAX_MS, max(0, int(latency / BUCKET_MS)))
+                    histogram[bucket] = histogram.get(bucket, 0) + 1
+        except Exception:
+            pass
+
+    await asyncio.gather(*(connect(offset + n) for n in range(count)))
+    ready.put((len(sockets), failed))
+    readers = [asyncio.ensure_future(receive(ws)) for ws in sockets]
+    while not stop.is_set():
+        await asyncio.sleep(0.05)
+    # Let broadcasts still in flight land
+    await asyncio.sleep(0.5)
+    for reader in readers:
+        reader.cancel()
+    await asyncio.gather(*(ws.close() for ws in sockets), return_exceptions=True)
+
+
+def client_process(ports, count, offset, ready, stop, results):
+    histogram = {}
+    asyncio.run(_hold_clients(ports, count, offset, ready, stop, histogram))
+    results.put(histogram)
+
+
+def histogram_percentile(histogram, pct):
+    total = sum(histogram.values())
+    if not total:
+        return None
+    threshold = total * pct / 100.0
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= threshold:
+            return (bucket + 1) * BUCKET_MS
+    return MAX_MS
+
+
+# -- workers -----------------------------------------------------------------------
+
+def start_workers(args, count, broker_port):
+    workers = []
+    env = dict(os.environ, MQTT_HOST='127.0.0.1', MQTT_PORT=str(broker_port), MQTT_TLS='0', MQTT_JOURNAL='',
+               LOG_LEVEL='warning')
+    for n in range(count):
+        port = free_port()
+        process = subprocess.Popen(
+            [sys.executable, TOKEN_APP, '--server', args.server, '--host', '127.0.0.1', '--port', str(port),
+             '--cluster', f'mqtt://127.0.0.1:{broker_port}', '--node-id', f'w{n}'],
+            cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        workers.append((port, process))
+        # Start order decides who owns publishing: w0 is the oldest
+        time.sleep(0.05)
+    return workers
+
+
+def stop_workers(workers):
+    for _, process in workers:
+        process.terminate()
+    for _, process in workers:
+        try:
+            process.wait(5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+async def get_json(port, path):
+    _, body = await http_request(port, 'GET', path)
+    return json.loads(body)
+
+
+async def wait_for_owner(ports, timeout=20.0):
+    """The node every worker agrees owns publishing, once exactly one claims it"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        states = await asyncio.gather(*(get_json(port, '/debug/cluster') for port in ports))
+        owners = {state['owner'] for state in states}
+        if len(owners) == 1 and None not in owners and sum(state['is_owner'] for state in states) == 1:
+            return owners.pop()
+        await asyncio.sleep(0.2)
+    return None
+
+
+# -- one step: N clients over the workers ---------------------------------------------
+
+async def run_step(args, ports, clients, step_index):
+    context = multiprocessing.get_context('spawn')
+    ready, results, stop = context.Queue(), context.Queue(), context.Event()
+    procs = min(args.client_procs, clients)
+    share, extra = divmod(clients, procs)
+    children = []
+    offset = 0
+    for n in range(procs):
+        count = share + (1 if n < extra else 0)
+        child = context.Process(target=client_process, args=(ports, count, offset, ready, stop, results),
+                                daemon=True)
+        child.start()
+        children.append(child)
+        offset += count
+
+    connected = failed = 0
+    for _ in children:
+        opened, refused = await asyncio.get_running_loop().run_in_executor(None, ready.get)
+        connected += opened
+        failed += refused
+
+    posts = 0
+    post_errors = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < args.duration:
+        port = ports[posts % len(ports)]
+        token = f"t{step_index}-{posts}:{time.time():.6f}"
+        status, _ = await http_request(port, 'POST', '/api/robot-status',
+                                       json.dumps({'hand': {'right': {'horizontal': token}}}).encode())
+        post_errors += status != 200
+        posts += 1
+        delay = started + posts / args.rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    stop.set()
+    histogram = {}
+    for _ in children:
+        for bucket, count in (await asyncio.get_running_loop().run_in_executor(None, results.get)).items():
+            histogram[bucket] = histogram.get(bucket, 0) + count
+    for child in children:
+        child.join(10)
+
+    received = sum(histogram.values())
+    expected = posts * connected
+    result = {
+        'clients': clients,
+        'connected': connected,
+        'failed': failed,
+        'posts': posts,
+        'post_errors': post_errors,
+        'delivery': round(received / expected, 4) if expected else None,
+        'p50_ms': histogram_percentile(histogram, 50),
+        'p99_ms': histogram_percentile(histogram, 99),
+    }
+    result['pass'] = (failed == 0 and not post_errors and result['delivery'] is not None
+                      and result['delivery'] >= args.min_delivery and result['p99_ms'] <= args.slo_ms)
+    return result
+
+
+async def run_cluster(args, count):
+    broker = LocalBroker(port=0).start()
+    counter_client, counter = start_topic_counter(broker.port)
+    workers = start_workers(args, count, broker.port)
+    ports = [port for port, _ in workers]
+    result = {'workers': count, 'server': args.server}
+    try:
+        for port in ports:
+            if not await wait_until_ready(port, timeout=30):
+                result['error'] = 'worker did not start'
+                return result
+        result['owner'] = await wait_for_owner(ports)
+        if result['owner'] is None:
+            result['error'] = 'workers did not agree on an owner'
+            return result
+
+        steps = []
+        for index, clients in enumerate(args.steps):
+            print(f"  🔄 {count} worker(s), {clients} clients...")
+            step = await run_step(args, ports, clients, index)
+            print(f"  {json.dumps(step)}")
+            steps.append(step)
+            if not step['pass'] and not args.all_steps:
+                break
+        result['steps'] = steps
+        result['capacity'] = max([step['clients'] for step in steps if step['pass']], default=0)
+
+        # Exactly one worker publishes; all of them end up with the same state
+        await asyncio.sleep(0.5)
+        statuses = await asyncio.gather(*(get_json(port, '/mqtt-status') for port in ports))
+        result['publishing_workers'] = sum(1 for status in statuses if status['publisher']['published'])
+        result['mqtt_robot_messages'] = sum(counter.topics.values())
+        states = await asyncio.gather(*(get_json(port, '/api/state') for port in ports))
+        result['states_converged'] = all({k: v for k, v in state.items() if k != 'version'} ==
+                                         {k: v for k, v in states[0].items() if k != 'version'}
+                                         for state in states)
+        stats = await asyncio.gather(*(get_json(port, '/debug/cluster') for port in ports))
+        result['backplane_messages'] = sum(stat['sent'] for stat in stats)
+        result['rss_mb'] = round(sum(process_stats(process.pid).get('rss_mb') or 0 for _, process in workers), 1)
+    finally:
+        stop_workers(workers)
+        counter_client.loop_stop()
+        counter_client.disconnect()
+        broker.stop()
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=['flask', 'asgi'], default='asgi')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--steps', type=int, nargs='+', default=[250, 500, 1000, 2000, 4000],
+                        help='WebSocket clients per step (all workers together)')
+    parser.add_argument('--rate', type=float, default=10.0, help='updates posted per second')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds of updates per step')
+    parser.add_argument('--client-procs', type=int, default=2, help='processes holding the client sockets')
+    parser.add_argument('--slo-ms', type=float, default=250.0, help='p99 broadcast latency a step must stay under')
+    parser.add_argument('--min-delivery', type=float, default=0.99, help='fraction of broadcasts that must arrive')
+    parser.add_argument('--all-steps', action='store_true', help='keep going after the first failing step')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    for count in args.workers:
+        print(f"🔄 {args.server}: {count} worker(s)...")
+        result = await run_cluster(args, count)
+        print(json.dumps({k: v for k, v in result.items() if k != 'steps'}))
+        results.append(result)
+
+    print("\n📊 Capacity (clients within the SLO): " +
+          ", ".join(f"{r['workers']} worker(s): {r.get('capacity')}" for r in results))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'cluster', 'args': vars(args), 'results': results}, f, indent=2)
+        print(f"📄 Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
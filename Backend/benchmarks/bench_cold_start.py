@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Cold start benchmark (runs fully offline)
+Starts app.py repeatedly and measures, from process launch:
+  - first served request (GET /health answering 200)
+  - ready (GET /health?ready=1 answering 200, i.e. MQTT connected)
+with the local MQTT broker stand-in up, and with it down (the server must
+still serve immediately and keep retrying in the background). For the
+broker-down runs it also reports how many connection attempts the server
+made while POSTs kept arriving: with the reconnect supervisor that is
+bounded by the backoff schedule, not by the publish rate.
+
+As a reference, 'import_ms' is the time for a bare `python -c "import app"`
+(interpreter start plus imports), the floor for any cold start.
+
+Usage: python benchmarks/bench_cold_start.py --runs 5 --outage 5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from bench_server_modes import BACKEND_DIR, TOKEN_APP, free_port, percentile, http_request
+from local_broker import LocalBroker
+
+
+def _round(value):
+    return None if value is None else round(value, 1)
+
+
+def summarize(samples):
+    return {'p50_ms': _round(percentile(samples, 50)), 'max_ms': _round(max(samples)) if samples else None}
+
+
+def import_time(runs):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import app'], cwd=BACKEND_DIR, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        samples.append((time.perf_counter() - started) * 1000)
+    return summarize(samples)
+
+
+async def poll(port, path, timeout, since=None):
+    """Milliseconds (from since, default now) until path answers 200 (None on timeout)"""
+    started = since or time.perf_counter()
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            status, body = await http_request(port, 'GET', path)
+            if status == 200:
+                return (time.perf_counter() - started) * 1000, body
+        except OSError:
+            pass
+        await asyncio.sleep(0.002)
+    return None, None
+
+
+async def cold_start(server_mode, broker, args):
+    port = free_port()
+    env = dict(os.environ, MQTT_HOST='127.0.0.1', MQTT_PORT=str(broker.port), MQTT_TLS='0', LOG_LEVEL='warning',
+               MQTT_JOURNAL='')
+    launched = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, TOKEN_APP, '--server', server_mode, '--host', '127.0.0.1', '--port', str(port)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        first_ms, _ = await poll(port, '/health', args.timeout, since=launched)
+        ready_ms, _ = await poll(port, '/health?ready=1', args.ready_timeout, since=launched)
+        return first_ms, ready_ms, port, server
+    except Exception:
+        server.kill()
+        raise
+
+
+async def run_mode(server_mode, args):
+    result = {'server': server_mode}
+    broker = LocalBroker(port=0).start()
+    try:
+        first, ready = [], []
+        for _ in range(args.runs):
+            first_ms, ready_ms, _, server = await cold_start(server_mode, broker, args)
+            server.terminate()
+            server.wait(5)
+            if first_ms is not None:
+                first.append(first_ms)
+            if ready_ms is not None:
+                ready.append(ready_ms)
+        result['broker_up'] = {'first_request': summarize(first), 'ready': summarize(ready)}
+
+        # Broker down: serve anyway, report not ready, retry with backoff while updates keep coming
+        broker.go_offline()
+        first_ms, _, port, server = await cold_start(server_mode, broker, argparse.Namespace(
+            timeout=args.timeout, ready_timeout=0.2))
+        try:
+            posts = 0
+            deadline = time.perf_counter() + args.outage
+            while time.perf_counter() < deadline:
+                body = json.dumps({'hand': {'right': {'horizontal': f'p{posts}'}}}).encode()
+                await http_request(port, 'POST', '/api/robot-status', body)
+                posts += 1
+                await asyncio.sleep(0.01)
+            status, body = await http_request(port, 'GET', '/health?ready=1')
+            _, mqtt_body = await http_request(port, 'GET', '/mqtt-status')
+            connection = json.loads(mqtt_body)['connection']
+
+            broker.go_online()
+            recovered, _ = await poll(port, '/health?ready=1', args.ready_timeout)
+            result['broker_down'] = {
+                'first_request_ms': _round(first_ms),
+                'ready_status_during_outage': status,
+                'outage_s': args.outage,
+                'posts_during_outage': posts,
+                'connection_attempts': connection['attempts'],
+                'state': connection['state'],
+                'ready_after_broker_back_ms': _round(recovered)
+            }
+        finally:
+            server.terminate()
+            server.wait(5)
+    finally:
+        broker.stop()
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--servers', nargs='+', choices=['flask', 'asgi'], default=['flask', 'asgi'])
+    parser.add_argument('--runs', type=int, default=5, help='cold starts per server mode')
+    parser.add_argument('--outage', type=float, default=5.0, help='seconds of broker outage (with POSTs)')
+    parser.add_argument('--timeout', type=float, default=15.0, help='max seconds to wait for the first response')
+    parser.add_argument('--ready-timeout', type=float, default=40.0, help='max seconds to wait for readiness')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    results = {'import_ms': import_time(args.runs), 'servers': []}
+    print(f"🐍 interpreter + imports: {json.dumps(results['import_ms'])}")
+    for server_mode in args.servers:
+        print(f"🔄 {server_mode}: {args.runs} cold starts, then a {args.outage}s broker outage...")
+        result = await run_mode(server_mode, args)
+        print(json.dumps(result, indent=2))
+        results['servers'].append(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'cold_start', 'args': vars(args), 'results': results}, f, indent=2)
+        print(f"📄 Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
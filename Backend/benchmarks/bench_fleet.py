@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Multi-robot (fleet) benchmark
+For each fleet size, starts app.py against the local MQTT broker stand-in,
+opens one /ws/<id> subscriber per robot and has concurrent posters drive
+random robots through /api/robots/<id>/status. Reports:
+  - POST throughput and latency
+  - broadcast latency: POST -> state received by that robot's subscriber
+  - cross-talk: broadcasts received by a subscriber for another robot (must be 0)
+  - MQTT: distinct robot/<id> topics seen by a broker-side subscriber
+Throughput and latency should stay flat as the fleet grows: each robot has
+its own lock, hub and topic, so robots never wait on each other.
+
+Usage: python benchmarks/bench_fleet.py --robots 1 10 100 500 --concurrency 32 --duration 5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+import websockets
+
+from bench_server_modes import (BACKEND_DIR, TOKEN_APP, free_port, percentile, http_request, wait_until_ready,
+                                process_stats)
+from local_broker import LocalBroker
+
+sys.path.insert(0, BACKEND_DIR)
+from config import MQTT_TOPIC
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+class TopicCounter:
+    def __init__(self):
+        self.topics = {}
+        self._lock = threading.Lock()
+
+    def on_message(self, client, userdata, message):
+        with self._lock:
+            self.topics[message.topic] = self.topics.get(message.topic, 0) + 1
+
+
+def start_topic_counter(broker_port):
+    counter = TopicCounter()
+    ready = threading.Event()
+    client = mqtt.Client(client_id=f"fleet_bench_{os.getpid()}", clean_session=True)
+    client.on_connect = lambda c, userdata, flags, rc: c.subscribe(f"{MQTT_TOPIC}/#", qos=0)
+    client.on_subscribe = lambda *a: ready.set()
+    client.on_message = counter.on_message
+    client.connect('127.0.0.1', broker_port, 60)
+    client.loop_start()
+    ready.wait(5)
+    return client, counter
+
+
+async def subscriber(robot_id, ws, sent, arrivals, crosstalk):
+    """Match each broadcast to the post that produced it (by robot id and token)"""
+    try:
+        async for message in ws:
+            now = time.perf_counter()
+            token = json.loads(message)['hand']['right']['horizontal']
+            if not token.startswith(f"{robot_id}:"):
+                if token != 'not active':
+                    crosstalk.append(token)
+                continue
+            started = sent.pop(token, None)
+            if started is not None:
+                arrivals.append((now - started) * 1000)
+    except Exception:
+        pass
+
+
+async def run_fleet(size, args):
+    broker = LocalBroker(port=0).start()
+    port = free_port()
+    env = dict(os.environ, MQTT_HOST='127.0.0.1', MQTT_PORT=str(broker.port), MQTT_TLS='0', LOG_LEVEL='warning')
+    server = subprocess.Popen(
+        [sys.executable, TOKEN_APP, '--server', args.server, '--host', '127.0.0.1', '--port', str(port)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    mqtt_client = None
+    result = {'robots': size}
+    try:
+        if not await wait_until_ready(port, timeout=30):
+            result['error'] = 'server did not start'
+            return result
+        mqtt_client, counter = start_topic_counter(broker.port)
+
+        robot_ids = [f"bot{n}" for n in range(size)]
+        sockets = []
+        for robot_id in robot_ids:
+            ws = await websockets.connect(f'ws://127.0.0.1:{port}/ws/{robot_id}', ping_interval=None,
+                                          max_queue=None, open_timeout=30)
+            await ws.recv()  # initial state
+            sockets.append(ws)
+
+        sent, arrivals, crosstalk = {}, [], []
+        readers = [asyncio.ensure_future(subscriber(robot_id, ws, sent, arrivals, crosstalk))
+                   for robot_id, ws in zip(robot_ids, sockets)]
+
+        post_ms = []
+        errors = 0
+        deadline = time.perf_counter() + args.duration
+
+        async def poster(n):
+            nonlocal errors
+            rng = random.Random(n)
+            seq = 0
+            while time.perf_counter() < deadline:
+                robot_id = rng.choice(robot_ids)
+                token = f"{robot_id}:{n}-{seq}"
+                seq += 1
+                body = json.dumps({'hand': {'right': {'horizontal': token}}}).encode()
+                started = time.perf_counter()
+                sent[token] = started
+                try:
+                    status, _ = await http_request(port, 'POST', f'/api/robots/{robot_id}/status', body)
+                    if status != 200:
+                        errors += 1
+                except OSError:
+                    errors += 1
+                post_ms.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(poster(n) for n in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        await asyncio.sleep(1.0)
+        result.update(process_stats(server.pid))
+
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*(ws.close() for ws in sockets), return_exceptions=True)
+
+        robot_topics = [t for t in counter.topics if t.count('/') == 1 and not t.endswith('/stop')]
+        result.update({
+            'posts': len(post_ms),
+            'post_rps': round(len(post_ms) / elapsed, 1),
+            'post_p50_ms': _round(percentile(post_ms, 50)),
+            'post_p99_ms': _round(percentile(post_ms, 99)),
+            'post_errors': errors,
+            'broadcast_p50_ms': _round(percentile(arrivals, 50)),
+            'broadcast_p99_ms': _round(percentile(arrivals, 99)),
+            'broadcasts_matched': len(arrivals),
+            'crosstalk': len(crosstalk),
+            'mqtt_robot_topics': len(robot_topics),
+            'mqtt_messages': sum(counter.topics.values())
+        })
+    finally:
+        if mqtt_client:
+            mqtt_client.loop_stop()
+            mqtt_client.disconnect()
+        server.terminate()
+        try:
+            server.wait(5)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        broker.stop()
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=['flask', 'asgi'], default='asgi')
+    parser.add_argument('--robots', type=int, nargs='+', default=[1, 10, 100, 500], help='fleet sizes to run')
+    parser.add_argument('--concurrency', type=int, default=32, help='concurrent HTTP posters')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds of load per fleet size')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    for size in args.robots:
+        print(f"🔄 {args.server}: {size} robots, {args.concurrency} posters for {args.duration}s...")
+        result = await run_fleet(size, args)
+        print(json.dumps(result))
+        results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'fleet', 'args': vars(args), 'results': results}, f, indent=2)
+        print(f"📄 Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Gesture classification benchmark (runs fully offline)
+Replays pointing traces through two classifiers and counts the direction
+changes each would send downstream (every change is one POST, one state
+version and one MQTT publish):
+  - client: what GestureController.ts does today, a hard ±0.2 threshold on
+    the raw ray, every sample, whatever its confidence
+  - server: gesture_classifier.GestureClassifier with the GESTURE_CLASSIFIER
+    settings from config.py (one-euro filter, hysteresis, confidence gate)
+
+Traces are gesture events in the README format, one JSON object per line
+(hand, confidence, rayDirection, timestamp). --trace replays a recorded
+file; otherwise seeded synthetic traces modelled on hand tracking are used
+(--record writes them out):
+  - hover: the hand held right at the +0.2 boundary with tremor
+  - sweeps: deliberate left/straight/right holds with tremor and quick moves
+  - dropouts: sweeps with low-confidence outliers and brief tracking losses
+
+Per trace it reports changes sent, flickers (changes undone within
+--flicker-ms), agreement with the intended direction, and the lag from an
+intended change to the matching change being sent. It also reports
+classification throughput for single events and batches.
+
+Usage: python benchmarks/bench_gesture_classifier.py --seconds 60 --rate 60
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from config import GESTURE_CLASSIFIER
+from gesture_classifier import GestureClassifier, parse_events, banded_label, NOT_ACTIVE
+
+CLIENT_THRESHOLD = 0.2
+
+
+def _event(hand, t, x, y, confidence):
+    z = math.sqrt(max(0.0, 1.0 - x * x - y * y))
+    return {'type': 'targeting', 'hand': hand, 'confidence': round(confidence, 3),
+            'rayOrigin': [0.0, 0.0, 0.0], 'rayDirection': [round(x, 5), round(y, 5), round(-z, 5)],
+            'timestamp': round(t, 4)}
+
+
+def _holds(rng, seconds, targets, hold=(0.8, 2.0), move=0.25):
+    """Piecewise path: hold a target, move to the next one over `move` seconds"""
+    segments, t, current = [], 0.0, rng.choice(targets)
+    while t < seconds:
+        duration = rng.uniform(*hold)
+        segments.append((t, t + duration, current, current))
+        t += duration
+        target = rng.choice([v for v in targets if v != current])
+        segments.append((t, t + move, current, target))
+        t += move
+        current = target
+    return segments
+
+
+def _position(segments, t):
+    for start, end, a, b in segments:
+        if t < end:
+            return a + (b - a) * (t - start) / (end - start)
+    return segments[-1][3]
+
+
+def synthetic_trace(kind, seconds, rate, seed):
+    """List of (event, intended {field: label}) for the right hand (x) and the left hand's vertical (y)"""
+    rng = random.Random(seed)
+    tremor = 0.025
+    if kind == 'hover':
+        path_x = [(0.0, seconds, 0.21, 0.21)]
+        path_y = [(0.0, seconds, -0.19, -0.19)]
+    else:
+        path_x = _holds(rng, seconds, (-0.6, 0.0, 0.6))
+        path_y = _holds(rng, seconds, (-0.5, 0.0, 0.5))
+    trace = []
+    lost_until = -1.0
+    for n in range(int(seconds * rate)):
+        t = 1700000000.0 + n / rate
+        rel = n / rate
+        x, y = _position(path_x, rel), _position(path_y, rel)
+        truth = {'right': banded_label(x, None, CLIENT_THRESHOLD, 0, 'left', 'straight', 'right'),
+                 'left': banded_label(y, None, CLIENT_THRESHOLD, 0, 'down', 'neutral', 'up')}
+        if kind == 'hover':
+            # Held on the boundary there is no intended side, so only changes count
+            truth = None
+        # Slow drift plus tremor
+        drift = 0.01 * math.sin(rel * 0.7)
+        for hand, value in (('right', x), ('left', y)):
+            confidence = rng.uniform(0.8, 1.0)
+            noisy = value + drift + rng.gauss(0, tremor)
+            if kind == 'dropouts':
+                if rel < lost_until:
+                    trace.append(({'hand': hand, 'confidence': 0.0, 'rayDirection': None,
+                                   'timestamp': round(t, 4)}, truth))
+                    continue
+                if rng.random() < 0.004:
+                    lost_until = rel + rng.uniform(0.05, 0.2)
+                if rng.random() < 0.08:
+                    # Tracking glitch: the ray jumps, the runtime knows it is unsure
+                    confidence = rng.uniform(0.1, 0.4)
+                    noisy = rng.uniform(-0.9, 0.9)
+            if hand == 'right':
+                trace.append((_event(hand, t, noisy, rng.gauss(0, tremor), confidence), truth))
+            else:
+                trace.append((_event(hand, t, rng.gauss(0, tremor), noisy, confidence), truth))
+    return trace
+
+
+def load_trace(path):
+    """Recorded events (optionally with an 'intended' {hand: label} key each)"""
+    trace = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                event = json.loads(line)
+                trace.append((event, event.pop('intended', None)))
+    return trace
+
+
+class ClientClassifier:
+    """GestureController.ts: fixed thresholds on the raw ray, no smoothing or confidence gate"""
+
+    def __init__(self):
+        self.labels = {'right': NOT_ACTIVE, 'left': NOT_ACTIVE}
+
+    def __call__(self, hand, direction):
+        if direction is None:
+            label = NOT_ACTIVE
+        elif hand == 'right':
+            label = banded_label(direction[0], None, CLIENT_THRESHOLD, 0, 'left', 'straight', 'right')
+        else:
+            label = banded_label(direction[1], None, CLIENT_THRESHOLD, 0, 'down', 'neutral', 'up')
+        changed = label != self.labels[hand]
+        self.labels[hand] = label
+        return label if changed else None
+
+
+def replay(trace, flicker_ms):
+    """Feed the trace through both classifiers; returns per-classifier change logs"""
+    client = ClientClassifier()
+    server = GestureClassifier(**GESTURE_CLASSIFIER)
+    field = {'right': 'horizontal', 'left': 'vertical'}
+    logs = {'client': [], 'server': []}
+    timeline = []
+    for event, intended in trace:
+        (hand, direction, confidence, t), = parse_events(event, time.time())
+        label = client(hand, direction)
+        if label is not None:
+            logs['client'].append((t, hand, label))
+        changes = server.classify([(hand, direction, confidence, t)])
+        label = changes.get('hand', {}).get(hand, {}).get(field[hand])
+        if label is not None:
+            logs['server'].append((t, hand, label))
+        timeline.append((t, hand, intended[hand] if intended else None, client.labels[hand],
+                         server.hands[hand].labels[field[hand]]))
+    return logs, timeline, server.stats()['samples']
+
+
+def summarize(name, log, timeline, flicker_ms, column):
+    changes = len(log)
+    # A flicker is a change undone (back to the previous label) within flicker_ms
+    flickers = 0
+    last = {}
+    for t, hand, label in log:
+        previous = last.get(hand)
+        if previous and t - previous[0] <= flicker_ms / 1000.0 and label == previous[2]:
+            flickers += 1
+        last[hand] = (t, label, last.get(hand, (0, None, None))[1])
+    labelled = [row for row in timeline if row[2] is not None]
+    agree = sum(1 for row in labelled if row[column] == row[2])
+
+    # Lag: intended change -> first sent label equal to the new intended label
+    lags = []
+    previous_intended = {}
+    pending = {}
+    for t, hand, intended, *labels in timeline:
+        if intended is None:
+            continue
+        if previous_intended.get(hand) not in (None, intended):
+            pending[hand] = (t, intended)
+        previous_intended[hand] = intended
+        if hand in pending and labels[column - 3] == pending[hand][1]:
+            lags.append((t - pending[hand][0]) * 1000)
+            del pending[hand]
+    lags.sort()
+    return {
+        'classifier': name,
+        'changes_sent': changes,
+        'flickers': flickers,
+        'agreement': round(agree / len(labelled), 4) if labelled else None,
+        'lag_p50_ms': round(lags[len(lags) // 2], 1) if lags else None,
+        'lag_p95_ms': round(lags[int(len(lags) * 0.95)], 1) if lags else None,
+        'intended_changes': len(lags) + len(pending)
+    }
+
+
+def bench_trace(name, trace, flicker_ms):
+    logs, timeline, outcomes = replay(trace, flicker_ms)
+    client = summarize('client', logs['client'], timeline, flicker_ms, 3)
+    server = summarize('server', logs['server'], timeline, flicker_ms, 4)
+    return {
+        'trace': name,
+        'samples': len(trace),
+        'client': client,
+        'server': server,
+        'server_sample_outcomes': outcomes,
+        'changes_reduction': round(1 - server['changes_sent'] / client['changes_sent'], 3)
+        if client['changes_sent'] else None
+    }
+
+
+def bench_throughput(trace, batch):
+    events = [event for event, _ in trace]
+    classifier = GestureClassifier(**GESTURE_CLASSIFIER)
+    started = time.perf_counter()
+    for event in events:
+        classifier.changes_from_events(event)
+    single_s = time.perf_counter() - started
+
+    classifier = GestureClassifier(**GESTURE_CLASSIFIER)
+    started = time.perf_counter()
+    for n in range(0, len(events), batch):
+        classifier.changes_from_events({'events': events[n:n + batch]})
+    batch_s = time.perf_counter() - started
+    return {
+        'events': len(events),
+        'single_us_per_event': round(single_s / len(events) * 1e6, 2),
+        'batch_size': batch,
+        'batched_us_per_event': round(batch_s / len(events) * 1e6, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trace', action='append', help='recorded trace (JSON lines); may be repeated')
+    parser.add_argument('--seconds', type=float, default=60.0, help='length of each synthetic trace')
+    parser.add_argument('--rate', type=float, default=60.0, help='hand tracking rate of synthetic traces (Hz)')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--flicker-ms', type=float, default=300.0)
+    parser.add_argument('--batch', type=int, default=16, help='events per batch for the throughput run')
+    parser.add_argument('--record', help='write the synthetic traces to this directory as JSON lines')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    if args.trace:
+        traces = [(os.path.basename(path), load_trace(path)) for path in args.trace]
+    else:
+        traces = [(kind, synthetic_trace(kind, args.seconds, args.rate, args.seed + n))
+                  for n, kind in enumerate(('hover', 'sweeps', 'dropouts'))]
+    if args.record:
+        os.makedirs(args.record, exist_ok=True)
+        for name, trace in traces:
+            with open(os.path.join(args.record, f'{name}.jsonl'), 'w') as f:
+                for event, intended in trace:
+                    f.write(json.dumps(dict(event, intended=intended) if intended else event) + '\n')
+        print(f"📄 Traces written to {args.record}")
+
+    print(f"🔄 classifier settings: {json.dumps(GESTURE_CLASSIFIER)}")
+    results = {'settings': GESTURE_CLASSIFIER, 'traces': []}
+    for name, trace in traces:
+        result = bench_trace(name, trace, args.flicker_ms)
+        print(json.dumps(result, indent=2))
+        results['traces'].append(result)
+    results['throughput'] = bench_throughput(traces[-1][1], args.batch)
+    print(json.dumps(results['throughput']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'gesture_classifier', 'args': vars(args), 'results': results}, f, indent=2)
+        print(f"📄 Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
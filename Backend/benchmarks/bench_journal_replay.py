@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Outage journal benchmark (runs fully offline)
+1. Journal alone: append / recover / replay throughput for a backlog of
+   motion snapshots across many topics plus interleaved stop transitions,
+   with 'latest' and 'none' compaction.
+2. Outage end to end: starts app.py against the local broker stand-in, takes
+   the broker offline, drives motion updates for --robots robots and stop
+   toggles on the default robot, then brings the broker back and timestamps
+   every message as the broker receives it. Reports how long the backlog took
+   to drain, the peak message rate the robot side saw (replay is paced at
+   MQTT_REPLAY_RATE), whether stops arrived complete and in order, and whether
+   each robot's last state is the last update sent. --crash kills the server
+   (SIGKILL) during the outage and restarts it, so the backlog has to come
+   back from the journal file.
+
+Usage: python benchmarks/bench_journal_replay.py --robots 50 --updates 20 --replay-rate 200 [--crash]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from bench_server_modes import BACKEND_DIR, TOKEN_APP, free_port, http_request, wait_until_ready
+from local_broker import LocalBroker
+
+sys.path.insert(0, BACKEND_DIR)
+from config import MQTT_TOPIC, MQTT_STOP_TOPIC
+from outbound_journal import OutboundJournal, KIND_STATE, KIND_STOP, COMPACTION_LATEST, COMPACTION_NONE
+
+
+def bench_journal(directory, messages, topics, stop_every, compaction):
+    path = os.path.join(directory, f'micro-{compaction}.journal')
+    journal = OutboundJournal(path, capacity=16 * 1024 * 1024, compaction=compaction).open()
+    payload = json.dumps({'hand': {'right': {'horizontal': 'x' * 16}}, 'stopped': False}).encode()
+
+    started = time.perf_counter()
+    for n in range(messages):
+        if stop_every and n % stop_every == 0:
+            journal.append(MQTT_STOP_TOPIC, b'{"stopped": true}', KIND_STOP)
+        else:
+            journal.append(f"{MQTT_TOPIC}/bot{n % topics}", payload, KIND_STATE)
+    append_s = time.perf_counter() - started
+    pending = len(journal)
+    journal.close()
+
+    started = time.perf_counter()
+    journal = OutboundJournal(path, compaction=compaction).open()
+    recover_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    replayed = 0
+    while True:
+        record = journal.peek()
+        if record is None:
+            break
+        journal.payload(record)
+        journal.consume(record)
+        replayed += 1
+    replay_s = time.perf_counter() - started
+    stats = journal.stats()
+    journal.close()
+    return {
+        'compaction': compaction,
+        'appended': messages,
+        'append_per_s': round(messages / append_s),
+        'pending_after_compaction': pending,
+        'recovered': stats['recovered'],
+        'recover_ms': round(recover_s * 1000, 2),
+        'replayed': replayed,
+        'replay_per_s': round(replayed / replay_s) if replay_s else None,
+        'evicted': stats['evicted'],
+        'compactions': stats['compactions']
+    }
+
+
+class BrokerRecorder:
+    """Timestamps every PUBLISH as the broker receives it (no subscriber reconnect races)"""
+
+    def __init__(self, broker):
+        self.arrivals = []
+        self._lock = threading.Lock()
+        self._route = broker.route
+        broker.route = self.route
+
+    def route(self, topic, payload, qos, retain, properties=None, received_at=None):
+        with self._lock:
+            self.arrivals.append((time.perf_counter(), topic, bytes(payload)))
+        self._route(topic, payload, qos, retain, properties, received_at)
+
+    def since(self, started):
+        with self._lock:
+            return [a for a in self.arrivals if a[0] >= started]
+
+
+def peak_rate(times, window=0.1):
+    peak, start = 0, 0
+    for end in range(len(times)):
+        while times[end] - times[start] > window:
+            start += 1
+        peak = max(peak, end - start + 1)
+    return round(peak / window)
+
+
+def start_server(args, port, broker_port, journal_path):
+    env = dict(os.environ, MQTT_HOST='127.0.0.1', MQTT_PORT=str(broker_port), MQTT_TLS='0', LOG_LEVEL='warning',
+               MQTT_JOURNAL=journal_path, MQTT_REPLAY_RATE=str(args.replay_rate),
+               MQTT_JOURNAL_COMPACTION=args.compaction)
+    return subprocess.Popen(
+        [sys.executable, TOKEN_APP, '--server', args.server, '--host', '127.0.0.1', '--port', str(port)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(5)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+async def journal_pending(port):
+    status, body = await http_request(port, 'GET', '/mqtt-status')
+    journal = json.loads(body).get('publisher', {}).get('journal') or {}
+    return journal.get('pending', 0), journal
+
+
+async def bench_outage(args, directory):
+    broker = LocalBroker(port=0).start()
+    recorder = BrokerRecorder(broker)
+    journal_path = os.path.join(directory, 'outage.journal')
+    port = free_port()
+    server = start_server(args, port, broker.port, journal_path)
+    result = {'server': args.server, 'robots': args.robots, 'updates_per_robot': args.updates,
+              'replay_rate': args.replay_rate, 'compaction': args.compaction, 'crash': args.crash}
+    try:
+        if not await wait_until_ready(port, timeout=30):
+            return dict(result, error='server did not start')
+        await asyncio.sleep(0.5)  # idle
+        broker.go_offline()
+        await asyncio.sleep(0.5)
+
+        # Outage: motion for every robot, interleaved with stop/resume on the default robot
+        last_token = {}
+        stops_sent = []
+        robot_ids = [f"bot{n}" for n in range(args.robots)]
+        outage_started = time.perf_counter()
+        for u in range(args.updates):
+            for robot_id in robot_ids:
+                token = f"{robot_id}:{u}"
+                body = json.dumps({'hand': {'right': {'horizontal': token}}}).encode()
+                await http_request(port, 'POST', f'/api/robots/{robot_id}/status', body)
+                last_token[robot_id] = token
+            if args.stop_every and u % args.stop_every == 0:
+                stopped = len(stops_sent) % 2 == 0
+                await http_request(port, 'POST', '/api/robot-status', json.dumps({'stopped': stopped}).encode())
+                stops_sent.append(stopped)
+        await asyncio.sleep(args.outage_tail)
+        result['outage_s'] = round(time.perf_counter() - outage_started, 2)
+        pending, journal = await journal_pending(port)
+        result['journaled'] = {'pending': pending, 'appended': journal.get('appended'),
+                               'superseded': journal.get('superseded')}
+
+        if args.crash:
+            server.kill()
+            server.wait(5)
+            broker.go_online()
+            port = free_port()
+            online_at = time.perf_counter()
+            server = start_server(args, port, broker.port, journal_path)
+            if not await wait_until_ready(port, timeout=30):
+                return dict(result, error='server did not restart')
+        else:
+            online_at = time.perf_counter()
+            broker.go_online()
+
+        # Wait for the backlog to drain
+        deadline = time.perf_counter() + args.timeout
+        while time.perf_counter() < deadline:
+            pending, journal = await journal_pending(port)
+            if pending == 0 and journal.get('replayed'):
+                break
+            await asyncio.sleep(0.05)
+        drained_at = time.perf_counter()
+        await asyncio.sleep(0.5)
+
+        arrivals = recorder.since(online_at)
+        stop_arrivals = [a for a in arrivals if a[1] == MQTT_STOP_TOPIC]
+        state_arrivals = [a for a in arrivals if a[1] != MQTT_STOP_TOPIC and not a[1].endswith('/stop')]
+        stops_seen = [json.loads(payload)['stopped'] for _, _, payload in stop_arrivals]
+        final = {}
+        for _, topic, payload in state_arrivals:
+            final[topic] = json.loads(payload)['hand']['right']['horizontal']
+        correct = sum(1 for robot_id in robot_ids if final.get(f"{MQTT_TOPIC}/{robot_id}") == last_token[robot_id])
+        times = [a[0] for a in arrivals]
+        result.update({
+            'drain_s': round(drained_at - online_at, 3),
+            'first_message_ms': round((times[0] - online_at) * 1000, 1) if times else None,
+            'stops_sent': len(stops_sent),
+            'stops_received': len(stops_seen),
+            'stops_in_order': stops_seen[:len(stops_sent)] == stops_sent,
+            'last_stop_ms': round((stop_arrivals[-1][0] - online_at) * 1000, 1) if stop_arrivals else None,
+            'states_received': len(state_arrivals),
+            'robots_with_latest_state': correct,
+            'replay_span_s': round(times[-1] - times[0], 3) if times else None,
+            'peak_msgs_per_s': peak_rate(times),
+            'replay_age': journal.get('replay_age')
+        })
+    finally:
+        stop_server(server)
+        broker.stop()
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=['flask', 'asgi'], default='flask')
+    parser.add_argument('--robots', type=int, default=50, help='robots updated during the outage')
+    parser.add_argument('--updates', type=int, default=20, help='motion updates per robot during the outage')
+    parser.add_argument('--stop-every', type=int, default=4, help='toggle stop every N rounds of updates')
+    parser.add_argument('--outage-tail', type=float, default=1.0, help='seconds the broker stays down after the last update')
+    parser.add_argument('--replay-rate', type=float, default=200.0, help='MQTT_REPLAY_RATE for the server')
+    parser.add_argument('--compaction', choices=[COMPACTION_LATEST, COMPACTION_NONE], default=COMPACTION_LATEST)
+    parser.add_argument('--crash', action='store_true', help='SIGKILL the server during the outage and restart it')
+    parser.add_argument('--timeout', type=float, default=60.0, help='max seconds to wait for the backlog to drain')
+    parser.add_argument('--micro-messages', type=int, default=50000, help='messages for the journal-only benchmark')
+    parser.add_argument('--skip-micro', action='store_true')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='journal-bench-')
+    results = {'micro': [], 'outage': None}
+    try:
+        if not args.skip_micro:
+            for compaction in (COMPACTION_LATEST, COMPACTION_NONE):
+                print(f"🔄 journal only: {args.micro_messages} messages, 100 topics, {compaction} compaction...")
+                result = bench_journal(directory, args.micro_messages, 100, 50, compaction)
+                print(json.dumps(result))
+                results['micro'].append(result)
+
+        print(f"🔄 {args.server}: outage with {args.robots} robots x {args.updates} updates"
+              f"{' + server crash' if args.crash else ''}, replay at {args.replay_rate}/s...")
+        results['outage'] = await bench_outage(args, directory)
+        print(json.dumps(results['outage'], indent=2))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'journal_replay', 'args': vars(args), 'results': results}, f, indent=2)
+        print(f"📄 Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
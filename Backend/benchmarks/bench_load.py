@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+End-to-end load and latency benchmark (runs fully offline)
+Starts the local MQTT broker stand-in and app.py pointed at it, then drives
+simulated Lens clients over HTTP POST /api/robot-status and over /ws at a set
+gesture rate, while a subscriber on the broker measures true end-to-end
+latency: update sent -> robot state containing it received from MQTT.
+
+Every update carries a unique token in hand.right.horizontal, so the
+subscriber can tell which update a published state reflects. Updates that
+were superseded before the next control tick never appear on their own
+(latest-wins); they are reported as 'coalesced', not as errors.
+
+Usage: python benchmarks/bench_load.py --http-clients 20 --ws-clients 20 --rate 30 --duration 10 \\
+           --output results/load.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+import websockets
+
+from bench_server_modes import (BACKEND_DIR, TOKEN_APP, free_port, percentile, http_request, wait_until_ready,
+                                process_stats)
+from local_broker import LocalBroker
+
+sys.path.insert(0, BACKEND_DIR)
+from config import MQTT_TOPIC
+
+
+class LatencyRecorder:
+    """Send times by token, matched against states seen by the MQTT subscriber"""
+
+    def __init__(self):
+        self.sent = {}
+        self.delivered = {}
+        self.states_received = 0
+        self._lock = threading.Lock()
+
+    def record_send(self, token):
+        self.sent[token] = time.perf_counter()
+
+    def on_message(self, client, userdata, message):
+        now = time.perf_counter()
+        try:
+            token = json.loads(message.payload)['hand']['right']['horizontal']
+        except (ValueError, KeyError, TypeError):
+            return
+        with self._lock:
+            self.states_received += 1
+            if token in self.sent and token not in self.delivered:
+                self.delivered[token] = now - self.sent[token]
+
+
+def summarize(samples_ms):
+    return {
+        'count': len(samples_ms),
+        'p50_ms': _round(percentile(samples_ms, 50)),
+        'p95_ms': _round(percentile(samples_ms, 95)),
+        'p99_ms': _round(percentile(samples_ms, 99)),
+        'max_ms': _round(max(samples_ms)) if samples_ms else None
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+class ClientStats:
+    def __init__(self):
+        self.sent = 0
+        self.errors = 0
+        self.request_ms = []
+
+
+async def http_client(n, port, args, recorder, stats, deadline):
+    """One Lens client posting gesture updates at args.rate Hz"""
+    period = 1.0 / args.rate
+    scheduled = time.perf_counter()
+    seq = 0
+    while scheduled < deadline:
+        token = f"h{n}-{seq}"
+        body = json.dumps({'hand': {'right': {'horizontal': token}}}).encode()
+        recorder.record_send(token)
+        started = time.perf_counter()
+        try:
+            status, _ = await http_request(port, 'POST', '/api/robot-status', body)
+            if status != 200:
+                stats.errors += 1
+        except OSError:
+            stats.errors += 1
+        stats.request_ms.append((time.perf_counter() - started) * 1000)
+        stats.sent += 1
+        seq += 1
+        scheduled += period
+        await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+
+
+async def ws_client(n, port, args, recorder, stats, deadline):
+    """One Lens client streaming gesture updates over /ws at args.rate Hz"""
+    try:
+        ws = await websockets.connect(f'ws://127.0.0.1:{port}/ws', open_timeout=30, ping_interval=None,
+                                      max_queue=None)
+    except Exception:
+        stats.errors += 1
+        return
+
+    async def drain():
+        # Every client also receives the broadcasts; keep reading so the server never sees us as slow
+        try:
+            async for _ in ws:
+                pass
+        except Exception:
+            pass
+
+    reader = asyncio.ensure_future(drain())
+    period = 1.0 / args.rate
+    scheduled = time.perf_counter()
+    seq = 0
+    try:
+        while scheduled < deadline:
+            token = f"w{n}-{seq}"
+            recorder.record_send(token)
+            try:
+                await ws.send(json.dumps({'hand': {'right': {'horizontal': token}}}))
+            except Exception:
+                stats.errors += 1
+                break
+            stats.sent += 1
+            seq += 1
+            scheduled += period
+            await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+    finally:
+        reader.cancel()
+        await ws.close()
+
+
+def start_subscriber(broker_port, recorder):
+    ready = threading.Event()
+    client = mqtt.Client(client_id=f"load_bench_{os.getpid()}", clean_session=True)
+    client.on_connect = lambda c, userdata, flags, rc: c.subscribe(MQTT_TOPIC, qos=0)
+    client.on_subscribe = lambda *a: ready.set()
+    client.on_message = recorder.on_message
+    client.connect('127.0.0.1', broker_port, 60)
+    client.loop_start()
+    ready.wait(5)
+    return client
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    broker = LocalBroker(port=0, delay_ms=args.broker_delay_ms).start()
+    port = free_port()
+    env = dict(os.environ, MQTT_HOST='127.0.0.1', MQTT_PORT=str(broker.port), MQTT_TLS='0',
+               LOG_LEVEL='warning')
+    server = subprocess.Popen(
+        [sys.executable, TOKEN_APP, '--server', args.server, '--host', '127.0.0.1', '--port', str(port),
+         '--control-rate', str(args.control_rate)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    recorder = LatencyRecorder()
+    subscriber = None
+    result = {}
+    try:
+        if not await wait_until_ready(port, timeout=30):
+            return {'error': 'server did not start'}
+        subscriber = start_subscriber(broker.port, recorder)
+
+        http_stats, ws_stats = ClientStats(), ClientStats()
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(
+            *(http_client(n, port, args, recorder, http_stats, deadline) for n in range(args.http_clients)),
+            *(ws_client(n, port, args, recorder, ws_stats, deadline) for n in range(args.ws_clients)))
+        elapsed = time.perf_counter() - started
+        # Let the last control ticks and PUBACKs land
+        await asyncio.sleep(args.settle)
+        server_stats = process_stats(server.pid)
+
+        latencies = {'http': [], 'ws': []}
+        for token, seconds in list(recorder.delivered.items()):
+            latencies['http' if token[0] == 'h' else 'ws'].append(seconds * 1000)
+        sent = http_stats.sent + ws_stats.sent
+        delivered = len(recorder.delivered)
+
+        result = {
+            'elapsed_s': round(elapsed, 3),
+            'updates_sent': sent,
+            'updates_per_s': round(sent / elapsed, 1),
+            'states_received': recorder.states_received,
+            'states_per_s': round(recorder.states_received / elapsed, 1),
+            'updates_delivered': delivered,
+            'updates_coalesced': sent - delivered,
+            'end_to_end': summarize(latencies['http'] + latencies['ws']),
+            'http': {
+                'clients': args.http_clients,
+                'sent': http_stats.sent,
+                'errors': http_stats.errors,
+                'error_rate': round(http_stats.errors / http_stats.sent, 4) if http_stats.sent else None,
+                'request': summarize(http_stats.request_ms),
+                'end_to_end': summarize(latencies['http'])
+            },
+            'ws': {
+                'clients': args.ws_clients,
+                'sent': ws_stats.sent,
+                'errors': ws_stats.errors,
+                'error_rate': round(ws_stats.errors / ws_stats.sent, 4) if ws_stats.sent else None,
+                'end_to_end': summarize(latencies['ws'])
+            },
+            'broker': broker.stats(),
+            'server': server_stats
+        }
+    finally:
+        if subscriber:
+            subscriber.loop_stop()
+            subscriber.disconnect()
+        server.terminate()
+        try:
+            server.wait(5)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        broker.stop()
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=['flask', 'asgi'], default='flask')
+    parser.add_argument('--http-clients', type=int, default=10, help='simulated clients posting over HTTP')
+    parser.add_argument('--ws-clients', type=int, default=10, help='simulated clients sending over /ws')
+    parser.add_argument('--rate', type=float, default=30.0, help='gesture updates per second per client')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of load')
+    parser.add_argument('--settle', type=float, default=1.0, help='seconds to wait for late MQTT messages')
+    parser.add_argument('--control-rate', type=float, default=50.0, help='server control loop rate (Hz)')
+    parser.add_argument('--broker-delay-ms', type=float, default=0.0, help='simulated broker latency')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    print(f"🔄 {args.server}: {args.http_clients} HTTP + {args.ws_clients} WS clients at {args.rate} Hz "
+          f"for {args.duration}s...")
+    result = await run(args)
+    print(json.dumps(result, indent=2))
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'load', 'revision': git_revision(), 'timestamp': time.time(),
+                       'args': vars(args), 'result': result}, f, indent=2)
+        print(f"📄 Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
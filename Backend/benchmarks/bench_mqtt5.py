@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+MQTT 5 vs 3.1.1 benchmark (against the local broker stand-in)
+Publishes robot commands the way the server does (paho driven by an
+MQTTSupervisor, through an MQTT5Session for v5) to a pipelined broker
+stand-in that adds --delay-ms, while a robot-side v5 subscriber timestamps
+every command as it arrives.
+
+Scenarios:
+  overhead  --messages state commands spread over --topics robot topics:
+            bytes per PUBLISH at the broker and one-way latency, for 3.1.1,
+            5, and 5 without the seq/ts user properties (aliases alone)
+  expiry    the broker link slows to --slow-delay-ms (past the expiry
+            interval) for --phase-seconds: motion commands delivered late
+            vs dropped by the broker; stop transitions arrive either way
+  outage    the broker drops every connection for --outage-seconds while
+            commands keep coming: stale commands resent after the reconnect
+  inflight  over a --inflight-delay-ms link the broker announces a receive
+            maximum of --receive-maximum: the most unacknowledged publishes it
+            saw and the disconnects it had to make, for a v5 client that
+            ignores the limit and for the session (which refuses publishes
+            past it; the server would keep those in its latest-wins queue)
+
+A command counts as stale when it reaches the robot more than MQTT5_MAX_AGE
+after it was sent.
+
+Usage: python benchmarks/bench_mqtt5.py --messages 500 --rate 50 --delay-ms 40
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import paho.mqtt.client as mqtt
+
+from local_broker import LocalBroker
+from bench_stop_latency import summarize
+from config import MQTT5_MESSAGE_EXPIRY, MQTT5_MAX_AGE, MQTT_MAX_INFLIGHT
+from event_log import events
+from mqtt_supervisor import MQTTSupervisor, Backoff
+from mqtt5 import MQTT5Session, new_client, user_properties, PROTOCOL_V311, PROTOCOL_V5
+
+STOP_TOPIC = 'robot/stop'
+# A typical robot state payload; 'n' and 't' identify and time each command
+STATE = {'stopped': False, 'hand': {'right': {'horizontal': 'left', 'active': True},
+                                   'left': {'horizontal': 'none', 'vertical': 'up', 'active': True}}}
+
+
+def topic_for(n, topics):
+    # The default robot and then robot/r1, robot/r2, ... as a fleet would use
+    k = n % topics
+    return 'robot' if k == 0 else f'robot/r{k}'
+
+
+class Robot:
+    """v5 subscriber on robot/#; records the first arrival of each command and its seq property"""
+
+    def __init__(self, port):
+        self.arrivals = {}
+        self.seq_gaps = 0
+        self._last_seq = {}
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self.client = mqtt.Client(client_id=f"mqtt5_bench_robot_{os.getpid()}", protocol=mqtt.MQTTv5)
+        self.client.on_connect = lambda client, userdata, flags, rc, properties: client.subscribe('robot/#', qos=1)
+        self.client.on_subscribe = lambda *args: self._ready.set()
+        self.client.on_message = self._on_message
+        self.client.reconnect_delay_set(0.1, 0.5)
+        self.client.connect('127.0.0.1', port, 30)
+        self.client.loop_start()
+        self._ready.wait(5)
+
+    def _on_message(self, client, userdata, message):
+        now = time.perf_counter()
+        command = json.loads(message.payload)
+        seq = user_properties(message.properties).get('seq')
+        with self._lock:
+            if seq is not None:
+                last = self._last_seq.get(message.topic)
+                if last is not None and int(seq) > last + 1:
+                    self.seq_gaps += 1
+                self._last_seq[message.topic] = int(seq)
+            if command['n'] not in self.arrivals:
+                self.arrivals[command['n']] = (now - command['t']) * 1000
+
+    def stop(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+class Publisher:
+    """The server's side of the connection: supervisor, optional MQTT5Session, publish only while connected"""
+
+    def __init__(self, port, protocol, session=True, stamp=True):
+        self.client = new_client(f"mqtt5_bench_{protocol}_{os.getpid()}_{time.monotonic_ns()}", protocol)
+        self.session = None
+        if protocol == PROTOCOL_V5 and session:
+            self.session = MQTT5Session(self.client, MQTT5_MESSAGE_EXPIRY, MQTT5_MAX_AGE, MQTT_MAX_INFLIGHT,
+                                        stamp=stamp)
+        else:
+            self.client.max_inflight_messages_set(MQTT_MAX_INFLIGHT)
+        self.disconnects = 0
+        self.supervisor = MQTTSupervisor(self.client, '127.0.0.1', port, keepalive=30, backoff=Backoff(0.1, 0.5),
+                                         session=self.session, on_disconnect=self._on_disconnect).start()
+        deadline = time.monotonic() + 5
+        while not self.supervisor.connected and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _on_disconnect(self, client, userdata, rc):
+        self.disconnects += 1
+
+    def publish(self, topic, payload):
+        if not self.supervisor.connected:
+            return False
+        publish = self.session.publish if self.session else self.client.publish
+        return publish(topic, payload, qos=1).rc == mqtt.MQTT_ERR_SUCCESS
+
+    def stop(self):
+        self.supervisor.stop()
+
+
+def send(publisher, args, count, start, topics=1, stop_every=0, during=None):
+    """Publish count commands at --rate (numbered from start); returns {n: (topic, published)}"""
+    sent = {}
+    started = time.perf_counter()
+    for index in range(count):
+        if during is not None:
+            during(index)
+        n = start + index
+        topic = STOP_TOPIC if stop_every and index % stop_every == stop_every - 1 else topic_for(n, topics)
+        payload = json.dumps(dict(STATE, n=n, t=time.perf_counter())).encode()
+        sent[n] = (topic, publisher.publish(topic, payload))
+        delay = started + (index + 1) / args.rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    return sent
+
+
+def report(robot, sent, max_age_ms):
+    published = [n for n, (_, ok) in sent.items() if ok]
+    latencies = [robot.arrivals[n] for n in published if n in robot.arrivals]
+    stops = [n for n in published if sent[n][0] == STOP_TOPIC]
+    result = {'sent': len(sent), 'published': len(published), 'delivered': len(latencies),
+              'stale_delivered': sum(1 for latency in latencies if latency > max_age_ms)}
+    if stops:
+        result['stops_delivered'] = f"{sum(1 for n in stops if n in robot.arrivals)}/{len(stops)}"
+    result.update(summarize(latencies))
+    return result
+
+
+def run(args, protocol, scenario, publisher_options, broker_options):
+    broker = LocalBroker(port=0, delay_ms=args.delay_ms, pipeline=True, **broker_options).start()
+    robot = Robot(broker.port)
+    publisher = Publisher(broker.port, protocol, **publisher_options)
+    try:
+        result = scenario(args, broker, robot, publisher)
+        time.sleep(args.settle)
+        stats = broker.stats()
+        result['broker'] = {key: stats[key] for key in ('received', 'bytes_received', 'aliased', 'expired',
+                                                         'max_inflight', 'receive_maximum_exceeded')}
+        if stats['received']:
+            result['bytes_per_publish'] = round(stats['bytes_received'] / stats['received'], 1)
+        result['disconnects'] = publisher.disconnects
+        result['seq_gaps'] = robot.seq_gaps
+        if publisher.session is not None:
+            result['session'] = {key: value for key, value in publisher.session.stats().items()
+                                 if key in ('aliased', 'topic_bytes_saved', 'stale_dropped', 'max_inflight',
+                                            'broker_receive_maximum')}
+        return result
+    finally:
+        publisher.stop()
+        robot.stop()
+        broker.stop()
+
+
+def overhead(args, broker, robot, publisher):
+    sent = send(publisher, args, args.messages, 0, topics=args.topics)
+    time.sleep(args.settle)
+    return report(robot, sent, MQTT5_MAX_AGE * 1000)
+
+
+def expiry(args, broker, robot, publisher):
+    per_phase = int(args.phase_seconds * args.rate)
+    results = {}
+    start = 0
+    for phase, delay_ms in (('normal', args.delay_ms), ('slow link', args.slow_delay_ms),
+                            ('recovered', args.delay_ms)):
+        broker.delay = delay_ms / 1000.0
+        sent = send(publisher, args, per_phase, start, stop_every=10)
+        start += per_phase
+        results[phase] = sent
+    time.sleep(args.slow_delay_ms / 1000.0 * 2)
+    return {'phases': {phase: report(robot, sent, MQTT5_MAX_AGE * 1000) for phase, sent in results.items()}}
+
+
+def outage(args, broker, robot, publisher):
+    per_phase = int(args.phase_seconds * args.rate)
+    sent = send(publisher, args, per_phase, 0)
+    broker.go_offline()
+    time.sleep(args.outage_seconds)
+    broker.go_online()
+    sent.update(send(publisher, args, per_phase, per_phase))
+    time.sleep(args.settle)
+    return report(robot, sent, MQTT5_MAX_AGE * 1000)
+
+
+def inflight(args, broker, robot, publisher):
+    broker.delay = args.inflight_delay_ms / 1000.0
+    sent = send(publisher, args, args.messages, 0)
+    time.sleep(args.settle)
+    return report(robot, sent, MQTT5_MAX_AGE * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', choices=['overhead', 'expiry', 'outage', 'inflight', 'all'], default='all')
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--rate', type=float, default=50.0, help='commands per second')
+    parser.add_argument('--topics', type=int, default=8, help='robot topics the overhead scenario uses')
+    parser.add_argument('--delay-ms', type=float, default=40.0, help='broker delay per publish (the WAN hop)')
+    parser.add_argument('--slow-delay-ms', type=float, default=1500.0, help='broker delay in the slow phase')
+    parser.add_argument('--phase-seconds', type=float, default=3.0)
+    parser.add_argument('--outage-seconds', type=float, default=2.0)
+    parser.add_argument('--receive-maximum', type=int, default=5)
+    parser.add_argument('--inflight-delay-ms', type=float, default=200.0, help='broker delay in the inflight scenario')
+    parser.add_argument('--settle', type=float, default=1.0, help='seconds to wait for stragglers')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+    events.configure(level='warning')
+
+    results = {}
+    limited = {'receive_maximum': args.receive_maximum}
+    # scenario -> [(label, protocol, Publisher options, LocalBroker options)]
+    runs = {
+        'overhead': [('3.1.1', PROTOCOL_V311, {}, {}), ('5', PROTOCOL_V5, {}, {}),
+                     ('5 without seq/ts', PROTOCOL_V5, {'stamp': False}, {})],
+        'expiry': [('3.1.1', PROTOCOL_V311, {}, {}), ('5', PROTOCOL_V5, {}, {})],
+        'outage': [('3.1.1', PROTOCOL_V311, {}, {}), ('5', PROTOCOL_V5, {}, {})],
+        'inflight': [('5 ignoring receive maximum', PROTOCOL_V5, {'session': False}, limited),
+                     ('5', PROTOCOL_V5, {}, limited)],
+    }
+    scenarios = {'overhead': overhead, 'expiry': expiry, 'outage': outage, 'inflight': inflight}
+    for name, scenario_runs in runs.items():
+        if args.scenario not in (name, 'all'):
+            continue
+        results[name] = []
+        for label, protocol, publisher_options, broker_options in scenario_runs:
+            print(f"🔄 {name}: MQTT {label}...")
+            result = dict(protocol=label, **run(args, protocol, scenarios[name], publisher_options, broker_options))
+            print(json.dumps(result))
+            results[name].append(result)
+
+    if 'overhead' in results:
+        print("\n📊 Bytes per PUBLISH / p50 ms: " + ", ".join(
+            f"{r['protocol']}: {r.get('bytes_per_publish')} / {r['p50_ms']}" for r in results['overhead']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'mqtt5', 'args': vars(args), 'results': results}, f, indent=2)
+        print(f"📄 Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Record-and-replay benchmark (runs fully offline)
+Feeds a recording made with app.py --record (recorder.py) back into a fresh
+server running against the local MQTT broker stand-in, at the recorded pace
+(--speed 1), N times faster (--speed N) or as fast as it will go (--speed 0).
+Each inbound record goes back the way it came in: HTTP status, batch and
+gesture bodies are POSTed to the same robot's route, WebSocket messages are
+sent in order over one socket per recorded client (text or binary).
+
+Per speed it reports frames replayed, achieved frames/s, how far sends fell
+behind the schedule, HTTP request latency, publish latency (from a frame
+being sent to the next MQTT message for that robot reaching the broker) and
+MQTT messages seen at the broker next to the number in the recording.
+
+--generate SECONDS first records a synthetic session (HTTP posts, a legacy
+and a protocol WebSocket client, batches, gesture events, stop toggles over
+--robots robots) to the recording path, so the tool also works without a
+production capture.
+
+Usage: python benchmarks/bench_replay.py results/session.rec --generate 10 --speed 1 4 0
+       python benchmarks/bench_replay.py incident.rec --speed 1 --server asgi --output results/replay.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import paho.mqtt.client as mqtt
+import websockets
+
+from bench_server_modes import BACKEND_DIR, free_port, http_request, wait_until_ready, percentile
+from local_broker import LocalBroker
+
+sys.path.insert(0, BACKEND_DIR)
+from config import MQTT_TOPIC, MQTT_STOP_TOPIC
+from recorder import read_recording, KIND_INBOUND, KIND_OUTBOUND
+from robots import DEFAULT_ROBOT_ID, state_topic, stop_topic
+from wire_format import encode_delta
+
+ROUTES = {'http': 'status', 'batch': 'batch', 'gesture': 'gesture'}
+DEFAULT_ROUTES = {'http': '/api/robot-status', 'batch': '/api/robot-status/batch', 'gesture': '/api/gesture'}
+
+
+def start_server(args, broker_port, record=None):
+    port = free_port()
+    env = dict(os.environ, MQTT_HOST='127.0.0.1', MQTT_PORT=str(broker_port), MQTT_TLS='0', LOG_LEVEL='warning',
+               MQTT_JOURNAL='')
+    command = [sys.executable, 'app.py', '--server', args.server, '--host', '127.0.0.1', '--port', str(port)]
+    if record:
+        command += ['--record', os.path.abspath(record)]
+    server = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    return server, port
+
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(5)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+class PublishWatcher:
+    """Broker subscriber resolving each robot's sent frames when its next MQTT message arrives"""
+
+    def __init__(self, port, robot_ids):
+        self.topics = {}
+        for robot_id in robot_ids:
+            self.topics[state_topic(MQTT_TOPIC, robot_id)] = robot_id
+            self.topics[stop_topic(MQTT_TOPIC, MQTT_STOP_TOPIC, robot_id)] = robot_id
+        self.pending = defaultdict(list)
+        self.latencies = []
+        self.messages = 0
+        self._lock = threading.Lock()
+        ready = threading.Event()
+        self.client = mqtt.Client(client_id=f"replay_bench_{os.getpid()}", clean_session=True)
+        self.client.on_connect = lambda c, userdata, flags, rc: c.subscribe(f"{MQTT_TOPIC}/#", qos=0)
+        self.client.on_subscribe = lambda *a: ready.set()
+        self.client.on_message = self._on_message
+        self.client.connect('127.0.0.1', port, 60)
+        self.client.loop_start()
+        ready.wait(5)
+
+    def sent(self, robot_id):
+        with self._lock:
+            self.pending[robot_id].append(time.perf_counter())
+
+    def _on_message(self, client, userdata, message):
+        now = time.perf_counter()
+        robot_id = self.topics.get(message.topic)
+        with self._lock:
+            self.messages += 1
+            if robot_id is not None:
+                self.latencies.extend((now - sent) * 1000 for sent in self.pending.pop(robot_id, ()))
+
+    def unresolved(self):
+        with self._lock:
+            return sum(len(sends) for sends in self.pending.values())
+
+    def stop(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+class Replayer:
+    def __init__(self, port, watcher, concurrency):
+        self.port = port
+        self.watcher = watcher
+        self.sockets = {}
+        self.readers = []
+        self.limit = asyncio.Semaphore(concurrency)
+        self.tasks = []
+        self.request_ms = []
+        self.errors = 0
+
+    async def send(self, record):
+        self.watcher.sent(record.key)
+        if record.source in ROUTES:
+            self.tasks.append(asyncio.ensure_future(self._post(record)))
+            return
+        ws = self.sockets.get((record.key, record.channel))
+        if ws is None:
+            path = '/ws' if record.key == DEFAULT_ROBOT_ID else f'/ws/{record.key}'
+            ws = await websockets.connect(f'ws://127.0.0.1:{self.port}{path}', ping_interval=None, max_queue=None)
+            self.sockets[(record.key, record.channel)] = ws
+            self.readers.append(asyncio.ensure_future(self._drain(ws)))
+        try:
+            await ws.send(record.payload if record.source == 'ws_binary' else record.payload.decode('utf-8'))
+        except websockets.ConnectionClosed:
+            self.errors += 1
+
+    async def _post(self, record):
+        if record.key == DEFAULT_ROBOT_ID:
+            path = DEFAULT_ROUTES[record.source]
+        else:
+            path = f'/api/robots/{record.key}/{ROUTES[record.source]}'
+        async with self.limit:
+            started = time.perf_counter()
+            try:
+                status, _ = await http_request(self.port, 'POST', path, record.payload)
+            except OSError:
+                status = None
+            self.request_ms.append((time.perf_counter() - started) * 1000)
+        if status != 200:
+            self.errors += 1
+
+    async def _drain(self, ws):
+        try:
+            async for _ in ws:
+                pass
+        except websockets.ConnectionClosed:
+            pass
+
+    async def finish(self):
+        await asyncio.gather(*self.tasks)
+        await asyncio.gather(*(ws.close() for ws in self.sockets.values()), return_exceptions=True)
+        for reader in self.readers:
+            reader.cancel()
+
+
+async def replay(args, records, outbound, speed):
+    inbound = [record for record in records if record.kind == KIND_INBOUND]
+    robot_ids = {record.key for record in inbound}
+    broker = LocalBroker(port=0).start()
+    server, port = start_server(args, broker.port, args.record_replay)
+    watcher = None
+    result = {'speed': speed if speed else 'max', 'frames': len(inbound)}
+    try:
+        if not await wait_until_ready(port, timeout=30):
+            result['error'] = 'server did not start'
+            return result
+        watcher = PublishWatcher(broker.port, robot_ids)
+        replayer = Replayer(port, watcher, args.concurrency)
+        lags = []
+        origin = inbound[0].time if inbound else 0.0
+        started = time.perf_counter()
+        for record in inbound:
+            if speed:
+                target = started + (record.time - origin) / speed
+                delay = target - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                lags.append(max(0.0, time.perf_counter() - target) * 1000)
+            await replayer.send(record)
+        await replayer.finish()
+        elapsed = time.perf_counter() - started
+        await asyncio.sleep(0.5)
+
+        result.update({
+            'recorded_s': round(inbound[-1].time - origin, 2) if inbound else 0,
+            'elapsed_s': round(elapsed, 2),
+            'frames_per_s': round(len(inbound) / elapsed, 1) if elapsed else None,
+            'schedule_lag_p99_ms': _round(percentile(lags, 99)),
+            'request_p50_ms': _round(percentile(replayer.request_ms, 50)),
+            'request_p99_ms': _round(percentile(replayer.request_ms, 99)),
+            'publish_p50_ms': _round(percentile(watcher.latencies, 50)),
+            'publish_p99_ms': _round(percentile(watcher.latencies, 99)),
+            'frames_without_publish': watcher.unresolved(),
+            'mqtt_messages': watcher.messages,
+            'mqtt_messages_recorded': outbound,
+            'errors': replayer.errors
+        })
+    finally:
+        if watcher:
+            watcher.stop()
+        stop_server(server)
+        broker.stop()
+    return result
+
+
+async def generate(args, path):
+    """Record a synthetic session: every kind of inbound traffic over several robots"""
+    broker = LocalBroker(port=0).start()
+    server, port = start_server(args, broker.port, record=path)
+    rng = random.Random(args.seed)
+    robot_ids = [DEFAULT_ROBOT_ID] + [f'bot{n}' for n in range(1, args.robots)]
+    horizontal = ('left', 'straight', 'right')
+    try:
+        if not await wait_until_ready(port, timeout=30):
+            raise RuntimeError('server did not start')
+        deadline = time.perf_counter() + args.generate
+
+        async def http_robot(robot_id, rate):
+            path = '/api/robot-status' if robot_id == DEFAULT_ROBOT_ID else f'/api/robots/{robot_id}/status'
+            n = 0
+            while time.perf_counter() < deadline:
+                n += 1
+                body = {'stopped': n % 100 < 5} if n % 50 == 0 else \
+                    {'hand': {'right': {'horizontal': rng.choice(horizontal)}}}
+                await http_request(port, 'POST', path, json.dumps(body).encode())
+                await asyncio.sleep(rng.expovariate(rate))
+
+        async def protocol_client(robot_id, rate):
+            async with websockets.connect(f'ws://127.0.0.1:{port}/ws/{robot_id}', ping_interval=None) as ws:
+                await ws.send(json.dumps({'op': 'hello', 'session': 'gen', 'subscribe': False}))
+                seq = 0
+                while time.perf_counter() < deadline:
+                    seq += 1
+                    await ws.send(encode_delta({'hand': {'right': {'horizontal': rng.choice(horizontal)}}}, seq))
+                    await asyncio.sleep(1 / rate)
+
+        async def legacy_client(rate):
+            async with websockets.connect(f'ws://127.0.0.1:{port}/ws', ping_interval=None, max_queue=None) as ws:
+                while time.perf_counter() < deadline:
+                    await ws.send(json.dumps({'hand': {'left': {'vertical': rng.choice(('up', 'down', 'neutral'))}}}))
+                    await asyncio.sleep(1 / rate)
+
+        async def batch_client(robot_id):
+            seq = 0
+            while time.perf_counter() < deadline:
+                frames = []
+                for _ in range(10):
+                    seq += 1
+                    frames.append({'seq': seq, 'hand': {'right': {'horizontal': rng.choice(horizontal)}}})
+                await http_request(port, 'POST', f'/api/robots/{robot_id}/batch', json.dumps(frames).encode())
+                await asyncio.sleep(0.5)
+
+        async def gesture_client(robot_id, rate):
+            while time.perf_counter() < deadline:
+                x = math.sin(time.perf_counter())
+                event = {'hand': 'right', 'confidence': 0.9, 'rayDirection': [x, 0.0, -1.0],
+                         'timestamp': time.time()}
+                await http_request(port, 'POST', f'/api/robots/{robot_id}/gesture', json.dumps(event).encode())
+                await asyncio.sleep(1 / rate)
+
+        clients = [http_robot(robot_id, 20) for robot_id in robot_ids]
+        clients += [legacy_client(30), protocol_client(robot_ids[-1], 60), batch_client(robot_ids[1 % len(robot_ids)]),
+                    gesture_client(robot_ids[-1], 30)]
+        await asyncio.gather(*clients)
+        # Let the recorder's writer flush before the server goes away
+        await asyncio.sleep(1.0)
+    finally:
+        stop_server(server)
+        broker.stop()
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recording', help='recording made with app.py --record (written first with --generate)')
+    parser.add_argument('--speed', type=float, nargs='+', default=[1, 0], help='replay speeds (0 = max)')
+    parser.add_argument('--server', choices=['flask', 'asgi'], default='flask')
+    parser.add_argument('--concurrency', type=int, default=64, help='most HTTP requests in flight')
+    parser.add_argument('--generate', type=float, metavar='SECONDS', help='record a synthetic session first')
+    parser.add_argument('--robots', type=int, default=4, help='robots in the synthetic session')
+    parser.add_argument('--seed', type=int, default=3)
+    parser.add_argument('--record-replay', metavar='PATH', help='have the replaying server record too')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    if args.generate:
+        print(f"⏺️ {args.server}: recording {args.generate}s of synthetic traffic to {args.recording}...")
+        await generate(args, args.recording)
+
+    header, records = read_recording(args.recording)
+    inbound = [record for record in records if record.kind == KIND_INBOUND]
+    outbound = sum(1 for record in records if record.kind == KIND_OUTBOUND)
+    by_source = defaultdict(int)
+    for record in inbound:
+        by_source[record.source] += 1
+    summary = {'records': header['records'], 'inbound': dict(by_source), 'outbound': outbound,
+               'robots': len({record.key for record in inbound})}
+    print(f"📼 {json.dumps(summary)}")
+
+    results = []
+    for speed in args.speed:
+        print(f"🔄 {args.server}: replaying at {'max' if not speed else f'{speed:g}x'} speed...")
+        result = await replay(args, records, outbound, speed)
+        print(json.dumps(result))
+        results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'replay', 'args': vars(args), 'recording': summary, 'results': results}, f,
+                      indent=2)
+        print(f"📄 Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Flask vs ASGI server mode benchmark
+Starts app.py in each --server mode (without MQTT), then measures:
+  - how many idle /ws connections it accepts and how long that takes
+  - broadcast latency: POST /api/robot-status -> state received by every /ws client
+  - HTTP POST throughput and latency with concurrent clients
+  - server threads and resident memory while holding the connections
+
+Usage: python benchmarks/bench_server_modes.py --clients 1000 --posts 50
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import websockets
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# app.py for benchmarks that tag each update with a unique token (token_app.py)
+TOKEN_APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'token_app.py')
+
+# Benchmarks simulate many clients from one address, which a per-client rate
+# limit would lump together; servers they start run without it unless asked
+# (admission.py, bench_admission.py)
+os.environ.setdefault('ADMISSION_RATE', '0')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def process_stats(pid):
+    stats = {}
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('Threads:'):
+                    stats['threads'] = int(line.split()[1])
+                elif line.startswith('VmRSS:'):
+                    stats['rss_mb'] = round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return stats
+
+
+async def http_request(port, method, path, body=b''):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    request = (f"{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n"
+               f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n").encode() + body
+    writer.write(request)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    return status, payload
+
+
+async def wait_until_ready(port, timeout=15.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            # Serving and connected to MQTT (or running without it)
+            status, _ = await http_request(port, 'GET', '/health?ready=1')
+            if status == 200:
+                return True
+        except OSError:
+            pass
+        await asyncio.sleep(0.1)
+    return False
+
+
+async def open_clients(port, count, concurrency=100):
+    """Open `count` /ws connections, `concurrency` handshakes at a time"""
+    sockets = []
+    failures = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def connect():
+        nonlocal failures
+        async with semaphore:
+            try:
+                ws = await websockets.connect(f'ws://127.0.0.1:{port}/ws', open_timeout=30,
+                                              ping_interval=None, max_queue=None)
+                await ws.recv()  # initial state
+                sockets.append(ws)
+            except Exception:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(connect() for _ in range(count)))
+    return sockets, failures, time.perf_counter() - started
+
+
+async def wait_for_version(ws, version, timeout):
+    deadline = time.perf_counter() + timeout
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return None
+        message = await asyncio.wait_for(ws.recv(), remaining)
+        if json.loads(message).get('version', 0) >= version:
+            return time.perf_counter()
+
+
+async def measure_broadcast(port, sockets, posts, timeout=10.0):
+    """Time from POST until the new version has reached every client"""
+    latencies = []
+    misses = 0
+    for i in range(posts):
+        body = json.dumps({'hand': {'right': {'horizontal': 'left' if i % 2 else 'right'}}}).encode()
+        started = time.perf_counter()
+        status, payload = await http_request(port, 'POST', '/api/robot-status', body)
+        version = json.loads(payload)['version']
+        arrivals = await asyncio.gather(*(wait_for_version(ws, version, timeout) for ws in sockets),
+                                        return_exceptions=True)
+        done = [t for t in arrivals if isinstance(t, float)]
+        misses += len(arrivals) - len(done)
+        if done:
+            latencies.append((max(done) - started) * 1000)
+    return latencies, misses
+
+
+async def measure_posts(port, concurrency, duration):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(n):
+        nonlocal errors
+        i = 0
+        while time.perf_counter() < deadline:
+            body = json.dumps({'hand': {'left': {'vertical': 'up' if (n + i) % 2 else 'down'}}}).encode()
+            started = time.perf_counter()
+            try:
+                status, _ = await http_request(port, 'POST', '/api/robot-status', body)
+                if status != 200:
+                    errors += 1
+            except OSError:
+                errors += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+            i += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+async def run_mode(mode, args):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, 'app.py', '--server', mode, '--no-mqtt', '--host', '127.0.0.1', '--port', str(port)],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    result = {'mode': mode}
+    try:
+        if not await wait_until_ready(port):
+            result['error'] = 'server did not start'
+            return result
+
+        sockets, failures, elapsed = await open_clients(port, args.clients)
+        result['ws_connected'] = len(sockets)
+        result['ws_failed'] = failures
+        result['ws_connect_s'] = round(elapsed, 3)
+        result.update(process_stats(server.pid))
+
+        latencies, misses = await measure_broadcast(port, sockets, args.posts)
+        result['broadcast_p50_ms'] = _round(percentile(latencies, 50))
+        result['broadcast_p99_ms'] = _round(percentile(latencies, 99))
+        result['broadcast_missed'] = misses
+
+        await asyncio.gather(*(ws.close() for ws in sockets), return_exceptions=True)
+
+        latencies, errors, elapsed = await measure_posts(port, args.concurrency, args.duration)
+        result['post_rps'] = round(len(latencies) / elapsed, 1)
+        result['post_p50_ms'] = _round(percentile(latencies, 50))
+        result['post_p99_ms'] = _round(percentile(latencies, 99))
+        result['post_mean_ms'] = _round(statistics.mean(latencies)) if latencies else None
+        result['post_errors'] = errors
+    finally:
+        server.terminate()
+        try:
+            server.wait(5)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    return result
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', nargs='+', default=['flask', 'asgi'], choices=['flask', 'asgi'])
+    parser.add_argument('--clients', type=int, default=500, help='idle /ws connections to hold open')
+    parser.add_argument('--posts', type=int, default=30, help='updates used for broadcast latency')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent HTTP posters')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds of HTTP load')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    for mode in args.modes:
+        print(f"🔄 Benchmarking {mode} mode with {args.clients} WebSocket clients...")
+        result = await run_mode(mode, args)
+        print(json.dumps(result, indent=2))
+        results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'server_modes', 'args': vars(args), 'results': results}, f, indent=2)
+        print(f"📄 Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
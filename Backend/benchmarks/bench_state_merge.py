@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+State validation and merge microbenchmark (in process, no server)
+Per update cost of turning a client payload into a state delta:
+  - legacy-http: the previous hand-written changes_from_status() followed by
+    the generic deep merge (merge_changes, deep-copying every changed value)
+  - legacy-ws: the previous changes_from_ws() pass-through (no validation)
+    followed by the same merge
+  - compiled: state_store.merge_state, validate and merge generated from
+    state_schema.STATE_SCHEMA in one pass
+  - store-apply: RobotStateStore.apply with the compiled merge, i.e. the full
+    locked update including the version commit
+over a few payload mixes: small deltas (one or two fields, like the
+WebSocket protocol sends), full states (what GestureController.ts posts),
+repeats of the current state (no-op), the legacy bare-string hand form,
+and, for the compiled paths only, invalid payloads that must be rejected. Every mix
+also checks that compiled produces the same deltas as legacy-http.
+
+Usage: python benchmarks/bench_state_merge.py --updates 200000
+"""
+
+import argparse
+import copy
+import json
+import random
+import sys
+import time
+
+from bench_server_modes import BACKEND_DIR
+
+sys.path.insert(0, BACKEND_DIR)
+from state_schema import HORIZONTAL, VERTICAL, ValidationError
+from state_store import DEFAULT_ROBOT_STATE, RobotStateStore, merge_state
+
+
+# -- previous implementation, kept here as the baseline ------------------------
+
+def legacy_changes_from_status(data):
+    changes = {}
+    if 'stopped' in data:
+        changes['stopped'] = bool(data['stopped'])
+    if 'hand' in data:
+        hand = data['hand']
+        hand_changes = {}
+        if 'right' in hand:
+            right = {}
+            if isinstance(hand['right'], dict):
+                if 'horizontal' in hand['right']:
+                    right['horizontal'] = str(hand['right']['horizontal'])
+                if 'active' in hand['right']:
+                    right['active'] = bool(hand['right']['active'])
+            else:
+                right['horizontal'] = str(hand['right'])
+            hand_changes['right'] = right
+        if 'left' in hand:
+            left = {}
+            if isinstance(hand['left'], dict):
+                if 'horizontal' in hand['left']:
+                    left['horizontal'] = str(hand['left']['horizontal'])
+                if 'vertical' in hand['left']:
+                    left['vertical'] = str(hand['left']['vertical'])
+                if 'active' in hand['left']:
+                    left['active'] = bool(hand['left']['active'])
+            else:
+                left['horizontal'] = str(hand['left'])
+            hand_changes['left'] = left
+        changes['hand'] = hand_changes
+    return changes
+
+
+def legacy_changes_from_ws(data):
+    changes = {}
+    if 'stopped' in data:
+        changes['stopped'] = data['stopped']
+    if 'hand' in data:
+        changes['hand'] = {}
+        if 'right' in data['hand']:
+            changes['hand']['right'] = data['hand']['right']
+        if 'left' in data['hand']:
+            changes['hand']['left'] = data['hand']['left']
+    return changes
+
+
+def legacy_merge_changes(target, changes):
+    delta = {}
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            sub_delta = legacy_merge_changes(target[key], value)
+            if sub_delta:
+                delta[key] = sub_delta
+        elif key not in target or target[key] != value:
+            target[key] = copy.deepcopy(value)
+            delta[key] = copy.deepcopy(value)
+    return delta
+
+
+# -- payload mixes --------------------------------------------------------------
+
+def payloads(mix, count, seed=1):
+    rng = random.Random(seed)
+    horizontal = HORIZONTAL[1:]
+    vertical = VERTICAL[1:]
+    result = []
+    for n in range(count):
+        if mix == 'delta':
+            payload = {'hand': {'right': {'horizontal': rng.choice(horizontal)}}}
+            if rng.random() < 0.5:
+                payload['hand']['left'] = {'vertical': rng.choice(vertical)}
+        elif mix == 'full':
+            payload = {
+                'stopped': rng.random() < 0.05,
+                'hand': {
+                    'right': {'horizontal': rng.choice(horizontal), 'active': True},
+                    'left': {'horizontal': rng.choice(horizontal), 'vertical': rng.choice(vertical), 'active': True}
+                }
+            }
+        elif mix == 'noop':
+            payload = copy.deepcopy(DEFAULT_ROBOT_STATE)
+        elif mix == 'legacy':
+            payload = {'hand': {'right': rng.choice(horizontal), 'left': rng.choice(horizontal)}}
+        else:  # invalid
+            payload = rng.choice([
+                {'hand': {'right': {'horizontal': 'diagonal'}}},
+                {'hand': {'left': {'vertical': 3}}},
+                {'stopped': 'no'},
+                {'hand': 'left'},
+            ])
+        # As parsed off the wire
+        result.append(json.loads(json.dumps(payload)))
+    return result
+
+
+def run(name, items, update):
+    state = copy.deepcopy(DEFAULT_ROBOT_STATE)
+    errors = 0
+    started = time.perf_counter()
+    for payload in items:
+        try:
+            update(state, payload)
+        except ValidationError:
+            errors += 1
+    elapsed = time.perf_counter() - started
+    return {'impl': name, 'us_per_update': round(elapsed / len(items) * 1e6, 3), 'rejected': errors}
+
+
+def same_deltas(items):
+    old_state = copy.deepcopy(DEFAULT_ROBOT_STATE)
+    new_state = copy.deepcopy(DEFAULT_ROBOT_STATE)
+    for payload in items[:5000]:
+        if legacy_merge_changes(old_state, legacy_changes_from_status(payload)) != merge_state(new_state, payload):
+            return False
+    return old_state == new_state
+
+
+def bench_mix(mix, count):
+    items = payloads(mix, count)
+    store = RobotStateStore(DEFAULT_ROBOT_STATE)
+    results = []
+    if mix != 'invalid':
+        results.append(run('legacy-http', items,
+                           lambda state, data: legacy_merge_changes(state, legacy_changes_from_status(data))))
+        results.append(run('legacy-ws', items,
+                           lambda state, data: legacy_merge_changes(state, legacy_changes_from_ws(data))))
+    results.append(run('compiled', items, merge_state))
+    results.append(run('store-apply', items, lambda state, data: store.apply(data)))
+    baseline = results[0]['us_per_update']
+    for result in results:
+        result['mix'] = mix
+        if mix != 'invalid' and result['impl'] != 'store-apply':
+            result['speedup'] = round(baseline / result['us_per_update'], 2)
+    if mix != 'invalid':
+        results[2]['same_deltas'] = same_deltas(items)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=200000, help='payloads per mix')
+    parser.add_argument('--mixes', nargs='+', default=['delta', 'full', 'noop', 'legacy', 'invalid'],
+                        choices=['delta', 'full', 'noop', 'legacy', 'invalid'])
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    for mix in args.mixes:
+        print(f"🔄 {mix}: {args.updates} payloads...")
+        for result in bench_mix(mix, args.updates):
+            print(json.dumps(result))
+            results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'state_merge', 'args': vars(args), 'results': results}, f, indent=2)
+        print(f"📄 Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
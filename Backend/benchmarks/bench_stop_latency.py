@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Emergency stop latency benchmark
+Runs the Flask app in-process against the local broker stand-in while a
+flood of motion updates is posted, toggling stop/resume at a fixed interval.
+Reports, for each stop/resume transition:
+  - ingest -> PUBACK on the stop priority lane (publisher's own measurement)
+  - ingest -> received by a subscriber on robot/stop
+  - ingest -> received by a subscriber on the regular state topic
+
+Usage: python benchmarks/bench_stop_latency.py --toggles 50 --flooders 4 --delay-ms 20
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import paho.mqtt.client as mqtt
+
+from local_broker import LocalBroker
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))], 3)
+
+
+def summarize(samples):
+    return {
+        'count': len(samples),
+        'p50_ms': percentile(samples, 50),
+        'p99_ms': percentile(samples, 99),
+        'max_ms': round(max(samples), 3) if samples else None
+    }
+
+
+class Observer:
+    """Subscribes to the state and stop topics and timestamps the first sighting of each transition"""
+
+    def __init__(self, port, state_topic, stop_topic):
+        self.state_topic = state_topic
+        self.stop_topic = stop_topic
+        self.stop_seen = {}
+        self.state_seen = {}
+        self._ready = threading.Event()
+        self.client = mqtt.Client(client_id=f"stop_bench_{int(time.time())}", clean_session=True)
+        self.client.on_connect = lambda client, userdata, flags, rc: client.subscribe(
+            [(state_topic, 1), (stop_topic, 1)])
+        self.client.on_subscribe = lambda *args: self._ready.set()
+        self.client.on_message = self._on_message
+        self.client.connect('127.0.0.1', port, 60)
+        self.client.loop_start()
+        self._ready.wait(5)
+
+    def _on_message(self, client, userdata, message):
+        now = time.monotonic()
+        data = json.loads(message.payload)
+        stopped = bool(data.get('stopped'))
+        version = data.get('version')
+        seen = self.stop_seen if message.topic == self.stop_topic else self.state_seen
+        # Key by the stop value; the first message carrying a newer version wins
+        for key, ts in list(seen.items()):
+            if key[0] == stopped and key[1] is not None and version is not None and version <= key[1]:
+                return
+        seen[(stopped, version)] = now
+
+    def first_seen(self, seen, stopped, min_version):
+        times = [ts for (value, version), ts in seen.items()
+                 if value == stopped and version is not None and version >= min_version]
+        return min(times) if times else None
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def run(args):
+    broker = LocalBroker(port=0, delay_ms=args.delay_ms).start()
+    os.environ['MQTT_HOST'] = '127.0.0.1'
+    os.environ['MQTT_PORT'] = str(broker.port)
+    os.environ['MQTT_TLS'] = '0'
+
+    # The app logs every request; keep the benchmark output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as robot_app
+        from config import MQTT_TOPIC, MQTT_STOP_TOPIC
+        robot_app.init_mqtt()
+        # Connects in the background; wait until it is up
+        deadline = time.monotonic() + 10
+        while not robot_app.mqtt_connected and time.monotonic() < deadline:
+            time.sleep(0.01)
+        robot_app.control_loop.set_rate(args.control_rate)
+        robot_app.control_loop.start()
+
+    observer = Observer(broker.port, MQTT_TOPIC, MQTT_STOP_TOPIC)
+    client = robot_app.app.test_client()
+    running = threading.Event()
+    running.set()
+    posted = [0]
+
+    def flood(n):
+        flask_client = robot_app.app.test_client()
+        i = 0
+        while running.is_set():
+            flask_client.post('/api/robot-status', json={
+                'hand': {'left': {'vertical': 'up' if (n + i) % 2 else 'down'}}})
+            posted[0] += 1
+            i += 1
+
+    transitions = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        flooders = [threading.Thread(target=flood, args=(n,), daemon=True) for n in range(args.flooders)]
+        for thread in flooders:
+            thread.start()
+        time.sleep(0.5)
+        for i in range(args.toggles):
+            stopped = i % 2 == 0
+            ingest = time.monotonic()
+            response = client.post('/api/robot-status', json={'stopped': stopped})
+            transitions.append((stopped, response.get_json()['version'], ingest))
+            time.sleep(args.interval)
+        time.sleep(1.0)
+        running.clear()
+        for thread in flooders:
+            thread.join(2)
+        robot_app.control_loop.stop()
+        priority = robot_app.mqtt_publisher.stats()['priority']
+        robot_app.mqtt_publisher.stop()
+        robot_app.mqtt_supervisor.stop()
+
+    stop_topic_ms, state_topic_ms = [], []
+    stop_missed = state_missed = 0
+    for stopped, version, ingest in transitions:
+        seen = observer.first_seen(observer.stop_seen, stopped, version)
+        if seen is None:
+            stop_missed += 1
+        else:
+            stop_topic_ms.append((seen - ingest) * 1000)
+        seen = observer.first_seen(observer.state_seen, stopped, version)
+        if seen is None:
+            state_missed += 1
+        else:
+            state_topic_ms.append((seen - ingest) * 1000)
+
+    observer.close()
+    broker_stats = broker.stats()
+    broker.stop()
+
+    return {
+        'transitions': len(transitions),
+        'motion_updates_posted': posted[0],
+        'broker_received': broker_stats['received'],
+        'priority_lane': priority,
+        'subscriber_stop_topic': dict(summarize(stop_topic_ms), missed=stop_missed),
+        'subscriber_state_topic': dict(summarize(state_topic_ms), missed=state_missed)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--toggles', type=int, default=40, help='stop/resume transitions to send')
+    parser.add_argument('--interval', type=float, default=0.1, help='seconds between transitions')
+    parser.add_argument('--flooders', type=int, default=4, help='threads posting motion updates')
+    parser.add_argument('--delay-ms', type=float, default=0.0, help='broker ack/forward delay')
+    parser.add_argument('--control-rate', type=float, default=50.0)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    print(f"🔄 Measuring stop latency: {args.toggles} transitions under {args.flooders} motion flooders...")
+    result = run(args)
+    print(json.dumps(result, indent=2))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'stop_latency', 'args': vars(args), 'result': result}, f, indent=2)
+        print(f"📄 Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
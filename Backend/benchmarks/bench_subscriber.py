@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Robot-side consumer benchmark
+Publishes bin1 robot commands at each of --rates to the local broker
+stand-in while mqtt_subscriber_test.py (run as its own process, the way it
+runs on a robot) consumes them, once printing every message (--print) and
+once keeping statistics only. Some sequence numbers are skipped and some
+messages sent twice on purpose, so its gap and duplicate counts can be
+checked against what was actually sent.
+
+Reports, per rate and mode: messages received, publish -> receive latency
+(from the frames' timestamps), and the counted vs expected gaps/duplicates.
+A consumer that falls behind shows up as latency that grows with the rate.
+
+Usage: python benchmarks/bench_subscriber.py --rates 500 2000 5000 --seconds 5
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import paho.mqtt.client as mqtt
+
+from local_broker import LocalBroker
+from wire_format import encode_state
+
+TOPIC = 'robot'
+STATE = {'stopped': False, 'hand': {'right': {'horizontal': 'left', 'active': True},
+                                   'left': {'horizontal': 'not active', 'vertical': 'up', 'active': True}}}
+
+
+class Consumer:
+    """mqtt_subscriber_test.py in a subprocess; its output is drained (and counted) like a terminal would"""
+
+    def __init__(self, port, duration, output, show):
+        # Unbuffered, as on a terminal
+        command = [sys.executable, '-u', os.path.join(BACKEND_DIR, 'mqtt_subscriber_test.py'), '--host', '127.0.0.1',
+                   '--port', str(port), '--no-tls', '--qos', '0', '--duration', str(duration), '--output', output]
+        if show:
+            command.append('--print')
+        self.lines = 0
+        self.ready = threading.Event()
+        self.process = subprocess.Popen(command, cwd=BACKEND_DIR, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT, text=True)
+        self._reader = threading.Thread(target=self._drain, daemon=True)
+        self._reader.start()
+
+    def _drain(self):
+        for line in self.process.stdout:
+            self.lines += 1
+            if 'Waiting for messages' in line:
+                self.ready.set()
+
+    def wait(self, timeout):
+        self.process.wait(timeout)
+        self._reader.join(5)
+
+
+def publish(port, rate, seconds, skip_every, dup_every):
+    """Send rate frames a second for seconds; returns (sent, skipped, duplicated)"""
+    client = mqtt.Client(client_id=f"subscriber_bench_{os.getpid()}", clean_session=True)
+    client.connect('127.0.0.1', port, 30)
+    client.loop_start()
+    sent = skipped = duplicated = 0
+    sequence = 0
+    started = time.perf_counter()
+    count = int(rate * seconds)
+    for index in range(count):
+        sequence += 1
+        if skip_every and sequence % skip_every == 0:
+            sequence += 1
+            skipped += 1
+        frame = encode_state(dict(STATE, version=sequence))
+        client.publish(TOPIC, frame, qos=0)
+        sent += 1
+        if dup_every and index % dup_every == dup_every - 1:
+            client.publish(TOPIC, frame, qos=0)
+            sent += 1
+            duplicated += 1
+        delay = started + (index + 1) / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    client.loop_stop()
+    client.disconnect()
+    return sent, skipped, duplicated
+
+
+def run(args, rate, show):
+    broker = LocalBroker(port=0).start()
+    output = tempfile.mktemp(suffix='.json')
+    consumer = Consumer(broker.port, args.seconds + args.settle + 2, output, show)
+    try:
+        if not consumer.ready.wait(10):
+            raise RuntimeError("consumer did not connect")
+        time.sleep(0.2)
+        sent, skipped, duplicated = publish(broker.port, rate, args.seconds, args.skip_every, args.dup_every)
+        consumer.wait(args.seconds + args.settle + 30)
+        with open(output) as f:
+            summary = json.load(f)
+    finally:
+        if consumer.process.poll() is None:
+            consumer.process.terminate()
+        broker.stop()
+        if os.path.exists(output):
+            os.remove(output)
+    latency = summary['latency']
+    return {
+        'rate': rate,
+        'mode': 'print' if show else 'stats',
+        'sent': sent,
+        'received': summary['messages'],
+        'output_lines': consumer.lines,
+        'p50_ms': latency.get('p50_ms'),
+        'p99_ms': latency.get('p99_ms'),
+        'max_ms': latency.get('max_ms'),
+        'gaps': f"{summary['gaps']}/{skipped}",
+        'duplicates': f"{summary['duplicates']}/{duplicated}"
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rates', type=int, nargs='+', default=[500, 2000, 5000], help='messages per second')
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--skip-every', type=int, default=100, help='leave out every Nth sequence number')
+    parser.add_argument('--dup-every', type=int, default=250, help='send every Nth message twice')
+    parser.add_argument('--settle', type=float, default=3.0, help='seconds the consumer keeps going after the last message')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    for rate in args.rates:
+        for show in (True, False):
+            print(f"🔄 {rate} msg/s, {'printing every message' if show else 'statistics only'}...")
+            result = run(args, rate, show)
+            print(json.dumps(result))
+            results.append(result)
+
+    print("\n📊 p99 latency ms (print / stats): " + ", ".join(
+        f"{rate}/s: {by_mode.get('print')} / {by_mode.get('stats')}"
+        for rate, by_mode in ((rate, {r['mode']: r['p99_ms'] for r in results if r['rate'] == rate})
+                              for rate in args.rates)))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'subscriber', 'args': vars(args), 'results': results}, f, indent=2)
+        print(f"📄 Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
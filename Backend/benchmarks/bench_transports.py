@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Robot transport benchmark (loopback harness)
+Stands up every delivery path on this machine: a cloud broker stand-in that
+adds --cloud-delay-ms to each publish (the WAN round trip), a LAN broker
+stand-in, and the robot's UDPReceiver behind a relay that adds
+--lan-delay-ms each way and can drop datagrams. A robot-side subscriber on
+both brokers and the receiver timestamps every command as it arrives.
+
+Scenarios:
+  latency   each transport on its own, then all of them with the router
+            choosing ('auto', which should pick udp): one-way command
+            latency, delivery and the probed round trip
+  failover  auto while the UDP link goes dark, then the LAN broker goes
+            offline, then both come back: which transport carried the
+            commands in each phase, the longest gap between arrivals, and
+            acknowledged commands that never arrived
+  loss      UDP alone with --loss of the datagrams dropped each way: QoS 0
+            with 1, 2 and 3 copies, and QoS 1 (retransmitted until acked).
+            Commands are spread over --loss-topics topics, as the receiver
+            drops anything older than what it already has on a topic and a
+            retransmission must not be overtaken by a newer command
+
+Usage: python benchmarks/bench_transports.py --messages 200 --rate 10 --loss 0.1
+"""
+
+import argparse
+import heapq
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import paho.mqtt.client as mqtt
+
+from local_broker import LocalBroker
+from bench_stop_latency import summarize
+from event_log import events
+from transports import (TransportRouter, BrokerTransport, UDPTransport, UDPReceiver, TRANSPORT_CLOUD,
+                        TRANSPORT_LOCAL, TRANSPORT_UDP)
+
+TOPIC = 'robot'
+STOP_TOPIC = 'robot/stop'
+
+
+class UDPRelay:
+    """Forwards datagrams between a sender and the receiver at target_port, delayed and lossy both ways"""
+
+    def __init__(self, target_port, delay_ms=0.0, loss=0.0, seed=1):
+        self.delay = delay_ms / 1000.0
+        self.loss = loss
+        # While down every datagram is dropped (the LAN link or the robot went away)
+        self.down = False
+        self.dropped = 0
+        self._random = random.Random(seed)
+        self.front = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.front.bind(('127.0.0.1', 0))
+        self.port = self.front.getsockname()[1]
+        self.back = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.back.connect(('127.0.0.1', target_port))
+        self._sender = None
+        self._queue = []
+        self._cond = threading.Condition()
+        self._running = True
+        for target in (self._forward, self._backward, self._deliver):
+            threading.Thread(target=target, daemon=True).start()
+
+    def _schedule(self, send):
+        if self.down or self._random.random() < self.loss:
+            self.dropped += 1
+            return
+        with self._cond:
+            heapq.heappush(self._queue, (time.perf_counter() + self.delay, id(send), send))
+            self._cond.notify()
+
+    def _forward(self):
+        while self._running:
+            data, address = self.front.recvfrom(65535)
+            self._sender = address
+            self._schedule(lambda data=data: self.back.send(data))
+
+    def _backward(self):
+        while self._running:
+            data = self.back.recv(65535)
+            if self._sender is not None:
+                self._schedule(lambda data=data, sender=self._sender: self.front.sendto(data, sender))
+
+    def _deliver(self):
+        while self._running:
+            with self._cond:
+                while not self._queue or self._queue[0][0] > time.perf_counter():
+                    self._cond.wait(max(0.0, self._queue[0][0] - time.perf_counter()) if self._queue else None)
+                _, _, send = heapq.heappop(self._queue)
+            try:
+                send()
+            except OSError:
+                pass
+
+
+class Robot:
+    """Robot side: subscribed on both brokers and listening on UDP; records the first arrival of each command"""
+
+    def __init__(self, cloud_port, local_port):
+        self.arrivals = {}
+        self.duplicates = 0
+        self._lock = threading.Lock()
+        self.clients = [self._subscribe(TRANSPORT_CLOUD, cloud_port), self._subscribe(TRANSPORT_LOCAL, local_port)]
+        self.receiver = UDPReceiver(lambda topic, payload: self.arrived(TRANSPORT_UDP, payload),
+                                    host='127.0.0.1', port=0).start()
+
+    def _subscribe(self, via, port):
+        ready = threading.Event()
+        client = mqtt.Client(client_id=f"transport_bench_robot_{via}_{os.getpid()}", clean_session=True)
+        client.on_connect = lambda c, userdata, flags, rc: c.subscribe(f"{TOPIC}/#", qos=1)
+        client.on_subscribe = lambda *args: ready.set()
+        client.on_message = lambda c, userdata, message: self.arrived(via, message.payload)
+        client.connect('127.0.0.1', port, 30)
+        client.loop_start()
+        ready.wait(5)
+        return client
+
+    def arrived(self, via, payload):
+        now = time.perf_counter()
+        command = json.loads(payload)
+        with self._lock:
+            if command['n'] in self.arrivals:
+                self.duplicates += 1
+            else:
+                self.arrivals[command['n']] = (now, (now - command['t']) * 1000, via)
+
+    def stop(self):
+        for client in self.clients:
+            client.loop_stop()
+            client.disconnect()
+        self.receiver.stop()
+
+
+class Harness:
+    def __init__(self, args):
+        self.args = args
+        self.cloud = LocalBroker(port=0, delay_ms=args.cloud_delay_ms).start()
+        self.local = LocalBroker(port=0, delay_ms=args.local_delay_ms).start()
+        self.robot = Robot(self.cloud.port, self.local.port)
+        self.relay = UDPRelay(self.robot.receiver.port, delay_ms=args.lan_delay_ms)
+        self._next = 0
+        self._runs = 0
+
+    def transports(self, names, copies=2):
+        self._runs += 1
+        made = {
+            TRANSPORT_UDP: lambda: UDPTransport(TRANSPORT_UDP, ('127.0.0.1', self.relay.port), copies=copies),
+            TRANSPORT_LOCAL: lambda: BrokerTransport(TRANSPORT_LOCAL, '127.0.0.1', self.local.port,
+                                                     f"transport_bench_local_{os.getpid()}_{self._runs}"),
+            TRANSPORT_CLOUD: lambda: BrokerTransport(TRANSPORT_CLOUD, '127.0.0.1', self.cloud.port,
+                                                     f"transport_bench_cloud_{os.getpid()}_{self._runs}"),
+        }
+        return [made[name]() for name in names]
+
+    def router(self, names, copies=2):
+        acked = set()
+        router = TransportRouter(self.transports(names, copies), on_ack=acked.add,
+                                 probe_interval=self.args.probe_interval).start()
+        router.acked = acked
+        # Ready once every transport has answered a probe (or 5 s have gone by). The router
+        # does not probe a lone transport, so its round trip is measured here for the report
+        deadline = time.monotonic() + 5.0
+        while time.monotonic() < deadline and not all(t.srtt is not None for t in router.transports):
+            if not router.probing:
+                router.transports[0].probe()
+            time.sleep(0.05)
+        time.sleep(self.args.probe_interval * 2)
+        return router
+
+    def send(self, router, count, qos, stop_every=10, phase_of=None, topics=1):
+        """Send count commands at --rate; returns [(n, tag, qos, sent_at, phase)]"""
+        sent = []
+        started = time.perf_counter()
+        for index in range(count):
+            self._next += 1
+            n = self._next
+            urgent = stop_every and index % stop_every == stop_every - 1
+            payload = json.dumps({'n': n, 't': time.perf_counter()}).encode()
+            topic = STOP_TOPIC if urgent else TOPIC if topics == 1 else f"{TOPIC}/bench-{n % topics}"
+            tag = router.send(topic, payload, 1 if urgent else qos)
+            sent.append((n, tag, 1 if urgent else qos, time.perf_counter(), phase_of(index) if phase_of else None))
+            delay = started + (index + 1) / self.args.rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        time.sleep(1.0)
+        return sent
+
+    def report(self, sent):
+        arrivals = [self.robot.arrivals.get(n) for n, _, _, _, _ in sent]
+        delivered = [arrival for arrival in arrivals if arrival is not None]
+        vias = {}
+        for _, _, via in delivered:
+            vias[via] = vias.get(via, 0) + 1
+        result = {'sent': len(sent), 'delivered': len(delivered),
+                  'delivery': round(len(delivered) / len(sent), 4) if sent else None, 'via': vias}
+        result.update(summarize([latency for _, latency, _ in delivered]))
+        return result
+
+    def stop(self):
+        self.robot.stop()
+        self.cloud.stop()
+        self.local.stop()
+
+
+def scenario_latency(harness, args):
+    results = []
+    for names in ([TRANSPORT_CLOUD], [TRANSPORT_LOCAL], [TRANSPORT_UDP],
+                  [TRANSPORT_UDP, TRANSPORT_LOCAL, TRANSPORT_CLOUD]):
+        label = names[0] if len(names) == 1 else 'auto'
+        print(f"🔄 latency: {label}...")
+        router = harness.router(names)
+        sent = harness.send(router, args.messages, args.qos)
+        result = {'transport': label, 'active': router.active.name if router.active else None}
+        result['probe_rtt_ms'] = {t.name: round(t.srtt * 1000, 3) if t.srtt is not None else None
+                                  for t in router.transports}
+        result.update(harness.report(sent))
+        router.stop()
+        print(json.dumps(result))
+        results.append(result)
+    return results
+
+
+def scenario_failover(harness, args):
+    print("🔄 failover: udp dark, then the LAN broker offline, then both back...")
+    router = harness.router([TRANSPORT_UDP, TRANSPORT_LOCAL, TRANSPORT_CLOUD])
+    per_phase = max(1, int(args.phase_seconds * args.rate))
+    phases = ['all up', 'udp dark', 'udp dark + LAN broker offline', 'all back']
+    actions = {1: lambda: setattr(harness.relay, 'down', True),
+               2: harness.local.go_offline,
+               3: lambda: (setattr(harness.relay, 'down', False), harness.local.go_online())}
+
+    sent = []
+    for index, phase in enumerate(phases):
+        if index in actions:
+            actions[index]()
+        sent += harness.send(router, per_phase, args.qos, phase_of=lambda i, phase=phase: phase)
+    results = {'phases': []}
+    for phase in phases:
+        in_phase = [entry for entry in sent if entry[4] == phase]
+        result = dict(phase=phase, **harness.report(in_phase))
+        # Longest silence at the robot while commands kept being sent
+        times = sorted(harness.robot.arrivals[n][0] for n, _, _, _, _ in in_phase if n in harness.robot.arrivals)
+        result['max_gap_ms'] = round(max((b - a for a, b in zip(times, times[1:])), default=0) * 1000, 1)
+        result['acked_lost'] = sum(1 for n, _, qos, _, _ in in_phase
+                                   if qos > 0 and n not in harness.robot.arrivals)
+        print(json.dumps(result))
+        results['phases'].append(result)
+    stats = router.stats()
+    results.update(switches=stats['switches'], failovers=stats['failovers'], resent=stats['resent'],
+                   active_at_end=stats['active'])
+    router.stop()
+    return results
+
+
+def scenario_loss(harness, args):
+    results = []
+    harness.relay.loss = args.loss
+    for copies, qos in ((1, 0), (2, 0), (3, 0), (1, 1)):
+        print(f"🔄 loss {args.loss:.0%}: udp, {copies} copies, QoS {qos}...")
+        router = harness.router([TRANSPORT_UDP], copies=copies)
+        sent = harness.send(router, args.messages, qos, stop_every=0, topics=args.loss_topics)
+        udp = router.get(TRANSPORT_UDP)
+        result = dict(copies=copies, qos=qos, retransmitted=udp.retransmitted, **harness.report(sent))
+        router.stop()
+        print(json.dumps(result))
+        results.append(result)
+    harness.relay.loss = 0.0
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', choices=['latency', 'failover', 'loss', 'all'], default='all')
+    parser.add_argument('--messages', type=int, default=200, help='commands per run')
+    parser.add_argument('--rate', type=float, default=10.0,
+                        help='commands per second (the broker stand-in applies its delay one publish at a time)')
+    parser.add_argument('--qos', type=int, choices=[0, 1], default=1, help='QoS of state commands (stops use 1)')
+    parser.add_argument('--cloud-delay-ms', type=float, default=40.0, help='added by the cloud broker stand-in')
+    parser.add_argument('--local-delay-ms', type=float, default=2.0, help='added by the LAN broker stand-in')
+    parser.add_argument('--lan-delay-ms', type=float, default=0.5, help='UDP relay delay, each way')
+    parser.add_argument('--loss', type=float, default=0.1, help='UDP datagrams dropped each way (loss scenario)')
+    parser.add_argument('--loss-topics', type=int, default=16, help='topics the loss scenario spreads commands over')
+    parser.add_argument('--probe-interval', type=float, default=0.2, help='seconds between RTT probes')
+    parser.add_argument('--phase-seconds', type=float, default=4.0, help='length of each failover phase')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+    events.configure(level='warning')
+
+    harness = Harness(args)
+    results = {}
+    try:
+        if args.scenario in ('latency', 'all'):
+            results['latency'] = scenario_latency(harness, args)
+        if args.scenario in ('failover', 'all'):
+            results['failover'] = scenario_failover(harness, args)
+        if args.scenario in ('loss', 'all'):
+            results['loss'] = scenario_loss(harness, args)
+    finally:
+        harness.stop()
+
+    if 'latency' in results:
+        print("\n📊 One-way p50 / p99 (ms): " + ", ".join(
+            f"{r['transport']}: {r['p50_ms']} / {r['p99_ms']}" for r in results['latency']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'transports', 'args': vars(args), 'results': results}, f, indent=2)
+        print(f"📄 Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Wire format benchmark (runs fully offline)
+1. Codec alone: encode and decode cost per message and bytes per message for
+   the old pretty-printed JSON (json.dumps(state, indent=2)), the compact JSON
+   the server sends today, and the bin1 frame, over a stream of realistic
+   gesture states. 'publish_bytes' adds the MQTT PUBLISH framing (QoS 1, topic
+   "robot") to get the bytes each message costs on the wire.
+2. End to end: starts app.py against the local broker stand-in, has a fake
+   robot announce "bin1,json" on robot/format (and robot/<id>/format), posts
+   updates and stop toggles, and checks what arrives at the broker: the format
+   and size of every state and stop message and whether each decodes back to
+   what was posted. A second robot that announced nothing stays on JSON.
+
+Usage: python benchmarks/bench_wire_format.py --messages 100000 --server flask
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+from bench_server_modes import BACKEND_DIR, TOKEN_APP, free_port, http_request, wait_until_ready
+from local_broker import LocalBroker
+
+sys.path.insert(0, BACKEND_DIR)
+import paho.mqtt.client as mqtt
+
+from config import MQTT_TOPIC, MQTT_STOP_TOPIC
+from wire_format import (FORMAT_BINARY, HORIZONTAL, VERTICAL, MAGIC_V1, capability_topic, encode_state,
+                         decode)
+
+
+def gesture_states(count, seed=1):
+    rng = random.Random(seed)
+    states = []
+    for version in range(1, count + 1):
+        states.append({
+            'stopped': rng.random() < 0.05,
+            'hand': {
+                'right': {'horizontal': rng.choice(HORIZONTAL), 'active': rng.random() < 0.9},
+                'left': {'horizontal': rng.choice(HORIZONTAL), 'vertical': rng.choice(VERTICAL),
+                         'active': rng.random() < 0.9}
+            },
+            'version': version
+        })
+    return states
+
+
+def publish_size(topic, payload_size, qos=1):
+    """Bytes of an MQTT 3.1.1 PUBLISH packet carrying payload_size bytes"""
+    remaining = 2 + len(topic.encode()) + (2 if qos else 0) + payload_size
+    length_bytes = 1 if remaining < 128 else 2 if remaining < 16384 else 3
+    return 1 + length_bytes + remaining
+
+
+def bench_codec(name, states, encode, decode_payload):
+    started = time.perf_counter()
+    payloads = [encode(state) for state in states]
+    encode_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for payload in payloads:
+        decode_payload(payload)
+    decode_s = time.perf_counter() - started
+
+    sizes = [len(payload) for payload in payloads]
+    mean_size = sum(sizes) / len(sizes)
+    return {
+        'format': name,
+        'encode_us': round(encode_s / len(states) * 1e6, 3),
+        'decode_us': round(decode_s / len(states) * 1e6, 3),
+        'payload_bytes': round(mean_size, 1),
+        'publish_bytes': round(publish_size(MQTT_TOPIC, round(mean_size)), 1),
+        'roundtrip_ok': all(decode_payload(p)['hand'] == s['hand'] for p, s in zip(payloads[:1000], states))
+    }
+
+
+def run_codecs(count):
+    states = gesture_states(count)
+    results = [
+        bench_codec('json_indent2 (before)', states,
+                    lambda state: json.dumps(state, indent=2).encode(), lambda payload: json.loads(payload)),
+        bench_codec('json_compact', states,
+                    lambda state: json.dumps(state, separators=(',', ':')).encode(),
+                    lambda payload: json.loads(payload)),
+        bench_codec(FORMAT_BINARY, states, encode_state, decode),
+    ]
+    baseline = results[0]['publish_bytes']
+    for result in results:
+        result['wire_vs_before'] = round(result['publish_bytes'] / baseline, 3)
+    return results
+
+
+class Recorder:
+    """Subscribes to everything under the robot topics and keeps raw payloads"""
+
+    def __init__(self, port):
+        self.messages = []
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self.client = mqtt.Client(client_id=f"wire_bench_{int(time.time())}", clean_session=True)
+        self.client.on_connect = lambda client, userdata, flags, rc: client.subscribe(f"{MQTT_TOPIC}/#")
+        self.client.on_subscribe = lambda *args: self._ready.set()
+        self.client.on_message = self._on_message
+        self.client.connect('127.0.0.1', port)
+        self.client.loop_start()
+        self._ready.wait(5)
+
+    def _on_message(self, client, userdata, msg):
+        with self._lock:
+            self.messages.append((msg.topic, bytes(msg.payload)))
+
+    def announce(self, topic, offer):
+        self.client.publish(capability_topic(topic), offer, qos=1, retain=True).wait_for_publish()
+
+    def on(self, topic):
+        with self._lock:
+            return [payload for t, payload in self.messages if t == topic]
+
+    def stop(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def describe(payloads, expected=None):
+    binary = [p for p in payloads if p[:1] == bytes([MAGIC_V1])]
+    decoded = [decode(p) for p in payloads]
+    result = {
+        'messages': len(payloads),
+        'bin1': len(binary),
+        'json': len(payloads) - len(binary),
+        'mean_bytes': round(sum(map(len, payloads)) / len(payloads), 1) if payloads else None,
+    }
+    if expected is not None:
+        result['last_matches_posted'] = bool(decoded) and decoded[-1]['hand']['right']['horizontal'] == expected
+    return result, decoded
+
+
+async def bench_end_to_end(args):
+    broker = LocalBroker(port=0).start()
+    recorder = Recorder(broker.port)
+    binary_robot, json_robot = 'jetson1', 'legacy1'
+    binary_topic = f"{MQTT_TOPIC}/{binary_robot}"
+    # Announced before the server starts: retained, so the server learns it on connect
+    recorder.announce(MQTT_TOPIC, 'bin1,json')
+    recorder.announce(binary_topic, 'bin1,json')
+
+    port = free_port()
+    env = dict(os.environ, MQTT_HOST='127.0.0.1', MQTT_PORT=str(broker.port), MQTT_TLS='0', LOG_LEVEL='warning',
+               MQTT_JOURNAL='')
+    server = subprocess.Popen(
+        [sys.executable, TOKEN_APP, '--server', args.server, '--host', '127.0.0.1', '--port', str(port)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not await wait_until_ready(port, timeout=30):
+            return {'error': 'server did not start'}
+        await asyncio.sleep(0.3)
+        last = None
+        for n in range(args.updates):
+            last = HORIZONTAL[1 + n % 3]
+            body = json.dumps({'hand': {'right': {'horizontal': last}, 'left': {'vertical': VERTICAL[1 + n % 3]}}})
+            for path in ('/api/robot-status', f'/api/robots/{binary_robot}/status', f'/api/robots/{json_robot}/status'):
+                await http_request(port, 'POST', path, body.encode())
+            if n % 10 == 0:
+                await http_request(port, 'POST', '/api/robot-status', json.dumps({'stopped': n % 20 == 0}).encode())
+            await asyncio.sleep(0.03)
+        # A value outside the enum tables falls back to JSON on a bin1 topic
+        await http_request(port, 'POST', f'/api/robots/{binary_robot}/status',
+                           json.dumps({'hand': {'right': {'horizontal': 'diagonal'}}}).encode())
+        await asyncio.sleep(0.5)
+        _, body = await http_request(port, 'GET', '/mqtt-status')
+        wire_stats = json.loads(body)['wire_format']
+
+        default_state, _ = describe(recorder.on(MQTT_TOPIC), last)
+        stops, stop_docs = describe(recorder.on(MQTT_STOP_TOPIC))
+        stops['decoded'] = [doc['stopped'] for doc in stop_docs]
+        binary_state, binary_docs = describe(recorder.on(binary_topic))
+        json_state, _ = describe(recorder.on(f"{MQTT_TOPIC}/{json_robot}"), last)
+        return {
+            'server': args.server,
+            'default_robot (announced bin1)': default_state,
+            'default_stop_topic': stops,
+            f'{binary_robot} (announced bin1)': dict(
+                binary_state, last_is_json_fallback=bool(binary_docs) and binary_docs[-1]['hand']['right'][
+                    'horizontal'] == 'diagonal'),
+            f'{json_robot} (no announcement)': json_state,
+            'server_stats': wire_stats
+        }
+    finally:
+        # Leave no retained announcements behind
+        recorder.announce(MQTT_TOPIC, b'')
+        recorder.announce(binary_topic, b'')
+        server.terminate()
+        server.wait(5)
+        recorder.stop()
+        broker.stop()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=100000, help='states for the codec benchmark')
+    parser.add_argument('--server', choices=['flask', 'asgi'], default='flask')
+    parser.add_argument('--updates', type=int, default=40, help='updates per robot for the end-to-end check')
+    parser.add_argument('--skip-e2e', action='store_true')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    results = {}
+    print(f"🔄 codecs: {args.messages} gesture states...")
+    results['codecs'] = run_codecs(args.messages)
+    for result in results['codecs']:
+        print(json.dumps(result))
+
+    if not args.skip_e2e:
+        print(f"🔄 {args.server}: negotiated bin1 end to end via the local broker...")
+        results['end_to_end'] = await bench_end_to_end(args)
+        print(json.dumps(results['end_to_end'], indent=2))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'wire_format', 'args': vars(args), 'results': results}, f, indent=2)
+        print(f"📄 Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+WebSocket ingestion protocol benchmark (runs fully offline, --no-mqtt)
+Sends the same stream of gesture deltas from --clients simulated Lens clients
+(one robot each) three ways:
+  - http: one POST /api/robots/<id>/status per update (today's hot path)
+  - ws-json: one socket per client, hello then {"op": "delta", "seq": n, ...}
+  - ws-bin1: the same with 18-byte bin1 delta frames
+Socket clients are ingest-only (subscribe: false) and pipeline their frames;
+the server acks in batches. --rate paces every client at that many updates
+per second (hand tracking runs at 30-60 Hz); 0 sends as fast as possible. Every run ends with each socket client resending
+its last --dups frames, which must all be counted stale.
+
+Reported per mode: updates/s, upstream bytes per update (HTTP request or
+payload plus the 6-byte client frame header), acks received and the ack
+latency from sending a frame to the first ack covering its seq.
+
+Usage: python benchmarks/bench_ws_ingest.py --server asgi --clients 20 --updates 2000
+       python benchmarks/bench_ws_ingest.py --clients 50 --updates 300 --rate 60
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+
+import websockets
+
+from bench_server_modes import BACKEND_DIR, free_port, http_request, wait_until_ready, percentile
+
+sys.path.insert(0, BACKEND_DIR)
+from wire_format import encode_delta
+
+HORIZONTAL = ('left', 'straight', 'right')
+VERTICAL = ('down', 'neutral', 'up')
+WS_CLIENT_HEADER = 6   # 2-byte header + 4-byte mask for frames under 126 bytes
+
+
+def client_deltas(count, seed):
+    """Partial states, each changing one or two fields"""
+    rng = random.Random(seed)
+    deltas = []
+    for _ in range(count):
+        delta = {'hand': {'right': {'horizontal': rng.choice(HORIZONTAL)}}}
+        if rng.random() < 0.5:
+            delta['hand']['left'] = {'vertical': rng.choice(VERTICAL)}
+        deltas.append(delta)
+    return deltas
+
+
+def http_bytes(path, body):
+    head = (f"POST {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n")
+    return len(head) + len(body)
+
+
+async def paced(items, rate):
+    """Yield items at rate per second (immediately when rate is 0)"""
+    started = time.perf_counter()
+    for n, item in enumerate(items):
+        if rate:
+            delay = started + n / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        yield item
+
+
+async def http_client(port, robot_id, deltas, totals, rate):
+    path = f'/api/robots/{robot_id}/status'
+    async for delta in paced(deltas, rate):
+        body = json.dumps(delta).encode()
+        status, _ = await http_request(port, 'POST', path, body)
+        totals['bytes'] += http_bytes(path, body)
+        if status != 200:
+            totals['errors'] += 1
+
+
+async def ws_client(port, robot_id, deltas, binary, dups, totals, ack_ms, rate):
+    ws = await websockets.connect(f'ws://127.0.0.1:{port}/ws/{robot_id}', ping_interval=None, max_queue=None)
+    await ws.recv()  # initial state
+    await ws.send(json.dumps({'op': 'hello', 'session': f'bench-{robot_id}', 'subscribe': False}))
+    welcome = json.loads(await ws.recv())
+    seq = welcome['last_seq'] or 0
+    sent_at = {}
+    last = {'seq': 0, 'ack': None}
+    done = asyncio.Event()
+
+    def encode(seq, delta):
+        if binary:
+            return encode_delta(delta, seq)
+        return json.dumps(dict(delta, op='delta', seq=seq))
+
+    async def reader():
+        async for message in ws:
+            ack = json.loads(message)
+            if ack.get('op') != 'ack':
+                continue
+            now = time.perf_counter()
+            totals['acks'] += 1
+            for n in range(last['seq'] + 1, (ack['seq'] or 0) + 1):
+                started = sent_at.pop(n, None)
+                if started is not None:
+                    ack_ms.append((now - started) * 1000)
+            last['seq'] = max(last['seq'], ack['seq'] or 0)
+            last['ack'] = ack
+            if ack['frames'] >= len(deltas) + dups:
+                done.set()
+
+    reading = asyncio.ensure_future(reader())
+    frames = []
+    async for delta in paced(deltas, rate):
+        seq += 1
+        frame = encode(seq, delta)
+        frames.append(frame)
+        sent_at[seq] = time.perf_counter()
+        await ws.send(frame)
+        totals['bytes'] += len(frame) + WS_CLIENT_HEADER
+    for frame in frames[-dups:] if dups else []:
+        await ws.send(frame)
+    try:
+        await asyncio.wait_for(done.wait(), 10)
+    except asyncio.TimeoutError:
+        totals['errors'] += 1
+    reading.cancel()
+    await ws.close()
+    if last['ack']:
+        totals['stale'] += last['ack']['stale']
+
+
+async def run_mode(args, mode):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, 'app.py', '--server', args.server, '--no-mqtt', '--host', '127.0.0.1', '--port', str(port)],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    result = {'mode': mode}
+    try:
+        if not await wait_until_ready(port, timeout=30):
+            result['error'] = 'server did not start'
+            return result
+        streams = [client_deltas(args.updates, seed=n) for n in range(args.clients)]
+        totals = {'bytes': 0, 'errors': 0, 'acks': 0, 'stale': 0}
+        ack_ms = []
+        started = time.perf_counter()
+        if mode == 'http':
+            await asyncio.gather(*(http_client(port, f'in{n}', deltas, totals, args.rate) for n, deltas in enumerate(streams)))
+        else:
+            await asyncio.gather(*(ws_client(port, f'in{n}', deltas, mode == 'ws-bin1', args.dups, totals, ack_ms,
+                                             args.rate)
+                                   for n, deltas in enumerate(streams)))
+        elapsed = time.perf_counter() - started
+
+        updates = args.clients * args.updates
+        result.update({
+            'updates': updates,
+            'updates_per_s': round(updates / elapsed, 1),
+            'bytes_per_update': round(totals['bytes'] / updates, 1),
+            'errors': totals['errors'],
+        })
+        if mode != 'http':
+            result.update({
+                'acks': totals['acks'],
+                'updates_per_ack': round(updates / totals['acks'], 1) if totals['acks'] else None,
+                'ack_p50_ms': _round(percentile(ack_ms, 50)),
+                'ack_p99_ms': _round(percentile(ack_ms, 99)),
+                'dups_stale': f"{totals['stale']}/{args.clients * args.dups}"
+            })
+    finally:
+        server.terminate()
+        try:
+            server.wait(5)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    return result
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=['flask', 'asgi'], default='flask')
+    parser.add_argument('--clients', type=int, default=10, help='simulated clients, one robot each')
+    parser.add_argument('--updates', type=int, default=1000, help='updates per client')
+    parser.add_argument('--rate', type=float, default=0, help='updates per second per client (0 = unpaced)')
+    parser.add_argument('--dups', type=int, default=20, help='frames each socket client resends at the end')
+    parser.add_argument('--modes', nargs='+', default=['http', 'ws-json', 'ws-bin1'],
+                        choices=['http', 'ws-json', 'ws-bin1'])
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    for mode in args.modes:
+        print(f"🔄 {args.server} {mode}: {args.clients} clients x {args.updates} updates...")
+        result = await run_mode(args, mode)
+        print(json.dumps(result))
+        results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'ws_ingest', 'args': vars(args), 'results': results}, f, indent=2)
+        print(f"📄 Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
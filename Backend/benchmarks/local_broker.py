@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+Local MQTT broker stand-in
+A small MQTT 3.1.1 / 5 broker for benchmarks and offline runs: CONNECT,
+PUBLISH (QoS 0/1/2), SUBSCRIBE/UNSUBSCRIBE with + and # wildcards, retained
+messages and PINGREQ. No auth, no persistence, no TLS. For MQTT 5 clients it
+resolves topic aliases (up to topic_alias_maximum), drops messages whose
+expiry interval ran out before they were forwarded, passes user properties on
+to v5 subscribers and announces receive_maximum in its CONNACK (in pipeline
+mode it disconnects a v5 client with more QoS 1/2 publishes unacknowledged).
+
+It can add a fixed delay before acks and forwarding (to mimic a WAN broker)
+and can be taken offline / brought back to simulate outages. By default a
+session handles one publish at a time, so the delay adds up when a client
+publishes faster than that; with pipeline=True publishes overlap and each is
+delayed on its own, as on a real link.
+
+Usage:
+    python benchmarks/local_broker.py --port 1883 --delay-ms 40
+or in-process:
+    broker = LocalBroker(port=0).start()   # runs on a background thread
+    ... broker.port ...
+    broker.stop()
+"""
+
+import argparse
+import asyncio
+import math
+import struct
+import threading
+import time
+
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+MQTT_V5 = 5
+# DISCONNECT reason codes (MQTT 5)
+RECEIVE_MAXIMUM_EXCEEDED, TOPIC_ALIAS_INVALID = 0x93, 0x94
+NO_PROPERTIES = b'\x00'
+
+
+def encode_remaining_length(length):
+    out = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        out.append(byte)
+        if not length:
+            return bytes(out)
+
+
+def encode_string(value):
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    return struct.pack('!H', len(value)) + value
+
+
+def packet(packet_type, flags, body):
+    return bytes([(packet_type << 4) | flags]) + encode_remaining_length(len(body)) + body
+
+
+def topic_matches(topic_filter, topic):
+    filter_parts = topic_filter.split('/')
+    topic_parts = topic.split('/')
+    for index, part in enumerate(filter_parts):
+        if part == '#':
+            return True
+        if index >= len(topic_parts):
+            return False
+        if part != '+' and part != topic_parts[index]:
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+
+class _Session:
+    def __init__(self, broker, reader, writer):
+        self.broker = broker
+        self.reader = reader
+        self.writer = writer
+        self.client_id = None
+        self.version = 4
+        self.subscriptions = {}
+        self.next_packet_id = 1
+        self.incoming_qos2 = set()
+        # MQTT 5 topic aliases the client set up: alias -> topic
+        self.aliases = {}
+        # QoS 1/2 publishes received and not yet acked (pipeline mode)
+        self.inflight = 0
+        self.pipeline = asyncio.Queue() if broker.pipeline else None
+
+    def send(self, data):
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+    def packet_id(self):
+        packet_id = self.next_packet_id
+        self.next_packet_id = packet_id % 65535 + 1
+        return packet_id
+
+    async def read_packet(self):
+        header = await self.reader.readexactly(1)
+        multiplier, length = 1, 0
+        while True:
+            byte = (await self.reader.readexactly(1))[0]
+            length += (byte & 0x7F) * multiplier
+            if not byte & 0x80:
+                break
+            multiplier *= 128
+        body = await self.reader.readexactly(length) if length else b''
+        return header[0] >> 4, header[0] & 0x0F, body
+
+    async def run(self):
+        worker = asyncio.ensure_future(self.drain_pipeline()) if self.pipeline is not None else None
+        try:
+            while True:
+                packet_type, flags, body = await self.read_packet()
+                if not await self.handle(packet_type, flags, body):
+                    break
+                await self.writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if worker is not None:
+                worker.cancel()
+            self.broker.sessions.discard(self)
+            self.writer.close()
+
+    async def drain_pipeline(self):
+        """Ack and route pipelined publishes in arrival order, each once its delay is up"""
+        while True:
+            due, publish = await self.pipeline.get()
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if publish[0]:
+                self.inflight -= 1
+            self.complete(*publish)
+
+    def refuse(self, reason):
+        """Protocol error: DISCONNECT with reason (MQTT 5) and drop the connection"""
+        self.broker.protocol_errors += 1
+        if self.version == MQTT_V5:
+            self.send(packet(DISCONNECT, 0, bytes([reason])))
+        return False
+
+    def resolve_alias(self, topic, properties):
+        """Topic of a v5 PUBLISH, setting up or using its topic alias; None if the alias is invalid"""
+        alias = getattr(properties, 'TopicAlias', None)
+        if alias is None:
+            return topic or None
+        if not 0 < alias <= self.broker.topic_alias_maximum:
+            return None
+        if topic:
+            self.aliases[alias] = topic
+            return topic
+        self.broker.aliased += 1
+        return self.aliases.get(alias)
+
+    async def handle(self, packet_type, flags, body):
+        broker = self.broker
+        if packet_type == CONNECT:
+            (name_len,) = struct.unpack_from('!H', body, 0)
+            self.version = body[2 + name_len]
+            offset = 2 + name_len + 4  # protocol name, level, flags, keepalive
+            if self.version == MQTT_V5:
+                _, length = Properties(PacketTypes.CONNECT).unpack(body[offset:])
+                offset += length
+            (id_len,) = struct.unpack_from('!H', body, offset)
+            self.client_id = body[offset + 2:offset + 2 + id_len].decode('utf-8', 'replace')
+            if self.version == MQTT_V5:
+                properties = Properties(PacketTypes.CONNACK)
+                if broker.topic_alias_maximum:
+                    properties.TopicAliasMaximum = broker.topic_alias_maximum
+                if broker.receive_maximum:
+                    properties.ReceiveMaximum = broker.receive_maximum
+                self.send(packet(CONNACK, 0, b'\x00\x00' + properties.pack()))
+            else:
+                self.send(packet(CONNACK, 0, b'\x00\x00'))
+        elif packet_type == PUBLISH:
+            qos = (flags >> 1) & 0x03
+            retain = bool(flags & 0x01)
+            (topic_len,) = struct.unpack_from('!H', body, 0)
+            topic = body[2:2 + topic_len].decode('utf-8')
+            offset = 2 + topic_len
+            packet_id = None
+            if qos:
+                (packet_id,) = struct.unpack_from('!H', body, offset)
+                offset += 2
+            properties = None
+            if self.version == MQTT_V5:
+                properties, length = Properties(PacketTypes.PUBLISH).unpack(body[offset:])
+                offset += length
+                topic = self.resolve_alias(topic, properties)
+                if topic is None:
+                    return self.refuse(TOPIC_ALIAS_INVALID)
+            payload = body[offset:]
+            broker.received += 1
+            broker.bytes_received += 1 + len(encode_remaining_length(len(body))) + len(body)
+            publish = (qos, packet_id, topic, payload, retain, properties, time.monotonic())
+            if self.pipeline is not None:
+                if qos:
+                    self.inflight += 1
+                    broker.max_inflight = max(broker.max_inflight, self.inflight)
+                    if (self.version == MQTT_V5 and broker.receive_maximum
+                            and self.inflight > broker.receive_maximum):
+                        broker.receive_maximum_exceeded += 1
+                        return self.refuse(RECEIVE_MAXIMUM_EXCEEDED)
+                self.pipeline.put_nowait((time.monotonic() + broker.delay, publish))
+                return True
+            if broker.delay:
+                await asyncio.sleep(broker.delay)
+            self.complete(*publish)
+        elif packet_type == PUBREL:
+            (packet_id,) = struct.unpack_from('!H', body, 0)
+            self.incoming_qos2.discard(packet_id)
+            self.send(packet(PUBCOMP, 0, struct.pack('!H', packet_id)))
+        elif packet_type == PUBREC:
+            # We delivered at QoS 2 to a subscriber
+            self.send(packet(PUBREL, 0x02, body[:2]))
+        elif packet_type in (PUBACK, PUBCOMP):
+            pass
+        elif packet_type == SUBSCRIBE:
+            (packet_id,) = struct.unpack_from('!H', body, 0)
+            offset = 2
+            if self.version == MQTT_V5:
+                offset += Properties(PacketTypes.SUBSCRIBE).unpack(body[offset:])[1]
+            granted = bytearray()
+            new_filters = []
+            while offset < len(body):
+                (filter_len,) = struct.unpack_from('!H', body, offset)
+                topic_filter = body[offset + 2:offset + 2 + filter_len].decode('utf-8')
+                qos = body[offset + 2 + filter_len] & 0x03
+                offset += 3 + filter_len
+                self.subscriptions[topic_filter] = qos
+                granted.append(qos)
+                new_filters.append(topic_filter)
+            properties = NO_PROPERTIES if self.version == MQTT_V5 else b''
+            self.send(packet(SUBACK, 0, struct.pack('!H', packet_id) + properties + bytes(granted)))
+            for topic, (payload, qos, properties) in list(broker.retained.items()):
+                for topic_filter in new_filters:
+                    if topic_matches(topic_filter, topic):
+                        self.deliver(topic, payload, min(qos, self.subscriptions[topic_filter]), retain=True,
+                                     properties=properties)
+                        break
+        elif packet_type == UNSUBSCRIBE:
+            (packet_id,) = struct.unpack_from('!H', body, 0)
+            offset = 2
+            if self.version == MQTT_V5:
+                offset += Properties(PacketTypes.UNSUBSCRIBE).unpack(body[offset:])[1]
+            removed = 0
+            while offset < len(body):
+                (filter_len,) = struct.unpack_from('!H', body, offset)
+                self.subscriptions.pop(body[offset + 2:offset + 2 + filter_len].decode('utf-8'), None)
+                offset += 2 + filter_len
+                removed += 1
+            reasons = NO_PROPERTIES + bytes(removed) if self.version == MQTT_V5 else b''
+            self.send(packet(UNSUBACK, 0, struct.pack('!H', packet_id) + reasons))
+        elif packet_type == PINGREQ:
+            self.send(packet(PINGRESP, 0, b''))
+        elif packet_type == DISCONNECT:
+            return False
+        return True
+
+    def complete(self, qos, packet_id, topic, payload, retain, properties, received_at):
+        """Ack a received publish and route it (once the broker's delay is up)"""
+        if qos == 1:
+            self.send(packet(PUBACK, 0, struct.pack('!H', packet_id)))
+        elif qos == 2:
+            if packet_id in self.incoming_qos2:
+                # Duplicate before PUBREL: ack again, do not forward twice
+                self.send(packet(PUBREC, 0, struct.pack('!H', packet_id)))
+                return
+            self.incoming_qos2.add(packet_id)
+            self.send(packet(PUBREC, 0, struct.pack('!H', packet_id)))
+        self.broker.route(topic, payload, qos, retain, properties, received_at)
+
+    def deliver(self, topic, payload, qos, retain=False, properties=None):
+        body = encode_string(topic)
+        if qos:
+            body += struct.pack('!H', self.packet_id())
+        if self.version == MQTT_V5:
+            body += properties.pack() if properties is not None else NO_PROPERTIES
+        self.send(packet(PUBLISH, (qos << 1) | int(retain), body + payload))
+        self.broker.forwarded += 1
+
+
+class LocalBroker:
+    """MQTT broker stand-in running on its own event loop thread"""
+
+    def __init__(self, host='127.0.0.1', port=1883, delay_ms=0.0, topic_alias_maximum=16, receive_maximum=0,
+                 pipeline=False):
+        self.host = host
+        self.port = port
+        self.delay = delay_ms / 1000.0
+        # MQTT 5 limits announced in CONNACK (receive_maximum 0: not announced, not enforced)
+        self.topic_alias_maximum = topic_alias_maximum
+        self.receive_maximum = receive_maximum
+        self.pipeline = pipeline
+        self.sessions = set()
+        self.retained = {}
+        self.received = 0
+        self.bytes_received = 0
+        self.forwarded = 0
+        self.aliased = 0
+        self.expired = 0
+        self.protocol_errors = 0
+        self.receive_maximum_exceeded = 0
+        self.max_inflight = 0
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    # -- broker logic (event loop thread) ------------------------------------
+
+    def route(self, topic, payload, qos, retain, properties=None, received_at=None):
+        forward = None
+        if properties is not None:
+            # What v5 subscribers get: the user properties and what is left of the expiry interval
+            forward = Properties(PacketTypes.PUBLISH)
+            for user_property in getattr(properties, 'UserProperty', None) or ():
+                forward.UserProperty = user_property
+            expiry = getattr(properties, 'MessageExpiryInterval', None)
+            if expiry is not None:
+                waited = time.monotonic() - received_at
+                if waited >= expiry:
+                    self.expired += 1
+                    return
+                forward.MessageExpiryInterval = max(1, math.ceil(expiry - waited))
+        if retain:
+            if payload:
+                self.retained[topic] = (payload, qos, forward)
+            else:
+                self.retained.pop(topic, None)
+        for session in list(self.sessions):
+            granted = None
+            for topic_filter, sub_qos in session.subscriptions.items():
+                if topic_matches(topic_filter, topic):
+                    granted = max(granted or 0, sub_qos)
+            if granted is not None:
+                session.deliver(topic, payload, min(qos, granted), properties=forward)
+
+    async def _handle_client(self, reader, writer):
+        session = _Session(self, reader, writer)
+        self.sessions.add(session)
+        await session.run()
+
+    async def _serve(self):
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    # -- control (any thread) --------------------------------------------------
+
+    def start(self):
+        """Start serving on a background thread; returns self once listening"""
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._serve())
+            self._ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="local-mqtt-broker", daemon=True)
+        self._thread.start()
+        self._ready.wait(5)
+        return self
+
+    def _call(self, func):
+        done = threading.Event()
+
+        def wrapper():
+            try:
+                func()
+            finally:
+                done.set()
+
+        self._loop.call_soon_threadsafe(wrapper)
+        done.wait(5)
+
+    def go_offline(self):
+        """Stop listening and drop every client connection (simulated outage)"""
+        def offline():
+            if self._server:
+                self._server.close()
+                self._server = None
+            for session in list(self.sessions):
+                session.writer.transport.abort()
+            self.sessions.clear()
+        self._call(offline)
+
+    def go_online(self):
+        """Listen again on the same port after go_offline()"""
+        future = asyncio.run_coroutine_threadsafe(self._serve(), self._loop)
+        future.result(5)
+
+    def stop(self):
+        if self._loop:
+            self.go_offline()
+
+            def shutdown():
+                for task in asyncio.all_tasks(self._loop):
+                    task.cancel()
+                self._loop.call_soon(self._loop.stop)
+            self._loop.call_soon_threadsafe(shutdown)
+            self._thread.join(5)
+
+    def stats(self):
+        return {'sessions': len(self.sessions), 'received': self.received, 'bytes_received': self.bytes_received,
+                'forwarded': self.forwarded, 'aliased': self.aliased, 'expired': self.expired,
+                'max_inflight': self.max_inflight, 'receive_maximum_exceeded': self.receive_maximum_exceeded,
+                'protocol_errors': self.protocol_errors}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local MQTT broker stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--delay-ms', type=float, default=0.0, help='delay before acking/forwarding each publish')
+    parser.add_argument('--topic-alias-maximum', type=int, default=16, help='topic aliases a v5 client may use')
+    parser.add_argument('--receive-maximum', type=int, default=0,
+                        help='unacknowledged QoS 1/2 publishes a v5 client may have (0: no limit)')
+    parser.add_argument('--pipeline', action='store_true', help='delay each publish on its own instead of in turn')
+    args = parser.parse_args()
+
+    broker = LocalBroker(args.host, args.port, args.delay_ms, args.topic_alias_maximum, args.receive_maximum,
+                         args.pipeline).start()
+    print(f"🧪 Local MQTT broker listening on {broker.host}:{broker.port} (delay {args.delay_ms} ms)")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"   {broker.stats()}")
+    except KeyboardInterrupt:
+        broker.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+app.py for benchmarks that tag every update with a unique token
+The load benchmarks post a token in hand.right.horizontal so a delivered
+state can be matched to the update that produced it. The server rejects
+values outside the direction enums, so this runs app.py (same arguments,
+same process) with the state schema compiled to accept any string there.
+The server itself has no switch for this.
+
+Usage (from Backend/): python benchmarks/token_app.py --server asgi --port 5001
+"""
+
+import os
+import runpy
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import state_schema
+
+_compile_schema = state_schema.compile_schema
+
+
+def compile_token_schema(schema, strict_enums=True):
+    return _compile_schema(schema, strict_enums=False)
+
+
+if __name__ == '__main__':
+    # Before state_store compiles its validators on import
+    state_schema.compile_schema = compile_token_schema
+    sys.argv[0] = os.path.join(BACKEND_DIR, 'app.py')
+    runpy.run_path(sys.argv[0], run_name='__main__')
@@ -0,0 +1,390 @@
+"""
+Cluster mode
+Several server processes behind a load balancer share robot state over a
+pub/sub backplane. Every process keeps a copy of every robot's state and
+fans updates out to its own WebSocket and SSE clients; exactly one of them,
+the owner, publishes to the robot topics.
+
+- Membership: each node heartbeats every `heartbeat` seconds. The owner is
+  the longest-running node heard from within `lease` seconds (ties broken by
+  node id). A node only counts itself once it has been up for a lease (so it
+  has heard who is older) and while its own heartbeats come back to it (so a
+  node cut off from the backplane steps down). When the owner goes quiet the
+  next oldest takes over and republishes every robot's current state.
+- Updates: the owner orders them. Everything it commits - its own clients'
+  updates and deltas proposed by other nodes - goes out as an authoritative
+  delta stamped with its version, which every other node applies in that
+  order (anything at or below a version already applied from that owner is
+  dropped as stale). Other nodes apply their own clients' updates at once and
+  propose the delta; the owner's echo settles concurrent writes to the same
+  field the same way everywhere.
+- Joining: a node asks for a sync on (re)connecting and whenever the owner
+  changes; the owner answers with every robot's state.
+
+State versions, ETags, batch/WebSocket seqs and gesture filters stay per
+process, so a client should stick to one node (sticky sessions). Updates
+taken while no owner is alive reach only the node that took them.
+
+Backplanes need start(on_message, on_connect), publish(data), stop() and
+stats(): LoopbackBackplane (in process, for tests) and MQTTBackplane (one
+topic on a broker, e.g. benchmarks/local_broker.py); a Redis channel would
+fit the same four methods.
+"""
+
+import json
+import os
+import queue
+import socket
+import ssl
+import threading
+import time
+from urllib.parse import urlparse
+
+import paho.mqtt.client as mqtt
+
+import metrics
+from event_log import events
+from mqtt_supervisor import MQTTSupervisor, Backoff
+
+MSG_HEARTBEAT = 'hb'
+MSG_UPDATE = 'u'
+MSG_SYNC = 'sync'
+
+# RobotStateStore.apply(origin=...) for deltas that arrived over the backplane
+ORIGIN_CLUSTER = 'cluster'
+
+
+class LoopbackHub:
+    """In-process pub/sub: every message goes to every attached backplane, in order, from one thread"""
+
+    def __init__(self):
+        self._subscribers = []
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def attach(self, on_message):
+        with self._lock:
+            self._subscribers.append(on_message)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="cluster-loopback", daemon=True)
+                self._thread.start()
+
+    def detach(self, on_message):
+        with self._lock:
+            if on_message in self._subscribers:
+                self._subscribers.remove(on_message)
+
+    def publish(self, data):
+        self._queue.put(data)
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            with self._lock:
+                subscribers = list(self._subscribers)
+            for on_message in subscribers:
+                try:
+                    on_message(data)
+                except Exception as e:
+                    events.error('cluster.deliver_failed', "❌ Loopback backplane delivery failed", error=repr(e))
+
+
+# The hub behind CLUSTER_BACKPLANE=loopback
+LOOPBACK = LoopbackHub()
+
+
+class LoopbackBackplane:
+    """A node's connection to a LoopbackHub"""
+
+    def __init__(self, hub=LOOPBACK):
+        self._hub = hub
+        self._on_message = None
+        self.published = 0
+
+    def start(self, on_message, on_connect=None):
+        self._on_message = on_message
+        self._hub.attach(on_message)
+        if on_connect:
+            on_connect()
+        return self
+
+    def publish(self, data):
+        self.published += 1
+        self._hub.publish(data)
+        return True
+
+    def stop(self):
+        self._hub.detach(self._on_message)
+
+    def stats(self):
+        return {'type': 'loopback', 'connected': True, 'published': self.published}
+
+
+class MQTTBackplane:
+    """One topic on an MQTT broker (QoS 0), kept connected by an MQTTSupervisor thread"""
+
+    def __init__(self, host, port, channel, client_id, username=None, password=None, use_tls=False):
+        self.host = host
+        self.port = port
+        self.channel = channel
+        self.published = 0
+        self.client = mqtt.Client(client_id=client_id, clean_session=True)
+        if username:
+            self.client.username_pw_set(username, password)
+        if use_tls:
+            context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            self.client.tls_set_context(context)
+        self._supervisor = None
+
+    def start(self, on_message, on_connect=None):
+        def connected(client, userdata, flags, rc):
+            if rc == 0:
+                client.subscribe(self.channel, qos=0)
+
+        # Only once subscribed can the answer to a sync come back
+        self.client.on_subscribe = lambda *args: on_connect and on_connect()
+        self.client.on_message = lambda client, userdata, message: on_message(message.payload)
+        self._supervisor = MQTTSupervisor(self.client, self.host, self.port, keepalive=30,
+                                          backoff=Backoff(0.2, 5.0), on_connect=connected).start()
+        return self
+
+    @property
+    def connected(self):
+        return self._supervisor is not None and self._supervisor.connected
+
+    def publish(self, data):
+        if not self.connected:
+            return False
+        result = self.client.publish(self.channel, data, qos=0)
+        self.published += 1
+        return result.rc == mqtt.MQTT_ERR_SUCCESS
+
+    def stop(self):
+        if self._supervisor:
+            self._supervisor.stop()
+
+    def stats(self):
+        return dict(self._supervisor.stats() if self._supervisor else {}, type='mqtt',
+                    broker=f"{self.host}:{self.port}", channel=self.channel, published=self.published)
+
+
+def open_backplane(url, node_id, channel):
+    """Backplane for a CLUSTER_BACKPLANE value: 'loopback' or mqtt[s]://[user:password@]host[:port]"""
+    if url == 'loopback':
+        return LoopbackBackplane()
+    parsed = urlparse(url)
+    if parsed.scheme not in ('mqtt', 'mqtts'):
+        raise ValueError(f"Unsupported cluster backplane: {url}")
+    use_tls = parsed.scheme == 'mqtts'
+    return MQTTBackplane(parsed.hostname or '127.0.0.1', parsed.port or (8883 if use_tls else 1883), channel,
+                         f"cluster_{node_id}_{os.getpid()}", username=parsed.username, password=parsed.password,
+                         use_tls=use_tls)
+
+
+def default_node_id(port):
+    return f"{socket.gethostname()}-{port}"
+
+
+class ClusterNode:
+    """This process's membership of the cluster: heartbeats, publishing ownership and state replication"""
+
+    def __init__(self, backplane, node_id, registry, apply_remote, heartbeat=0.5, lease=2.0):
+        # apply_remote(robot_id, changes) merges a replicated delta into that robot's
+        # store with origin=ORIGIN_CLUSTER, then publishes and fans it out like any update
+        self.backplane = backplane
+        self.node_id = node_id
+        self.registry = registry
+        self._apply_remote = apply_remote
+        self.heartbeat = heartbeat
+        self.lease = lease
+        self.started_at = time.time()
+        self._started = time.monotonic()
+        self._echoed = None
+        self.owner = None
+        self.is_owner = False
+        # node id -> {'started_at', 'heard', 'owner', 'ws_clients'}
+        self._peers = {}
+        # robot id -> (node id, version) of the last authoritative delta applied
+        self._applied = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.sent = 0
+        self.received = 0
+        self.stale = 0
+        self.invalid = 0
+        self.proposals = 0
+        self.snapshots = 0
+        self.takeovers = 0
+
+        metrics.CLUSTER_OWNER.set_function(lambda: int(self.is_owner))
+        metrics.CLUSTER_PEERS.set_function(lambda: len(self._live_peers(time.monotonic())))
+
+    def start(self):
+        self.registry.set_on_commit(self._on_commit)
+        self.backplane.start(self._on_message, self._on_connect)
+        self._thread = threading.Thread(target=self._run, name="cluster-heartbeat", daemon=True)
+        self._thread.start()
+        events.info('cluster.joined', "🧩 Joined the cluster", node=self.node_id, backplane=self.backplane.stats())
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(2.0)
+        self.backplane.stop()
+
+    # -- outbound --------------------------------------------------------------
+
+    def _send(self, message):
+        try:
+            if self.backplane.publish(json.dumps(message, separators=(',', ':')).encode()):
+                self.sent += 1
+                metrics.CLUSTER_MESSAGES.inc('sent')
+        except Exception as e:
+            events.error('cluster.send_failed', "❌ Cluster backplane publish failed", error=repr(e))
+
+    def _on_connect(self):
+        # (Re)connected: catch up with whatever the owner has
+        self._send({'t': MSG_SYNC, 'n': self.node_id})
+
+    def _on_commit(self, session, version, delta, origin):
+        """State store hook, called under the robot's lock so deltas go out in version order"""
+        if self.is_owner:
+            self._send({'t': MSG_UPDATE, 'n': self.node_id, 'a': 1, 'r': session.robot_id, 'v': version,
+                        'd': delta})
+        elif origin != ORIGIN_CLUSTER:
+            # Ours: propose it to the owner
+            self._send({'t': MSG_UPDATE, 'n': self.node_id, 'a': 0, 'r': session.robot_id, 'd': delta})
+
+    def _send_snapshots(self):
+        for session in self.registry.sessions():
+            # Under the store lock, so no newer delta for this robot can overtake it
+            session.state_store.with_snapshot(
+                lambda version, state: self._send({'t': MSG_UPDATE, 'n': self.node_id, 'a': 1,
+                                                   'r': session.robot_id, 'v': version, 'd': state}))
+            self.snapshots += 1
+
+    # -- inbound ---------------------------------------------------------------
+
+    def _on_message(self, data):
+        try:
+            message = json.loads(data)
+            sender = message['n']
+            kind = message['t']
+        except (ValueError, KeyError, TypeError):
+            self.invalid += 1
+            return
+        if sender == self.node_id:
+            if kind == MSG_HEARTBEAT:
+                self._echoed = time.monotonic()
+            return
+        self.received += 1
+        metrics.CLUSTER_MESSAGES.inc('received')
+        if kind == MSG_HEARTBEAT:
+            with self._lock:
+                self._peers[sender] = {'started_at': message.get('s', 0.0), 'heard': time.monotonic(),
+                                       'owner': bool(message.get('o')), 'ws_clients': message.get('c', 0)}
+        elif kind == MSG_UPDATE:
+            self._on_update(sender, message)
+        elif kind == MSG_SYNC and self.is_owner:
+            self._send_snapshots()
+
+    def _on_update(self, sender, message):
+        robot_id = message.get('r')
+        if message.get('a') and not (self.is_owner and self._rank(sender) > self._rank(self.node_id)):
+            version = message.get('v', 0)
+            last = self._applied.get(robot_id)
+            if last is not None and last[0] == sender and version <= last[1]:
+                self.stale += 1
+                metrics.CLUSTER_MESSAGES.inc('stale')
+                return
+            self._applied[robot_id] = (sender, version)
+        elif self.is_owner:
+            # A proposal (or the writes of a younger node that briefly thought it was the owner)
+            self.proposals += 1
+        else:
+            return
+        try:
+            self._apply_remote(robot_id, message['d'])
+        except Exception as e:
+            self.invalid += 1
+            events.warning('cluster.apply_failed', "⚠️ Could not apply replicated update", robot=robot_id,
+                           sender=sender, error=str(e))
+
+    # -- membership ------------------------------------------------------------
+
+    def _rank(self, node_id):
+        if node_id == self.node_id:
+            return self.started_at, node_id
+        peer = self._peers.get(node_id)
+        return (peer['started_at'] if peer else float('inf')), node_id
+
+    def _live_peers(self, now):
+        with self._lock:
+            return {node: peer for node, peer in self._peers.items() if now - peer['heard'] < self.lease}
+
+    def _run(self):
+        while True:
+            self._send({'t': MSG_HEARTBEAT, 'n': self.node_id, 's': self.started_at, 'o': self.is_owner,
+                        'c': self.registry.ws_clients()})
+            self._elect(time.monotonic())
+            if self._stop.wait(self.heartbeat):
+                return
+
+    def _elect(self, now):
+        live = self._live_peers(now)
+        with self._lock:
+            for node in [node for node, peer in self._peers.items() if now - peer['heard'] > 10 * self.lease]:
+                del self._peers[node]
+        candidates = [(peer['started_at'], node) for node, peer in live.items()]
+        if (now - self._started >= self.lease and self._echoed is not None
+                and now - self._echoed < self.lease):
+            candidates.append((self.started_at, self.node_id))
+        owner = min(candidates)[1] if candidates else None
+        changed, self.owner = owner != self.owner, owner
+        is_owner = owner == self.node_id
+        if changed and owner is not None and not is_owner:
+            # A new owner: take its state, which settles anything proposed to the old one and lost
+            self._send({'t': MSG_SYNC, 'n': self.node_id})
+        if is_owner == self.is_owner:
+            return
+        self.is_owner = is_owner
+        if is_owner:
+            self.takeovers += 1
+            events.warning('cluster.owner', "👑 This node now owns MQTT publishing", node=self.node_id,
+                           peers=len(live))
+            # What the previous owner last sent may be stale or lost
+            for session in self.registry.sessions():
+                session.control_loop.republish()
+        else:
+            events.warning('cluster.owner_lost', "🔽 Another node owns MQTT publishing now", node=self.node_id,
+                           owner=owner)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            peers = {node: {'owner': peer['owner'], 'ws_clients': peer['ws_clients'],
+                            'live': now - peer['heard'] < self.lease,
+                            'heard_ms_ago': round((now - peer['heard']) * 1000, 1)}
+                     for node, peer in self._peers.items()}
+        return {
+            'enabled': True,
+            'node_id': self.node_id,
+            'owner': self.owner,
+            'is_owner': self.is_owner,
+            'uptime_s': round(now - self._started, 1),
+            'peers': peers,
+            'sent': self.sent,
+            'received': self.received,
+            'stale': self.stale,
+            'invalid': self.invalid,
+            'proposals_applied': self.proposals,
+            'snapshots_sent': self.snapshots,
+            'takeovers': self.takeovers,
+            'backplane': self.backplane.stats()
+        }
@@ -0,0 +1,158 @@
+"""
+Shared configuration for the robot control server
+"""
+
+import os
+
+from ws_hub import POLICY_LATEST
+
+# MQTT Configuration for HiveMQ Cloud
+# (MQTT_HOST / MQTT_PORT / MQTT_TLS / MQTT_USERNAME / MQTT_PASSWORD in the
+# environment point the server at another broker, e.g. a local one)
+HIVEMQ_HOST = os.environ.get('MQTT_HOST', "a2016a11d3614243aeb27bda75dd2204.s1.eu.hivemq.cloud")
+HIVEMQ_PORT = int(os.environ.get('MQTT_PORT', 8883))
+MQTT_TOPIC = "robot"
+HIVEMQ_USERNAME = os.environ.get('MQTT_USERNAME', "kushal")
+HIVEMQ_PASSWORD = os.environ.get('MQTT_PASSWORD', "Hackthenorth25")
+MQTT_USE_TLS = os.environ.get('MQTT_TLS', '1') not in ('0', 'false', 'no')
+MQTT_QOS = 1
+
+# MQTT protocol for the broker connections: '3.1.1' or '5' (MQTT_VERSION in the
+# environment). With 5 (see mqtt5.py) repeated topics go as topic aliases,
+# motion commands expire at the broker after MQTT5_MESSAGE_EXPIRY seconds (the
+# wire allows whole seconds only), unacknowledged ones older than MQTT5_MAX_AGE
+# seconds are not resent after a reconnect, and (MQTT5_STAMP) every publish
+# carries 'seq' and 'ts' user properties. MQTT_MAX_INFLIGHT caps unacknowledged
+# QoS 1 publishes; a v5 broker's Receive Maximum can lower it.
+MQTT_VERSION = os.environ.get('MQTT_VERSION', '3.1.1')
+MQTT5_MESSAGE_EXPIRY = 1
+MQTT5_MAX_AGE = 0.3
+MQTT5_STAMP = os.environ.get('MQTT5_STAMP', '1') not in ('0', 'false', 'no')
+MQTT_MAX_INFLIGHT = 20
+
+# Wire format for robot commands: 'json' or the compact binary 'bin1' (see
+# wire_format.py). Robots announce what they decode on <topic>/format; this
+# is the format for topics that have not announced anything.
+MQTT_WIRE_FORMAT = os.environ.get('MQTT_WIRE_FORMAT', 'json')
+
+# Reconnect backoff (seconds): jittered, doubling from MIN up to MAX
+MQTT_RECONNECT_MIN = 0.5
+MQTT_RECONNECT_MAX = 30.0
+
+# Robot transports (transports.py): besides the cloud broker above, commands
+# can go to an MQTT broker on the robot's network (LOCAL_MQTT=mqtt://host:port)
+# and straight to the robot over UDP (ROBOT_UDP=host[:port], where its
+# UDPReceiver listens). Each configured transport is probed every
+# TRANSPORT_PROBE_INTERVAL seconds and commands take the one with the lowest
+# round trip; another has to be TRANSPORT_SWITCH_MARGIN faster to take over.
+# ROBOT_TRANSPORT=cloud|local|udp uses only that one ('auto' chooses). Each
+# UDP datagram is sent UDP_COPIES times; acknowledged ones (QoS 1) are
+# retransmitted UDP_RETRIES times before going out over another transport.
+LOCAL_MQTT = os.environ.get('LOCAL_MQTT', '')
+ROBOT_UDP = os.environ.get('ROBOT_UDP', '')
+ROBOT_UDP_PORT = 7400
+ROBOT_TRANSPORT = os.environ.get('ROBOT_TRANSPORT', 'auto')
+UDP_COPIES = int(os.environ.get('UDP_COPIES', 2))
+UDP_RETRIES = 5
+TRANSPORT_PROBE_INTERVAL = 1.0   # seconds
+TRANSPORT_PROBE_TOPIC = 'robot-probe'
+TRANSPORT_SWITCH_MARGIN = 0.2
+
+# Emergency stop priority lane: stop/resume transitions skip the control loop
+# and the latest-wins queue and go out first, on their own topic
+MQTT_STOP_TOPIC = "robot/stop"
+MQTT_STOP_QOS = 1
+
+# Store-and-forward journal for broker outages: with MQTT_JOURNAL set to a
+# file path (e.g. /var/lib/robot-control/mqtt_outbox.journal), messages that
+# cannot be published are appended to that memory-mapped file and replayed in
+# order on reconnect. Off by default: unsent messages are then kept in memory.
+# 'latest' compaction keeps only the newest state per topic, 'none' keeps every
+# snapshot; stop transitions are always kept. State replay is paced at
+# MQTT_REPLAY_RATE messages per second so a backlog cannot flood the robot.
+MQTT_JOURNAL_PATH = os.environ.get('MQTT_JOURNAL', '')
+MQTT_JOURNAL_SIZE = 4 * 1024 * 1024
+MQTT_JOURNAL_COMPACTION = os.environ.get('MQTT_JOURNAL_COMPACTION', 'latest')
+MQTT_REPLAY_RATE = float(os.environ.get('MQTT_REPLAY_RATE', 200.0))
+
+# WebSocket fan-out configuration
+WS_SEND_POLICY = POLICY_LATEST   # or POLICY_DROP_OLDEST
+WS_MAX_QUEUE = 32                # per-client outbound queue (drop_oldest policy)
+WS_SLOW_CLIENT_TIMEOUT = 5.0     # seconds a client may stay backed up before being dropped
+# Ingestion protocol (ws_protocol.py): default ack batching a client's hello can override
+WS_ACK_EVERY = 16                # frames per cumulative ack
+WS_ACK_MS = 50                   # longest an applied frame waits for its ack (ms)
+
+# Dashboard push / long-poll configuration
+LONG_POLL_MAX_WAIT = 30.0        # upper bound for /api/state?wait=N
+SSE_KEEPALIVE_INTERVAL = 15.0    # comment line sent on idle /api/stream connections
+
+# Control loop: fixed rate at which the merged state is published to MQTT
+CONTROL_RATE_HZ = 50.0
+
+# Server-side gesture classification of raw rays (/api/gesture, see
+# gesture_classifier.py): ±threshold on the filtered unit direction with a
+# hysteresis band either side, a confidence gate, how long a lost ray is
+# bridged before the hand counts as not active (seconds), and one-euro
+# filter parameters (min_cutoff in Hz, beta per unit/s of movement)
+GESTURE_CLASSIFIER = {
+    'threshold': 0.2,
+    'hysteresis': 0.05,
+    'min_confidence': 0.5,
+    'min_cutoff': 1.0,
+    'beta': 4.0,
+    'lost_timeout': 0.25,
+    'buffer_size': 64,
+}
+
+# Admission control (admission.py): per-client token bucket for inbound
+# updates (stop/resume is exempt; ADMISSION_RATE=0 turns it off), and the
+# outbound backlog - MQTT messages queued or awaiting PUBACK, and the age of
+# the oldest - past which non-stop updates get 503 until it has drained
+# ('inf' turns either limit off)
+ADMISSION_RATE = float(os.environ.get('ADMISSION_RATE', 120.0))   # updates/s per client
+ADMISSION_BURST = float(os.environ.get('ADMISSION_BURST', 240.0))
+# Buckets one address may hold under client-chosen ids (X-Client-Id / WebSocket session)
+ADMISSION_IDS_PER_ADDRESS = int(os.environ.get('ADMISSION_IDS_PER_ADDRESS', 16))
+ADMISSION_MAX_BACKLOG = float(os.environ.get('ADMISSION_MAX_BACKLOG', 512))
+ADMISSION_MAX_LATENCY = float(os.environ.get('ADMISSION_MAX_LATENCY', 0.5))   # seconds
+ADMISSION_RETRY_AFTER = 1.0      # seconds, suggested to clients shed for overload
+
+# Batched ingestion (/api/robot-status/batch): most frames accepted per request
+BATCH_MAX_FRAMES = 1000
+
+# Traffic recording (recorder.py): file for every inbound frame and outbound
+# command ('' = off; app.py --record overrides) and the most it may grow to
+RECORD_PATH = os.environ.get('RECORD_PATH', '')
+RECORD_MAX_BYTES = 256 * 1024 * 1024
+
+# Cluster mode (cluster.py): several server processes share robot state over
+# a pub/sub backplane - 'mqtt://host:port' (a topic on that broker) or
+# 'loopback' (in process, for tests); '' runs a single process. Each node has
+# an id (app.py --node-id, default <hostname>-<port>); the oldest live node
+# owns MQTT publishing, and another takes over once it has not been heard
+# from for CLUSTER_LEASE seconds
+CLUSTER_BACKPLANE = os.environ.get('CLUSTER_BACKPLANE', '')
+CLUSTER_NODE_ID = os.environ.get('CLUSTER_NODE_ID', '')
+CLUSTER_CHANNEL = 'robot-cluster'
+CLUSTER_HEARTBEAT = 0.5          # seconds
+CLUSTER_LEASE = 2.0              # seconds
+
+# Multi-robot: robot <id> publishes to MQTT_TOPIC/<id> and MQTT_TOPIC/<id>/stop
+# (the default robot keeps MQTT_TOPIC / MQTT_STOP_TOPIC)
+MAX_ROBOTS = 1024
+
+# Event log: level (debug/info/warning/error), text or json lines, ring buffer
+# size for /debug/recent-events, and the fraction of routine events kept
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'info')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+LOG_BUFFER_SIZE = 1000
+LOG_SAMPLE_RATES = {
+    'robot.update': 0.1,
+    'ws.update': 0.1,
+    'mqtt.published': 0.1,
+}
+
+# Server defaults
+SERVER_HOST = '0.0.0.0'
+SERVER_PORT = 5000
@@ -0,0 +1,196 @@
+"""
+Fixed-rate control loop
+Publishes the latest merged robot state at a fixed tick rate, independent of
+how often gesture updates arrive. Ticks with no new state version are skipped,
+and urgent transitions (stop / resume) can be pushed out immediately.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+
+from event_log import events
+
+# Top-level state fields whose changes bypass the tick schedule
+URGENT_FIELDS = ('stopped',)
+
+
+class ControlLoop:
+    """Publishes state_store snapshots at rate_hz; runs on a thread or an asyncio loop"""
+
+    def __init__(self, state_store, publish, rate_hz=50.0, urgent_fields=URGENT_FIELDS, jitter_window=1000,
+                 publish_urgent=None):
+        # publish(payload, ingest_time=None) must not block (e.g. MQTTPublisher.submit);
+        # publish_urgent(version, changes, ingest_time) feeds the stop priority lane
+        self._store = state_store
+        self._publish = publish
+        self._publish_urgent = publish_urgent
+        self._urgent_fields = urgent_fields
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._task = None
+        self.set_rate(rate_hz)
+
+        self._last_version = -1
+        # Receive time of the oldest update not yet published, for latency tracing
+        self._pending_ingest = None
+        self._ticks = 0
+        self._published = 0
+        self._skipped = 0
+        self._urgent = 0
+        self._overruns = 0
+        self._missed_ticks = 0
+        self._lateness = deque(maxlen=jitter_window)
+        self._max_lateness = 0.0
+        self._last_tick_duration = 0.0
+
+    def set_rate(self, rate_hz):
+        if rate_hz <= 0:
+            raise ValueError("control rate must be positive")
+        self.rate_hz = float(rate_hz)
+        self.period = 1.0 / self.rate_hz
+
+    # -- inputs ----------------------------------------------------------------
+
+    def notify(self, delta, version=None, ingest_time=None):
+        """Called after each state update; publishes at once if an urgent field changed"""
+        if delta and ingest_time is not None and self._pending_ingest is None:
+            self._pending_ingest = ingest_time
+        urgent = {field: delta[field] for field in self._urgent_fields if field in delta}
+        if not urgent:
+            return True
+        if self._publish_urgent is not None:
+            # Priority lane first, then the full state on the regular topic
+            self._publish_urgent(self._store.version if version is None else version, urgent, ingest_time)
+        return self.publish_now()
+
+    def publish_now(self):
+        """Out-of-band publish of the current state, outside the tick schedule"""
+        with self._lock:
+            version, payload = self._store.serialized_bytes()
+            if version <= self._last_version:
+                return True
+            self._last_version = version
+            self._urgent += 1
+            return self._publish(payload, ingest_time=self._take_ingest())
+
+    def republish(self):
+        """Publish the current state on the next tick even if that version already went out"""
+        with self._lock:
+            self._last_version = -1
+
+    # -- tick ------------------------------------------------------------------
+
+    def tick(self):
+        """Publish the current state if it changed since the last publish"""
+        if self._store.version == self._last_version:
+            self._skipped += 1
+            return False
+        with self._lock:
+            version, payload = self._store.serialized_bytes()
+            if version <= self._last_version:
+                self._skipped += 1
+                return False
+            # Held across the (non-blocking) publish so an older snapshot can
+            # never be queued after a newer urgent one
+            self._last_version = version
+            self._published += 1
+            self._publish(payload, ingest_time=self._take_ingest())
+            return True
+
+    def _take_ingest(self):
+        # Caller holds the lock
+        ingest_time, self._pending_ingest = self._pending_ingest, None
+        return ingest_time
+
+    def _after_tick(self, scheduled, started, finished):
+        """Record jitter/overruns; returns the next scheduled tick time"""
+        self._ticks += 1
+        lateness = max(0.0, started - scheduled)
+        self._lateness.append(lateness)
+        if lateness > self._max_lateness:
+            self._max_lateness = lateness
+        self._last_tick_duration = finished - started
+
+        next_tick = scheduled + self.period
+        if finished > next_tick:
+            # Ran past the next deadline: count it and skip the ticks we missed
+            missed = int((finished - next_tick) / self.period) + 1
+            self._overruns += 1
+            self._missed_ticks += missed
+            next_tick += missed * self.period
+        return next_tick
+
+    # -- runners ---------------------------------------------------------------
+
+    def start(self):
+        """Run the loop on a background thread (Flask mode)"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="control-loop", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+        if self._thread:
+            self._thread.join(2.0)
+
+    def start_async(self):
+        """Run the loop as a task on the running asyncio loop (ASGI mode)"""
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._run_async())
+
+    def _run(self):
+        scheduled = time.monotonic()
+        while True:
+            delay = scheduled - time.monotonic()
+            if delay > 0 and self._stop.wait(delay):
+                return
+            if self._stop.is_set():
+                return
+            started = time.monotonic()
+            try:
+                self.tick()
+            except Exception as e:
+                events.error('control.tick_failed', "❌ Control loop tick failed", error=str(e))
+            scheduled = self._after_tick(scheduled, started, time.monotonic())
+
+    async def _run_async(self):
+        scheduled = time.monotonic()
+        while not self._stop.is_set():
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            started = time.monotonic()
+            try:
+                self.tick()
+            except Exception as e:
+                events.error('control.tick_failed', "❌ Control loop tick failed", error=str(e))
+            scheduled = self._after_tick(scheduled, started, time.monotonic())
+
+    def stats(self):
+        samples = sorted(self._lateness)
+        if samples:
+            mean = sum(samples) / len(samples)
+            p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+        else:
+            mean = p99 = 0.0
+        return {
+            'running': bool((self._thread and self._thread.is_alive()) or (self._task and not self._task.done())),
+            'rate_hz': self.rate_hz,
+            'ticks': self._ticks,
+            'published': self._published,
+            'skipped_unchanged': self._skipped,
+            'urgent_published': self._urgent,
+            'overruns': self._overruns,
+            'missed_ticks': self._missed_ticks,
+            'jitter_mean_ms': round(mean * 1000, 3),
+            'jitter_p99_ms': round(p99 * 1000, 3),
+            'jitter_max_ms': round(self._max_lateness * 1000, 3),
+            'last_tick_duration_ms': round(self._last_tick_duration * 1000, 3)
+        }
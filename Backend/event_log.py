@@ -0,0 +1,194 @@
+"""
+Structured event log
+Request handlers and MQTT callbacks record events as (time, level, event,
+message, fields) tuples; nothing is formatted on the calling thread. A
+background writer renders them to stdout, and the most recent events are kept
+in a bounded ring buffer for /debug/recent-events.
+
+Field values may be callables, which are only called when the event is
+actually rendered. Noisy event types can be sampled (keep a fraction).
+"""
+
+import atexit
+import json
+import math
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+LEVELS = {name.lower(): level for level, name in LEVEL_NAMES.items()}
+
+FORMAT_TEXT = 'text'
+FORMAT_JSON = 'json'
+
+
+def parse_level(value, default=INFO):
+    if isinstance(value, int):
+        return value
+    return LEVELS.get(str(value).lower(), default)
+
+
+def _render_value(value):
+    if callable(value):
+        value = value()
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    if value is None or isinstance(value, (str, int, float, bool, list, dict)):
+        return value
+    return str(value)
+
+
+class EventLog:
+    """Leveled, sampled event recorder with a background writer and a recent-events ring buffer"""
+
+    def __init__(self, level=INFO, capacity=1000, queue_size=10000, sample_rates=None, fmt=FORMAT_TEXT,
+                 stream=None):
+        self._recent = deque(maxlen=capacity)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stream = stream
+        self._thread = None
+        self._lock = threading.Lock()
+        self._sample_counts = {}
+        self.logged = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self.configure(level=level, sample_rates=sample_rates or {}, fmt=fmt)
+
+    def configure(self, level=None, sample_rates=None, fmt=None, capacity=None):
+        """Change level, per-event sample rates (0..1, fraction kept), output format or buffer size"""
+        if level is not None:
+            self.level = parse_level(level)
+        if sample_rates is not None:
+            self._sample_rates = dict(sample_rates)
+        if fmt is not None:
+            self.format = fmt
+        if capacity is not None:
+            self._recent = deque(self._recent, maxlen=capacity)
+
+    def enabled(self, level):
+        return level >= self.level
+
+    # -- recording (any thread, hot path) --------------------------------------
+
+    def debug(self, event, message='', **fields):
+        if DEBUG >= self.level:
+            self._record(DEBUG, event, message, fields)
+
+    def info(self, event, message='', **fields):
+        if INFO >= self.level:
+            self._record(INFO, event, message, fields)
+
+    def warning(self, event, message='', **fields):
+        if WARNING >= self.level:
+            self._record(WARNING, event, message, fields)
+
+    def error(self, event, message='', **fields):
+        if ERROR >= self.level:
+            self._record(ERROR, event, message, fields)
+
+    def _record(self, level, event, message, fields):
+        rate = self._sample_rates.get(event)
+        if rate is not None and level < WARNING and not self._keep(event, rate):
+            self.sampled_out += 1
+            return
+        record = (time.time(), level, event, message, fields)
+        self._recent.append(record)
+        self.logged += 1
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            # Never block a request on stdout; the ring buffer still has it
+            self.dropped += 1
+
+    def _keep(self, event, rate):
+        # Deterministic sampling: keep the first event, then each time n * rate crosses an integer
+        with self._lock:
+            n = self._sample_counts.get(event, 0)
+            self._sample_counts[event] = n + 1
+        return math.floor(n * rate) != math.floor((n - 1) * rate)
+
+    # -- writer ----------------------------------------------------------------
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="event-log-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            try:
+                stream = self._stream or sys.stdout
+                stream.write(self.render(record) + '\n')
+                if self._queue.empty():
+                    stream.flush()
+            except Exception:
+                pass
+            finally:
+                self._queue.task_done()
+
+    def flush(self, timeout=1.0):
+        """Wait (briefly) for the writer to drain the queue"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def render(self, record):
+        timestamp, level, event, message, fields = record
+        if self.format == FORMAT_JSON:
+            return json.dumps(self.to_dict(record), default=str)
+        parts = [datetime.fromtimestamp(timestamp).strftime('%H:%M:%S.%f')[:-3], LEVEL_NAMES.get(level, level),
+                 event]
+        if message:
+            parts.append(message)
+        for key, value in fields.items():
+            parts.append(f"{key}={_render_value(value)}")
+        return ' '.join(str(part) for part in parts)
+
+    # -- inspection ------------------------------------------------------------
+
+    def to_dict(self, record):
+        timestamp, level, event, message, fields = record
+        data = {
+            'time': timestamp,
+            'level': LEVEL_NAMES.get(level, level),
+            'event': event,
+            'message': message
+        }
+        if fields:
+            data['fields'] = {key: _render_value(value) for key, value in fields.items()}
+        return data
+
+    def recent(self, limit=100, event=None, min_level=DEBUG):
+        """Newest-last list of buffered events, optionally filtered by event prefix and level"""
+        records = [r for r in list(self._recent)
+                   if r[1] >= min_level and (event is None or r[2].startswith(event))]
+        if limit:
+            records = records[-limit:]
+        return [self.to_dict(r) for r in records]
+
+    def stats(self):
+        return {
+            'level': LEVEL_NAMES.get(self.level, self.level),
+            'format': self.format,
+            'buffered': len(self._recent),
+            'capacity': self._recent.maxlen,
+            'logged': self.logged,
+            'sampled_out': self.sampled_out,
+            'dropped': self.dropped,
+            'queue_depth': self._queue.qsize(),
+            'sample_rates': self._sample_rates
+        }
+
+
+# Shared by every module; app.py / asgi_app.py apply the settings from config.py
+events = EventLog()
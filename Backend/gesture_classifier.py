@@ -0,0 +1,261 @@
+"""
+Server-side gesture classification
+Turns raw pointing rays (the README's Gesture Events: hand, confidence,
+rayOrigin, rayDirection, timestamp) into the bucketed directions the robot
+state uses. Each hand keeps a ring buffer of recent samples and a one-euro
+filter over the normalized ray direction; the filtered x/y then go through
+hysteresis bands around the ±threshold boundaries, and samples below the
+confidence gate never move a label; a lost ray only clears the labels once
+tracking has been gone for lost_timeout. Only label changes come out, so a hand
+held near a boundary produces one update instead of a stream of
+"straight"/"left" flips.
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import metrics
+
+HANDS = ('left', 'right')
+NOT_ACTIVE = 'not active'
+
+# Field -> (axis, label below -threshold, label in between, label above +threshold)
+_AXES = {
+    'horizontal': (0, 'left', 'straight', 'right'),
+    'vertical': (1, 'down', 'neutral', 'up'),
+}
+# The right hand only steers; the left hand also points up/down (as in GestureController.ts)
+HAND_FIELDS = {
+    'right': ('horizontal',),
+    'left': ('horizontal', 'vertical'),
+}
+
+
+class OneEuroFilter:
+    """One-euro low-pass filter (Casiez et al.): smooths jitter at rest, follows fast moves with little lag"""
+
+    def __init__(self, min_cutoff=1.0, beta=4.0, d_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self):
+        self.value = None
+        self._derivative = 0.0
+        self._time = None
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def __call__(self, value, timestamp):
+        if self.value is None or timestamp <= self._time:
+            if self.value is None:
+                self.value = value
+            self._time = timestamp if self._time is None else max(self._time, timestamp)
+            return self.value
+        dt = timestamp - self._time
+        self._time = timestamp
+        derivative = (value - self.value) / dt
+        a_d = self._alpha(self.d_cutoff, dt)
+        self._derivative = a_d * derivative + (1 - a_d) * self._derivative
+        cutoff = self.min_cutoff + self.beta * abs(self._derivative)
+        a = self._alpha(cutoff, dt)
+        self.value = a * value + (1 - a) * self.value
+        return self.value
+
+
+def banded_label(value, current, threshold, band, low, mid, high):
+    """Label for value with hysteresis: entering low/high takes threshold+band, leaving takes threshold-band"""
+    if current == high and value > threshold - band:
+        return high
+    if current == low and value < -(threshold - band):
+        return low
+    if current not in (low, mid, high):
+        # First confident sample: plain thresholds
+        band = 0.0
+    if value > threshold + band:
+        return high
+    if value < -(threshold + band):
+        return low
+    return mid
+
+
+class HandTracker:
+    """Filter state, labels and a ring buffer of recent samples for one hand"""
+
+    def __init__(self, fields, threshold, hysteresis, min_confidence, min_cutoff, beta, buffer_size,
+                 lost_timeout):
+        self.fields = fields
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+        self.min_confidence = min_confidence
+        self.lost_timeout = lost_timeout
+        self.filters = (OneEuroFilter(min_cutoff, beta), OneEuroFilter(min_cutoff, beta))
+        self.labels = {field: NOT_ACTIVE for field in fields}
+        # (timestamp, x, y, confidence, filtered x, filtered y); filtered is None for gated samples
+        self.samples = deque(maxlen=buffer_size)
+        self.last_time = None
+        self.lost_since = None
+
+    def update(self, direction, confidence, timestamp):
+        """Feed one sample; returns ({field: new label}, outcome)"""
+        if self.last_time is not None and timestamp < self.last_time:
+            return {}, 'stale'
+        self.last_time = timestamp
+        if direction is None:
+            self.samples.append((timestamp, None, None, confidence, None, None))
+            if self.lost_since is None:
+                self.lost_since = timestamp
+            if timestamp - self.lost_since < self.lost_timeout:
+                # Brief tracking gap: hold the current labels
+                return {}, 'lost'
+            # Hand gone: like the client, stop pointing anywhere
+            for f in self.filters:
+                f.reset()
+            return self._set({field: NOT_ACTIVE for field in self.fields})
+        self.lost_since = None
+        x, y = direction
+        if confidence < self.min_confidence:
+            self.samples.append((timestamp, x, y, confidence, None, None))
+            return {}, 'low_confidence'
+        fx = self.filters[0](x, timestamp)
+        fy = self.filters[1](y, timestamp)
+        self.samples.append((timestamp, x, y, confidence, fx, fy))
+        filtered = (fx, fy)
+        labels = {}
+        for field in self.fields:
+            axis, low, mid, high = _AXES[field]
+            labels[field] = banded_label(filtered[axis], self.labels[field], self.threshold, self.hysteresis,
+                                         low, mid, high)
+        return self._set(labels)
+
+    def _set(self, labels):
+        changed = {field: label for field, label in labels.items() if self.labels[field] != label}
+        self.labels.update(changed)
+        return changed, 'changed' if changed else 'unchanged'
+
+    def snapshot(self, recent=0):
+        filtered = [f.value for f in self.filters]
+        result = {
+            'labels': dict(self.labels),
+            'filtered': [None if v is None else round(v, 4) for v in filtered],
+            'buffered': len(self.samples)
+        }
+        if recent:
+            result['recent'] = [list(sample) for sample in list(self.samples)[-recent:]]
+        return result
+
+
+class GestureClassifier:
+    """Per-robot classifier for both hands; thread-safe"""
+
+    def __init__(self, threshold=0.2, hysteresis=0.05, min_confidence=0.5, min_cutoff=1.0, beta=4.0,
+                 buffer_size=64, lost_timeout=0.25):
+        self.hands = {hand: HandTracker(HAND_FIELDS[hand], threshold, hysteresis, min_confidence,
+                                        min_cutoff, beta, buffer_size, lost_timeout) for hand in HANDS}
+        self._lock = threading.Lock()
+        self.outcomes = {'changed': 0, 'unchanged': 0, 'low_confidence': 0, 'lost': 0, 'stale': 0, 'invalid': 0}
+
+    def classify(self, samples):
+        """Run (hand, direction, confidence, timestamp) samples in timestamp order
+
+        Returns a partial robot state holding only the labels that changed
+        (suitable for RobotStateStore.apply), or {} when nothing did.
+        """
+        hand_changes = {}
+        with self._lock:
+            for hand, direction, confidence, timestamp in sorted(samples, key=lambda s: s[3]):
+                tracker = self.hands.get(hand)
+                if tracker is None:
+                    self.outcomes['invalid'] += 1
+                    metrics.GESTURE_SAMPLES.inc('invalid')
+                    continue
+                changed, outcome = tracker.update(direction, confidence, timestamp)
+                self.outcomes[outcome] += 1
+                metrics.GESTURE_SAMPLES.inc(outcome)
+                if changed:
+                    hand_changes.setdefault(hand, {}).update(changed)
+        return {'hand': hand_changes} if hand_changes else {}
+
+    def changes_from_events(self, data, now=None):
+        """Classify a gesture event, a list of them, or {'events': [...]}; returns (changes, samples used)"""
+        samples = parse_events(data, time.time() if now is None else now)
+        return self.classify(samples), len(samples)
+
+    def labels(self):
+        with self._lock:
+            return {hand: dict(tracker.labels) for hand, tracker in self.hands.items()}
+
+    def stats(self, recent=0):
+        with self._lock:
+            return {
+                'hands': {hand: tracker.snapshot(recent) for hand, tracker in self.hands.items()},
+                'samples': dict(self.outcomes)
+            }
+
+
+def is_gesture_event(data):
+    """True for messages in the raw ray format rather than pre-bucketed robot status"""
+    if isinstance(data, list):
+        return bool(data) and all(isinstance(item, dict) and 'rayDirection' in item for item in data)
+    return isinstance(data, dict) and ('rayDirection' in data or 'events' in data)
+
+
+def parse_events(data, now):
+    """(hand, (x, y) or None, confidence, timestamp) samples from gesture event JSON
+
+    Directions are normalized to unit length; a missing or zero-length ray
+    means the hand is not tracked. Timestamps may be ISO 8601 strings or
+    epoch seconds; events without one are stamped with now. Raises
+    ValueError for malformed events.
+    """
+    if isinstance(data, dict) and 'events' in data:
+        data = data['events']
+    if isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list):
+        raise ValueError("expected a gesture event or a list of them")
+    samples = []
+    for event in data:
+        if not isinstance(event, dict):
+            raise ValueError("gesture events must be objects")
+        hand = event.get('hand')
+        if hand not in HANDS:
+            raise ValueError(f"unknown hand: {hand!r}")
+        confidence = float(event.get('confidence', 1.0))
+        samples.append((hand, _direction(event.get('rayDirection')), confidence,
+                        parse_timestamp(event.get('timestamp'), now)))
+    return samples
+
+
+def _direction(ray):
+    if ray is None:
+        return None
+    if isinstance(ray, dict):
+        ray = (ray.get('x', 0.0), ray.get('y', 0.0), ray.get('z', 0.0))
+    if len(ray) != 3:
+        raise ValueError("rayDirection must have 3 components")
+    x, y, z = (float(c) for c in ray)
+    norm = math.sqrt(x * x + y * y + z * z)
+    if not norm or math.isnan(norm) or math.isinf(norm):
+        return None
+    return x / norm, y / norm
+
+
+def parse_timestamp(value, now):
+    """Epoch seconds from an ISO 8601 string, epoch seconds or JS epoch milliseconds (now if missing)"""
+    if value is None:
+        return now
+    if isinstance(value, (int, float)):
+        # Epoch milliseconds from JS Date.now(), or seconds
+        return value / 1000.0 if value > 1e11 else float(value)
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        raise ValueError(f"invalid timestamp: {value!r}") from None
@@ -0,0 +1,225 @@
+"""
+Prometheus-style metrics for the robot control backend
+Counters, gauges and fixed-bucket histograms cheap enough for the request
+path, rendered in the Prometheus text exposition format on /metrics.
+
+Every update carries its receive time (time.monotonic()) through the
+pipeline; each stage observes the time elapsed since then in
+STAGE_LATENCY, so the 'puback' stage is the full receive -> broker-ack latency.
+"""
+
+import threading
+from bisect import bisect_left
+
+# Seconds; dense below 100 ms where the latency budget lives
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Pipeline stages, in order
+STAGES = ('parse', 'merge', 'enqueue', 'publish', 'puback')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, optionally split by label values"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues):
+        return self._values.get(labelvalues, 0)
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = sorted(self._values.items()) or ([((), 0)] if not self.labelnames else [])
+        for labelvalues, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}')
+        return lines
+
+
+class Gauge(_Metric):
+    """Point-in-time value; either set directly or read from a callback at scrape time"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation):
+        super().__init__(name, documentation)
+        self._value = 0
+        self._function = None
+
+    def set(self, value):
+        self._value = value
+
+    def set_function(self, function):
+        self._function = function
+
+    def value(self):
+        if self._function is not None:
+            try:
+                return self._function()
+            except Exception:
+                return float('nan')
+        return self._value
+
+    def render(self):
+        return self.header() + [f'{self.name} {_format_value(float(self.value()))}']
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram; observe() is a bisect and three increments under a lock"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def _get_series(self, labelvalues):
+        series = self._series.get(labelvalues)
+        if series is None:
+            # [per-bucket counts (+Inf last), sum, count]
+            series = self._series.setdefault(labelvalues, [[0] * (len(self.buckets) + 1), 0.0, 0])
+        return series
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._get_series(labelvalues)
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            snapshot = sorted((key, (list(value[0]), value[1], value[2])) for key, value in self._series.items())
+        for labelvalues, (counts, total, count) in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames + ('le',), labelvalues + (_format_value(float(bound)),))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text format (version 0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_LATENCY = REGISTRY.register(Histogram(
+    'robot_stage_latency_seconds', 'Time from receiving an update until it reached each pipeline stage',
+    ('stage', 'lane')))
+UPDATES = REGISTRY.register(Counter(
+    'robot_updates_total', 'Robot state updates received', ('transport',)))
+GESTURE_SAMPLES = REGISTRY.register(Counter(
+    'robot_gesture_samples_total', 'Raw gesture samples classified, by outcome', ('outcome',)))
+BATCH_FRAMES = REGISTRY.register(Counter(
+    'robot_batch_frames_total', 'Frames received in batched updates, by result', ('result',)))
+WS_FRAMES = REGISTRY.register(Counter(
+    'robot_ws_frames_total', 'Sequenced WebSocket protocol frames received, by result', ('result',)))
+WS_ACKS = REGISTRY.register(Counter(
+    'robot_ws_acks_total', 'Cumulative acks sent to WebSocket protocol clients'))
+ADMISSION_SHED = REGISTRY.register(Counter(
+    'robot_admission_shed_total', 'Inbound updates refused by admission control', ('transport', 'reason')))
+ADMISSION_EXEMPT = REGISTRY.register(Counter(
+    'robot_admission_exempt_total', 'Stop/resume updates let through that admission control would have refused',
+    ('transport',)))
+BACKPRESSURE = REGISTRY.register(Gauge(
+    'robot_backpressure', '1 while the outbound backlog has the server shedding non-stop updates'))
+UPDATE_ERRORS = REGISTRY.register(Counter(
+    'robot_update_errors_total', 'Robot state updates rejected or failed', ('transport',)))
+MQTT_PUBLISHED = REGISTRY.register(Counter(
+    'robot_mqtt_published_total', 'Messages handed to the MQTT client', ('lane',)))
+MQTT_PUBLISH_FAILURES = REGISTRY.register(Counter(
+    'robot_mqtt_publish_failures_total', 'MQTT publish attempts that failed', ('lane',)))
+MQTT_JOURNALED = REGISTRY.register(Counter(
+    'robot_mqtt_journaled_total', 'Messages written to the outage journal instead of being published', ('lane',)))
+MQTT_REPLAYED = REGISTRY.register(Counter(
+    'robot_mqtt_replayed_total', 'Journaled messages published after the broker came back', ('lane',)))
+MQTT_JOURNAL_PENDING = REGISTRY.register(Gauge(
+    'robot_mqtt_journal_pending', 'Journaled messages waiting to be replayed'))
+MQTT_RECONNECTS = REGISTRY.register(Counter(
+    'robot_mqtt_reconnects_total', 'Successful MQTT connections after the first one'))
+MQTT_CONNECTED = REGISTRY.register(Gauge(
+    'robot_mqtt_connected', '1 while connected to the MQTT broker'))
+MQTT_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'robot_mqtt_queue_depth', 'Topics waiting in the latest-wins outbound queue'))
+TRANSPORT_MESSAGES = REGISTRY.register(Counter(
+    'robot_transport_messages_total', 'Robot commands per transport, by result (sent, failed, retransmitted, lost)',
+    ('transport', 'result')))
+TRANSPORT_RTT = REGISTRY.register(Histogram(
+    'robot_transport_rtt_seconds', 'Probe round trip of each robot transport', ('transport',)))
+TRANSPORT_SWITCHES = REGISTRY.register(Counter(
+    'robot_transport_switches_total', 'Times commands moved to another robot transport'))
+WS_CLIENTS = REGISTRY.register(Gauge(
+    'robot_ws_clients', 'Connected WebSocket clients'))
+ROBOTS = REGISTRY.register(Gauge(
+    'robot_sessions', 'Robots with state on this server'))
+CLUSTER_MESSAGES = REGISTRY.register(Counter(
+    'robot_cluster_messages_total', 'Cluster backplane messages, by direction (sent, received, stale)',
+    ('direction',)))
+CLUSTER_OWNER = REGISTRY.register(Gauge(
+    'robot_cluster_owner', '1 while this process owns MQTT publishing for the cluster'))
+CLUSTER_PEERS = REGISTRY.register(Gauge(
+    'robot_cluster_peers', 'Other cluster nodes heard from within the lease'))
+
+LANE_STATE = 'state'
+LANE_STOP = 'stop'
+
+
+def observe_stage(stage, ingest_time, now, lane=LANE_STATE):
+    """Record how long after ingest_time an update reached stage (no-op without a trace)"""
+    if ingest_time is not None:
+        STAGE_LATENCY.observe(now - ingest_time, stage, lane)
@@ -0,0 +1,191 @@
+"""
+MQTT v5 publishing (MQTT_VERSION=5)
+An MQTT5Session wraps one paho client and, for every publish:
+- replaces the topic string with a topic alias once the topic has been sent
+  with it on this connection (up to the broker's Topic Alias Maximum),
+- gives motion commands a message expiry interval, so the broker drops them
+  instead of delivering them late (stop topics never expire),
+- adds 'seq' (per topic) and 'ts' (sender clock, ms since the epoch) user
+  properties, so a robot can count gaps and ignore commands that are too old
+  (about 30 bytes a message, more than an alias saves on a short topic;
+  stamp=False leaves them out),
+- keeps unacknowledged publishes within the broker's Receive Maximum. Past
+  that, publish() is refused rather than queued inside paho, so commands wait
+  in the server's latest-wins queue, where newer ones replace them.
+
+Expiry intervals are whole seconds on the wire. max_age is the finer limit the
+sender applies itself: paho resends unacknowledged messages after a reconnect,
+and motion commands older than max_age are dropped instead of going out late.
+Robots apply the same limit with message_age().
+"""
+
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+from event_log import events
+
+PROTOCOL_V311 = '3.1.1'
+PROTOCOL_V5 = '5'
+
+
+def new_client(client_id, protocol=PROTOCOL_V311):
+    """paho client speaking protocol; v5 clients start clean on every connect (see MQTT5Session.connect_args)"""
+    if protocol == PROTOCOL_V5:
+        return mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5)
+    if protocol != PROTOCOL_V311:
+        raise ValueError(f"Unsupported MQTT version: {protocol}")
+    return mqtt.Client(client_id=client_id, clean_session=True)
+
+
+def is_stop_topic(topic):
+    return topic.endswith('/stop')
+
+
+def user_properties(properties):
+    """User properties of a received v5 message as a dict ({} for 3.1.1)"""
+    return dict(getattr(properties, 'UserProperty', None) or ())
+
+
+def message_age(properties, now=None):
+    """Seconds since the sender stamped the message ('ts'), or None without a stamp"""
+    stamp = user_properties(properties).get('ts')
+    if stamp is None:
+        return None
+    return (now if now is not None else time.time()) - int(stamp) / 1000.0
+
+
+class MQTT5Session:
+    """MQTT v5 publishing state for one paho client (created with new_client(..., PROTOCOL_V5))"""
+
+    def __init__(self, client, message_expiry=1, max_age=0.3, max_inflight=20, receive_maximum=100, stamp=True):
+        self.client = client
+        # Add the seq/ts user properties
+        self.stamp = stamp
+        # Seconds a motion command may wait at the broker (0: no expiry)
+        self.message_expiry = message_expiry
+        self.max_age = max_age
+        self.max_inflight = max_inflight
+        # Unacknowledged QoS 1/2 messages the broker may send us at once
+        self.receive_maximum = receive_maximum
+        # Limits the broker announced in its CONNACK
+        self.alias_maximum = 0
+        self.server_receive_maximum = None
+        self.published = 0
+        self.aliased = 0
+        self.topic_bytes_saved = 0
+        self.stale_dropped = 0
+        # topic -> alias on the current connection, topic -> last seq
+        self._aliases = {}
+        self._seq = {}
+        # mid -> when a motion command went to paho (mids wrap at 65535, which bounds this)
+        self._sent_at = {}
+        self._lock = threading.Lock()
+        self._set_window(max_inflight)
+
+    def connect_args(self):
+        """Keyword arguments for client.connect()"""
+        properties = Properties(PacketTypes.CONNECT)
+        properties.SessionExpiryInterval = 0
+        properties.ReceiveMaximum = self.receive_maximum
+        return {'clean_start': True, 'properties': properties}
+
+    def connected(self, properties):
+        """From on_connect after a successful CONNACK (before paho resends anything)"""
+        with self._lock:
+            previous = {alias: topic for topic, alias in self._aliases.items()}
+            self._aliases = {}
+            self.alias_maximum = getattr(properties, 'TopicAliasMaximum', 0)
+            self.server_receive_maximum = getattr(properties, 'ReceiveMaximum', 65535)
+        self._set_window(min(self.max_inflight, self.server_receive_maximum))
+        self._prune_resends(previous)
+
+    def _set_window(self, size):
+        # paho counts sent-but-unacked and waiting messages against the queue size: a full window refuses
+        self.client.max_inflight_messages_set(size)
+        self.client.max_queued_messages_set(size)
+
+    def _prune_resends(self, previous):
+        # paho resends what the last connection left unacknowledged and has no API to change that. Aliases
+        # died with that connection, so those messages get their topic back, and stale motion commands go.
+        now = time.monotonic()
+        dropped = 0
+        with self.client._out_message_mutex:
+            for mid, message in list(self.client._out_messages.items()):
+                properties = message.properties
+                if properties is None:
+                    continue
+                sent_at = self._sent_at.get(mid)
+                alias = getattr(properties, 'TopicAlias', None)
+                topic = message.topic or previous.get(alias)
+                if (sent_at is not None and now - sent_at > self.max_age) or not topic:
+                    del self.client._out_messages[mid]
+                    dropped += 1
+                    continue
+                if alias is not None:
+                    message.topic = topic.encode('utf-8')
+                    del properties.TopicAlias
+        if dropped:
+            self.stale_dropped += dropped
+            events.warning('mqtt.stale_dropped', "🗑️ Dropped stale motion commands instead of resending them",
+                           count=dropped, max_age=self.max_age)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        """client.publish() with alias, expiry and seq/ts properties; returns paho's MQTTMessageInfo"""
+        properties = Properties(PacketTypes.PUBLISH)
+        expires = bool(self.message_expiry) and not is_stop_topic(topic)
+        if expires:
+            properties.MessageExpiryInterval = self.message_expiry
+        with self._lock:
+            seq = self._seq.get(topic, 0) + 1
+            if self.stamp:
+                properties.UserProperty = ('seq', str(seq))
+                properties.UserProperty = ('ts', str(int(time.time() * 1000)))
+            wire_topic = topic
+            alias = self._aliases.get(topic) if qos > 0 else None
+            new_alias = None
+            if alias is not None:
+                wire_topic = ''
+            elif qos > 0 and len(self._aliases) < self.alias_maximum:
+                # QoS 0 bypasses paho's in-order queue, so only QoS 1/2 publishes use (and set up) aliases
+                new_alias = alias = len(self._aliases) + 1
+                self._aliases[topic] = alias
+            if alias is not None:
+                properties.TopicAlias = alias
+            # Under the lock: the publish that sets up an alias must be queued before the ones that use it
+            result = self.client.publish(wire_topic, payload, qos=qos, retain=retain, properties=properties)
+            if result.rc != mqtt.MQTT_ERR_SUCCESS and new_alias is not None:
+                del self._aliases[topic]
+            if result.rc != mqtt.MQTT_ERR_QUEUE_SIZE:
+                # Sent, or kept by paho for the next connection; a refused one never existed
+                self._seq[topic] = seq
+                # paho keeps QoS 1/2 messages (sent or not) for after a reconnect; see _prune_resends
+                if expires and qos > 0:
+                    self._sent_at[result.mid] = time.monotonic()
+                else:
+                    self._sent_at.pop(result.mid, None)
+        if result.rc == mqtt.MQTT_ERR_SUCCESS:
+            self.published += 1
+            if not wire_topic:
+                self.aliased += 1
+                self.topic_bytes_saved += len(topic.encode('utf-8'))
+        return result
+
+    def stats(self):
+        return {
+            'protocol': PROTOCOL_V5,
+            'message_expiry': self.message_expiry,
+            'max_age': self.max_age,
+            'stamp': self.stamp,
+            'max_inflight': self.max_inflight,
+            'broker_receive_maximum': self.server_receive_maximum,
+            'topic_alias_maximum': self.alias_maximum,
+            'aliases': len(self._aliases),
+            'published': self.published,
+            'aliased': self.aliased,
+            'topic_bytes_saved': self.topic_bytes_saved,
+            'stale_dropped': self.stale_dropped
+        }
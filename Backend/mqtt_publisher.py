@@ -0,0 +1,136 @@
+"""
+Outbound MQTT publisher stage
+Request handlers drop snapshots into a small queue keyed by topic and return
+straight away; a background worker publishes only the newest one per topic.
+Stop/resume transitions use a separate priority lane that is never coalesced
+and always goes out before any queued state snapshot.
+
+With an OutboundJournal attached, messages that fail to publish are written
+to disk instead of being retried from memory, and everything after them is
+journaled too until the backlog has been replayed, so order is preserved
+across an outage (and a restart). Replayed state snapshots are paced at
+replay_rate per second; journaled stop transitions are not. A journaled
+record is only consumed once the broker acknowledges it (at most
+replay_window in flight); one still unacknowledged after ack_timeout - e.g.
+handed to a connection that dropped - is sent again.
+
+The lanes themselves (see outbound_lanes.py) are shared with AsyncMQTTBridge;
+this module adds the worker thread that drives them.
+"""
+
+import threading
+import time
+
+from event_log import events
+from metrics import observe_stage, LANE_STOP
+from outbound_lanes import OutboundLanes
+
+
+class MQTTPublisher:
+    """Latest-wins, bounded outbound queue plus a priority lane, with a single publishing worker"""
+
+    def __init__(self, send, qos=1, max_topics=64, max_priority=1024, retry_interval=0.5, journal=None,
+                 replay_rate=200.0, replay_window=32, ack_timeout=5.0):
+        # send(topic, payload, qos) -> message id (truthy) on success, falsy on failure
+        self._send = send
+        self._lanes = OutboundLanes(qos, max_topics, max_priority, retry_interval, journal, replay_rate,
+                                    replay_window, ack_timeout)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        """Start the background worker (idempotent)"""
+        with self._cond:
+            if self._running:
+                return
+            self._lanes.open_journal()
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="mqtt-publisher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=2.0):
+        """Stop the worker after it finishes the message in flight"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+        with self._cond:
+            self._lanes.close_journal()
+
+    def submit(self, topic, payload, ingest_time=None):
+        """Queue payload for topic without blocking; returns False if it was dropped
+
+        ingest_time (time.monotonic() when the update arrived) traces it through
+        the publish and PUBACK stages.
+        """
+        with self._cond:
+            queued, ingest_time = self._lanes.submit(topic, payload, ingest_time)
+            if not queued:
+                return False
+            self._cond.notify()
+        observe_stage('enqueue', ingest_time, time.monotonic())
+        return True
+
+    def submit_priority(self, topic, payload, qos=1, ingest_time=None):
+        """Queue an urgent message ahead of everything else; never coalesced"""
+        with self._cond:
+            now = time.monotonic()
+            if not self._lanes.submit_priority(topic, payload, qos, ingest_time, now):
+                return False
+            self._cond.notify()
+        observe_stage('enqueue', ingest_time, now, LANE_STOP)
+        return True
+
+    def resume(self):
+        """The connection is back: retry now instead of waiting out the backoff"""
+        with self._cond:
+            self._lanes.resume()
+            self._cond.notify()
+
+    def acknowledge(self, mid):
+        """Called from the MQTT client's on_publish callback (PUBACK for QoS 1)"""
+        now = time.monotonic()
+        with self._cond:
+            if self._lanes.acknowledge(mid, now):
+                self._cond.notify()
+
+    def stats(self):
+        """Queue depth and counters for status endpoints"""
+        with self._cond:
+            return {'running': self._running, **self._lanes.stats()}
+
+    def backlog(self):
+        """(messages queued or awaiting their PUBACK, seconds the oldest of them has waited) for admission control"""
+        with self._cond:
+            return self._lanes.backlog(time.monotonic())
+
+    def _wait_for_work(self):
+        # Caller holds the lock; the next (urgent, message, record) to send, None once stopped
+        while self._running:
+            now = time.monotonic()
+            outgoing = self._lanes.next_send(now)
+            if outgoing is not None:
+                return outgoing
+            due = self._lanes.next_due(now)
+            self._cond.wait(max(0.0, due - now) if due is not None else None)
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                outgoing = self._wait_for_work()
+                if outgoing is None:
+                    return
+            topic, payload, qos, _ = outgoing[1]
+            mid = self._try_send(topic, payload, qos)
+            with self._cond:
+                self._lanes.sent(outgoing, mid, time.monotonic())
+
+    def _try_send(self, topic, payload, qos):
+        try:
+            return self._send(topic, payload, qos)
+        except Exception as e:
+            events.error('mqtt.publisher_error', "❌ MQTT publisher error", topic=topic, error=str(e))
+            return None
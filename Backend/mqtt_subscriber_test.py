@@ -1,13 +1,44 @@
 #!/usr/bin/env python3
 """
-Simple MQTT Subscriber Test Script
-Subscribes to the robot control topic and displays received messages
+MQTT Subscriber Test Script
+Subscribes to the robot control topics and keeps delivery statistics for
+everything it receives: message rate, inter-arrival times and jitter,
+sequence gaps and duplicates, and publish-to-receive latency. Every
+--interval seconds it prints one summary line, and a full summary on exit.
+--print also shows each message (fine for a few a second, far too slow for the
+control rate), and --samples FILE writes one CSV row per message for offline
+analysis.
+
+Messages are not decoded for the statistics. The sequence number and send
+time come from the 'seq'/'ts' user properties under MQTT 5 (MQTT_VERSION=5 on
+the server, --mqtt-version 5 here), else from the bin1 header, else from the
+"version"/"timestamp" fields of the JSON text (stop transitions carry both,
+JSON states only a version). The server sends only the latest state per
+topic, so gaps in the state version include updates it merged; gaps in the
+v5 seq are messages lost. Latency compares the server's clock with ours, so
+both need to be synchronized (NTP).
+
+Commands are JSON or the compact bin1 frames (see wire_format.py). With
+--format bin1 it announces on robot/format that it decodes bin1, so the server
+switches the topic to binary; the announcement is cleared again on exit. With
+--udp PORT it also takes the commands the server sends straight over the LAN
+(ROBOT_UDP, see transports.py).
 """
 
-import paho.mqtt.client as mqtt
+import argparse
 import json
+import os
+import re
+import threading
+import time
+import paho.mqtt.client as mqtt
 from datetime import datetime
 
+from wire_format import FORMAT_JSON, FORMAT_BINARY, MAGIC_V1, capability_topic, decode, peek_stamp
+from transports import UDPReceiver
+from outbound_lanes import LatencyWindow
+from mqtt5 import new_client, user_properties, PROTOCOL_V311, PROTOCOL_V5
+
 # MQTT Configuration (same as your app.py)
 HIVEMQ_HOST = "a2016a11d3614243aeb27bda75dd2204.s1.eu.hivemq.cloud"
 HIVEMQ_PORT = 8883
@@ -15,82 +46,350 @@ MQTT_TOPIC = "robot"
 HIVEMQ_USERNAME = "kushal"
 HIVEMQ_PASSWORD = "Hackthenorth25"
 
-def on_connect(client, userdata, flags, rc):
-    """Callback when MQTT client connects"""
-    if rc == 0:
-        print(f"✅ Connected to HiveMQ Cloud!")
-        print(f"📡 Subscribing to topic: {MQTT_TOPIC}")
-        client.subscribe(MQTT_TOPIC)
-        print("🔄 Waiting for messages... (Press Ctrl+C to exit)")
-        print("-" * 50)
-    else:
-        print(f"❌ Failed to connect, return code {rc}")
+# Sequence and send time in JSON commands, found without parsing them
+JSON_VERSION = re.compile(rb'"version":\s*(\d+)')
+JSON_TIMESTAMP = re.compile(rb'"timestamp":\s*(\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)')
+# Sequence numbers skipped within this distance can still arrive late (reordered)
+REORDER_WINDOW = 1024
+SAMPLES_HEADER = "received,topic,bytes,seq,sent,latency_ms\n"
 
-def on_message(client, userdata, msg):
-    """Callback when a message is received"""
+
+def stamp(payload, properties=None):
+    """(sequence, send time in seconds since the epoch) of a message; either may be None"""
+    props = user_properties(properties)
+    if 'seq' in props:
+        sent = props.get('ts')
+        return int(props['seq']), int(sent) / 1000.0 if sent is not None else None
+    header = peek_stamp(payload)
+    if header is not None:
+        return header
+    if payload[:1] != b'{':
+        return None, None
+    version = JSON_VERSION.search(payload)
+    sent = JSON_TIMESTAMP.search(payload)
+    return (int(version.group(1)) if version else None,
+            float(sent.group(1)) if sent else None)
+
+
+class StreamStats:
+    """Delivery statistics for the run so far and the current reporting interval"""
+
+    def __init__(self, late_after=0.3, samples=None):
+        self.late_after = late_after
+        self.samples = samples
+        self.started = time.time()
+        self.total = 0
+        self.bytes = 0
+        self.stamped = 0
+        self.late = 0
+        # Sequence numbers never received, received twice, received after a later one
+        self.gaps = 0
+        self.duplicates = 0
+        self.reordered = 0
+        # The sender started over (a server restart resets the state version)
+        self.resets = 0
+        # RFC 3550 interarrival jitter: smoothed change in transit time, seconds
+        self.jitter = 0.0
+        self.latency = LatencyWindow(100000)
+        self.interarrival = LatencyWindow(100000)
+        self._last_arrival = None
+        self._last_transit = None
+        # topic -> [last sequence, set of skipped sequences that may still arrive]
+        self._sequences = {}
+        self._lock = threading.Lock()
+        self._interval_started = self.started
+        self._interval_total = 0
+        self._interval_latency = LatencyWindow(100000)
+        self._interval_interarrival = LatencyWindow(100000)
+
+    def add(self, topic, payload, properties=None):
+        """Record one received message (called from the MQTT and UDP receive threads)"""
+        received = time.time()
+        sequence, sent = stamp(payload, properties)
+        with self._lock:
+            self.total += 1
+            self.bytes += len(payload)
+            self._interval_total += 1
+            if self._last_arrival is not None:
+                gap = received - self._last_arrival
+                self.interarrival.add(gap)
+                self._interval_interarrival.add(gap)
+            self._last_arrival = received
+            latency = None
+            if sent is not None:
+                latency = received - sent
+                self.stamped += 1
+                self.latency.add(latency)
+                self._interval_latency.add(latency)
+                if latency > self.late_after:
+                    self.late += 1
+                if self._last_transit is not None:
+                    self.jitter += (abs(latency - self._last_transit) - self.jitter) / 16
+                self._last_transit = latency
+            if sequence is not None:
+                self._track(topic, sequence)
+            if self.samples is not None:
+                self.samples.write(f"{received:.6f},{topic},{len(payload)},{'' if sequence is None else sequence},"
+                                   f"{'' if sent is None else f'{sent:.6f}'},"
+                                   f"{'' if latency is None else f'{latency * 1000:.3f}'}\n")
+
+    def _track(self, topic, sequence):
+        # Caller holds the lock
+        state = self._sequences.get(topic)
+        if state is None:
+            self._sequences[topic] = [sequence, set()]
+            return
+        last, skipped = state
+        if sequence > last:
+            missing = sequence - last - 1
+            if missing:
+                self.gaps += missing
+                if missing <= REORDER_WINDOW:
+                    skipped.update(range(last + 1, sequence))
+                if len(skipped) > REORDER_WINDOW:
+                    state[1] = {s for s in skipped if s > sequence - REORDER_WINDOW}
+            state[0] = sequence
+        elif sequence in skipped:
+            skipped.discard(sequence)
+            self.gaps -= 1
+            self.reordered += 1
+        elif last - sequence > REORDER_WINDOW:
+            self.resets += 1
+            self._sequences[topic] = [sequence, set()]
+        else:
+            self.duplicates += 1
+
+    def interval(self):
+        """Summary of the messages since the last call, then start a new interval"""
+        now = time.time()
+        with self._lock:
+            elapsed = now - self._interval_started
+            result = {
+                'rate': round(self._interval_total / elapsed, 1) if elapsed > 0 else 0.0,
+                'total': self.total,
+                'jitter_ms': round(self.jitter * 1000, 3) if self.stamped else None,
+                'gaps': self.gaps,
+                'duplicates': self.duplicates,
+                'reordered': self.reordered,
+                'late': self.late
+            }
+            interarrival, latency = self._interval_interarrival, self._interval_latency
+            self._interval_started = now
+            self._interval_total = 0
+            self._interval_latency = LatencyWindow(100000)
+            self._interval_interarrival = LatencyWindow(100000)
+        # Sorted outside the lock so the receive threads are not held up
+        result['interarrival'] = interarrival.summary()
+        result['latency'] = latency.summary()
+        return result
+
+    def summary(self):
+        with self._lock:
+            elapsed = time.time() - self.started
+            return {
+                'seconds': round(elapsed, 3),
+                'messages': self.total,
+                'bytes': self.bytes,
+                'rate': round(self.total / elapsed, 1) if elapsed > 0 else 0.0,
+                'interarrival': self.interarrival.summary(),
+                'latency': self.latency.summary(),
+                'stamped': self.stamped,
+                'late': self.late,
+                'jitter_ms': round(self.jitter * 1000, 3) if self.stamped else None,
+                'gaps': self.gaps,
+                'duplicates': self.duplicates,
+                'reordered': self.reordered,
+                'resets': self.resets,
+                'topics': len(self._sequences)
+            }
+
+
+def format_interval(stats):
+    """One compact line for an interval summary"""
+    interarrival = stats['interarrival']
+    latency = stats['latency']
+    line = f"📊 {datetime.now().strftime('%H:%M:%S')} {stats['rate']:8.1f} msg/s  total {stats['total']}"
+    if 'p50_ms' in interarrival:
+        line += f"  gap p50 {interarrival['p50_ms']:.2f} p99 {interarrival['p99_ms']:.2f} ms"
+    if 'p50_ms' in latency:
+        line += (f"  latency p50 {latency['p50_ms']:.1f} p99 {latency['p99_ms']:.1f}"
+                 f" max {latency['max_ms']:.1f} ms  jitter {stats['jitter_ms']:.2f} ms")
+    line += f"  missing {stats['gaps']} dup {stats['duplicates']} reord {stats['reordered']} late {stats['late']}"
+    return line
+
+
+def print_message(topic, payload, via=''):
+    """Decode and show one command (the --print output)"""
     try:
         # Get timestamp
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        # Parse JSON message
-        payload = json.loads(msg.payload.decode())
-        
+
+        # Parse the message (JSON or a bin1 frame)
+        data = decode(payload)
+        wire = FORMAT_BINARY if payload[:1] == bytes([MAGIC_V1]) else FORMAT_JSON
+
         # Pretty print the received data
-        print(f"📨 [{timestamp}] Received robot state:")
-        print(f"   🛑 Stopped: {payload.get('stopped', 'N/A')}")
-        
-        if 'hand' in payload:
-            hand = payload['hand']
+        kind = 'stop transition' if topic.endswith('/stop') else 'robot state'
+        print(f"📨 [{timestamp}] Received {kind}{via} ({wire}, {len(payload)} bytes, version {data.get('version', 'N/A')}):")
+        print(f"   🛑 Stopped: {data.get('stopped', 'N/A')}")
+
+        if 'hand' in data:
+            hand = data['hand']
             if 'right' in hand:
                 right = hand['right']
                 print(f"   👉 Right Hand: {right.get('horizontal', 'N/A')} (Active: {right.get('active', 'N/A')})")
-            
+
             if 'left' in hand:
                 left = hand['left']
                 print(f"   👈 Left Hand: H:{left.get('horizontal', 'N/A')} V:{left.get('vertical', 'N/A')} (Active: {left.get('active', 'N/A')})")
-        
+
         print("-" * 50)
-        
-    except json.JSONDecodeError:
-        print(f"📨 [{timestamp}] Raw message: {msg.payload.decode()}")
+
+    except ValueError:
+        print(f"📨 [{timestamp}] Raw message: {payload!r}")
         print("-" * 50)
     except Exception as e:
         print(f"❌ Error processing message: {e}")
 
-def on_disconnect(client, userdata, rc):
+
+def on_connect(client, userdata, flags, rc, properties=None):
+    """Callback when MQTT client connects"""
+    if rc == 0:
+        topics = [userdata['topic'], f"{userdata['topic']}/stop"]
+        print(f"✅ Connected to {userdata['host']}!")
+        print(f"📡 Subscribing to topics: {', '.join(topics)}")
+        client.subscribe([(topic, userdata['qos']) for topic in topics])
+        if userdata['format'] == FORMAT_BINARY:
+            # Retained, so the server picks it up whenever it (re)connects
+            print(f"🔧 Announcing wire format: {FORMAT_BINARY},{FORMAT_JSON}")
+            client.publish(capability_topic(userdata['topic']), f"{FORMAT_BINARY},{FORMAT_JSON}", qos=1, retain=True)
+        print("🔄 Waiting for messages... (Press Ctrl+C to exit)")
+        print("-" * 50)
+    else:
+        print(f"❌ Failed to connect, return code {rc}")
+
+
+def on_message(client, userdata, msg):
+    """Callback when a message is received"""
+    userdata['stats'].add(msg.topic, msg.payload, getattr(msg, 'properties', None))
+    if userdata['print']:
+        print_message(msg.topic, msg.payload)
+
+
+def on_disconnect(client, userdata, rc, properties=None):
     """Callback when MQTT client disconnects"""
-    print("🔌 Disconnected from HiveMQ Cloud")
+    print(f"🔌 Disconnected from {userdata['host']}")
+
+
+def print_summary(summary):
+    latency = summary['latency']
+    interarrival = summary['interarrival']
+    print("-" * 50)
+    print(f"📈 {summary['messages']} messages ({summary['bytes']} bytes) in {summary['seconds']:.1f} s, "
+          f"{summary['rate']} msg/s over {summary['topics']} topics")
+    if 'p50_ms' in interarrival:
+        print(f"   ⏱️ Inter-arrival p50 {interarrival['p50_ms']} ms, p99 {interarrival['p99_ms']} ms, "
+              f"max {interarrival['max_ms']} ms")
+    if 'p50_ms' in latency:
+        print(f"   📡 Latency ({summary['stamped']} stamped) p50 {latency['p50_ms']} ms, p99 {latency['p99_ms']} ms, "
+              f"max {latency['max_ms']} ms, jitter {summary['jitter_ms']} ms, late {summary['late']}")
+    print(f"   🔢 Sequence: {summary['gaps']} missing, {summary['duplicates']} duplicates, "
+          f"{summary['reordered']} reordered, {summary['resets']} restarts")
+
 
 def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=HIVEMQ_HOST)
+    parser.add_argument('--port', type=int, default=HIVEMQ_PORT)
+    parser.add_argument('--no-tls', action='store_true', help="plain TCP (a local broker)")
+    parser.add_argument('--username', default=HIVEMQ_USERNAME)
+    parser.add_argument('--password', default=HIVEMQ_PASSWORD)
+    parser.add_argument('--mqtt-version', choices=[PROTOCOL_V311, PROTOCOL_V5], default=PROTOCOL_V311)
+    parser.add_argument('--topic', default=MQTT_TOPIC, help="state topic; its /stop topic is subscribed as well")
+    parser.add_argument('--qos', type=int, choices=[0, 1], default=1)
+    parser.add_argument('--format', choices=[FORMAT_JSON, FORMAT_BINARY], default=FORMAT_JSON,
+                        help="wire format to ask the server for")
+    parser.add_argument('--udp', type=int, metavar='PORT',
+                        help="also take commands sent straight over UDP on PORT (the server's ROBOT_UDP)")
+    parser.add_argument('--interval', type=float, default=1.0, help="seconds between summary lines")
+    parser.add_argument('--late-ms', type=float, default=300.0, help="latency above which a message counts as late")
+    parser.add_argument('--print', action='store_true', help="also show every message")
+    parser.add_argument('--samples', metavar='FILE', help="write one CSV row per message to FILE")
+    parser.add_argument('--duration', type=float, help="stop after this many seconds")
+    parser.add_argument('--output', metavar='FILE', help="write the final summary as JSON to FILE")
+    args = parser.parse_args()
+
+    samples = None
+    if args.samples:
+        samples = open(args.samples, 'w', buffering=1 << 20)
+        samples.write(SAMPLES_HEADER)
+    stats = StreamStats(late_after=args.late_ms / 1000.0, samples=samples)
+
+    receiver = None
+    if args.udp:
+        # Answers the server's pings and acks; copies and retransmissions are dropped
+        def on_datagram(topic, payload):
+            stats.add(topic, payload)
+            if args.print:
+                print_message(topic, payload, ' over UDP')
+
+        receiver = UDPReceiver(on_datagram, port=args.udp).start()
+        print(f"📶 Listening for LAN commands on UDP port {receiver.port}")
+
     print("🚀 Starting MQTT Subscriber Test")
-    print(f"🌐 Connecting to: {HIVEMQ_HOST}:{HIVEMQ_PORT}")
-    
+    print(f"🌐 Connecting to: {args.host}:{args.port} (MQTT {args.mqtt_version})")
+
     # Create MQTT client
-    client = mqtt.Client()
-    
-    # Set credentials
-    client.username_pw_set(HIVEMQ_USERNAME, HIVEMQ_PASSWORD)
-    
-    # Set TLS for secure connection
-    client.tls_set()
-    
+    client = new_client(f"robot_subscriber_test_{os.getpid()}", args.mqtt_version)
+    client.user_data_set({'format': args.format, 'host': args.host, 'topic': args.topic, 'qos': args.qos,
+                          'stats': stats, 'print': args.print})
+
+    # Set credentials and TLS for secure connection
+    if not args.no_tls:
+        client.username_pw_set(args.username, args.password)
+        client.tls_set()
+
     # Set callbacks
     client.on_connect = on_connect
     client.on_message = on_message
     client.on_disconnect = on_disconnect
-    
+
     try:
-        # Connect to broker
-        client.connect(HIVEMQ_HOST, HIVEMQ_PORT, 60)
-        
-        # Start the loop to process network traffic
-        client.loop_forever()
-        
+        # Connect to broker and process network traffic on paho's thread
+        client.connect(args.host, args.port, 60)
+        client.loop_start()
+
+        deadline = time.monotonic() + args.duration if args.duration else None
+        next_report = time.monotonic() + args.interval
+        while deadline is None or time.monotonic() < deadline:
+            time.sleep(max(0.0, min(next_report, deadline or next_report) - time.monotonic()))
+            if time.monotonic() >= next_report:
+                print(format_interval(stats.interval()), flush=True)
+                next_report += args.interval
+
     except KeyboardInterrupt:
         print("\n👋 Stopping subscriber...")
-        client.disconnect()
     except Exception as e:
         print(f"❌ Connection error: {e}")
 
+    if args.format != FORMAT_JSON:
+        # Clear the retained announcement so the server goes back to its default format
+        cleared = client.publish(capability_topic(args.topic), b'', qos=1, retain=True)
+        if cleared.rc == mqtt.MQTT_ERR_SUCCESS:
+            cleared.wait_for_publish(1)
+    client.disconnect()
+    client.loop_stop()
+    if receiver is not None:
+        receiver.stop()
+    if samples is not None:
+        samples.close()
+
+    summary = stats.summary()
+    print_summary(summary)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"📄 Summary written to {args.output}")
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
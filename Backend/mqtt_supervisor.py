@@ -0,0 +1,165 @@
+"""
+MQTT connection supervisor
+Owns the broker connection for the threaded (Flask) server: connects in the
+background, drives paho's network loop, and after a failed attempt or a
+dropped connection tries again with jittered exponential backoff. Nothing
+else calls connect()/reconnect() - publishers only look at `connected` and
+leave unsent messages to the publisher's retry/journal - so the server can
+start serving before the broker answers, and an outage costs one connection
+attempt per backoff step instead of one per publish.
+"""
+
+import random
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from event_log import events
+
+STATE_IDLE = 'idle'
+STATE_CONNECTING = 'connecting'
+STATE_CONNECTED = 'connected'
+STATE_BACKOFF = 'backoff'
+STATE_STOPPED = 'stopped'
+
+
+class Backoff:
+    """Exponential backoff with 'equal jitter': each delay is uniform in [d/2, d], d doubling up to maximum"""
+
+    def __init__(self, initial=0.5, maximum=30.0, multiplier=2.0, rng=None):
+        self.initial = initial
+        self.maximum = maximum
+        self.multiplier = multiplier
+        self.attempts = 0
+        self._random = rng or random.Random()
+
+    def next(self):
+        ceiling = min(self.maximum, self.initial * self.multiplier ** self.attempts)
+        self.attempts += 1
+        return ceiling / 2 + self._random.random() * ceiling / 2
+
+    def reset(self):
+        self.attempts = 0
+
+
+class MQTTSupervisor:
+    """Background thread that keeps a paho client connected"""
+
+    def __init__(self, client, host, port, keepalive=60, backoff=None, on_connect=None, on_disconnect=None,
+                 session=None):
+        self.client = client
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.backoff = backoff or Backoff()
+        # MQTT5Session of a v5 client (mqtt5.py): connect options and the CONNACK's limits
+        self.session = session
+        self._on_connect_callback = on_connect
+        self._on_disconnect_callback = on_disconnect
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+
+        self.state = STATE_IDLE
+        self.connected = False
+        self.attempts = 0
+        self.connections = 0
+        self.last_error = None
+        self._started_at = None
+        self._connected_at = None
+        self._next_attempt_at = None
+        self.time_to_first_connect = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start connecting in the background; returns immediately"""
+        if self._thread is None:
+            self._started_at = time.monotonic()
+            self._thread = threading.Thread(target=self._run, name="mqtt-supervisor", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        self._stop.set()
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+        if self._thread:
+            self._thread.join(timeout)
+        self.state = STATE_STOPPED
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.state = STATE_CONNECTING
+            self.attempts += 1
+            try:
+                # DNS, TCP and TLS handshake; the CONNACK arrives through loop() below
+                self.client.connect(self.host, self.port, self.keepalive,
+                                    **(self.session.connect_args() if self.session else {}))
+            except Exception as e:
+                self.last_error = str(e)
+                events.warning('mqtt.connect_failed', "❌ MQTT connection failed", error=str(e),
+                               attempt=self.attempts)
+                self._wait_before_retry()
+                continue
+
+            # Drive the connection until it drops (a refused CONNACK drops it too)
+            while not self._stop.is_set():
+                if self.client.loop(timeout=0.5) != mqtt.MQTT_ERR_SUCCESS:
+                    break
+            if not self._stop.is_set():
+                self._wait_before_retry()
+
+    def _wait_before_retry(self):
+        delay = self.backoff.next()
+        self.state = STATE_BACKOFF
+        self._next_attempt_at = time.monotonic() + delay
+        events.info('mqtt.backoff', "🔄 Retrying MQTT connection", delay=round(delay, 2),
+                    attempt=self.backoff.attempts)
+        self._stop.wait(delay)
+        self._next_attempt_at = None
+
+    # -- paho callbacks (supervisor thread) --------------------------------------
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc == 0:
+            if self.session is not None:
+                self.session.connected(properties)
+            self.connected = True
+            self.state = STATE_CONNECTED
+            self.connections += 1
+            self.last_error = None
+            self._connected_at = time.time()
+            if self.time_to_first_connect is None:
+                self.time_to_first_connect = time.monotonic() - self._started_at
+            self.backoff.reset()
+        else:
+            self.last_error = mqtt.connack_string(rc)
+        if self._on_connect_callback:
+            self._on_connect_callback(client, userdata, flags, rc)
+
+    def _on_disconnect(self, client, userdata, rc, properties=None):
+        self.connected = False
+        if self.state == STATE_CONNECTED:
+            self.state = STATE_CONNECTING
+        if rc != 0:
+            self.last_error = mqtt.error_string(rc)
+        if self._on_disconnect_callback:
+            self._on_disconnect_callback(client, userdata, rc)
+
+    def stats(self):
+        next_attempt = self._next_attempt_at
+        return {
+            'state': self.state,
+            'connected': self.connected,
+            'attempts': self.attempts,
+            'connections': self.connections,
+            'last_error': self.last_error,
+            'connected_since': self._connected_at if self.connected else None,
+            'next_attempt_in': round(max(0.0, next_attempt - time.monotonic()), 3) if next_attempt else None,
+            'time_to_first_connect': (round(self.time_to_first_connect, 3)
+                                      if self.time_to_first_connect is not None else None),
+            'mqtt5': self.session.stats() if self.session else None
+        }
@@ -0,0 +1,428 @@
+"""
+Store-and-forward journal for outbound MQTT messages
+While the broker is unreachable, messages that could not be published are
+appended to a memory-mapped file instead of being lost, and replayed in order
+once the connection is back.
+
+File layout: a fixed header followed by append-only records
+
+    header  magic b'RBJ1' | u32 format version | u64 capacity
+    record  u32 body length | u32 crc32(body) | u8 live flag | body
+    body    u8 kind | u8 qos | u16 topic length | f64 wall time | topic | payload
+
+A record is written body first and its length/crc last, with a zero length
+already in place after it, so a crash mid-append leaves a torn record that
+fails its crc and ends the scan on the next open. Consuming (or superseding)
+a record only clears its one-byte live flag.
+
+Replay is at-least-once: the publisher marks a record sent, and consumes it
+only when the broker acknowledges it; unacknowledged records are offered
+again after a timeout.
+
+Compaction:
+  'latest' - a newer state snapshot for a topic tombstones the older one,
+             so at most one motion record per topic is ever replayed
+  'none'   - every state snapshot is kept and replayed
+Stop transitions are never compacted or dropped: if the file is full they
+evict the oldest state snapshots, and the file grows only if nothing else
+can go. Journaled stops replay ahead of journaled snapshots, so a stop (or a
+live stop sent past the backlog, see supersede_states) tombstones the
+snapshots of the same robot written before it: those carry the state from
+before the stop and replaying them after it would undo it.
+"""
+
+import itertools
+import mmap
+import os
+import struct
+import time
+import zlib
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory lock, one server per journal file is up to the operator
+    fcntl = None
+
+KIND_STATE = 0
+KIND_STOP = 1
+
+COMPACTION_LATEST = 'latest'
+COMPACTION_NONE = 'none'
+
+STOP_SUFFIX = '/stop'
+
+MAGIC = b'RBJ1'
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct('<4sIQ')
+_RECORD = struct.Struct('<IIB')
+_BODY = struct.Struct('<BBHd')
+HEADER_SIZE = 64
+_LIVE_OFFSET = 8  # position of the live flag inside a record header
+
+
+def state_topic_of(stop_topic):
+    """State topic of the robot a stop topic belongs to ('robot/arm/stop' -> 'robot/arm')"""
+    if stop_topic.endswith(STOP_SUFFIX):
+        return stop_topic[:-len(STOP_SUFFIX)]
+    return None
+
+
+class JournalLocked(Exception):
+    """Another process already has this journal open"""
+
+
+class JournalRecord:
+    __slots__ = ('key', 'offset', 'size', 'kind', 'qos', 'topic', 'timestamp', 'sent_at')
+
+    def __init__(self, offset, size, kind, qos, topic, timestamp):
+        self.key = None
+        self.offset = offset
+        self.size = size
+        self.kind = kind
+        self.qos = qos
+        self.topic = topic
+        self.timestamp = timestamp
+        # time.monotonic() of the last replay attempt still waiting for its ack
+        self.sent_at = None
+
+
+class OutboundJournal:
+    """Bounded, crash-safe append-only journal with latest-state compaction
+
+    Not thread-safe: owned by one publisher worker (stats() may be read anywhere).
+    """
+
+    def __init__(self, path, capacity=4 * 1024 * 1024, compaction=COMPACTION_LATEST, sync_interval=1.0):
+        if compaction not in (COMPACTION_LATEST, COMPACTION_NONE):
+            raise ValueError(f"unknown compaction mode {compaction!r}")
+        self.path = path
+        self.capacity = max(capacity, HEADER_SIZE + 4096)
+        self.compaction = compaction
+        self.sync_interval = sync_interval
+        self._file = None
+        self._map = None
+        self._tail = HEADER_SIZE
+        # Live records in append order, one lane per kind, keyed by a
+        # sequence number that (unlike the offset) survives compaction
+        self._keys = itertools.count()
+        self._stops = OrderedDict()
+        self._states = OrderedDict()
+        self._latest_state = {}
+        self._last_sync = 0.0
+        self._dirty = False
+
+        self.appended = 0
+        self.consumed = 0
+        self.superseded = 0
+        self.evicted = 0
+        self.dropped = 0
+        self.compactions = 0
+        self.recovered = 0
+        self.torn = 0
+
+    # -- lifecycle -----------------------------------------------------------
+
+    def open(self):
+        """Map the file (creating it if needed) and recover any live records"""
+        if self._map is not None:
+            return self
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, 'a+b')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._file.close()
+                self._file = None
+                raise JournalLocked(self.path)
+        self._map_file()
+        self.recovered = len(self)
+        return self
+
+    def close(self):
+        if self._map is None:
+            return
+        self._map.flush()
+        self._map.close()
+        self._map = None
+        self._file.close()
+        self._file = None
+
+    def _map_file(self):
+        size = os.fstat(self._file.fileno()).st_size
+        fresh = size < HEADER_SIZE
+        if fresh:
+            self._file.truncate(self.capacity)
+            size = self.capacity
+        self._map = mmap.mmap(self._file.fileno(), size)
+        magic, version, _ = _HEADER.unpack_from(self._map, 0)
+        if fresh or magic != MAGIC or version != FORMAT_VERSION:
+            # New file or one we cannot read: start empty rather than replay garbage
+            self._map[:HEADER_SIZE] = bytes(HEADER_SIZE)
+            _HEADER.pack_into(self._map, 0, MAGIC, FORMAT_VERSION, size)
+            self._map[HEADER_SIZE:HEADER_SIZE + _RECORD.size] = bytes(_RECORD.size)
+        self.capacity = size
+        self._scan()
+
+    def _scan(self):
+        self._stops.clear()
+        self._states.clear()
+        self._latest_state.clear()
+        offset = HEADER_SIZE
+        while offset + _RECORD.size <= self.capacity:
+            length, crc, live = _RECORD.unpack_from(self._map, offset)
+            end = offset + _RECORD.size + length
+            if length < _BODY.size or end > self.capacity:
+                break
+            body = self._map[offset + _RECORD.size:end]
+            if zlib.crc32(body) != crc:
+                self.torn += 1
+                break
+            if live:
+                kind, qos, topic_len, timestamp = _BODY.unpack_from(body, 0)
+                topic = body[_BODY.size:_BODY.size + topic_len].decode('utf-8')
+                self._index(JournalRecord(offset, end - offset, kind, qos, topic, timestamp))
+            offset = end
+        self._tail = offset
+        if len(self) == 0:
+            self._reset()
+
+    # -- writing -------------------------------------------------------------
+
+    def append(self, topic, payload, kind=KIND_STATE, qos=1, timestamp=None):
+        """Journal one message; returns False only if a state snapshot could not fit"""
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        topic_bytes = topic.encode('utf-8')
+        body_header = _BODY.pack(kind, qos, len(topic_bytes), timestamp or time.time())
+        length = len(body_header) + len(topic_bytes) + len(payload)
+        size = _RECORD.size + length
+        if not self._make_room(size, kind):
+            self.dropped += 1
+            return False
+
+        offset = self._tail
+        end = offset + size
+        start = offset + _RECORD.size
+        # Terminator first, then the body, then the header that makes it valid
+        if end + _RECORD.size <= self.capacity:
+            self._map[end:end + _RECORD.size] = bytes(_RECORD.size)
+        self._map[start:start + len(body_header)] = body_header
+        self._map[start + len(body_header):start + len(body_header) + len(topic_bytes)] = topic_bytes
+        self._map[end - len(payload):end] = payload
+        crc = zlib.crc32(self._map[start:end])
+        _RECORD.pack_into(self._map, offset, length, crc, 1)
+        self._tail = end
+        self.appended += 1
+
+        record = JournalRecord(offset, size, kind, qos, topic, None)
+        previous = self._index(record)
+        if previous is not None:
+            self._kill(previous)
+            self.superseded += 1
+        if kind == KIND_STOP:
+            self._supersede_states(topic, record.key)
+        self._dirty = True
+        self.sync(force=kind == KIND_STOP)
+        return True
+
+    def supersede_states(self, stop_topic):
+        """Tombstone every journaled snapshot of the robot a stop was just sent live for"""
+        if self._states and self._supersede_states(stop_topic, None):
+            self._dirty = True
+            if not self:
+                self._reset()
+            self.sync(force=True)
+
+    def _supersede_states(self, stop_topic, before_key):
+        # Snapshots journaled before the stop (all of them when before_key is None)
+        topic = state_topic_of(stop_topic)
+        if topic is None:
+            return 0
+        stale = [record for key, record in self._states.items()
+                 if record.topic == topic and (before_key is None or key < before_key)]
+        for record in stale:
+            del self._states[record.key]
+            if self._latest_state.get(topic) is record:
+                del self._latest_state[topic]
+            self._kill(record)
+        self.superseded += len(stale)
+        return len(stale)
+
+    def _index(self, record):
+        # Returns the state record this one supersedes, if any
+        record.key = next(self._keys)
+        if record.kind == KIND_STOP:
+            self._stops[record.key] = record
+            return None
+        self._states[record.key] = record
+        if self.compaction != COMPACTION_LATEST:
+            return None
+        previous = self._latest_state.get(record.topic)
+        self._latest_state[record.topic] = record
+        if previous is not None:
+            del self._states[previous.key]
+        return previous
+
+    def _kill(self, record):
+        self._map[record.offset + _LIVE_OFFSET] = 0
+
+    def _make_room(self, size, kind):
+        if self._tail + size <= self.capacity:
+            return True
+        if self._live_bytes() < self._tail - HEADER_SIZE:
+            self.compact()
+            if self._tail + size <= self.capacity:
+                return True
+        # Full of live records: the oldest motion snapshots are the least useful.
+        # Free an extra eighth of the file so this does not repeat on every append
+        needed = self._tail + size - self.capacity + self.capacity // 8
+        while needed > 0 and self._states:
+            _, record = self._states.popitem(last=False)
+            if self._latest_state.get(record.topic) is record:
+                del self._latest_state[record.topic]
+            self._kill(record)
+            self.evicted += 1
+            needed -= record.size
+        self.compact()
+        if self._tail + size <= self.capacity:
+            return True
+        if kind != KIND_STOP:
+            return False
+        # Stop transitions are never dropped
+        self._grow(max(self.capacity * 2, self._tail + size + HEADER_SIZE))
+        return True
+
+    def _live_bytes(self):
+        return sum(r.size for r in self._stops.values()) + sum(r.size for r in self._states.values())
+
+    def _grow(self, capacity):
+        self._map.flush()
+        self._map.close()
+        self._file.truncate(capacity)
+        self._map = mmap.mmap(self._file.fileno(), capacity)
+        _HEADER.pack_into(self._map, 0, MAGIC, FORMAT_VERSION, capacity)
+        self.capacity = capacity
+
+    def compact(self):
+        """Rewrite the live records to the front of the file (atomically, via rename)"""
+        live = sorted(list(self._stops.values()) + list(self._states.values()), key=lambda r: r.offset)
+        if not live:
+            self._reset()
+            return
+        temp_path = self.path + '.compact'
+        with open(temp_path, 'w+b') as temp:
+            temp.truncate(self.capacity)
+            with mmap.mmap(temp.fileno(), self.capacity) as target:
+                _HEADER.pack_into(target, 0, MAGIC, FORMAT_VERSION, self.capacity)
+                offset = HEADER_SIZE
+                moved = []
+                for record in live:
+                    target[offset:offset + record.size] = self._map[record.offset:record.offset + record.size]
+                    moved.append(offset)
+                    offset += record.size
+                if offset + _RECORD.size <= self.capacity:
+                    target[offset:offset + _RECORD.size] = bytes(_RECORD.size)
+                target.flush()
+            os.fsync(temp.fileno())
+
+        self._map.close()
+        os.replace(temp_path, self.path)
+        old_file = self._file
+        self._file = open(self.path, 'r+b')
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        old_file.close()
+        self._map = mmap.mmap(self._file.fileno(), self.capacity)
+        # Same record objects (and keys, and in-flight marks), new positions
+        for record, new_offset in zip(live, moved):
+            record.offset = new_offset
+        self._tail = offset
+        self.compactions += 1
+
+    def _reset(self):
+        # Nothing live: start writing from the front again
+        self._tail = HEADER_SIZE
+        self._map[HEADER_SIZE:HEADER_SIZE + _RECORD.size] = bytes(_RECORD.size)
+        self._dirty = True
+
+    def sync(self, force=False):
+        """msync the map at most every sync_interval seconds (always when forced)"""
+        if not self._dirty:
+            return
+        now = time.monotonic()
+        if force or now - self._last_sync >= self.sync_interval:
+            self._map.flush()
+            self._last_sync = now
+            self._dirty = False
+
+    # -- replay --------------------------------------------------------------
+
+    def __len__(self):
+        return len(self._stops) + len(self._states)
+
+    def peek(self, now=None, resend_after=None):
+        """Next record to replay: journaled stop transitions first, then state snapshots, each in order
+
+        Snapshots older than a stop of the same robot are gone by then (superseded),
+        so letting the stops go first never replays a robot's state from before its stop.
+
+        With now/resend_after, records sent less than resend_after seconds ago
+        (still waiting for their ack) are skipped.
+        """
+        for lane in (self._stops, self._states):
+            for record in lane.values():
+                if record.sent_at is None or now is None or now - record.sent_at >= resend_after:
+                    return record
+        return None
+
+    def next_resend(self, resend_after):
+        """Earliest time an unacknowledged record is due to be offered again (None if none are)"""
+        sent = [r.sent_at for lane in (self._stops, self._states) for r in lane.values() if r.sent_at is not None]
+        return min(sent) + resend_after if sent else None
+
+    def has_stops(self):
+        return bool(self._stops)
+
+    def payload(self, record):
+        start = record.offset + _RECORD.size
+        kind, qos, topic_len, timestamp = _BODY.unpack_from(self._map, start)
+        record.timestamp = timestamp
+        return bytes(self._map[start + _BODY.size + topic_len:record.offset + record.size])
+
+    def consume(self, record):
+        """Mark a replayed record as done; False if it already was (or was superseded meanwhile)"""
+        lane = self._stops if record.kind == KIND_STOP else self._states
+        if lane.get(record.key) is not record:
+            return False
+        del lane[record.key]
+        if self._latest_state.get(record.topic) is record:
+            del self._latest_state[record.topic]
+        self._kill(record)
+        self.consumed += 1
+        self._dirty = True
+        if not self:
+            self._reset()
+        self.sync()
+        return True
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'compaction': self.compaction,
+            'capacity_bytes': self.capacity,
+            'used_bytes': self._tail - HEADER_SIZE,
+            'pending': len(self._stops) + len(self._states),
+            'pending_stops': len(self._stops),
+            'appended': self.appended,
+            'consumed': self.consumed,
+            'superseded': self.superseded,
+            'evicted': self.evicted,
+            'dropped': self.dropped,
+            'compactions': self.compactions,
+            'recovered': self.recovered,
+            'torn': self.torn
+        }
@@ -0,0 +1,421 @@
+"""
+Outbound lane scheduling shared by MQTTPublisher and AsyncMQTTBridge
+Queued state snapshots (latest wins per topic), the stop priority lane,
+store and forward through an optional OutboundJournal, replay pacing and the
+PUBACK bookkeeping, without any I/O or locking of its own. The front end
+holds its lock (or runs on one event loop), asks next_send() what to publish,
+publishes it, reports the outcome with sent() and, when nothing is due,
+waits until next_due() or until a submit or an ack wakes it.
+"""
+
+import time
+from collections import OrderedDict, deque
+
+from event_log import events
+from metrics import (observe_stage, MQTT_PUBLISHED, MQTT_PUBLISH_FAILURES, MQTT_JOURNALED, MQTT_REPLAYED,
+                     LANE_STATE, LANE_STOP)
+from outbound_journal import KIND_STATE, KIND_STOP, JournalLocked
+
+
+class LatencyWindow:
+    """Recent latency samples (seconds) with percentile summaries in ms"""
+
+    def __init__(self, size=1000):
+        self._samples = deque(maxlen=size)
+        self.count = 0
+        self.max = 0.0
+        self.last = None
+
+    def add(self, seconds):
+        self._samples.append(seconds)
+        self.count += 1
+        self.last = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def summary(self):
+        samples = sorted(self._samples)
+        if not samples:
+            return {'count': self.count}
+
+        def pct(p):
+            return round(samples[min(len(samples) - 1, int(len(samples) * p))] * 1000, 3)
+
+        return {
+            'count': self.count,
+            'p50_ms': pct(0.50),
+            'p99_ms': pct(0.99),
+            'max_ms': round(self.max * 1000, 3),
+            'last_ms': round(self.last * 1000, 3)
+        }
+
+
+class OutboundLanes:
+    """What to publish next, and what became of what was published
+
+    Messages are (topic, payload, qos, ingest_time) tuples; next_send() returns
+    (urgent, message, record), where record is the JournalRecord being
+    replayed or None for a live message. Callers hold their lock.
+    """
+
+    def __init__(self, qos=1, max_topics=64, max_priority=1024, retry_interval=0.5, journal=None,
+                 replay_rate=200.0, replay_window=32, ack_timeout=5.0):
+        self.journal = journal
+        self.qos = qos
+        self.max_topics = max_topics
+        self.max_priority = max_priority
+        self._retry_interval = retry_interval
+        self._replay_interval = 1.0 / replay_rate if replay_rate else 0.0
+        self._replay_window = replay_window
+        self._ack_timeout = ack_timeout
+        self._pending = OrderedDict()
+        self._priority = deque()
+        # After a failed publish the lane backs off until these (monotonic) times
+        self._retry_at = 0.0
+        self._priority_retry_at = 0.0
+        self._journal_retry_at = 0.0
+        self._replay_at = 0.0
+
+        self._submitted = 0
+        self._coalesced = 0
+        self._dropped = 0
+        self._published = 0
+        self._failed = 0
+        self._last_publish_time = None
+
+        # Published mids waiting for their PUBACK: mid -> (ingest_time, urgent)
+        self._awaiting_ack = OrderedDict()
+        self._early_acks = deque(maxlen=64)
+
+        # Priority lane: ingest -> publish call, and ingest -> PUBACK (matched by mid)
+        self._priority_published = 0
+        self._priority_failed = 0
+        self.priority_send_latency = LatencyWindow()
+        self.priority_ack_latency = LatencyWindow()
+
+        # Journal replay: how old (wall clock) messages were when they finally went out
+        self._replayed = 0
+        self.replay_age = LatencyWindow()
+        # Replayed mids waiting for their PUBACK: mid -> JournalRecord
+        self._replay_inflight = OrderedDict()
+
+    # -- journal lifecycle -----------------------------------------------------
+
+    def open_journal(self):
+        """Open the journal, or carry on in memory without it; True if it holds a backlog to replay"""
+        if self.journal is None:
+            return False
+        try:
+            self.journal.open()
+        except (JournalLocked, OSError) as e:
+            events.error('mqtt.journal_unavailable', "❌ MQTT journal unavailable, buffering in memory",
+                         path=self.journal.path, error=repr(e))
+            self.journal = None
+            return False
+        if not len(self.journal):
+            return False
+        events.warning('mqtt.journal_recovered', "💾 Replaying journaled MQTT messages",
+                       pending=len(self.journal), path=self.journal.path)
+        return True
+
+    def close_journal(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    # -- submitting ------------------------------------------------------------
+
+    def submit(self, topic, payload, ingest_time=None):
+        """Queue payload for topic, replacing one not yet sent; (queued, ingest_time it is timed from)"""
+        self._submitted += 1
+        queued = self._pending.get(topic)
+        if queued is not None:
+            # An older snapshot for this topic has not gone out yet - replace it,
+            # but keep timing from the oldest update still waiting
+            self._coalesced += 1
+            if queued[1] is not None:
+                ingest_time = queued[1] if ingest_time is None else min(ingest_time, queued[1])
+        elif len(self._pending) >= self.max_topics:
+            self._dropped += 1
+            return False, ingest_time
+        self._pending[topic] = (payload, ingest_time)
+        return True, ingest_time
+
+    def submit_priority(self, topic, payload, qos, ingest_time, now):
+        """Queue an urgent message ahead of everything else; False if max_priority are already waiting"""
+        if len(self._priority) >= self.max_priority:
+            return False
+        self._priority.append((topic, payload, qos, ingest_time or now))
+        # A fresh stop is worth an immediate attempt even while backing off
+        self._priority_retry_at = 0.0
+        self._journal_retry_at = 0.0
+        return True
+
+    def resume(self):
+        """The connection is back: retry now instead of waiting out the backoff"""
+        self._retry_at = self._priority_retry_at = self._journal_retry_at = 0.0
+
+    # -- scheduling ------------------------------------------------------------
+
+    def next_send(self, now):
+        """The (urgent, message, record) due for publishing now, or None
+
+        Live messages that must queue up behind the journal backlog are
+        journaled on the way.
+        """
+        while (self._priority and now >= self._priority_retry_at) or (self._pending and now >= self._retry_at):
+            urgent, message = self._next_message(now)
+            if not self._must_journal(urgent):
+                return urgent, message, None
+            # Keep order behind the backlog still on disk
+            self._journal_message(urgent, message)
+        journal_at = self._journal_ready(now)
+        if journal_at is None or now < journal_at:
+            return None
+        record = self.journal.peek(now, self._ack_timeout)
+        if record is None:
+            return None
+        return record.kind == KIND_STOP, (record.topic, self.journal.payload(record), record.qos, None), record
+
+    def next_due(self, now):
+        """Monotonic time the next lane comes due (retry backoff, replay pacing, ack timeout); None if idle"""
+        deadlines = []
+        if self._priority:
+            deadlines.append(self._priority_retry_at)
+        if self._pending:
+            deadlines.append(self._retry_at)
+        journal_at = self._journal_ready(now)
+        if journal_at is not None:
+            deadlines.append(journal_at)
+        return min(deadlines) if deadlines else None
+
+    def _next_message(self, now):
+        # A lane is due; a due priority message preempts queued snapshots, one
+        # backing off must not be resent early
+        if self._priority and now >= self._priority_retry_at:
+            return True, self._priority.popleft()
+        topic, (payload, ingest_time) = self._pending.popitem(last=False)
+        return False, (topic, payload, self.qos, ingest_time)
+
+    def _journal_ready(self, now):
+        # When may the next journaled record be replayed
+        if self.journal is None or not len(self.journal):
+            return None
+        record = self.journal.peek(now, self._ack_timeout)
+        if record is None or len(self._replay_inflight) >= self._replay_window:
+            # Waiting for acks (acknowledge() wakes the front end) or for one to time out
+            return self.journal.next_resend(self._ack_timeout)
+        if record.kind == KIND_STOP:
+            return self._journal_retry_at
+        return max(self._journal_retry_at, self._replay_at)
+
+    # -- outcomes --------------------------------------------------------------
+
+    def sent(self, outgoing, mid, now):
+        """Record the outcome of publishing what next_send() returned; mid is falsy if it failed"""
+        urgent, message, record = outgoing
+        if record is not None:
+            self._replay_sent(record, mid, now)
+        elif urgent:
+            self._priority_sent(message, mid, now)
+        elif mid:
+            topic, payload, qos, ingest_time = message
+            self._published += 1
+            self._last_publish_time = time.time()
+            MQTT_PUBLISHED.inc(LANE_STATE)
+            self._trace_published(mid, qos, ingest_time, False, now)
+        else:
+            topic, payload, qos, ingest_time = message
+            self._failed += 1
+            MQTT_PUBLISH_FAILURES.inc(LANE_STATE)
+            if self.journal is not None:
+                self._journal_message(False, message)
+            elif topic not in self._pending:
+                # Put it back unless a newer snapshot arrived in the meantime
+                self._pending[topic] = (payload, ingest_time)
+                self._pending.move_to_end(topic, last=False)
+            self._retry_at = now + self._retry_interval
+            self._journal_retry_at = self._retry_at
+
+    def _priority_sent(self, message, mid, now):
+        topic, payload, qos, ingest_time = message
+        if not mid:
+            self._priority_failed += 1
+            MQTT_PUBLISH_FAILURES.inc(LANE_STOP)
+            # Stop transitions are never dropped: retry them first (from disk when journaling)
+            if self.journal is not None:
+                self._journal_message(True, message)
+                self._journal_retry_at = now + self._retry_interval
+            else:
+                self._priority.appendleft(message)
+            self._priority_retry_at = now + self._retry_interval
+            # Snapshots wait too: they must not overtake the stop, and the link is down for them as well
+            self._retry_at = max(self._retry_at, self._priority_retry_at)
+            return
+
+        self._priority_published += 1
+        self._last_publish_time = time.time()
+        self.priority_send_latency.add(now - ingest_time)
+        MQTT_PUBLISHED.inc(LANE_STOP)
+        self._trace_published(mid, qos, ingest_time, True, now)
+        if self.journal is not None:
+            # It went out ahead of any journaled motion: that motion must not follow and undo it
+            self.journal.supersede_states(topic)
+
+    def _replay_sent(self, record, mid, now):
+        urgent = record.kind == KIND_STOP
+        lane = LANE_STOP if urgent else LANE_STATE
+        if not mid:
+            MQTT_PUBLISH_FAILURES.inc(lane)
+            if urgent:
+                self._priority_failed += 1
+            else:
+                self._failed += 1
+            self._journal_retry_at = now + self._retry_interval
+            return
+        self._last_publish_time = time.time()
+        MQTT_PUBLISHED.inc(lane)
+        if urgent:
+            self._priority_published += 1
+        else:
+            self._published += 1
+            # Pace the motion backlog so it cannot flood the robot
+            self._replay_at = now + self._replay_interval
+        if record.qos == 0 or self._take_early_ack(mid) is not None:
+            self._replay_acked(record)
+            return
+        record.sent_at = now
+        self._replay_inflight[mid] = record
+        if len(self._replay_inflight) > self.max_priority:
+            self._replay_inflight.popitem(last=False)
+
+    def acknowledge(self, mid, now):
+        """PUBACK for mid; True if it acknowledged a replayed record (the replay window moved)"""
+        record = self._replay_inflight.pop(mid, None)
+        if record is not None:
+            self._replay_acked(record)
+            return True
+        traced = self._awaiting_ack.pop(mid, None)
+        if traced is None:
+            # The ack can beat the front end back from publishing; remember it briefly
+            self._early_acks.append((mid, now))
+        else:
+            self._record_ack(traced, now)
+        return False
+
+    def _trace_published(self, mid, qos, ingest_time, urgent, now):
+        observe_stage('publish', ingest_time, now, LANE_STOP if urgent else LANE_STATE)
+        if qos == 0 or ingest_time is None:
+            return
+        acked_at = self._take_early_ack(mid)
+        if acked_at is not None:
+            self._record_ack((ingest_time, urgent), acked_at)
+            return
+        self._awaiting_ack[mid] = (ingest_time, urgent)
+        if len(self._awaiting_ack) > self.max_priority:
+            # Acks lost to a disconnect; forget the oldest
+            self._awaiting_ack.popitem(last=False)
+
+    def _take_early_ack(self, mid):
+        for index, (acked_mid, acked_at) in enumerate(self._early_acks):
+            if acked_mid == mid:
+                del self._early_acks[index]
+                return acked_at
+        return None
+
+    def _record_ack(self, traced, acked_at):
+        ingest_time, urgent = traced
+        observe_stage('puback', ingest_time, acked_at, LANE_STOP if urgent else LANE_STATE)
+        if urgent:
+            self.priority_ack_latency.add(acked_at - ingest_time)
+
+    # -- store and forward -----------------------------------------------------
+
+    def _must_journal(self, urgent):
+        # A live stop may only overtake journaled state snapshots (as it would
+        # in memory), never journaled stops
+        if self.journal is None or not len(self.journal):
+            return False
+        return self.journal.has_stops() if urgent else True
+
+    def _journal_message(self, urgent, message):
+        topic, payload, qos, _ = message
+        lane = LANE_STOP if urgent else LANE_STATE
+        if self.journal.append(topic, payload, KIND_STOP if urgent else KIND_STATE, qos):
+            MQTT_JOURNALED.inc(lane)
+        else:
+            self._dropped += 1
+            events.warning('mqtt.journal_full', "⚠️ MQTT journal full, dropped state snapshot", topic=topic)
+
+    def journal_queued(self):
+        """Move everything still queued to the journal, in order (no-op without one), e.g. before a restart"""
+        if self.journal is None:
+            return
+        while self._priority:
+            self._journal_message(True, self._priority.popleft())
+        while self._pending:
+            topic, (payload, ingest_time) = self._pending.popitem(last=False)
+            self._journal_message(False, (topic, payload, self.qos, ingest_time))
+
+    def _replay_acked(self, record):
+        # A resent record may be acked twice; count it once
+        if self.journal is None or not self.journal.consume(record):
+            return
+        self._replayed += 1
+        self.replay_age.add(max(0.0, time.time() - record.timestamp))
+        MQTT_REPLAYED.inc(LANE_STOP if record.kind == KIND_STOP else LANE_STATE)
+        if not len(self.journal):
+            events.info('mqtt.journal_drained', "💾 MQTT journal replayed", replayed=self._replayed)
+
+    # -- status ----------------------------------------------------------------
+
+    def stats(self):
+        """Queue depth and counters for status endpoints"""
+        return {
+            'queue_depth': len(self._pending),
+            'max_topics': self.max_topics,
+            'submitted': self._submitted,
+            'coalesced': self._coalesced,
+            'dropped': self._dropped,
+            'published': self._published,
+            'failed': self._failed,
+            'last_publish_time': self._last_publish_time,
+            'priority': {
+                'queue_depth': len(self._priority),
+                'max_priority': self.max_priority,
+                'published': self._priority_published,
+                'failed': self._priority_failed,
+                'awaiting_ack': sum(1 for _, urgent in self._awaiting_ack.values() if urgent),
+                'ingest_to_publish': self.priority_send_latency.summary(),
+                'ingest_to_puback': self.priority_ack_latency.summary()
+            },
+            'journal': self._journal_stats()
+        }
+
+    def _journal_stats(self):
+        if self.journal is None:
+            return None
+        stats = self.journal.stats()
+        stats['replayed'] = self._replayed
+        stats['in_flight'] = len(self._replay_inflight)
+        stats['replay_age'] = self.replay_age.summary()
+        return stats
+
+    def backlog(self, now):
+        """(messages queued or awaiting their PUBACK, seconds the oldest of them has waited)
+
+        Mids older than ack_timeout count as lost (their acks went with a dropped
+        connection) rather than as backlog.
+        """
+        oldest = now
+        if self._pending:
+            ingest_time = next(iter(self._pending.values()))[1]
+            if ingest_time is not None:
+                oldest = min(oldest, ingest_time)
+        if self._priority:
+            oldest = min(oldest, self._priority[0][3])
+        awaiting = [ingest_time for ingest_time, _ in self._awaiting_ack.values()
+                    if now - ingest_time < self._ack_timeout]
+        if awaiting:
+            oldest = min(oldest, awaiting[0])
+        return len(self._pending) + len(self._priority) + len(awaiting), now - oldest
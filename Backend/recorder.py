@@ -0,0 +1,229 @@
+"""
+Traffic recorder
+Appends every inbound frame (HTTP status, batch and gesture bodies, WebSocket
+messages) and every outbound MQTT command to a file of fixed-size records, so
+an incident or a real load pattern can be fed back through the pipeline later
+(benchmarks/bench_replay.py). Off unless app.py --record / RECORD_PATH is set.
+
+File layout, little-endian, every slot RECORD_SIZE bytes:
+
+    header  magic b'RBR1' | u16 format version | u16 record size | f64 wall time at start
+            (zero padded to one slot)
+    record  u8 kind | u8 source | u16 chunk length | u32 payload length | u32 channel
+            | u64 ns since start | chunk (zero padded)
+
+A payload is key + b'\\0' + body, the key being the robot id (inbound) or the
+topic (outbound). Payloads longer than one chunk continue in the following
+slots with kind CONTINUATION. channel is the WebSocket client id (0 for HTTP
+and MQTT). A torn last slot after a crash is simply ignored by the reader.
+
+The calling thread only packs its slots and appends them to an in-memory
+buffer; a background thread writes the buffer out every FLUSH_INTERVAL (or
+sooner when it fills up). If the
+writer falls behind by more than max_pending bytes, new records are dropped
+and counted rather than blocking a request.
+"""
+
+import atexit
+import struct
+import threading
+import time
+
+from event_log import events
+
+MAGIC = b'RBR1'
+FORMAT_VERSION = 1
+RECORD_SIZE = 128
+
+KIND_INBOUND = 1
+KIND_OUTBOUND = 2
+KIND_CONTINUATION = 3
+
+# Source codes; 'ws_binary' is a binary WebSocket message, 'state'/'stop' the MQTT lanes
+SOURCES = ('http', 'batch', 'gesture', 'ws', 'ws_binary', 'state', 'stop')
+_SOURCE_CODES = {name: code for code, name in enumerate(SOURCES)}
+
+_HEADER = struct.Struct('<4sHHd')
+_RECORD = struct.Struct('<BBHIIQ')
+CHUNK_SIZE = RECORD_SIZE - _RECORD.size
+
+FLUSH_INTERVAL = 0.2
+
+
+class Recorder:
+    """Append-only recorder with a buffered background writer; a no-op until open() is called"""
+
+    def __init__(self):
+        self.path = None
+        self._file = None
+        self._lock = threading.Lock()
+        self._pending = []
+        self._pending_bytes = 0
+        self._thread = None
+        self._wake = threading.Event()
+        self._start_ns = 0
+        self.max_bytes = 0
+        self.max_pending = 0
+        self.records = 0
+        self.written = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self):
+        return self._file is not None
+
+    def open(self, path, max_bytes=256 * 1024 * 1024, max_pending=8 * 1024 * 1024):
+        """Start recording to path (truncated); records stop once the file would exceed max_bytes"""
+        self.close()
+        f = open(path, 'wb')
+        header = _HEADER.pack(MAGIC, FORMAT_VERSION, RECORD_SIZE, time.time())
+        f.write(header.ljust(RECORD_SIZE, b'\0'))
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_pending = max_pending
+        self.written = RECORD_SIZE
+        self._start_ns = time.perf_counter_ns()
+        self._wake.clear()
+        self._file = f
+        self._thread = threading.Thread(target=self._run, name="recorder-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        events.info('recorder.started', "⏺️ Recording inbound frames and outbound commands", path=path)
+
+    def close(self):
+        f = self._file
+        if f is None:
+            return
+        self._file = None
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(2.0)
+        self._flush(f)
+        f.close()
+        events.info('recorder.stopped', "⏹️ Recording stopped", path=self.path, records=self.records,
+                    dropped=self.dropped)
+
+    # -- recording (any thread, hot path) --------------------------------------
+
+    def inbound(self, source, key, payload, channel=0):
+        if self._file is not None:
+            self._append(KIND_INBOUND, source, key, payload, channel)
+
+    def outbound(self, source, topic, payload):
+        if self._file is not None:
+            self._append(KIND_OUTBOUND, source, topic, payload, 0)
+
+    def _append(self, kind, source, key, payload, channel):
+        elapsed = time.perf_counter_ns() - self._start_ns
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        data = key.encode('utf-8') + b'\0' + (payload or b'')
+        size = len(data)
+        chunk = data[:CHUNK_SIZE]
+        slots = [_RECORD.pack(kind, _SOURCE_CODES[source], len(chunk), size, channel, elapsed)
+                 + chunk.ljust(CHUNK_SIZE, b'\0')]
+        for offset in range(CHUNK_SIZE, size, CHUNK_SIZE):
+            chunk = data[offset:offset + CHUNK_SIZE]
+            slots.append(_RECORD.pack(KIND_CONTINUATION, 0, len(chunk), size, channel, elapsed)
+                         + chunk.ljust(CHUNK_SIZE, b'\0'))
+        length = len(slots) * RECORD_SIZE
+        with self._lock:
+            if (self._pending_bytes + length > self.max_pending
+                    or self.written + self._pending_bytes + length > self.max_bytes):
+                self.dropped += 1
+                return
+            self._pending.extend(slots)
+            self._pending_bytes += length
+            self.records += 1
+            if self._pending_bytes > self.max_pending // 4:
+                # Bursts: write out early rather than wait for the next interval
+                self._wake.set()
+
+    # -- writer ----------------------------------------------------------------
+
+    def _run(self):
+        while self._file is not None:
+            self._wake.wait(FLUSH_INTERVAL)
+            self._wake.clear()
+            f = self._file
+            if f is not None:
+                self._flush(f)
+
+    def _flush(self, f):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._pending_bytes = 0
+        if pending:
+            data = b''.join(pending)
+            try:
+                f.write(data)
+                f.flush()
+            except (OSError, ValueError):
+                self.dropped += len(pending)
+                return
+            self.written += len(data)
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'path': self.path,
+            'records': self.records,
+            'bytes_written': self.written,
+            'pending_bytes': self._pending_bytes,
+            'dropped': self.dropped,
+            'max_bytes': self.max_bytes
+        }
+
+
+class Record:
+    __slots__ = ('kind', 'source', 'channel', 'time', 'key', 'payload')
+
+    def __init__(self, kind, source, channel, time, key, payload):
+        self.kind = kind
+        self.source = source
+        self.channel = channel
+        self.time = time
+        self.key = key
+        self.payload = payload
+
+
+def read_recording(path):
+    """(header dict, list of Record) from a recording; Record.time is seconds since the start"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < RECORD_SIZE:
+        raise ValueError("not a recording: file too short")
+    magic, version, record_size, started = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("not a recording: bad magic")
+    if version != FORMAT_VERSION or record_size < _RECORD.size:
+        raise ValueError(f"unsupported recording format {version} (record size {record_size})")
+    chunk_size = record_size - _RECORD.size
+    records = []
+    offset = record_size
+    end = len(data) - (len(data) - record_size) % record_size
+    while offset < end:
+        kind, source, length, size, channel, elapsed = _RECORD.unpack_from(data, offset)
+        if kind not in (KIND_INBOUND, KIND_OUTBOUND):
+            # Continuation without its first slot
+            offset += record_size
+            continue
+        chunks = [data[offset + _RECORD.size:offset + _RECORD.size + length]]
+        received = len(chunks[0])
+        offset += record_size
+        while received < size and offset < end:
+            length = min(_RECORD.unpack_from(data, offset)[2], chunk_size)
+            chunks.append(data[offset + _RECORD.size:offset + _RECORD.size + length])
+            received += length
+            offset += record_size
+        body = b''.join(chunks)
+        if len(body) < size:
+            break  # torn tail
+        key, _, payload = body.partition(b'\0')
+        records.append(Record(kind, SOURCES[source] if source < len(SOURCES) else str(source), channel,
+                              elapsed / 1e9, key.decode('utf-8', 'replace'), payload))
+    return {'version': version, 'record_size': record_size, 'started': started, 'records': len(records)}, records
+
+
+# Shared by both servers; app.py opens it when --record / RECORD_PATH is set
+recording = Recorder()
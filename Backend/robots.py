@@ -0,0 +1,185 @@
+"""
+Per-robot sessions
+One server can drive a fleet: every robot id gets its own state store (and
+lock), WebSocket hub, MQTT topics and publish bookkeeping, so updates to one
+robot never contend with or get broadcast to another. A single fleet control
+loop ticks every session at the configured rate.
+
+The default robot keeps the original topics ("robot", "robot/stop") and the
+original routes (/api/robot-status, /ws, ...); other robots are addressed as
+/api/robots/<id>/... and /ws/<id>, and publish to robot/<id>.
+"""
+
+import re
+import threading
+
+from control_loop import ControlLoop
+from gesture_classifier import GestureClassifier
+from batch_ingest import SequenceTracker
+from state_store import RobotStateStore, DEFAULT_ROBOT_STATE
+from wire_format import CAPABILITY_SUFFIX
+
+DEFAULT_ROBOT_ID = 'default'
+
+# Robot ids end up in MQTT topics, so no '/', '+', '#' or whitespace
+_ROBOT_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+# robot/<id> must not land on a topic the server already uses: robot/stop is the
+# default robot's stop topic, robot/format its capability topic (which the server
+# subscribes to), and the probe/cluster names are kept for the transport probe and
+# cluster channels
+RESERVED_ROBOT_IDS = frozenset({'stop', CAPABILITY_SUFFIX, 'probe', 'cluster', 'robot-probe', 'robot-cluster'})
+
+
+class UnknownRobot(KeyError):
+    pass
+
+
+class InvalidRobotId(UnknownRobot):
+    """The id can never name a robot (bad characters or reserved)"""
+
+
+class FleetFull(Exception):
+    pass
+
+
+def valid_robot_id(robot_id):
+    return (bool(robot_id) and _ROBOT_ID.match(robot_id) is not None
+            and robot_id.lower() not in RESERVED_ROBOT_IDS)
+
+
+def state_topic(base_topic, robot_id):
+    return base_topic if robot_id == DEFAULT_ROBOT_ID else f"{base_topic}/{robot_id}"
+
+
+def stop_topic(base_topic, base_stop_topic, robot_id):
+    return base_stop_topic if robot_id == DEFAULT_ROBOT_ID else f"{base_topic}/{robot_id}/stop"
+
+
+class RobotSession:
+    """Everything owned by a single robot"""
+
+    def __init__(self, robot_id, topic, stop_topic, hub, publish, publish_urgent, gestures=None):
+        self.robot_id = robot_id
+        self.topic = topic
+        self.stop_topic = stop_topic
+        self.state_store = RobotStateStore(DEFAULT_ROBOT_STATE)
+        self.ws_hub = hub
+        self.control_loop = ControlLoop(
+            self.state_store,
+            lambda payload, ingest_time=None: publish(self, payload, ingest_time),
+            publish_urgent=lambda version, changes, ingest_time=None: publish_urgent(self, version, changes,
+                                                                                    ingest_time))
+        # Raw pointing rays -> direction labels (only changes reach the state store)
+        self.gestures = gestures or GestureClassifier()
+        # Highest client seq applied per client session by batch ingestion (stale frames are rejected)
+        self.sequence = SequenceTracker()
+        # Server-specific change notification (the ASGI app keeps an asyncio.Event here)
+        self.state_changed = None
+
+    def summary(self):
+        return {
+            'robot_id': self.robot_id,
+            'topic': self.topic,
+            'stop_topic': self.stop_topic,
+            'version': self.state_store.version,
+            'ws_clients': len(self.ws_hub)
+        }
+
+
+class RobotRegistry:
+    """Robot id -> RobotSession; lookups are lock-free, only creating a session takes the lock"""
+
+    def __init__(self, hub_factory, publish, publish_urgent, base_topic, base_stop_topic, max_robots=1024,
+                 gesture_factory=GestureClassifier):
+        # publish(session, payload, ingest_time) / publish_urgent(session, version, changes, ingest_time)
+        self._hub_factory = hub_factory
+        self._gesture_factory = gesture_factory
+        self._publish = publish
+        self._publish_urgent = publish_urgent
+        self._base_topic = base_topic
+        self._base_stop_topic = base_stop_topic
+        self.max_robots = max_robots
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._on_commit = None
+        self.get(DEFAULT_ROBOT_ID)
+
+    @property
+    def default(self):
+        return self._sessions[DEFAULT_ROBOT_ID]
+
+    def get(self, robot_id, create=True):
+        """Session for robot_id; raises InvalidRobotId, UnknownRobot (not created yet) or FleetFull"""
+        session = self._sessions.get(robot_id)
+        if session is not None:
+            return session
+        if not valid_robot_id(robot_id):
+            raise InvalidRobotId(robot_id)
+        if not create:
+            raise UnknownRobot(robot_id)
+        with self._lock:
+            session = self._sessions.get(robot_id)
+            if session is None:
+                if len(self._sessions) >= self.max_robots:
+                    raise FleetFull(robot_id)
+                session = RobotSession(robot_id, state_topic(self._base_topic, robot_id),
+                                       stop_topic(self._base_topic, self._base_stop_topic, robot_id),
+                                       self._hub_factory(), self._publish, self._publish_urgent,
+                                       self._gesture_factory())
+                self._watch(session)
+                self._sessions[robot_id] = session
+        return session
+
+    def set_on_commit(self, on_commit):
+        """Call on_commit(session, version, delta, origin) for every state version of every robot"""
+        with self._lock:
+            self._on_commit = on_commit
+            for session in self._sessions.values():
+                self._watch(session)
+
+    def _watch(self, session):
+        # Caller holds the lock
+        on_commit = self._on_commit
+        if on_commit is not None:
+            session.state_store.on_commit = lambda version, delta, origin: on_commit(session, version, delta, origin)
+
+    def sessions(self):
+        return list(self._sessions.values())
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def ws_clients(self):
+        return sum(len(session.ws_hub) for session in self.sessions())
+
+    def summary(self):
+        return [session.summary() for session in self.sessions()]
+
+
+class FleetControlLoop(ControlLoop):
+    """One fixed-rate loop (thread or asyncio task) ticking every robot's ControlLoop"""
+
+    def __init__(self, registry, rate_hz=50.0, jitter_window=1000):
+        super().__init__(None, None, rate_hz=rate_hz, jitter_window=jitter_window)
+        self._registry = registry
+
+    def notify(self, delta, version=None, ingest_time=None):
+        raise TypeError("notify the robot's own session.control_loop")
+
+    def tick(self):
+        published = 0
+        for session in self._registry.sessions():
+            if session.control_loop.tick():
+                published += 1
+        if published:
+            self._published += published
+        else:
+            self._skipped += 1
+        return published > 0
+
+    def stats(self):
+        stats = super().stats()
+        stats['robots'] = len(self._registry)
+        stats['urgent_published'] = sum(s.control_loop.stats()['urgent_published']
+                                        for s in self._registry.sessions())
+        return stats
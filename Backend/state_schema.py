@@ -0,0 +1,167 @@
+"""
+Declarative robot state schema
+STATE_SCHEMA lists every field a client may set, with its type: booleans,
+enums of the direction labels GestureController.ts sends, and the nested hand
+objects (which also accept the legacy bare-string form, "right": "left"
+meaning "right": {"horizontal": "left"}). Unknown keys are ignored, so
+envelope fields such as seq, timestamp or op can ride along.
+
+compile_schema() turns a schema into two straight-line Python functions,
+generated and compiled once:
+  - validate(data) -> normalized partial state holding only the fields sent
+  - merge(state, data) -> validates, merges into state in place and returns
+    the minimal delta (only fields whose value actually changed; {} for a
+    no-op update)
+Both raise ValidationError (a ValueError) naming the offending field, and
+merge validates everything before it touches state, so a bad update changes
+nothing. Leaf values are immutable (bool/str), so neither needs deep copies.
+"""
+
+HORIZONTAL = ('not active', 'left', 'right', 'straight')
+VERTICAL = ('not active', 'up', 'down', 'neutral')
+
+
+class ValidationError(ValueError):
+    pass
+
+
+class Bool:
+    """true/false (numbers are accepted and coerced, like bool() did before)"""
+
+
+class Enum:
+    def __init__(self, values):
+        self.values = tuple(values)
+
+
+class Object:
+    """Nested object; legacy names the field a bare (non-object) value stands for"""
+
+    def __init__(self, fields, legacy=None):
+        self.fields = fields
+        self.legacy = legacy
+
+
+STATE_SCHEMA = Object({
+    'stopped': Bool(),
+    'hand': Object({
+        'right': Object({'horizontal': Enum(HORIZONTAL), 'active': Bool()}, legacy='horizontal'),
+        'left': Object({'horizontal': Enum(HORIZONTAL), 'vertical': Enum(VERTICAL), 'active': Bool()},
+                       legacy='horizontal'),
+    }),
+})
+
+
+class CompiledSchema:
+    def __init__(self, validate, merge, source):
+        self.validate = validate
+        self.merge = merge
+        # Generated code, for debugging
+        self.source = source
+
+
+def compile_schema(schema, strict_enums=True):
+    """Generate validate/merge functions for schema; strict_enums=False accepts any string for enums"""
+    generator = _Generator(strict_enums)
+    source = generator.build(schema)
+    namespace = dict(generator.constants, ValidationError=ValidationError, _MISSING=_MISSING,
+                     _enum_error=_enum_error)
+    exec(compile(source, '<state_schema>', 'exec'), namespace)
+    return CompiledSchema(namespace['validate'], namespace['merge'], source)
+
+
+_MISSING = object()
+
+
+def _enum_error(path, value, values):
+    return ValidationError(f"{path}: {value!r} is not one of {', '.join(values)}")
+
+
+class _Generator:
+    def __init__(self, strict_enums):
+        self.strict_enums = strict_enums
+        self.constants = {}
+        self.leaves = []   # (path, local variable)
+        self.lines = []
+
+    def build(self, schema):
+        check = []
+        self.lines = check
+        self._emit_object(schema, 'data', (), 1)
+
+        body = ["    if not isinstance(data, dict):",
+                "        raise ValidationError('state update must be an object')"]
+        body += [f"    {var} = _MISSING" for _, var in self.leaves]
+        body += check
+
+        validate = ["def validate(data):"] + body + ["    changes = {}"]
+        for path, var in self.leaves:
+            validate.append(f"    if {var} is not _MISSING:")
+            validate.append(f"        {self._nested('changes', path[:-1])}[{path[-1]!r}] = {var}")
+        validate.append("    return changes")
+
+        merge = ["def merge(state, data):"] + body + ["    delta = {}"]
+        for path, var in self.leaves:
+            merge.append(f"    if {var} is not _MISSING:")
+            merge.append(f"        target = {self._nested('state', path[:-1])}")
+            merge.append(f"        if target.get({path[-1]!r}, _MISSING) != {var}:")
+            merge.append(f"            target[{path[-1]!r}] = {var}")
+            merge.append(f"            {self._nested('delta', path[:-1])}[{path[-1]!r}] = {var}")
+        merge.append("    return delta")
+        return '\n'.join(validate + [''] + merge) + '\n'
+
+    @staticmethod
+    def _nested(root, path):
+        return root + ''.join(f".setdefault({name!r}, {{}})" for name in path)
+
+    def _line(self, indent, text):
+        self.lines.append('    ' * indent + text)
+
+    def _emit_object(self, obj, expr, path, indent):
+        for name, field in obj.fields.items():
+            sub_path = path + (name,)
+            self._line(indent, f"if {name!r} in {expr}:")
+            if isinstance(field, Object):
+                node = 'n_' + '_'.join(sub_path)
+                self._line(indent + 1, f"{node} = {expr}[{name!r}]")
+                self._line(indent + 1, f"if isinstance({node}, dict):")
+                self._emit_object(field, node, sub_path, indent + 2)
+                self._line(indent + 1, "else:")
+                if field.legacy:
+                    # Legacy form: a bare value stands for the legacy field
+                    self._emit_leaf(field.fields[field.legacy], node, sub_path + (field.legacy,), indent + 2)
+                else:
+                    self._line(indent + 2, f"raise ValidationError({'.'.join(sub_path) + ' must be an object'!r})")
+            else:
+                self._emit_leaf(field, f"{expr}[{name!r}]", sub_path, indent + 1)
+
+    def _enum_constant(self, values):
+        for name, constant in self.constants.items():
+            if constant == values:
+                return name[:-len('_list')]
+        name = f"E_{len(self.constants) // 2}"
+        self.constants[name] = frozenset(values)
+        self.constants[name + '_list'] = values
+        return name
+
+    def _emit_leaf(self, field, expr, path, indent):
+        dotted = '.'.join(path)
+        var = 'v_' + '_'.join(path)
+        if var not in (v for _, v in self.leaves):
+            self.leaves.append((path, var))
+        self._line(indent, f"{var} = {expr}")
+        if isinstance(field, Bool):
+            self._line(indent, f"if {var} is not True and {var} is not False:")
+            self._line(indent + 1, f"if not isinstance({var}, (int, float)):")
+            self._line(indent + 2, f"raise ValidationError({dotted + ' must be true or false'!r})")
+            self._line(indent + 1, f"{var} = bool({var})")
+        elif isinstance(field, Enum):
+            if self.strict_enums:
+                values = self._enum_constant(field.values)
+                self._line(indent, f"if {var}.__class__ is not str or {var} not in {values}:")
+                self._line(indent + 1, f"raise _enum_error({dotted!r}, {var}, {values}_list)")
+            else:
+                self._line(indent, f"if {var}.__class__ is not str:")
+                self._line(indent + 1, f"{var} = str({var})")
+        else:
+            raise TypeError(f"unknown schema field type for {dotted}: {field!r}")
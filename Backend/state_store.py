@@ -0,0 +1,211 @@
+"""
+Versioned robot state store
+Updates are applied atomically under one lock, each change bumps a monotonic
+version, and the serialized form of every version is produced only once.
+Payloads are validated and merged in one pass by functions compiled from
+state_schema.STATE_SCHEMA.
+"""
+
+import copy
+import json
+import threading
+from collections import deque
+
+from state_schema import STATE_SCHEMA, ValidationError, compile_schema
+
+# Default robot state
+DEFAULT_ROBOT_STATE = {
+    'stopped': False,
+    'hand': {
+        'right': {
+            'horizontal': 'not active',
+            'active': True
+        },
+        'left': {
+            'horizontal': 'not active', 
+            'vertical': 'not active',
+            'active': True
+        }
+    }
+}
+
+# validate_state(data) -> changes; merge_state(state, data) -> delta (see state_schema)
+_compiled = compile_schema(STATE_SCHEMA)
+validate_state = _compiled.validate
+merge_state = _compiled.merge
+
+
+def version_from_etag(value):
+    """Parse a state version out of an ETag / If-None-Match header such as '"12"'"""
+    if not value:
+        return None
+    value = value.split(',')[0].strip()
+    if value.startswith('W/'):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError:
+        return None
+
+
+def _copy_tree(value):
+    """Copy of a delta: schema leaves are immutable, so only the dicts need copying"""
+    return {key: _copy_tree(item) if isinstance(item, dict) else item for key, item in value.items()}
+
+
+def combine_deltas(base, newer):
+    """Fold a newer delta into base in place"""
+    for key, value in newer.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            combine_deltas(base[key], value)
+        else:
+            base[key] = copy.deepcopy(value)
+    return base
+
+
+class RobotStateStore:
+    """Thread-safe robot state with version stamps and cached serialization"""
+
+    def __init__(self, initial_state, history_size=256, merge=merge_state):
+        self._lock = threading.Condition()
+        self._merge = merge
+        self._state = copy.deepcopy(initial_state)
+        self._version = 0
+        self._history = deque(maxlen=history_size)
+        self._cached_version = -1
+        self._cached_text = None
+        self._cached_bytes = None
+        # (version, encoder, payload) for the last alternative encoding asked for
+        self._encoded = None
+        # on_commit(version, delta, origin), called under the lock after every new
+        # version (cluster replication); it must not block or modify delta
+        self.on_commit = None
+
+    @property
+    def version(self):
+        return self._version
+
+    def apply(self, changes, origin=None):
+        """Validate and merge a partial state atomically; returns (version, delta)
+
+        changes may be a raw client payload: it is checked against the schema
+        (ValidationError, with nothing applied, if it does not fit). The
+        version only moves when something actually changed, in which case
+        delta holds just the changed fields. origin is passed on to on_commit.
+        """
+        with self._lock:
+            delta = self._merge(self._state, changes)
+            if not delta:
+                return self._version, {}
+            created = self._commit(delta, origin)
+            self._lock.notify_all()
+            return created
+
+    def apply_batch(self, frames, split_on=()):
+        """Merge a sequence of partial states atomically, in order, into as few versions as possible
+
+        Consecutive changes are folded into one version; a frame that changes
+        one of the split_on fields gets a version of its own (after the ones
+        before it) so that transition is never folded away. Returns the
+        versions created as [(version, delta), ...].
+        """
+        with self._lock:
+            created = []
+            pending = {}
+            for changes in frames:
+                delta = self._merge(self._state, changes)
+                if not delta:
+                    continue
+                if any(field in delta for field in split_on):
+                    if pending:
+                        created.append(self._commit(pending))
+                        pending = {}
+                    created.append(self._commit(delta))
+                else:
+                    combine_deltas(pending, delta)
+            if pending:
+                created.append(self._commit(pending))
+            if created:
+                self._lock.notify_all()
+            return created
+
+    def _commit(self, delta, origin=None):
+        # Caller holds the lock
+        self._version += 1
+        self._history.append((self._version, delta))
+        if self.on_commit is not None:
+            self.on_commit(self._version, delta, origin)
+        return self._version, _copy_tree(delta)
+
+    def with_snapshot(self, callback):
+        """Call callback(version, state) under the lock, so no later version can be seen before it
+
+        state is the live document: callback must not keep or modify it.
+        """
+        with self._lock:
+            return callback(self._version, self._state)
+
+    def peek(self, key):
+        """Current value of a top-level field, read without the lock (for cheap pre-checks)"""
+        return self._state.get(key)
+
+    def wait_for_change(self, version, timeout):
+        """Block until the state moves past `version` or timeout; returns the current version"""
+        with self._lock:
+            self._lock.wait_for(lambda: self._version != version, timeout)
+            return self._version
+
+    def snapshot(self):
+        """Return (version, deep copy of the current state)"""
+        with self._lock:
+            return self._version, copy.deepcopy(self._state)
+
+    def serialized(self):
+        """Return (version, JSON text) for the current state, serialized once per version"""
+        with self._lock:
+            self._refresh_cache()
+            return self._version, self._cached_text
+
+    def serialized_bytes(self):
+        """Same as serialized() but UTF-8 encoded, for MQTT and HTTP bodies"""
+        with self._lock:
+            self._refresh_cache()
+            return self._version, self._cached_bytes
+
+    def encoded(self, encoder):
+        """Return (version, encoder(document)) for the current state, encoded once per version"""
+        with self._lock:
+            cached = self._encoded
+            if cached is None or cached[0] != self._version or cached[1] is not encoder:
+                document = dict(self._state)
+                document['version'] = self._version
+                cached = self._encoded = (self._version, encoder, encoder(document))
+            return self._version, cached[2]
+
+    def changes_since(self, version):
+        """Return (current_version, changes, is_full) for a reader at `version`
+
+        If the history still covers everything after `version` the combined
+        delta is returned, otherwise a full snapshot with is_full=True.
+        """
+        with self._lock:
+            if version == self._version:
+                return self._version, {}, False
+            # Readers ahead of us saw a previous server run; send them everything
+            if (version < 0 or version > self._version or not self._history
+                    or self._history[0][0] > version + 1):
+                return self._version, copy.deepcopy(self._state), True
+            changes = {}
+            for entry_version, delta in self._history:
+                if entry_version > version:
+                    combine_deltas(changes, delta)
+            return self._version, changes, False
+
+    def _refresh_cache(self):
+        # Caller holds the lock
+        if self._cached_version != self._version:
+            document = dict(self._state)
+            document['version'] = self._version
+            self._cached_text = json.dumps(document, separators=(',', ':'))
+            self._cached_bytes = self._cached_text.encode('utf-8')
+            self._cached_version = self._version
@@ -0,0 +1,119 @@
+"""
+Admission control: per-client token buckets, overload hysteresis and the stop exemption
+"""
+
+import threading
+
+import pytest
+
+from admission import (AdmissionController, SocketThrottle, REASON_RATE, REASON_OVERLOAD, is_urgent,
+                       shed_response)
+
+
+LENS = ('10.0.0.1', 'lens')
+PHONE = ('10.0.0.2', None)
+
+
+def make_controller(rate=10, burst=3, **kwargs):
+    return AdmissionController(rate, burst, max_backlog=100, max_latency=0.5, **kwargs)
+
+
+def test_bucket_allows_a_burst_then_refills_at_the_rate():
+    controller = make_controller()
+    assert all(controller.admit('http', LENS, now=0.0) is None for _ in range(3))
+    reason, retry_after = controller.admit('http', LENS, now=0.0)
+    assert reason == REASON_RATE and retry_after == pytest.approx(0.1)
+    # One token back after 1/rate seconds, never more than burst
+    assert controller.admit('http', LENS, now=0.1) is None
+    assert controller.admit('http', LENS, now=0.1) is not None
+    assert all(controller.admit('http', LENS, now=100.0) is None for _ in range(3))
+    assert controller.admit('http', LENS, now=100.0) is not None
+
+
+def test_clients_have_their_own_buckets():
+    controller = make_controller(burst=1)
+    assert controller.admit('http', LENS, now=0.0) is None
+    assert controller.admit('http', LENS, now=0.0) is not None
+    assert controller.admit('http', PHONE, now=0.0) is None
+
+
+def test_stop_and_resume_are_never_refused_nor_charged():
+    controller = make_controller(burst=1)
+    assert controller.admit('http', LENS, now=0.0) is None
+    assert controller.admit('http', LENS, urgent=True, now=0.0) is None
+    assert controller.exempt == 1
+    controller = make_controller(burst=1)
+    assert controller.admit('http', LENS, urgent=True, now=0.0) is None
+    assert controller.admit('http', LENS, now=0.0) is None
+
+
+def test_new_client_ids_do_not_escape_the_limit():
+    controller = make_controller(burst=1, max_ids_per_address=2)
+    admitted = sum(controller.admit('http', ('10.0.0.1', f'id-{n}'), now=0.0) is None for n in range(50))
+    # Two buckets under ids, then every further id shares the address's own one
+    assert admitted == 3
+    assert controller.admit('http', ('10.0.0.1', 'id-0'), now=0.0) is not None
+    # Other addresses are unaffected
+    assert controller.admit('http', ('10.0.0.9', 'id-0'), now=0.0) is None
+
+
+def test_counters_are_consistent_across_threads():
+    controller = make_controller(rate=1, burst=1000)
+
+    def client(n):
+        for _ in range(500):
+            controller.admit('http', ('10.0.0.1', f'c{n % 4}'), urgent=n % 2 == 0, now=0.0)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = controller.stats()
+    assert stats['admitted'] + stats['exempt'] + stats['shed'][REASON_RATE] == 4000
+
+
+def test_rate_zero_turns_the_limit_off():
+    controller = make_controller(rate=0)
+    assert all(controller.admit('http', LENS, now=0.0) is None for _ in range(100))
+
+
+def test_least_recently_seen_clients_are_forgotten():
+    controller = make_controller(max_clients=2)
+    for address in ('10.0.0.1', '10.0.0.2', '10.0.0.3'):
+        controller.admit('http', (address, None), now=0.0)
+    assert controller.stats()['clients'] == 2
+
+
+def test_overload_sheds_until_the_backlog_is_under_half():
+    controller = make_controller(rate=0, check_interval=0)
+    backlog = [0, 0.0]
+    controller.set_backlog(lambda: tuple(backlog))
+    assert controller.admit('http', LENS, now=0.0) is None
+    backlog[0] = 100
+    assert controller.admit('http', LENS, now=1.0)[0] == REASON_OVERLOAD
+    assert controller.admit('http', LENS, urgent=True, now=1.0) is None
+    backlog[0] = 60
+    assert controller.admit('http', LENS, now=2.0)[0] == REASON_OVERLOAD
+    backlog[0] = 50
+    assert controller.admit('http', LENS, now=3.0) is None
+
+
+def test_socket_throttle_drops_until_retry_after():
+    throttle = SocketThrottle(make_controller(burst=1), LENS)
+    assert throttle.admit(False, now=0.0) == (True, None)
+    admitted, notice = throttle.admit(False, now=0.0)
+    assert not admitted and notice[0] == REASON_RATE
+    # Dropped quietly (no second notice) for the rest of the window, stops still go through
+    assert throttle.admit(False, now=0.05) == (False, None)
+    assert throttle.admit(True, now=0.05) == (True, None)
+    assert throttle.admit(False, now=0.2) == (True, None)
+
+
+def test_shed_response_and_is_urgent():
+    assert shed_response((REASON_RATE, 0.25)) == (429, {'error': 'Too many updates from this client; slow down',
+                                                        'reason': REASON_RATE, 'retry_after_ms': 250}, '1')
+    assert shed_response((REASON_OVERLOAD, 2.5))[0] == 503
+    assert is_urgent({'stopped': True}, False)
+    assert not is_urgent({'stopped': False}, False)
+    assert is_urgent([{'hand': {}}, {'stopped': False}], True)
@@ -0,0 +1,88 @@
+"""
+Batch ingestion: per-session sequence numbers and stale frames
+"""
+
+from batch_ingest import SequenceTracker, ingest_batch, parse_batch
+from robots import RobotSession
+
+
+def make_session():
+    return RobotSession('arm', 'robot/arm', 'robot/arm/stop', None, lambda *args: None, lambda *args: None)
+
+
+def frame(session, seq, horizontal, timestamp=None):
+    data = {'session': session, 'seq': seq, 'hand': {'right': {'horizontal': horizontal}}}
+    if timestamp is not None:
+        data['timestamp'] = timestamp
+    return data
+
+
+def test_stale_and_duplicate_seqs_are_dropped():
+    robot = make_session()
+    _, report = ingest_batch(robot, [frame('a', 1, 'left'), frame('a', 2, 'right'), frame('a', 2, 'right')], 0)
+    assert (report['applied'], report['stale'], report['last_seq']) == (2, 1, 2)
+    _, report = ingest_batch(robot, [frame('a', 1, 'straight')], 0)
+    assert report['stale'] == 1
+    assert robot.state_store.peek('hand')['right']['horizontal'] == 'right'
+
+
+def test_two_clients_keep_their_own_sequence_numbers():
+    robot = make_session()
+    ingest_batch(robot, [frame('a', 10, 'left')], 0)
+    _, report = ingest_batch(robot, [frame('b', 1, 'right')], 0)
+    assert report['applied'] == 1
+    # a's numbering was not reset by b: its retry is still a duplicate, its next frame is not
+    _, report = ingest_batch(robot, [frame('a', 10, 'left'), frame('a', 11, 'straight')], 0)
+    assert (report['applied'], report['stale'], report['last_seq']) == (1, 1, 11)
+    _, report = ingest_batch(robot, [frame('b', 1, 'right')], 0)
+    assert report['stale'] == 1
+    assert robot.sequence.last_seq_for('a') == 11 and robot.sequence.last_seq_for('b') == 1
+
+
+def test_frames_older_than_their_sessions_newest_are_stale():
+    robot = make_session()
+    ingest_batch(robot, [frame('a', 1, 'left', timestamp=100.0)], 0)
+    _, report = ingest_batch(robot, [{'session': 'a', 'hand': {'right': {'horizontal': 'right'}},
+                                      'timestamp': 99.0}], 0)
+    assert report['stale'] == 1
+    # Frames without a timestamp are only checked by seq
+    _, report = ingest_batch(robot, [frame('a', 2, 'right')], 0)
+    assert report['applied'] == 1
+
+
+def test_skewed_clocks_across_sessions_never_drop_a_stop():
+    robot = make_session()
+    # The phone's clock runs 0.3 s behind the lens's
+    ingest_batch(robot, [frame('lens', 1, 'left', timestamp=1000.0)], 0)
+    _, report = ingest_batch(robot, [{'session': 'phone', 'seq': 1, 'timestamp': 999.7, 'stopped': True}], 0)
+    assert report['applied'] == 1 and report['stale'] == 0
+    assert robot.state_store.peek('stopped') is True
+    _, report = ingest_batch(robot, [frame('phone', 2, 'right', timestamp=999.8)], 0)
+    assert report['applied'] == 1
+
+
+def test_a_stop_is_not_dropped_for_its_own_sessions_timestamp_either():
+    robot = make_session()
+    ingest_batch(robot, [frame('lens', 1, 'left', timestamp=100.0)], 0)
+    _, report = ingest_batch(robot, [{'session': 'lens', 'seq': 2, 'timestamp': 99.0, 'stopped': True}], 0)
+    assert report['applied'] == 1
+    assert robot.state_store.peek('stopped') is True
+    # A repeated seq is still a duplicate, stop or not
+    _, report = ingest_batch(robot, [{'session': 'lens', 'seq': 2, 'stopped': False}], 0)
+    assert report['stale'] == 1
+
+
+def test_sessions_are_bounded_least_recently_active_first():
+    tracker = SequenceTracker(max_sessions=2)
+    tracker.applied('a', 1)
+    tracker.applied('b', 1)
+    tracker.applied('a', 2)
+    tracker.applied('c', 1)
+    assert tracker.last_seq_for('b') is None
+    assert tracker.last_seq_for('a') == 2 and tracker.last_seq_for('c') == 1
+
+
+def test_parse_batch_accepts_arrays_objects_and_ndjson():
+    assert parse_batch('[{"seq": 1}]', 10) == [{'seq': 1}]
+    assert parse_batch('{"frames": [{"seq": 1}]}', 10) == [{'seq': 1}]
+    assert parse_batch(b'{"seq": 1}\n{"seq": 2}\n', 10) == [{'seq': 1}, {'seq': 2}]
@@ -2,8 +2,24 @@
 """
 MQTT Connection Debug Script
 Tests various connection scenarios and provides detailed diagnostics
+
+With --probe it measures instead of checking: how long DNS, the TCP connect,
+the TLS handshake and MQTT CONNECT -> CONNACK take (over --connects fresh
+connections), then a publish/subscribe echo loop through the broker for every
+combination of --qos, --sizes and --rates. Each gets round-trip percentiles
+and a histogram, loss (no echo within --settle), duplicates and throughput.
+--host/--port/--no-tls point it at any broker, e.g. a local stand-in:
+
+    python benchmarks/local_broker.py --port 1883
+    python test_gesture.py --probe --host 127.0.0.1 --port 1883 --no-tls
 """
 
+import argparse
+import os
+import struct
+import threading
+from bisect import bisect_left
+
 import paho.mqtt.client as mqtt
 import json
 import time
@@ -11,32 +27,41 @@ import ssl
 import socket
 from datetime import datetime
 
+from config import MQTT_MAX_INFLIGHT
+from metrics import LATENCY_BUCKETS
+
 # Configuration
 HIVEMQ_HOST = "a2016a11d3614243aeb27bda75dd2204.s1.eu.hivemq.cloud"
 HIVEMQ_PORT = 8883
 MQTT_TOPIC = "robot"
 HIVEMQ_USERNAME = "kushal"
 HIVEMQ_PASSWORD = "Hackthenorth25"
+# Echo probes publish under here, away from the robot topics
+PROBE_TOPIC = "robot-latency-probe"
+# Echo payload header: run, sequence number, send time (perf_counter)
+ECHO_HEADER = struct.Struct('<IQd')
 
-def test_dns_resolution():
+def test_dns_resolution(host=None):
     """Test if we can resolve the HiveMQ hostname"""
+    host = host or HIVEMQ_HOST
     print("🔍 Testing DNS resolution...")
     try:
         import socket
-        ip = socket.gethostbyname(HIVEMQ_HOST)
-        print(f"✅ DNS resolution successful: {HIVEMQ_HOST} -> {ip}")
+        ip = socket.gethostbyname(host)
+        print(f"✅ DNS resolution successful: {host} -> {ip}")
         return True
     except Exception as e:
         print(f"❌ DNS resolution failed: {e}")
         return False
 
-def test_tcp_connection():
+def test_tcp_connection(host=None, port=None):
     """Test basic TCP connection to HiveMQ"""
-    print(f"🔍 Testing TCP connection to {HIVEMQ_HOST}:{HIVEMQ_PORT}...")
+    host, port = host or HIVEMQ_HOST, port or HIVEMQ_PORT
+    print(f"🔍 Testing TCP connection to {host}:{port}...")
     try:
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.settimeout(10)
-        result = sock.connect_ex((HIVEMQ_HOST, HIVEMQ_PORT))
+        result = sock.connect_ex((host, port))
         sock.close()
         
         if result == 0:
@@ -49,16 +74,15 @@ def test_tcp_connection():
         print(f"❌ TCP connection error: {e}")
         return False
 
-def test_ssl_connection():
+def test_ssl_connection(host=None, port=None):
     """Test SSL/TLS connection"""
+    host, port = host or HIVEMQ_HOST, port or HIVEMQ_PORT
     print(f"🔍 Testing SSL/TLS connection...")
     try:
-        context = ssl.create_default_context()
-        context.check_hostname = False
-        context.verify_mode = ssl.CERT_NONE
+        context = _tls_context()
         
-        with socket.create_connection((HIVEMQ_HOST, HIVEMQ_PORT), timeout=10) as sock:
-            with context.wrap_socket(sock, server_hostname=HIVEMQ_HOST) as ssock:
+        with socket.create_connection((host, port), timeout=10) as sock:
+            with context.wrap_socket(sock, server_hostname=host) as ssock:
                 print("✅ SSL/TLS connection successful")
                 print(f"   SSL version: {ssock.version()}")
                 print(f"   Cipher: {ssock.cipher()}")
@@ -67,6 +91,13 @@ def test_ssl_connection():
         print(f"❌ SSL/TLS connection failed: {e}")
         return False
 
+def _tls_context():
+    # The diagnostics only look at the link, not at the certificate
+    context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
 class MQTTTestClient:
     def __init__(self):
         self.connected = False
@@ -119,8 +150,9 @@ class MQTTTestClient:
         """Callback for logging"""
         print(f"🔍 MQTT Log [{level}]: {buf}")
 
-def test_mqtt_connection():
+def test_mqtt_connection(host=None, port=None, use_tls=True):
     """Test MQTT connection with detailed logging"""
+    host, port = host or HIVEMQ_HOST, port or HIVEMQ_PORT
     print("🔍 Testing MQTT connection...")
     
     test_client = MQTTTestClient()
@@ -141,19 +173,17 @@ def test_mqtt_connection():
     
     # Configure TLS
     try:
-        context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
-        context.check_hostname = False
-        context.verify_mode = ssl.CERT_NONE
-        client.tls_set_context(context)
-        print("✅ TLS configured successfully")
+        if use_tls:
+            client.tls_set_context(_tls_context())
+            print("✅ TLS configured successfully")
     except Exception as e:
         print(f"❌ TLS configuration failed: {e}")
         return False
     
     # Connect
     try:
-        print(f"🔄 Connecting to {HIVEMQ_HOST}:{HIVEMQ_PORT} as {client_id}...")
-        client.connect(HIVEMQ_HOST, HIVEMQ_PORT, 60)
+        print(f"🔄 Connecting to {host}:{port} as {client_id}...")
+        client.connect(host, port, 60)
         client.loop_start()
         
         # Wait for connection
@@ -204,26 +234,283 @@ def test_mqtt_connection():
         print(f"❌ MQTT connection exception: {e}")
         return False
 
-def main():
+# -- latency probe -------------------------------------------------------------
+
+def _mqtt_string(value):
+    data = value.encode('utf-8')
+    return struct.pack('!H', len(data)) + data
+
+def _remaining_length(length):
+    encoded = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        encoded.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(encoded)
+
+def connect_packet(client_id, username=None, password=None, keepalive=60):
+    """MQTT 3.1.1 CONNECT (clean session), built by hand so the handshake can be timed on a bare socket"""
+    flags = 0x02
+    payload = _mqtt_string(client_id)
+    if username:
+        flags |= 0x80
+        payload += _mqtt_string(username)
+        if password:
+            flags |= 0x40
+            payload += _mqtt_string(password)
+    body = _mqtt_string('MQTT') + bytes([4, flags]) + struct.pack('!H', keepalive) + payload
+    return bytes([0x10]) + _remaining_length(len(body)) + body
+
+def _recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed by the broker")
+        data += chunk
+    return data
+
+def time_connection_stages(host, port, use_tls=True, username=None, password=None, timeout=10):
+    """Seconds spent in DNS, TCP connect, TLS handshake and CONNECT -> CONNACK on one fresh connection"""
+    stages = {}
+    started = time.perf_counter()
+    family, socktype, proto, _, address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0]
+    stages['dns'] = time.perf_counter() - started
+    sock = socket.socket(family, socktype, proto)
+    sock.settimeout(timeout)
+    try:
+        mark = time.perf_counter()
+        sock.connect(address)
+        stages['tcp'] = time.perf_counter() - mark
+        if use_tls:
+            mark = time.perf_counter()
+            sock = _tls_context().wrap_socket(sock, server_hostname=host)
+            stages['tls'] = time.perf_counter() - mark
+        mark = time.perf_counter()
+        sock.sendall(connect_packet(f"latency_probe_{os.getpid()}_{time.monotonic_ns()}", username, password))
+        connack = _recv_exactly(sock, 4)
+        stages['connack'] = time.perf_counter() - mark
+        if connack[0] >> 4 != 2 or connack[3] != 0:
+            raise ConnectionError(f"CONNACK refused, return code {connack[3]}")
+        sock.sendall(b'\xe0\x00')
+    finally:
+        sock.close()
+    stages['total'] = time.perf_counter() - started
+    return stages
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def latency_summary(samples):
+    """Percentiles (ms) and a LATENCY_BUCKETS histogram of round-trip samples in seconds"""
+    ordered = sorted(samples)
+    counts = [0] * (len(LATENCY_BUCKETS) + 1)
+    for sample in ordered:
+        counts[bisect_left(LATENCY_BUCKETS, sample)] += 1
+    summary = {'count': len(ordered), 'histogram': counts}
+    if ordered:
+        summary.update({name: round(_percentile(ordered, fraction) * 1000, 3)
+                        for name, fraction in (('p50_ms', 0.5), ('p90_ms', 0.9), ('p99_ms', 0.99))})
+        summary['min_ms'] = round(ordered[0] * 1000, 3)
+        summary['max_ms'] = round(ordered[-1] * 1000, 3)
+    return summary
+
+def print_histogram(counts, width=40):
+    used = [index for index, count in enumerate(counts) if count]
+    if not used:
+        return
+    peak = max(counts)
+    for index in range(used[0], used[-1] + 1):
+        label = f"≤ {LATENCY_BUCKETS[index] * 1000:g} ms" if index < len(LATENCY_BUCKETS) else f"> {LATENCY_BUCKETS[-1] * 1000:g} ms"
+        bar = '█' * max(1 if counts[index] else 0, round(counts[index] / peak * width))
+        print(f"      {label:>10} {bar} {counts[index]}")
+
+class EchoProbe:
+    """One connection that publishes to its own topic and times each message's return from the broker"""
+
+    def __init__(self, host, port, use_tls=True, username=None, password=None, timeout=10):
+        self.client_id = f"latency_probe_{os.getpid()}_{int(time.time())}"
+        self.topic = f"{PROBE_TOPIC}/{self.client_id}"
+        self._run = 0
+        self._received = {}
+        self._duplicates = 0
+        self._last_arrival = None
+        # Any echo, current run or not
+        self._last_echo = time.perf_counter()
+        self._lock = threading.Lock()
+        self._subscribed = threading.Event()
+        self.client = mqtt.Client(client_id=self.client_id, clean_session=True)
+        # The same window the server publishes with
+        self.client.max_inflight_messages_set(MQTT_MAX_INFLIGHT)
+        if username:
+            self.client.username_pw_set(username, password)
+        if use_tls:
+            self.client.tls_set_context(_tls_context())
+        self.client.on_connect = lambda client, userdata, flags, rc: rc == 0 and client.subscribe(self.topic, 1)
+        self.client.on_subscribe = lambda *args: self._subscribed.set()
+        self.client.on_message = self._on_message
+        self.client.connect(host, port, 60)
+        self.client.loop_start()
+        if not self._subscribed.wait(timeout):
+            self.close()
+            raise ConnectionError(f"no SUBACK from {host}:{port} within {timeout} s")
+
+    def _on_message(self, client, userdata, msg):
+        now = time.perf_counter()
+        run, seq, sent = ECHO_HEADER.unpack_from(msg.payload)
+        with self._lock:
+            self._last_echo = now
+            if run != self._run:
+                return
+            if seq in self._received:
+                self._duplicates += 1
+                return
+            self._received[seq] = now - sent
+            self._last_arrival = now
+
+    def run(self, qos, size, rate, seconds, settle):
+        """Publish rate messages a second of size bytes for seconds and collect their echoes
+
+        Echoes that are not back within settle seconds of the last send count as lost.
+        """
+        self._wait_quiet()
+        with self._lock:
+            self._run += 1
+            run = self._run
+            self._received = {}
+            self._duplicates = 0
+            self._last_arrival = None
+        padding = b'\0' * max(0, size - ECHO_HEADER.size)
+        count = max(1, int(rate * seconds))
+        refused = 0
+        started = time.perf_counter()
+        for seq in range(count):
+            payload = ECHO_HEADER.pack(run, seq, time.perf_counter()) + padding
+            if self.client.publish(self.topic, payload, qos=qos).rc != mqtt.MQTT_ERR_SUCCESS:
+                refused += 1
+            delay = started + (seq + 1) / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        sent_in = time.perf_counter() - started
+        sent = count - refused
+        deadline = time.perf_counter() + settle
+        while time.perf_counter() < deadline and len(self._received) < sent:
+            time.sleep(0.01)
+        with self._lock:
+            samples = list(self._received.values())
+            duplicates = self._duplicates
+            elapsed = (self._last_arrival or started) - started
+            # Late echoes of this run are ignored from here on
+            self._run += 1
+        received = len(samples)
+        return {
+            'qos': qos,
+            'size': len(padding) + ECHO_HEADER.size,
+            'rate': rate,
+            'sent': sent,
+            'refused': refused,
+            'received': received,
+            # Refused publishes count as lost
+            'loss': round(1 - received / count, 4),
+            'duplicates': duplicates,
+            'send_rate': round(sent / sent_in, 1),
+            'throughput': round(received / elapsed, 1) if elapsed > 0 else None,
+            'throughput_kbps': round(received * (len(padding) + ECHO_HEADER.size) * 8 / elapsed / 1000, 1)
+            if elapsed > 0 else None,
+            'rtt': latency_summary(samples)
+        }
+
+    def _wait_quiet(self, quiet=0.5, limit=30.0):
+        # A broker still working through the previous run's backlog would slow this one down
+        deadline = time.perf_counter() + limit
+        while time.perf_counter() < deadline and time.perf_counter() - self._last_echo < quiet:
+            time.sleep(0.05)
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+def probe(args):
+    """Latency probe: connection stage timings, then the echo matrix"""
+    use_tls = not args.no_tls
+    print(f"🚀 Latency probe for {args.host}:{args.port} ({'TLS' if use_tls else 'plain TCP'})")
+    print("=" * 60)
+    results = {'host': args.host, 'port': args.port, 'tls': use_tls, 'stages': {}, 'echo': []}
+
+    runs = []
+    for attempt in range(args.connects):
+        try:
+            runs.append(time_connection_stages(args.host, args.port, use_tls, HIVEMQ_USERNAME, HIVEMQ_PASSWORD))
+        except Exception as e:
+            print(f"❌ Connection {attempt + 1} failed: {e}")
+    if not runs:
+        print("❌ No connection succeeded; run without --probe for diagnostics")
+        return results
+    print(f"⏱️ Connection stages over {len(runs)} connections (ms): first / min / p50 / max")
+    for stage in runs[0]:
+        samples = [run[stage] * 1000 for run in runs]
+        ordered = sorted(samples)
+        results['stages'][stage] = {'first_ms': round(samples[0], 3), 'min_ms': round(ordered[0], 3),
+                                    'p50_ms': round(_percentile(ordered, 0.5), 3), 'max_ms': round(ordered[-1], 3)}
+        print(f"   {stage:>8}: " + " / ".join(f"{value:.2f}" for value in results['stages'][stage].values()))
+    print()
+
+    try:
+        echo = EchoProbe(args.host, args.port, use_tls, HIVEMQ_USERNAME, HIVEMQ_PASSWORD)
+    except Exception as e:
+        print(f"❌ Echo probe could not connect: {e}")
+        return results
+    try:
+        for qos in args.qos:
+            for size in args.sizes:
+                for rate in args.rates:
+                    result = echo.run(qos, size, rate, args.seconds, args.settle)
+                    results['echo'].append(result)
+                    rtt = result['rtt']
+                    line = (f"📡 QoS {qos} {result['size']:>6} B {rate:>7g}/s: sent {result['sent']}, "
+                            f"loss {result['loss']:.1%}, dup {result['duplicates']}, {result['throughput']} msg/s")
+                    if 'p50_ms' in rtt:
+                        line += f", rtt p50 {rtt['p50_ms']} p90 {rtt['p90_ms']} p99 {rtt['p99_ms']} max {rtt['max_ms']} ms"
+                    print(line)
+                    print_histogram(rtt['histogram'])
+    finally:
+        echo.close()
+
+    print("=" * 60)
+    print("🏁 RTT p99 ms by QoS / size / rate:")
+    for result in results['echo']:
+        print(f"   QoS {result['qos']} {result['size']:>6} B {result['rate']:>7g}/s: "
+              f"{result['rtt'].get('p99_ms')} (loss {result['loss']:.1%}, {result['throughput_kbps']} kbit/s)")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"📄 Results written to {args.output}")
+    return results
+
+def diagnose(host=HIVEMQ_HOST, port=HIVEMQ_PORT, use_tls=True):
     """Main diagnostic function"""
     print("🚀 Starting MQTT Connection Diagnostics")
     print("=" * 60)
     
     # Test 1: DNS Resolution
-    dns_ok = test_dns_resolution()
+    dns_ok = test_dns_resolution(host)
     print()
     
     # Test 2: TCP Connection
-    tcp_ok = test_tcp_connection()
+    tcp_ok = test_tcp_connection(host, port)
     print()
     
     # Test 3: SSL/TLS Connection
-    ssl_ok = test_ssl_connection()
+    if use_tls:
+        ssl_ok = test_ssl_connection(host, port)
+    else:
+        print("⏭️ Skipping SSL/TLS test (--no-tls)")
+        ssl_ok = True
     print()
     
     # Test 4: MQTT Connection
     if dns_ok and tcp_ok and ssl_ok:
-        mqtt_ok = test_mqtt_connection()
+        mqtt_ok = test_mqtt_connection(host, port, use_tls)
     else:
         print("⚠️ Skipping MQTT test due to previous failures")
         mqtt_ok = False
@@ -233,7 +520,7 @@ def main():
     print("🏁 DIAGNOSTIC SUMMARY:")
     print(f"   DNS Resolution: {'✅' if dns_ok else '❌'}")
     print(f"   TCP Connection: {'✅' if tcp_ok else '❌'}")
-    print(f"   SSL/TLS Connection: {'✅' if ssl_ok else '❌'}")
+    print(f"   SSL/TLS Connection: {('✅' if ssl_ok else '❌') if use_tls else '⏭️'}")
     print(f"   MQTT Connection: {'✅' if mqtt_ok else '❌'}")
     
     if not mqtt_ok:
@@ -254,5 +541,25 @@ def main():
     
     print("=" * 60)
 
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=HIVEMQ_HOST)
+    parser.add_argument('--port', type=int, default=HIVEMQ_PORT)
+    parser.add_argument('--no-tls', action='store_true', help="plain TCP (a local broker)")
+    parser.add_argument('--probe', action='store_true', help="measure connection stages and echo latency")
+    parser.add_argument('--connects', type=int, default=5, help="fresh connections to time the stages over")
+    parser.add_argument('--qos', type=int, nargs='+', choices=[0, 1], default=[0, 1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[64, 1024, 16384], help="payload bytes")
+    parser.add_argument('--rates', type=float, nargs='+', default=[10, 100, 500], help="messages per second")
+    parser.add_argument('--seconds', type=float, default=3.0, help="echo loop length for each combination")
+    parser.add_argument('--settle', type=float, default=2.0, help="seconds to wait for echoes after the last send")
+    parser.add_argument('--output', help="write the probe results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.probe:
+        probe(args)
+    else:
+        diagnose(args.host, args.port, not args.no_tls)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,100 @@
+"""
+MQTTPublisher lane scheduling: latest-wins coalescing, the stop priority lane
+and backoff while the broker is unreachable
+"""
+
+import threading
+import time
+
+from mqtt_publisher import MQTTPublisher
+
+
+class FakeBroker:
+    """send() for MQTTPublisher: records every attempt, fails while down"""
+
+    def __init__(self, up=True):
+        self.up = up
+        self.attempts = []
+        self.sent = []
+        self._lock = threading.Lock()
+        self._mid = 0
+
+    def send(self, topic, payload, qos):
+        with self._lock:
+            self.attempts.append(topic)
+            if not self.up:
+                return False
+            self._mid += 1
+            self.sent.append((topic, payload))
+            return self._mid
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def test_outage_backs_off_instead_of_spinning():
+    broker = FakeBroker(up=False)
+    publisher = MQTTPublisher(broker.send, retry_interval=0.1, journal=None)
+    publisher.start()
+    try:
+        publisher.submit('robot', b'state')
+        publisher.submit_priority('robot/stop', b'stop')
+        time.sleep(1.0)
+    finally:
+        publisher.stop()
+    # One attempt per lane per retry interval, give or take scheduling
+    assert 2 <= len(broker.attempts) <= 30, len(broker.attempts)
+
+
+def test_state_waits_behind_a_failing_stop():
+    broker = FakeBroker(up=False)
+    publisher = MQTTPublisher(broker.send, retry_interval=0.1, journal=None)
+    publisher.start()
+    try:
+        publisher.submit_priority('robot/stop', b'stop')
+        assert wait_for(lambda: broker.attempts)
+        publisher.submit('robot', b'state')
+        broker.up = True
+        assert wait_for(lambda: len(broker.sent) == 2)
+    finally:
+        publisher.stop()
+    assert [topic for topic, _ in broker.sent] == ['robot/stop', 'robot']
+
+
+def test_priority_preempts_queued_snapshots():
+    broker = FakeBroker(up=False)
+    publisher = MQTTPublisher(broker.send, retry_interval=0.05, journal=None)
+    publisher.submit('robot/a', b'a')
+    publisher.submit('robot/b', b'b')
+    publisher.submit_priority('robot/stop', b'stop')
+    broker.up = True
+    publisher.start()
+    try:
+        assert wait_for(lambda: len(broker.sent) == 3)
+    finally:
+        publisher.stop()
+    assert [topic for topic, _ in broker.sent] == ['robot/stop', 'robot/a', 'robot/b']
+
+
+def test_snapshots_are_latest_wins_per_topic():
+    broker = FakeBroker()
+    publisher = MQTTPublisher(broker.send, max_topics=2, journal=None)
+    assert publisher.submit('robot/a', b'1')
+    assert publisher.submit('robot/a', b'2')
+    assert publisher.submit('robot/b', b'3')
+    # A third topic does not fit; the queued ones are never evicted
+    assert not publisher.submit('robot/c', b'4')
+    publisher.start()
+    try:
+        assert wait_for(lambda: len(broker.sent) == 2)
+    finally:
+        publisher.stop()
+    assert broker.sent == [('robot/a', b'2'), ('robot/b', b'3')]
+    stats = publisher.stats()
+    assert stats['coalesced'] == 1 and stats['dropped'] == 1
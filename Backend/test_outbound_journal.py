@@ -0,0 +1,100 @@
+"""
+OutboundJournal replay order, compaction and crash recovery
+"""
+
+from outbound_journal import (OutboundJournal, COMPACTION_LATEST, COMPACTION_NONE, KIND_STATE, KIND_STOP,
+                              state_topic_of)
+
+
+def open_journal(tmp_path, compaction=COMPACTION_LATEST, capacity=64 * 1024):
+    return OutboundJournal(str(tmp_path / 'outbound.journal'), capacity=capacity, compaction=compaction,
+                           sync_interval=0).open()
+
+
+def drain(journal):
+    replayed = []
+    while True:
+        record = journal.peek()
+        if record is None:
+            return replayed
+        replayed.append((record.topic, journal.payload(record)))
+        assert journal.consume(record)
+
+
+def test_state_stop_state_outage_never_replays_the_state_before_the_stop(tmp_path):
+    for compaction in (COMPACTION_NONE, COMPACTION_LATEST):
+        journal = open_journal(tmp_path / compaction, compaction)
+        journal.append('robot', b'moving-1', KIND_STATE)
+        journal.append('robot', b'moving-2', KIND_STATE)
+        journal.append('robot/arm', b'arm-moving', KIND_STATE)
+        journal.append('robot/stop', b'stopped', KIND_STOP)
+        journal.append('robot', b'stopped-state', KIND_STATE)
+        assert drain(journal) == [('robot/stop', b'stopped'), ('robot/arm', b'arm-moving'),
+                                  ('robot', b'stopped-state')]
+        assert journal.stats()['superseded'] == 2
+        journal.close()
+
+
+def test_live_stop_supersedes_journaled_snapshots_of_its_robot(tmp_path):
+    journal = open_journal(tmp_path, COMPACTION_NONE)
+    journal.append('robot/arm', b'arm-1', KIND_STATE)
+    journal.append('robot/rover', b'rover-1', KIND_STATE)
+    journal.append('robot/arm', b'arm-2', KIND_STATE)
+    journal.supersede_states('robot/arm/stop')
+    assert drain(journal) == [('robot/rover', b'rover-1')]
+    journal.close()
+
+
+def test_latest_compaction_keeps_one_snapshot_per_topic(tmp_path):
+    journal = open_journal(tmp_path)
+    for n in range(5):
+        journal.append('robot', f'state-{n}'.encode())
+    journal.append('robot/arm', b'arm')
+    assert len(journal) == 2
+    assert drain(journal) == [('robot', b'state-4'), ('robot/arm', b'arm')]
+    journal.close()
+
+
+def test_unacknowledged_records_are_offered_again_after_the_timeout(tmp_path):
+    journal = open_journal(tmp_path)
+    journal.append('robot', b'state')
+    record = journal.peek(now=10.0, resend_after=1.0)
+    record.sent_at = 10.0
+    assert journal.peek(now=10.5, resend_after=1.0) is None
+    assert journal.next_resend(1.0) == 11.0
+    assert journal.peek(now=11.0, resend_after=1.0) is record
+    assert journal.consume(record)
+    assert not journal.consume(record)
+    journal.close()
+
+
+def test_live_records_survive_a_reopen(tmp_path):
+    journal = open_journal(tmp_path, COMPACTION_NONE)
+    journal.append('robot', b'old')
+    journal.append('robot/stop', b'stopped', KIND_STOP)
+    journal.append('robot', b'new')
+    record = journal.peek()
+    assert journal.consume(record)
+    journal.close()
+
+    journal = open_journal(tmp_path, COMPACTION_NONE)
+    assert journal.recovered == 1
+    assert drain(journal) == [('robot', b'new')]
+    journal.close()
+
+
+def test_full_journal_evicts_snapshots_but_keeps_stops(tmp_path):
+    journal = open_journal(tmp_path, COMPACTION_NONE, capacity=8 * 1024)
+    journal.append('robot/stop', b'stopped', KIND_STOP)
+    for n in range(200):
+        journal.append('robot/arm', b'x' * 100)
+    stats = journal.stats()
+    assert stats['evicted'] > 0 and stats['pending_stops'] == 1
+    assert journal.peek().kind == KIND_STOP
+    journal.close()
+
+
+def test_state_topic_of():
+    assert state_topic_of('robot/stop') == 'robot'
+    assert state_topic_of('robot/arm/stop') == 'robot/arm'
+    assert state_topic_of('robot/arm') is None
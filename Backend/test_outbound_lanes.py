@@ -0,0 +1,111 @@
+"""
+OutboundLanes, the scheduling under both MQTT front ends: lane order, backoff,
+journaling behind a backlog, paced replay and acks
+"""
+
+from async_mqtt import AsyncMQTTBridge
+from mqtt_publisher import MQTTPublisher
+from outbound_journal import OutboundJournal
+from outbound_lanes import OutboundLanes
+
+
+def make_lanes(tmp_path=None, **kwargs):
+    journal = None
+    if tmp_path is not None:
+        journal = OutboundJournal(str(tmp_path / 'outbound.journal'), capacity=64 * 1024, sync_interval=0)
+    lanes = OutboundLanes(retry_interval=1.0, journal=journal, **kwargs)
+    lanes.open_journal()
+    return lanes
+
+
+def publish(lanes, now, mids):
+    """Send everything due at now; mids is an iterator of results (None for a failure)"""
+    sent = []
+    while True:
+        outgoing = lanes.next_send(now)
+        if outgoing is None:
+            return sent
+        mid = next(mids)
+        lanes.sent(outgoing, mid, now)
+        sent.append((outgoing[1][0], outgoing[1][1], mid))
+
+
+def counter(start=1):
+    while True:
+        yield start
+        start += 1
+
+
+def test_stops_go_first_and_snapshots_wait_behind_a_failing_one():
+    lanes = make_lanes()
+    lanes.submit('robot', b'moving', 0.0)
+    assert lanes.submit_priority('robot/stop', b'stop', 1, 0.0, 0.0)
+    assert publish(lanes, 0.0, iter([None])) == [('robot/stop', b'stop', None)]
+    # Both lanes back off; the stop is retried ahead of the snapshot
+    assert lanes.next_due(0.5) == 1.0
+    assert publish(lanes, 1.0, counter()) == [('robot/stop', b'stop', 1), ('robot', b'moving', 2)]
+    assert lanes.next_due(1.0) is None
+
+
+def test_priority_lane_is_bounded():
+    lanes = make_lanes(max_priority=2)
+    assert lanes.submit_priority('robot/stop', b'1', 1, None, 0.0)
+    assert lanes.submit_priority('robot/stop', b'2', 1, None, 0.0)
+    assert not lanes.submit_priority('robot/stop', b'3', 1, None, 0.0)
+    assert lanes.stats()['priority']['queue_depth'] == 2
+
+
+def test_both_front_ends_bound_the_priority_lane():
+    publisher = MQTTPublisher(lambda *args: 1, max_priority=1)
+    bridge = AsyncMQTTBridge('localhost', 1883, use_tls=False, max_priority=1)
+    for front_end in (publisher, bridge):
+        assert front_end.submit_priority('robot/stop', b'1')
+        assert not front_end.submit_priority('robot/stop', b'2')
+
+
+def test_outage_journals_in_order_and_replay_waits_for_acks(tmp_path):
+    lanes = make_lanes(tmp_path, replay_rate=10.0, replay_window=1, ack_timeout=5.0)
+    lanes.submit('robot/a', b'a1')
+    assert publish(lanes, 0.0, iter([None])) == [('robot/a', b'a1', None)]
+    # Newer snapshots wait in memory out the backoff, then queue up on disk behind the backlog
+    lanes.submit('robot/b', b'b1')
+    assert publish(lanes, 0.5, iter([])) == []
+    assert lanes.stats()['queue_depth'] == 1
+    assert publish(lanes, 1.0, iter([7])) == [('robot/a', b'a1', 7)]
+    assert lanes.stats()['journal']['pending'] == 2
+    # One in flight fills the window: nothing more until its ack, or until it is due again
+    assert publish(lanes, 2.0, iter([])) == []
+    assert lanes.next_due(2.0) == 6.0
+    assert lanes.acknowledge(7, 2.0)
+    # Replayed snapshots are paced at replay_rate
+    assert lanes.next_due(2.0) == 1.1
+    assert publish(lanes, 2.0, iter([8])) == [('robot/b', b'b1', 8)]
+    # Unacknowledged past ack_timeout: offered again
+    assert publish(lanes, 6.9, iter([])) == []
+    assert publish(lanes, 7.0, iter([9])) == [('robot/b', b'b1', 9)]
+    # Both copies are acknowledged; the record is consumed once
+    assert lanes.acknowledge(8, 7.0) and lanes.acknowledge(9, 7.0)
+    stats = lanes.stats()['journal']
+    assert stats['pending'] == 0 and stats['replayed'] == 2
+
+
+def test_a_live_stop_overtakes_and_supersedes_journaled_motion(tmp_path):
+    lanes = make_lanes(tmp_path)
+    lanes.submit('robot', b'moving')
+    publish(lanes, 0.0, iter([None]))
+    lanes.submit_priority('robot/stop', b'stop', 1, None, 0.5)
+    assert publish(lanes, 0.5, iter([1])) == [('robot/stop', b'stop', 1)]
+    # The motion from before the stop is never replayed after it
+    assert lanes.stats()['journal']['pending'] == 0
+    assert publish(lanes, 2.0, iter([])) == []
+
+
+def test_an_ack_that_beats_sent_is_matched():
+    lanes = make_lanes()
+    lanes.submit_priority('robot/stop', b'stop', 1, 0.0, 0.0)
+    outgoing = lanes.next_send(0.0)
+    assert not lanes.acknowledge(1, 0.01)
+    lanes.sent(outgoing, 1, 0.02)
+    stats = lanes.stats()['priority']
+    assert stats['awaiting_ack'] == 0 and stats['ingest_to_puback']['count'] == 1
+    assert lanes.backlog(0.02) == (0, 0.0)
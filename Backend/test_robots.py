@@ -0,0 +1,52 @@
+"""
+Robot ids and per-robot topics
+"""
+
+import pytest
+
+from robots import (RobotRegistry, InvalidRobotId, UnknownRobot, FleetFull, DEFAULT_ROBOT_ID, valid_robot_id,
+                    state_topic, stop_topic)
+
+
+def make_registry(max_robots=4):
+    return RobotRegistry(lambda: None, lambda *args: None, lambda *args: None, 'robot', 'robot/stop',
+                         max_robots=max_robots)
+
+
+def test_valid_robot_ids():
+    assert valid_robot_id('arm-1')
+    assert valid_robot_id('Rover_2')
+    for robot_id in ('', 'a/b', 'a+b', '#', 'a b', 'x' * 65):
+        assert not valid_robot_id(robot_id), robot_id
+
+
+def test_reserved_ids_would_collide_with_server_topics():
+    for robot_id in ('stop', 'format', 'STOP', 'probe', 'cluster', 'robot-probe', 'robot-cluster'):
+        assert not valid_robot_id(robot_id), robot_id
+
+
+def test_topics():
+    assert state_topic('robot', DEFAULT_ROBOT_ID) == 'robot'
+    assert stop_topic('robot', 'robot/stop', DEFAULT_ROBOT_ID) == 'robot/stop'
+    assert state_topic('robot', 'arm') == 'robot/arm'
+    assert stop_topic('robot', 'robot/stop', 'arm') == 'robot/arm/stop'
+
+
+def test_registry_rejects_invalid_and_unknown_ids():
+    registry = make_registry()
+    with pytest.raises(InvalidRobotId):
+        registry.get('stop')
+    with pytest.raises(InvalidRobotId):
+        registry.get('format', create=False)
+    with pytest.raises(UnknownRobot) as raised:
+        registry.get('arm', create=False)
+    assert not isinstance(raised.value, InvalidRobotId)
+    assert registry.get('arm').topic == 'robot/arm'
+    assert registry.get('arm', create=False) is registry.get('arm')
+
+
+def test_registry_limit():
+    registry = make_registry(max_robots=2)
+    registry.get('arm')
+    with pytest.raises(FleetFull):
+        registry.get('rover')
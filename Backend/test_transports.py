@@ -0,0 +1,70 @@
+"""
+TransportRouter: probing only when there is a transport to switch to
+"""
+
+import time
+
+from transports import Transport, TransportRouter, open_transports
+
+
+class FakeTransport(Transport):
+    """Always connected; counts probes and sends, answers probes at once"""
+
+    kind = 'fake'
+
+    def __init__(self, name, **kwargs):
+        super().__init__(name, **kwargs)
+        self.probes = 0
+        self.messages = []
+
+    def connected(self):
+        return True
+
+    def _send(self, topic, payload, qos, tag):
+        self.messages.append(topic)
+        return True
+
+    def _send_probe(self, sent_at):
+        self.probes += 1
+        self._probe_answered(sent_at)
+        return True
+
+
+def test_single_transport_is_not_probed():
+    cloud = FakeTransport('cloud')
+    router = TransportRouter([cloud], probe_interval=0.02).start()
+    try:
+        time.sleep(0.2)
+        assert router.send('robot', b'state', 1)
+    finally:
+        router.stop()
+    assert cloud.probes == 0
+    assert cloud.messages == ['robot']
+    assert router.active is cloud and router.failovers == 0
+    assert not router.stats()['probing']
+
+
+def test_alternatives_are_probed_and_the_fastest_wins():
+    udp, cloud = FakeTransport('udp'), FakeTransport('cloud')
+    router = TransportRouter([udp, cloud], probe_interval=0.02).start()
+    try:
+        time.sleep(0.2)
+    finally:
+        router.stop()
+    assert udp.probes > 1 and cloud.probes > 1
+    assert router.active in (udp, cloud)
+
+
+def test_pinned_transport_is_used_alone():
+    cloud = FakeTransport('cloud')
+    transports = open_transports(cloud, udp_address='127.0.0.1:7400', only='cloud')
+    assert transports == [cloud]
+    assert not TransportRouter(transports).probing
+
+
+def test_acknowledged_message_clears_failures():
+    cloud = FakeTransport('cloud', max_failures=2)
+    cloud.failures = 2
+    assert not cloud.healthy
+    cloud._delivered(1)
+    assert cloud.healthy
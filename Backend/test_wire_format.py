@@ -0,0 +1,70 @@
+"""
+bin1 frames: round trips, JSON fallback and per-send timestamps
+"""
+
+import json
+import time
+
+import pytest
+
+from state_store import RobotStateStore, DEFAULT_ROBOT_STATE
+from wire_format import (WireFormats, FORMAT_BINARY, FORMAT_JSON, FRAME_SIZE, encode_state, encode_stop,
+                         encode_delta, decode, restamp, peek_stamp, parse_offer)
+
+STATE = {'stopped': True, 'version': 7,
+         'hand': {'right': {'horizontal': 'left', 'active': True},
+                  'left': {'horizontal': 'straight', 'vertical': 'down', 'active': False}}}
+
+
+def test_state_round_trip():
+    frame = encode_state(STATE, timestamp=1234.5)
+    assert len(frame) == FRAME_SIZE
+    assert decode(frame) == dict(STATE, timestamp=1234.5)
+
+
+def test_stop_and_delta_round_trip():
+    assert decode(encode_stop(False, 2 ** 32 + 3, timestamp=1.0)) == {'stopped': False, 'version': 3, 'timestamp': 1.0}
+    changes = {'stopped': False, 'hand': {'left': {'vertical': 'up'}}}
+    assert decode(encode_delta(changes, 9, timestamp=2.0)) == dict(changes, seq=9, timestamp=2.0)
+
+
+def test_values_outside_the_enum_tables_fall_back_to_json():
+    odd = {'hand': {'right': {'horizontal': 'sideways'}}}
+    assert encode_state(odd) is None
+    assert encode_delta({'speed': 3}, 1) is None
+    formats = WireFormats()
+    formats.negotiate('robot', [FORMAT_BINARY])
+    assert json.loads(formats.encode('robot', odd)) == odd
+    assert formats.stats()['json_fallbacks'] == 1
+    assert decode(b'{"stopped": true}') == {'stopped': True}
+
+
+def test_malformed_frames_are_rejected():
+    frame = encode_state(STATE)
+    with pytest.raises(ValueError):
+        decode(frame[:-1])
+    with pytest.raises(ValueError):
+        decode(b'\xb2' + frame[1:])
+
+
+def test_cached_state_frame_is_stamped_on_every_send():
+    store = RobotStateStore(DEFAULT_ROBOT_STATE)
+    formats = WireFormats()
+    formats.negotiate('robot', parse_offer(b'bin1,json'))
+    first = formats.state_payload('robot', store, b'{}')
+    time.sleep(0.01)
+    second = formats.state_payload('robot', store, b'{}')
+    # Same version, encoded once, but each send carries its own time
+    assert peek_stamp(first)[0] == peek_stamp(second)[0]
+    assert peek_stamp(second)[1] > peek_stamp(first)[1]
+    assert first[:10] == second[:10]
+
+
+def test_restamp_leaves_json_alone():
+    assert restamp(b'{"stopped": false}') == b'{"stopped": false}'
+    assert peek_stamp(restamp(encode_state(STATE, timestamp=1.0), 5.0))[1] == 5.0
+
+
+def test_json_topics_get_the_json_payload():
+    store = RobotStateStore(DEFAULT_ROBOT_STATE)
+    assert WireFormats(FORMAT_JSON).state_payload('robot', store, b'{"a": 1}') == b'{"a": 1}'
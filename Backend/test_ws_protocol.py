@@ -0,0 +1,66 @@
+"""
+Sequenced WebSocket ingestion: resume from the client's own last seq
+"""
+
+import json
+
+from robots import RobotSession
+from wire_format import encode_delta
+from ws_protocol import IngestStream
+
+
+def make_session():
+    return RobotSession('arm', 'robot/arm', 'robot/arm/stop', None, lambda *args: None, lambda *args: None)
+
+
+def connect(robot, session):
+    stream = IngestStream({'op': 'hello', 'session': session}, 16, 50)
+    return stream, json.loads(stream.welcome(robot))
+
+
+def delta(seq, horizontal):
+    return json.dumps({'op': 'delta', 'seq': seq, 'hand': {'right': {'horizontal': horizontal}}})
+
+
+def test_reconnect_resumes_from_the_clients_own_session():
+    robot = make_session()
+    lens, welcome = connect(robot, 'lens')
+    assert welcome['last_seq'] is None
+    for seq in (1, 2, 3):
+        lens.receive(robot, delta(seq, 'left'), 0)
+    # Another client keeps sending after this one dropped
+    phone, _ = connect(robot, 'phone')
+    phone.receive(robot, delta(40, 'right'), 0)
+
+    _, welcome = connect(robot, 'lens')
+    assert welcome['last_seq'] == 3
+    _, welcome = connect(robot, 'phone')
+    assert welcome['last_seq'] == 40
+    _, welcome = connect(robot, 'tablet')
+    assert welcome['last_seq'] is None
+
+
+def test_binary_duplicates_are_dropped_per_session():
+    robot = make_session()
+    lens, _ = connect(robot, 'lens')
+    phone, _ = connect(robot, 'phone')
+    lens.receive(robot, encode_delta({'stopped': False}, 5), 0)
+    phone.receive(robot, encode_delta({'stopped': False}, 1), 0)
+    lens.receive(robot, encode_delta({'stopped': False}, 5), 0)
+    phone.receive(robot, encode_delta({'stopped': False}, 2), 0)
+    assert (lens.stale, phone.stale) == (1, 0)
+    assert (lens.last_seq, phone.last_seq) == (5, 2)
+
+
+def test_stop_from_a_second_device_with_a_slower_clock_is_applied():
+    robot = make_session()
+    lens, _ = connect(robot, 'lens')
+    phone, _ = connect(robot, 'phone')
+    lens.receive(robot, json.dumps({'op': 'delta', 'seq': 1, 'timestamp': 1000.0,
+                                    'hand': {'right': {'horizontal': 'left'}}}), 0)
+    # JSON and bin1 stops stamped 0.3 s behind the other device's last frame
+    created = phone.receive(robot, json.dumps({'op': 'delta', 'seq': 1, 'timestamp': 999.7, 'stopped': True}), 0)
+    assert created and robot.state_store.peek('stopped') is True
+    created = phone.receive(robot, encode_delta({'stopped': False}, 2, timestamp=999.8), 0)
+    assert created and robot.state_store.peek('stopped') is False
+    assert phone.stale == 0 and phone.last_seq == 2
@@ -0,0 +1,761 @@
+"""
+Delivery paths to the robot
+Robot commands can leave over several transports: the cloud MQTT broker, an
+MQTT broker on the robot's local network, or straight to the robot as UDP
+datagrams. TransportRouter probes each one's round trip, sends over the
+fastest healthy one and fails over to the next when a send fails, probes go
+unanswered or an acknowledged message is never acknowledged. A transport has
+to be switch_margin faster than the active one to take over, so two similar
+paths do not flap. With a single transport (the default, or one pinned with
+ROBOT_TRANSPORT) there is nothing to choose, so nothing is probed.
+
+For MQTT transports the probe is a QoS 1 publish on a topic nobody
+subscribes to, timed until the broker's PUBACK; for UDP it is a ping that
+the robot's receiver echoes.
+
+UDP datagram, big-endian:
+
+    offset  size  field
+    0       2     magic b'KU'
+    2       1     kind: 1 data, 2 ack, 3 ping, 4 pong
+    3       1     flags: bit 0 ack requested
+    4       4     epoch: random per sender start, so a restarted server is not
+                  mistaken for an old one
+    8       4     sequence (per sender, mod 2**32)
+    12      1     topic length n
+    13      n     topic (UTF-8)
+    13+n    ...   payload (the same bytes that would go to MQTT)
+
+Data goes out `copies` times; QoS 1 and above also asks for an ack and is
+retransmitted until it arrives (after `retries` the router resends it over
+another transport). The receiver (UDPReceiver, for the robot side) acks
+every datagram that asks and passes a message on only if its sequence is
+newer than the last one it passed on for that topic, so copies,
+retransmissions and reordered datagrams are dropped.
+"""
+
+import random
+import socket
+import ssl
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+from urllib.parse import urlparse
+
+import paho.mqtt.client as mqtt
+
+import metrics
+from event_log import events
+from outbound_lanes import LatencyWindow
+from mqtt_supervisor import MQTTSupervisor, Backoff
+from mqtt5 import MQTT5Session, new_client, PROTOCOL_V311, PROTOCOL_V5
+
+TRANSPORT_CLOUD = 'cloud'
+TRANSPORT_LOCAL = 'local'
+TRANSPORT_UDP = 'udp'
+
+UDP_MAGIC = b'KU'
+DATAGRAM_DATA = 1
+DATAGRAM_ACK = 2
+DATAGRAM_PING = 3
+DATAGRAM_PONG = 4
+FLAG_ACK_REQUESTED = 0x01
+
+_HEADER = struct.Struct('!2sBBIIB')
+HEADER_SIZE = _HEADER.size
+_SEQ_MOD = 2 ** 32
+
+# Tag of probe publishes awaiting their PUBACK
+_PROBE = object()
+
+
+def encode_datagram(kind, epoch, seq, topic='', payload=b'', flags=0):
+    topic_bytes = topic.encode('utf-8')
+    if len(topic_bytes) > 255:
+        raise ValueError(f"topic too long for a datagram: {topic}")
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    return _HEADER.pack(UDP_MAGIC, kind, flags, epoch, seq % _SEQ_MOD, len(topic_bytes)) + topic_bytes + payload
+
+
+def decode_datagram(data):
+    """(kind, flags, epoch, seq, topic, payload); ValueError if it is not one of ours"""
+    if len(data) < HEADER_SIZE:
+        raise ValueError("short datagram")
+    magic, kind, flags, epoch, seq, topic_length = _HEADER.unpack_from(data)
+    if magic != UDP_MAGIC:
+        raise ValueError("not a robot datagram")
+    end = HEADER_SIZE + topic_length
+    if len(data) < end:
+        raise ValueError("truncated topic")
+    return kind, flags, epoch, seq, data[HEADER_SIZE:end].decode('utf-8'), data[end:]
+
+
+def seq_newer(seq, last):
+    """seq was sent after last, allowing for wrap-around"""
+    return 0 < (seq - last) % _SEQ_MOD < _SEQ_MOD // 2
+
+
+def parse_udp_address(value, default_port):
+    """'host[:port]' -> (host, port)"""
+    host, _, port = value.rpartition(':') if ':' in value else (value, '', '')
+    return host, int(port) if port else default_port
+
+
+class Transport:
+    """One way to reach the robot; subclasses implement connected(), _send() and _send_probe()"""
+
+    kind = None
+
+    def __init__(self, name, probe_timeout=1.0, max_failures=3):
+        self.name = name
+        self.probe_timeout = probe_timeout
+        self.max_failures = max_failures
+        self.rtt = LatencyWindow(100)
+        # Smoothed round trip (seconds, as TCP's SRTT), None until a probe came back
+        self.srtt = None
+        # Unanswered probes / lost messages since the last answer
+        self.failures = 0
+        self.sent = 0
+        self.failed = 0
+        self.lost = 0
+        self._probe_sent_at = None
+        self._lock = threading.Lock()
+        self._router = None
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def connected(self):
+        raise NotImplementedError
+
+    def _can_probe(self):
+        return self.connected()
+
+    @property
+    def healthy(self):
+        return self.failures < self.max_failures and self.connected()
+
+    def send(self, topic, payload, qos, tag):
+        """Send one message; True if it went out. With qos > 0 the router hears about tag once it is acked"""
+        try:
+            sent = self._send(topic, payload, qos, tag)
+        except Exception as e:
+            events.error('transport.send_failed', "❌ Robot transport send failed", transport=self.name,
+                         topic=topic, error=str(e))
+            sent = False
+        if sent:
+            self.sent += 1
+            metrics.TRANSPORT_MESSAGES.inc(self.name, 'sent')
+        else:
+            self.failed += 1
+            metrics.TRANSPORT_MESSAGES.inc(self.name, 'failed')
+        return sent
+
+    def probe(self):
+        """Send a round-trip probe unless one is still out; an unanswered one counts as a failure"""
+        now = time.monotonic()
+        with self._lock:
+            if self._probe_sent_at is not None:
+                if now - self._probe_sent_at < self.probe_timeout:
+                    return
+                self._probe_sent_at = None
+                self.failures += 1
+            if not self._can_probe():
+                return
+            self._probe_sent_at = now
+        try:
+            sent = self._send_probe(now)
+        except Exception:
+            sent = False
+        if not sent:
+            with self._lock:
+                self._probe_sent_at = None
+                self.failures += 1
+
+    def _probe_answered(self, sent_at):
+        with self._lock:
+            # Too late (already counted as a failure) or not the probe in flight
+            if self._probe_sent_at is None or sent_at != self._probe_sent_at:
+                return
+            self._probe_sent_at = None
+            rtt = time.monotonic() - sent_at
+            self.rtt.add(rtt)
+            self.srtt = rtt if self.srtt is None else self.srtt + (rtt - self.srtt) / 8
+            self.failures = 0
+        metrics.TRANSPORT_RTT.observe(rtt, self.name)
+
+    def _delivered(self, tag):
+        # An acknowledged message answers for the path as well as a probe does
+        with self._lock:
+            self.failures = 0
+        if self._router is not None:
+            self._router.delivered(tag)
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'type': self.kind,
+            'connected': self.connected(),
+            'healthy': self.healthy,
+            'srtt_ms': round(self.srtt * 1000, 3) if self.srtt is not None else None,
+            'rtt': self.rtt.summary(),
+            'failures': self.failures,
+            'sent': self.sent,
+            'failed': self.failed,
+            'lost': self.lost
+        }
+
+
+class MQTTTransport(Transport):
+    """A broker connection managed elsewhere: publish(topic, payload, qos) -> mid or falsy
+
+    Whoever owns the client must call acknowledge(mid) from its on_publish callback.
+    """
+
+    kind = 'mqtt'
+
+    def __init__(self, name, publish, connected, probe_topic='robot-probe', **kwargs):
+        super().__init__(name, **kwargs)
+        self._publish = publish
+        self._is_connected = connected
+        self.probe_topic = probe_topic
+        # mid -> (tag, sent_at, topic, payload, qos) for QoS 1+ publishes and probes; acks that
+        # beat publish() back wait in _early
+        self._awaiting = OrderedDict()
+        self._early = deque(maxlen=64)
+
+    def connected(self):
+        return bool(self._is_connected())
+
+    def _send(self, topic, payload, qos, tag):
+        mid = self._publish(topic, payload, qos)
+        if not mid:
+            return False
+        if qos > 0:
+            self._expect(mid, (tag, time.monotonic(), topic, payload, qos))
+        return True
+
+    def _send_probe(self, sent_at):
+        mid = self._publish(self.probe_topic, b'', 1)
+        if mid:
+            self._expect(mid, (_PROBE, sent_at, None, None, 1))
+        return bool(mid)
+
+    def _expect(self, mid, entry):
+        with self._lock:
+            if mid in self._early:
+                self._early.remove(mid)
+                acked = True
+            else:
+                acked = False
+                self._awaiting[mid] = entry
+                if len(self._awaiting) > 1024:
+                    # Acks lost to a disconnect; forget the oldest
+                    self._awaiting.popitem(last=False)
+        if acked:
+            self._settle(entry)
+
+    def acknowledge(self, mid):
+        """PUBACK for mid (from the client's on_publish)"""
+        with self._lock:
+            entry = self._awaiting.pop(mid, None)
+            if entry is None:
+                self._early.append(mid)
+                return
+        self._settle(entry)
+
+    def disconnected(self):
+        """The connection dropped (its owner's on_disconnect): unacknowledged messages go out over another transport"""
+        with self._lock:
+            stranded = [entry for entry in self._awaiting.values() if entry[0] is not _PROBE]
+            self._awaiting.clear()
+        for tag, _, topic, payload, qos in stranded:
+            self.lost += 1
+            metrics.TRANSPORT_MESSAGES.inc(self.name, 'lost')
+            if self._router is not None:
+                self._router.lost(self, topic, payload, qos, tag)
+
+    def _settle(self, entry):
+        tag, sent_at = entry[0], entry[1]
+        if tag is _PROBE:
+            self._probe_answered(sent_at)
+        else:
+            self._delivered(tag)
+
+    def stats(self):
+        stats = super().stats()
+        stats['probe_topic'] = self.probe_topic
+        stats['awaiting_ack'] = len(self._awaiting)
+        return stats
+
+
+class BrokerTransport(MQTTTransport):
+    """MQTT transport with a connection of its own (e.g. a broker on the robot's LAN)"""
+
+    def __init__(self, name, host, port, client_id, username=None, password=None, use_tls=False,
+                 protocol=PROTOCOL_V311, max_inflight=20, message_expiry=1, max_age=0.3, stamp=True, **kwargs):
+        self.host = host
+        self.port = port
+        self.client = new_client(client_id, protocol)
+        # MQTT v5 publishing (mqtt5.py)
+        self.session = None
+        if protocol == PROTOCOL_V5:
+            self.session = MQTT5Session(self.client, message_expiry, max_age, max_inflight, stamp=stamp)
+        else:
+            self.client.max_inflight_messages_set(max_inflight)
+        if username:
+            self.client.username_pw_set(username, password)
+        if use_tls:
+            context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            self.client.tls_set_context(context)
+        self.client.on_publish = lambda client, userdata, mid: self.acknowledge(mid)
+        self._supervisor = None
+        super().__init__(name, self._publish_now, lambda: self._supervisor is not None and self._supervisor.connected,
+                         **kwargs)
+
+    def start(self):
+        self._supervisor = MQTTSupervisor(self.client, self.host, self.port, keepalive=30,
+                                          backoff=Backoff(0.2, 5.0), session=self.session,
+                                          on_disconnect=lambda client, userdata, rc: self.disconnected()).start()
+
+    def stop(self):
+        if self._supervisor:
+            self._supervisor.stop()
+
+    def _publish_now(self, topic, payload, qos):
+        if not self.connected():
+            return None
+        publish = self.session.publish if self.session else self.client.publish
+        result = publish(topic, payload, qos=qos, retain=False)
+        return result.mid if result.rc == mqtt.MQTT_ERR_SUCCESS else None
+
+    def stats(self):
+        stats = super().stats()
+        stats['broker'] = f"{self.host}:{self.port}"
+        stats['connection'] = self._supervisor.stats() if self._supervisor else None
+        return stats
+
+
+class UDPTransport(Transport):
+    """Datagrams straight to the robot's UDPReceiver at (host, port)"""
+
+    kind = 'udp'
+
+    def __init__(self, name, address, copies=2, retries=5, min_retry_interval=0.02, silence_timeout=3.0,
+                 **kwargs):
+        super().__init__(name, **kwargs)
+        self.address = address
+        self.copies = max(1, copies)
+        self.retries = retries
+        self.min_retry_interval = min_retry_interval
+        # Connected while the robot has answered within this long (seconds)
+        self.silence_timeout = silence_timeout
+        self.retransmitted = 0
+        self._epoch = random.getrandbits(32)
+        self._seq = 0
+        self._ping_seq = 0
+        self._pings = {}
+        self._heard_at = None
+        # seq -> [datagram, topic, payload, qos, tag, retransmit_at, tries]
+        self._unacked = OrderedDict()
+        self._sock = None
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.connect(self.address)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=f"transport-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join(2.0)
+        if self._sock is not None:
+            self._sock.close()
+
+    def connected(self):
+        heard_at = self._heard_at
+        return heard_at is not None and time.monotonic() - heard_at < self.silence_timeout
+
+    def _can_probe(self):
+        # Pings are how the robot is found in the first place
+        return self._sock is not None
+
+    def _retry_interval(self):
+        srtt = self.srtt
+        return max(self.min_retry_interval, 2 * srtt) if srtt is not None else 0.1
+
+    def _send(self, topic, payload, qos, tag):
+        if self._sock is None:
+            return False
+        with self._lock:
+            self._seq = (self._seq + 1) % _SEQ_MOD
+            seq = self._seq
+            datagram = encode_datagram(DATAGRAM_DATA, self._epoch, seq, topic, payload,
+                                       FLAG_ACK_REQUESTED if qos > 0 else 0)
+            if qos > 0:
+                self._unacked[seq] = [datagram, topic, payload, qos, tag,
+                                      time.monotonic() + self._retry_interval(), 0]
+        try:
+            for _ in range(self.copies):
+                self._sock.send(datagram)
+        except OSError:
+            with self._lock:
+                self._unacked.pop(seq, None)
+            return False
+        return True
+
+    def _send_probe(self, sent_at):
+        with self._lock:
+            self._ping_seq = (self._ping_seq + 1) % _SEQ_MOD
+            self._pings = {self._ping_seq: sent_at}
+            datagram = encode_datagram(DATAGRAM_PING, self._epoch, self._ping_seq)
+        try:
+            self._sock.send(datagram)
+        except OSError:
+            return False
+        return True
+
+    def _run(self):
+        while self._running:
+            self._sock.settimeout(self._next_timeout())
+            try:
+                data = self._sock.recv(65535)
+            except socket.timeout:
+                data = None
+            except OSError:
+                # ICMP port unreachable surfaces here on a connected socket
+                data = None
+                time.sleep(0.05)
+            if data:
+                self._receive(data)
+            self._retransmit()
+
+    def _next_timeout(self):
+        with self._lock:
+            if not self._unacked:
+                return 0.25
+            due = min(entry[5] for entry in self._unacked.values())
+        return min(0.25, max(0.001, due - time.monotonic()))
+
+    def _receive(self, data):
+        try:
+            kind, _, epoch, seq, _, _ = decode_datagram(data)
+        except ValueError:
+            return
+        if epoch != self._epoch:
+            return
+        self._heard_at = time.monotonic()
+        if kind == DATAGRAM_ACK:
+            with self._lock:
+                entry = self._unacked.pop(seq, None)
+                self.failures = 0
+            if entry is not None:
+                self._delivered(entry[4])
+        elif kind == DATAGRAM_PONG:
+            with self._lock:
+                sent_at = self._pings.pop(seq, None)
+            if sent_at is not None:
+                self._probe_answered(sent_at)
+
+    def _retransmit(self):
+        now = time.monotonic()
+        resend, lost = [], []
+        with self._lock:
+            for seq, entry in list(self._unacked.items()):
+                if entry[5] > now:
+                    continue
+                if entry[6] >= self.retries:
+                    del self._unacked[seq]
+                    lost.append((seq, entry))
+                else:
+                    entry[6] += 1
+                    entry[5] = now + self._retry_interval() * (entry[6] + 1)
+                    resend.append(entry[0])
+        for datagram in resend:
+            try:
+                self._sock.send(datagram)
+                self.retransmitted += 1
+                metrics.TRANSPORT_MESSAGES.inc(self.name, 'retransmitted')
+            except OSError:
+                pass
+        for seq, entry in lost:
+            _, topic, payload, qos, tag, _, _ = entry
+            self.lost += 1
+            metrics.TRANSPORT_MESSAGES.inc(self.name, 'lost')
+            # The robot has stopped acking: take this path out until it answers again
+            self.failures = self.max_failures
+            if self._router is None or not self._router.lost(self, topic, payload, qos, tag):
+                # Nowhere else to send it: keep trying here, slowly
+                entry[5], entry[6] = now + 1.0, 0
+                with self._lock:
+                    self._unacked[seq] = entry
+
+    def stats(self):
+        stats = super().stats()
+        stats.update(address=f"{self.address[0]}:{self.address[1]}", copies=self.copies,
+                     unacked=len(self._unacked), retransmitted=self.retransmitted)
+        return stats
+
+
+class UDPReceiver:
+    """Robot side of UDPTransport: acks, answers pings and passes each topic's newer messages to on_message"""
+
+    def __init__(self, on_message, host='0.0.0.0', port=7400):
+        # on_message(topic, payload) runs on the receiver thread
+        self.on_message = on_message
+        self.host = host
+        self.port = port
+        self.received = 0
+        self.delivered = 0
+        self.duplicates = 0
+        self.invalid = 0
+        # topic -> (epoch, seq) of the last message passed on
+        self._last = {}
+        self._sock = None
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((self.host, self.port))
+        self._sock.settimeout(0.25)
+        self.port = self._sock.getsockname()[1]
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="udp-receiver", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join(2.0)
+        if self._sock is not None:
+            self._sock.close()
+
+    def _run(self):
+        while self._running:
+            try:
+                data, address = self._sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                if not self._running:
+                    return
+                continue
+            self.handle(data, address)
+
+    def handle(self, data, address):
+        try:
+            kind, flags, epoch, seq, topic, payload = decode_datagram(data)
+        except ValueError:
+            self.invalid += 1
+            return
+        if kind == DATAGRAM_PING:
+            self._reply(encode_datagram(DATAGRAM_PONG, epoch, seq), address)
+            return
+        if kind != DATAGRAM_DATA:
+            return
+        self.received += 1
+        if flags & FLAG_ACK_REQUESTED:
+            self._reply(encode_datagram(DATAGRAM_ACK, epoch, seq), address)
+        last = self._last.get(topic)
+        # A new epoch is a restarted sender: start over with its sequence numbers
+        if last is not None and last[0] == epoch and not seq_newer(seq, last[1]):
+            self.duplicates += 1
+            return
+        self._last[topic] = (epoch, seq)
+        self.delivered += 1
+        self.on_message(topic, payload)
+
+    def _reply(self, datagram, address):
+        try:
+            self._sock.sendto(datagram, address)
+        except OSError:
+            pass
+
+    def stats(self):
+        return {'port': self.port, 'received': self.received, 'delivered': self.delivered,
+                'duplicates': self.duplicates, 'invalid': self.invalid}
+
+
+class TransportRouter:
+    """Sends each message over the fastest healthy transport and fails over down the list"""
+
+    def __init__(self, transports, on_ack=None, probe_interval=1.0, switch_margin=0.2):
+        # transports in order of preference while their round trips are unknown;
+        # on_ack(tag) runs (on a transport's thread) when a QoS 1+ message is acknowledged
+        self.transports = list(transports)
+        self.on_ack = on_ack
+        self.probe_interval = probe_interval
+        self.switch_margin = switch_margin
+        self.active = None
+        self.switches = 0
+        self.failovers = 0
+        self.resent = 0
+        self._next_tag = 0
+        # Until every transport has had time to answer a probe, the fastest one wins outright
+        self._warm_until = None
+        # Probing only pays off when there is an alternative to switch to
+        self.probing = len(self.transports) > 1
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+        for transport in self.transports:
+            transport._router = self
+
+    def start(self):
+        for transport in self.transports:
+            transport.start()
+        if not self.probing:
+            self.active = self.transports[0] if self.transports else None
+            return self
+        self._warm_until = time.monotonic() + self.probe_interval + max(
+            (transport.probe_timeout for transport in self.transports), default=0.0)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="transport-probe", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join(2.0)
+        for transport in self.transports:
+            transport.stop()
+
+    def get(self, name):
+        for transport in self.transports:
+            if transport.name == name:
+                return transport
+        return None
+
+    def available(self):
+        """Some transport can take a message right now"""
+        return any(transport.connected() for transport in self.transports)
+
+    def send(self, topic, payload, qos):
+        """Send over the active transport, else the next one that takes it; returns a tag for acks, or None"""
+        with self._lock:
+            self._next_tag = self._next_tag % 0x7FFFFFFF + 1
+            tag = self._next_tag
+            active = self.active
+        for transport in self._candidates():
+            if transport.send(topic, payload, qos, tag):
+                if transport is not active:
+                    self.failovers += 1
+                return tag
+        return None
+
+    def delivered(self, tag):
+        if self.on_ack is not None:
+            self.on_ack(tag)
+
+    def lost(self, transport, topic, payload, qos, tag):
+        """transport gave up on an acknowledged message: resend it elsewhere; False if nothing took it"""
+        if not self.probing:
+            return False
+        self._choose()
+        for other in self._candidates():
+            if other is not transport and other.send(topic, payload, qos, tag):
+                self.resent += 1
+                events.warning('transport.resent', "🔁 Unacknowledged message resent over another transport",
+                               lost_on=transport.name, resent_on=other.name, topic=topic)
+                return True
+        return False
+
+    def _ranked(self):
+        healthy = [transport for transport in self.transports if transport.healthy]
+        measured = sorted((transport for transport in healthy if transport.srtt is not None),
+                          key=lambda transport: transport.srtt)
+        return measured + [transport for transport in healthy if transport.srtt is None]
+
+    def _candidates(self):
+        # Active first, then the rest by round trip; unhealthy but connected ones as a last resort
+        active = self.active
+        ranked = self._ranked()
+        ordered = ([active] if active in ranked else []) + [t for t in ranked if t is not active]
+        return ordered + [t for t in self.transports if t not in ordered and t.connected()]
+
+    def _choose(self):
+        ranked = self._ranked()
+        with self._lock:
+            current = self.active
+            best = ranked[0] if ranked else None
+            warm = self._warm_until is None or time.monotonic() >= self._warm_until
+            if warm and current in ranked and best is not current:
+                # Only switch for a clearly faster path
+                if best.srtt is None or (current.srtt is not None and
+                                         best.srtt >= current.srtt * (1 - self.switch_margin)):
+                    best = current
+            if best is current:
+                return
+            self.active = best
+            self.switches += 1
+        metrics.TRANSPORT_SWITCHES.inc()
+        if best is None:
+            events.warning('transport.unavailable', "⚠️ No robot transport is healthy",
+                           previous=current.name if current else None)
+        else:
+            events.info('transport.switched', "🔀 Robot transport switched", previous=current.name if current else None,
+                        active=best.name, rtt_ms=round(best.srtt * 1000, 2) if best.srtt is not None else None)
+
+    def _run(self):
+        while self._running:
+            for transport in self.transports:
+                transport.probe()
+            self._choose()
+            # Probes come back within the interval; choose again once they have
+            deadline = time.monotonic() + self.probe_interval
+            while self._running and time.monotonic() < deadline:
+                time.sleep(min(0.05, self.probe_interval))
+                if self.active is None or not self.active.healthy:
+                    self._choose()
+
+    def stats(self):
+        return {
+            'active': self.active.name if self.active else None,
+            'switches': self.switches,
+            'failovers': self.failovers,
+            'resent': self.resent,
+            'probing': self.probing,
+            'probe_interval': self.probe_interval,
+            'switch_margin': self.switch_margin,
+            'transports': [transport.stats() for transport in self.transports]
+        }
+
+
+def open_transports(cloud, local_url='', udp_address='', only='auto', client_id='robot_local', udp_port=7400,
+                    copies=2, retries=5, probe_topic='robot-probe', protocol=PROTOCOL_V311, max_inflight=20,
+                    message_expiry=1, max_age=0.3, stamp=True):
+    """cloud (an MQTTTransport) plus the configured LAN transports, LAN first; only names one to use alone"""
+    transports = []
+    if udp_address:
+        transports.append(UDPTransport(TRANSPORT_UDP, parse_udp_address(udp_address, udp_port), copies=copies,
+                                       retries=retries))
+    if local_url:
+        parsed = urlparse(local_url)
+        if parsed.scheme not in ('mqtt', 'mqtts'):
+            raise ValueError(f"Unsupported local broker: {local_url}")
+        use_tls = parsed.scheme == 'mqtts'
+        transports.append(BrokerTransport(TRANSPORT_LOCAL, parsed.hostname or '127.0.0.1',
+                                          parsed.port or (8883 if use_tls else 1883), client_id,
+                                          username=parsed.username, password=parsed.password, use_tls=use_tls,
+                                          probe_topic=probe_topic, protocol=protocol, max_inflight=max_inflight,
+                                          message_expiry=message_expiry, max_age=max_age, stamp=stamp))
+    transports.append(cloud)
+    if only and only != 'auto':
+        transports = [transport for transport in transports if transport.name == only]
+        if not transports:
+            raise ValueError(f"Robot transport '{only}' is not configured")
+    return transports
@@ -0,0 +1,336 @@
+"""
+Robot command wire formats
+Commands go to the broker either as compact JSON ('json', the default and
+the fallback) or as a fixed 18-byte binary frame ('bin1'). Each robot picks
+its format per topic by publishing the formats it can decode, most preferred
+first, as a retained message on <state topic>/format (e.g. "bin1,json" on
+robot/format or robot/<id>/format); the server uses the first one it also
+speaks for that robot's state and stop topics.
+
+bin1 frame, little-endian:
+
+    offset  size  field
+    0       1     magic/version, 0xB1 (never '{' or whitespace, so a decoder
+                  can tell binary from JSON by the first byte)
+    1       1     kind: 0 state snapshot, 1 stop/resume transition,
+                  2 delta (client -> server, see ws_protocol.py)
+    2       1     flags: bit 0 stopped, bit 1 right.active, bit 2 left.active
+    3       1     right.horizontal code  (HORIZONTAL index)
+    4       1     left.horizontal code   (HORIZONTAL index)
+    5       1     left.vertical code     (VERTICAL index)
+    6       4     sequence: state version (mod 2**32); client seq in deltas
+    10      8     timestamp: float64 seconds since the epoch
+
+Stop frames leave the enum bytes at 0. Delta frames carry only some fields:
+flags bits 4-7 say which (stopped, right.horizontal, left.horizontal,
+left.vertical). States whose values are not in the enum tables cannot be
+framed and go out as JSON instead, so a bin1 decoder must also accept JSON;
+decode() handles both.
+"""
+
+import json
+import struct
+import threading
+import time
+
+from event_log import events
+
+FORMAT_JSON = 'json'
+FORMAT_BINARY = 'bin1'
+# Formats this server can produce, most compact first
+SUPPORTED_FORMATS = (FORMAT_BINARY, FORMAT_JSON)
+
+CAPABILITY_SUFFIX = 'format'
+
+MAGIC_V1 = 0xB1
+KIND_STATE = 0
+KIND_STOP = 1
+KIND_DELTA = 2
+
+FLAG_STOPPED = 0x01
+FLAG_RIGHT_ACTIVE = 0x02
+FLAG_LEFT_ACTIVE = 0x04
+# Delta frames: which fields are present
+FLAG_HAS_STOPPED = 0x10
+FLAG_HAS_RIGHT_H = 0x20
+FLAG_HAS_LEFT_H = 0x40
+FLAG_HAS_LEFT_V = 0x80
+
+HORIZONTAL = ('not active', 'left', 'right', 'straight')
+VERTICAL = ('not active', 'up', 'down', 'neutral')
+_HORIZONTAL_CODES = {value: code for code, value in enumerate(HORIZONTAL)}
+_VERTICAL_CODES = {value: code for code, value in enumerate(VERTICAL)}
+
+_FRAME = struct.Struct('<BBBBBBId')
+FRAME_SIZE = _FRAME.size
+_SEQUENCE = struct.Struct('<I')
+_STAMP = struct.Struct('<Id')
+_TIMESTAMP = struct.Struct('<d')
+_TIMESTAMP_OFFSET = 10
+
+
+def encode_state(state, timestamp=None):
+    """bin1 frame for a full robot state document, or None if it does not fit the enum tables"""
+    hand = state.get('hand')
+    if not isinstance(hand, dict):
+        return None
+    right = hand.get('right') or {}
+    left = hand.get('left') or {}
+    try:
+        right_h = _HORIZONTAL_CODES[right.get('horizontal', 'not active')]
+        left_h = _HORIZONTAL_CODES[left.get('horizontal', 'not active')]
+        left_v = _VERTICAL_CODES[left.get('vertical', 'not active')]
+    except (KeyError, TypeError):
+        return None
+    flags = ((FLAG_STOPPED if state.get('stopped') else 0)
+             | (FLAG_RIGHT_ACTIVE if right.get('active', True) else 0)
+             | (FLAG_LEFT_ACTIVE if left.get('active', True) else 0))
+    return _FRAME.pack(MAGIC_V1, KIND_STATE, flags, right_h, left_h, left_v,
+                       int(state.get('version', 0)) & 0xFFFFFFFF,
+                       time.time() if timestamp is None else timestamp)
+
+
+def encode_stop(stopped, version, timestamp=None):
+    """bin1 frame for a stop/resume transition"""
+    return _FRAME.pack(MAGIC_V1, KIND_STOP, FLAG_STOPPED if stopped else 0, 0, 0, 0,
+                       int(version) & 0xFFFFFFFF, time.time() if timestamp is None else timestamp)
+
+
+def encode_delta(changes, seq, timestamp=None):
+    """bin1 delta frame for a partial state, or None if it has fields or values a frame cannot carry"""
+    flags = 0
+    codes = [0, 0, 0]
+    for key, value in changes.items():
+        if key == 'stopped':
+            flags |= FLAG_HAS_STOPPED | (FLAG_STOPPED if value else 0)
+        elif key != 'hand' or not isinstance(value, dict):
+            return None
+    hand = changes.get('hand', {})
+    fields = [(hand.get('right'), 'horizontal', 0, _HORIZONTAL_CODES, FLAG_HAS_RIGHT_H),
+              (hand.get('left'), 'horizontal', 1, _HORIZONTAL_CODES, FLAG_HAS_LEFT_H),
+              (hand.get('left'), 'vertical', 2, _VERTICAL_CODES, FLAG_HAS_LEFT_V)]
+    if set(hand) - {'right', 'left'}:
+        return None
+    for side in hand.values():
+        if not isinstance(side, dict) or set(side) - {'horizontal', 'vertical'}:
+            return None
+    for side, field, index, table, flag in fields:
+        if side is not None and field in side:
+            code = table.get(side[field]) if isinstance(side[field], str) else None
+            if code is None:
+                return None
+            codes[index] = code
+            flags |= flag
+    return _FRAME.pack(MAGIC_V1, KIND_DELTA, flags, codes[0], codes[1], codes[2], int(seq) & 0xFFFFFFFF,
+                       time.time() if timestamp is None else timestamp)
+
+
+def restamp(frame, timestamp=None):
+    """Copy of a bin1 frame with its timestamp set to now (or timestamp); JSON payloads are returned as is"""
+    if len(frame) != FRAME_SIZE or frame[0] != MAGIC_V1:
+        return frame
+    stamped = bytearray(frame)
+    _TIMESTAMP.pack_into(stamped, _TIMESTAMP_OFFSET, time.time() if timestamp is None else timestamp)
+    return bytes(stamped)
+
+
+def peek_sequence(payload):
+    """Sequence field of a bin1 frame without decoding the rest (None for JSON or other sizes)"""
+    if len(payload) != FRAME_SIZE or payload[0] != MAGIC_V1:
+        return None
+    return _SEQUENCE.unpack_from(payload, 6)[0]
+
+
+def peek_stamp(payload):
+    """(sequence, timestamp) fields of a bin1 frame without decoding the rest (None for JSON or other sizes)"""
+    if len(payload) != FRAME_SIZE or payload[0] != MAGIC_V1:
+        return None
+    return _STAMP.unpack_from(payload, 6)
+
+
+def decode(payload):
+    """Decode a command in either format into the JSON document shape
+
+    State frames decode to {'stopped', 'hand', 'version', 'timestamp'}, stop
+    frames to {'stopped', 'version', 'timestamp'}, delta frames to
+    {'seq', 'timestamp'} plus the fields they carry. Raises ValueError for
+    malformed frames and binary versions this module does not know.
+    """
+    if not payload:
+        raise ValueError("empty payload")
+    first = payload[0]
+    if isinstance(first, str):
+        first = ord(first)
+    if first < 0x80:
+        return json.loads(payload)
+    if first != MAGIC_V1:
+        raise ValueError(f"unsupported wire format version 0x{first:02x}")
+    if len(payload) != FRAME_SIZE:
+        raise ValueError(f"bin1 frame must be {FRAME_SIZE} bytes, got {len(payload)}")
+    _, kind, flags, right_h, left_h, left_v, sequence, timestamp = _FRAME.unpack(payload)
+    if kind == KIND_STOP:
+        return {'stopped': bool(flags & FLAG_STOPPED), 'version': sequence, 'timestamp': timestamp}
+    if kind == KIND_DELTA:
+        return _decode_delta(flags, right_h, left_h, left_v, sequence, timestamp)
+    if kind != KIND_STATE:
+        raise ValueError(f"unknown bin1 frame kind {kind}")
+    try:
+        return {
+            'stopped': bool(flags & FLAG_STOPPED),
+            'hand': {
+                'right': {'horizontal': HORIZONTAL[right_h], 'active': bool(flags & FLAG_RIGHT_ACTIVE)},
+                'left': {'horizontal': HORIZONTAL[left_h], 'vertical': VERTICAL[left_v],
+                         'active': bool(flags & FLAG_LEFT_ACTIVE)}
+            },
+            'version': sequence,
+            'timestamp': timestamp
+        }
+    except IndexError:
+        raise ValueError("bin1 enum code out of range") from None
+
+
+def _decode_delta(flags, right_h, left_h, left_v, sequence, timestamp):
+    frame = {'seq': sequence, 'timestamp': timestamp}
+    if flags & FLAG_HAS_STOPPED:
+        frame['stopped'] = bool(flags & FLAG_STOPPED)
+    try:
+        hand = {}
+        if flags & FLAG_HAS_RIGHT_H:
+            hand['right'] = {'horizontal': HORIZONTAL[right_h]}
+        if flags & FLAG_HAS_LEFT_H:
+            hand.setdefault('left', {})['horizontal'] = HORIZONTAL[left_h]
+        if flags & FLAG_HAS_LEFT_V:
+            hand.setdefault('left', {})['vertical'] = VERTICAL[left_v]
+    except IndexError:
+        raise ValueError("bin1 enum code out of range") from None
+    if hand:
+        frame['hand'] = hand
+    return frame
+
+
+def parse_offer(payload):
+    """Formats a robot announced (b"bin1,json" or b'["bin1", "json"]'), in its order of preference"""
+    if isinstance(payload, bytes):
+        payload = payload.decode('utf-8', 'replace')
+    payload = payload.strip()[:256]
+    if payload.startswith('['):
+        try:
+            offered = json.loads(payload)
+        except ValueError:
+            return []
+        return [str(name).strip().lower() for name in offered if isinstance(name, str)]
+    return [name.strip().lower() for name in payload.split(',') if name.strip()]
+
+
+def choose_format(offered):
+    """First offered format this server supports, or None"""
+    for name in offered:
+        if name in SUPPORTED_FORMATS:
+            return name
+    return None
+
+
+def capability_topic(topic):
+    return f"{topic}/{CAPABILITY_SUFFIX}"
+
+
+def capability_subscriptions(base_topic):
+    """Topic filters covering the capability topic of every robot under base_topic"""
+    return [capability_topic(base_topic), f"{base_topic}/+/{CAPABILITY_SUFFIX}"]
+
+
+class WireFormats:
+    """Per-topic negotiated format plus payload counters; safe to use from any thread"""
+
+    def __init__(self, default=FORMAT_JSON):
+        if default not in SUPPORTED_FORMATS:
+            raise ValueError(f"unsupported wire format: {default}")
+        self.default = default
+        self._formats = {}
+        self._lock = threading.Lock()
+        self._messages = {name: 0 for name in SUPPORTED_FORMATS}
+        self._bytes = {name: 0 for name in SUPPORTED_FORMATS}
+        self._fallbacks = 0
+        self._negotiations = 0
+
+    def format_for(self, topic):
+        return self._formats.get(topic, self.default)
+
+    def negotiate(self, topic, offered):
+        """Use the robot's preferred supported format on topic; an empty offer resets to the default"""
+        chosen = choose_format(offered)
+        with self._lock:
+            self._negotiations += 1
+            if chosen is None:
+                self._formats.pop(topic, None)
+            else:
+                self._formats[topic] = chosen
+        if offered and chosen is None:
+            events.warning('mqtt.format_unsupported', "⚠️ Robot offered no supported wire format",
+                           topic=topic, offered=offered, default=self.default)
+        else:
+            events.info('mqtt.format_negotiated', "🔧 Wire format negotiated", topic=topic,
+                        format=chosen or self.default)
+        return chosen or self.default
+
+    def on_capability(self, topic, payload):
+        """Handle a message on a <state topic>/format capability topic"""
+        suffix = '/' + CAPABILITY_SUFFIX
+        if not topic.endswith(suffix):
+            return None
+        return self.negotiate(topic[:-len(suffix)], parse_offer(payload))
+
+    def state_payload(self, topic, store, json_payload):
+        """Payload for a state snapshot on topic: store's cached bin1 frame or its cached JSON
+
+        The frame is encoded once per state version but stamped with the time
+        of each send, so a republished version does not carry a stale timestamp.
+        """
+        if self.format_for(topic) == FORMAT_BINARY:
+            _, payload = store.encoded(encode_state)
+            if payload is not None:
+                return self._count(FORMAT_BINARY, restamp(payload))
+            self._count_fallback()
+        return self._count(FORMAT_JSON, json_payload)
+
+    def stop_payload(self, topic, robot_id, stopped, version):
+        """Payload for a stop/resume transition for the robot publishing state on topic"""
+        if self.format_for(topic) == FORMAT_BINARY:
+            return self._count(FORMAT_BINARY, encode_stop(stopped, version))
+        return self._count(FORMAT_JSON, json.dumps({
+            'robot_id': robot_id,
+            'stopped': bool(stopped),
+            'version': version,
+            'timestamp': time.time()
+        }))
+
+    def encode(self, topic, data):
+        """Serialize an arbitrary document for topic (bin1 only if it is a robot state)"""
+        if self.format_for(topic) == FORMAT_BINARY:
+            payload = encode_state(data)
+            if payload is not None:
+                return self._count(FORMAT_BINARY, payload)
+            self._count_fallback()
+        return self._count(FORMAT_JSON, json.dumps(data))
+
+    def _count(self, name, payload):
+        with self._lock:
+            self._messages[name] += 1
+            self._bytes[name] += len(payload)
+        return payload
+
+    def _count_fallback(self):
+        with self._lock:
+            self._fallbacks += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'default': self.default,
+                'supported': list(SUPPORTED_FORMATS),
+                'topics': dict(self._formats),
+                'negotiations': self._negotiations,
+                'messages': dict(self._messages),
+                'bytes': dict(self._bytes),
+                'json_fallbacks': self._fallbacks
+            }
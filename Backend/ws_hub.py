@@ -0,0 +1,277 @@
+"""
+WebSocket fan-out hub
+Every connected client gets its own bounded outbound queue and writer, so a
+slow or stuck socket never delays the code that broadcasts an update.
+ClientConnection uses a writer thread (Flask / flask_sock), AsyncClientConnection
+a writer task (asyncio / ASGI).
+"""
+
+import asyncio
+import contextlib
+import itertools
+import threading
+import time
+from collections import deque
+
+from event_log import events
+
+# Outbound queue policies
+POLICY_LATEST = 'latest'            # keep only the newest pending message
+POLICY_DROP_OLDEST = 'drop_oldest'  # bounded FIFO, oldest message is discarded
+
+
+class _QueuedClient:
+    """Queueing policy, slow-client tracking and metrics shared by both writers"""
+
+    def __init__(self, client_id, remote_addr, max_queue, policy, lock):
+        self.client_id = client_id
+        self.remote_addr = remote_addr
+        self.policy = policy
+        self.max_queue = 1 if policy == POLICY_LATEST else max_queue
+        self.connected_at = time.time()
+        self.closed = False
+        # False for ingest-only protocol clients that asked not to get state broadcasts
+        self.subscribed = True
+
+        self._queue = deque()
+        # Protocol replies (welcome, acks) go out ahead of state and are never dropped
+        self._control = deque()
+        self._lock = lock
+        self._full_since = None
+
+        self.sent = 0
+        self.dropped = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def send(self, payload):
+        """Queue payload for this client without blocking"""
+        now = time.monotonic()
+        with self._lock:
+            if self.closed:
+                return False
+            if len(self._queue) >= self.max_queue:
+                # Coalesce / drop-oldest: the newest message always gets in
+                self._queue.popleft()
+                self.dropped += 1
+                if self._full_since is None:
+                    self._full_since = now
+            self._queue.append((now, payload))
+            self._wake()
+        return True
+
+    def send_control(self, payload, replace=False):
+        """Queue a protocol reply ahead of pending state; replace=True supersedes a still-unsent replaceable one"""
+        now = time.monotonic()
+        with self._lock:
+            if self.closed:
+                return False
+            if replace and self._control and self._control[-1][2]:
+                self._control[-1] = (now, payload, True)
+            else:
+                self._control.append((now, payload, replace))
+            self._wake()
+        return True
+
+    def full_for(self, now=None):
+        """Seconds the queue has continuously been at capacity (0 if it is draining)"""
+        with self._lock:
+            if self._full_since is None:
+                return 0.0
+            return (now or time.monotonic()) - self._full_since
+
+    def metrics(self):
+        now = time.monotonic()
+        with self._lock:
+            oldest_age = now - self._queue[0][0] if self._queue else 0.0
+            return {
+                'id': self.client_id,
+                'remote_addr': self.remote_addr,
+                'policy': self.policy,
+                'subscribed': self.subscribed,
+                'queue_depth': len(self._queue),
+                'max_queue': self.max_queue,
+                'sent': self.sent,
+                'dropped': self.dropped,
+                'pending_age_ms': round(oldest_age * 1000, 3),
+                'last_lag_ms': round(self.last_lag * 1000, 3),
+                'max_lag_ms': round(self.max_lag * 1000, 3),
+                'connected_for_s': round(time.time() - self.connected_at, 1)
+            }
+
+    def _pending(self):
+        # Caller holds the lock
+        return bool(self._queue or self._control)
+
+    def _pop(self):
+        # Caller holds the lock
+        if self._control:
+            enqueued_at, payload, _ = self._control.popleft()
+            return enqueued_at, payload
+        enqueued_at, payload = self._queue.popleft()
+        if len(self._queue) < self.max_queue:
+            self._full_since = None
+        return enqueued_at, payload
+
+    def _record_sent(self, enqueued_at):
+        lag = time.monotonic() - enqueued_at
+        with self._lock:
+            self.sent += 1
+            self.last_lag = lag
+            if lag > self.max_lag:
+                self.max_lag = lag
+
+    def _wake(self):
+        raise NotImplementedError
+
+
+class ClientConnection(_QueuedClient):
+    """One flask_sock client with its own send queue and writer thread"""
+
+    def __init__(self, ws, client_id, remote_addr=None, max_queue=32, policy=POLICY_LATEST):
+        super().__init__(client_id, remote_addr, max_queue, policy, threading.Condition())
+        self.ws = ws
+        self._thread = threading.Thread(target=self._run, name=f"ws-writer-{client_id}", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop the writer and close the socket"""
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            self._queue.clear()
+            self._control.clear()
+            self._lock.notify_all()
+        try:
+            self.ws.close()
+        except Exception:
+            pass
+
+    def _wake(self):
+        self._lock.notify()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self.closed and not self._pending():
+                    self._lock.wait()
+                if self.closed:
+                    return
+                enqueued_at, payload = self._pop()
+
+            try:
+                self.ws.send(payload)
+            except Exception:
+                self.close()
+                return
+
+            self._record_sent(enqueued_at)
+
+
+class AsyncClientConnection(_QueuedClient):
+    """One ASGI WebSocket client with its own send queue and writer task"""
+
+    def __init__(self, send, client_id, remote_addr=None, max_queue=32, policy=POLICY_LATEST):
+        # Everything runs on the event loop thread, so no real lock is needed
+        super().__init__(client_id, remote_addr, max_queue, policy, contextlib.nullcontext())
+        self._asgi_send = send
+        self._ready = asyncio.Event()
+        # The route handler waits on this to end the connection from our side
+        self.closed_event = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def close(self):
+        """Stop the writer (even mid-send) and signal the route handler to hang up"""
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.clear()
+        self._control.clear()
+        self._task.cancel()
+        self.closed_event.set()
+
+    def _wake(self):
+        self._ready.set()
+
+    async def _run(self):
+        while not self.closed:
+            await self._ready.wait()
+            self._ready.clear()
+            while self._pending() and not self.closed:
+                enqueued_at, payload = self._pop()
+                try:
+                    if isinstance(payload, bytes):
+                        await self._asgi_send({'type': 'websocket.send', 'bytes': payload})
+                    else:
+                        await self._asgi_send({'type': 'websocket.send', 'text': payload})
+                except Exception:
+                    self.closed = True
+                    self.closed_event.set()
+                    return
+                self._record_sent(enqueued_at)
+
+
+class WebSocketHub:
+    """Tracks connected clients and fans messages out through their queues"""
+
+    connection_class = ClientConnection
+
+    def __init__(self, max_queue=32, policy=POLICY_LATEST, slow_client_timeout=5.0):
+        self.max_queue = max_queue
+        self.policy = policy
+        self.slow_client_timeout = slow_client_timeout
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.evicted = 0
+
+    def register(self, ws, remote_addr=None):
+        """Wrap ws (a flask_sock socket or an ASGI send callable) in a queued connection"""
+        conn = self.connection_class(ws, next(self._ids), remote_addr, self.max_queue, self.policy)
+        with self._lock:
+            self._clients[conn.client_id] = conn
+        return conn
+
+    def unregister(self, conn):
+        with self._lock:
+            self._clients.pop(conn.client_id, None)
+        conn.close()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def broadcast(self, payload):
+        """Queue payload for every client and disconnect the ones that stay backed up"""
+        with self._lock:
+            conns = list(self._clients.values())
+
+        now = time.monotonic()
+        for conn in conns:
+            if conn.closed:
+                self.unregister(conn)
+            elif conn.full_for(now) > self.slow_client_timeout:
+                events.warning('ws.slow_client', "🐢 Disconnecting slow WebSocket client", client=conn.client_id,
+                               remote_addr=conn.remote_addr)
+                self.evicted += 1
+                self.unregister(conn)
+            elif conn.subscribed:
+                conn.send(payload)
+
+    def metrics(self):
+        with self._lock:
+            conns = list(self._clients.values())
+        return {
+            'connected': len(conns),
+            'policy': self.policy,
+            'max_queue': self.max_queue,
+            'slow_client_timeout_s': self.slow_client_timeout,
+            'evicted': self.evicted,
+            'clients': [conn.metrics() for conn in conns]
+        }
+
+
+class AsyncWebSocketHub(WebSocketHub):
+    """WebSocketHub for the asyncio server; register() takes the ASGI send callable"""
+
+    connection_class = AsyncClientConnection
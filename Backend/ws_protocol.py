@@ -0,0 +1,195 @@
+"""
+WebSocket ingestion protocol
+A client that opens /ws (or /ws/<id>) and sends a hello switches that socket
+from fire-and-forget state messages to sequenced frames with acks:
+
+  -> {"op": "hello", "session": "lens-42", "subscribe": false, "ack_every": 16, "ack_ms": 50}
+  <- {"op": "welcome", "protocol": 1, "session": "lens-42", "last_seq": 120, "version": 57,
+      "ack_every": 16, "ack_ms": 50, "binary": "bin1"}
+  -> {"op": "delta", "seq": 121, "timestamp": 1700000000.25, "hand": {"right": {"horizontal": "left"}}}
+  -> 18-byte bin1 delta frame (wire_format.encode_delta) with seq 122
+  <- {"op": "ack", "seq": 122, "version": 58, "frames": 2, "stale": 0, "invalid": 0, "throttled": 0}
+  <- {"op": "throttle", "reason": "rate_limited", "retry_after_ms": 250, "seq": 122}
+
+- session: client session id; seq numbering is per session and shared with
+  /api/robots/<id>/batch. welcome.last_seq is the highest seq already applied
+  for it, so a reconnecting client resends only what came after.
+- subscribe: false makes the socket ingest-only (no state broadcasts).
+- Frames are partial states (only the fields that changed) or gesture events,
+  validated and applied like batch frames (batch_ingest.ingest_batch); frames
+  at or below the last applied seq are dropped, binary ones before decoding.
+- Acks are cumulative: one goes out after ack_every frames or ack_ms after the
+  first unacknowledged one, and at once for a stop/resume, carrying the
+  highest applied seq, the state version it produced and running totals of
+  frames received, stale and invalid on this socket (so a newer ack can
+  replace an unsent older one).
+- Throttle: admission control (admission.py) refused a frame; it and every
+  other non-stop frame for retry_after_ms are dropped (counted as throttled).
+  seq is the last applied one, so the client resends from seq + 1 after the
+  wait. Fire-and-forget sockets get the same message, without seq.
+Messages without "op" keep the original fire-and-forget behaviour.
+"""
+
+import json
+import math
+import time
+
+import metrics
+from admission import is_urgent
+from batch_ingest import ingest_batch, SESSION_KEY
+from wire_format import FORMAT_BINARY, peek_sequence, decode
+
+PROTOCOL_VERSION = 1
+OP_KEY = 'op'
+OP_HELLO = 'hello'
+OP_DELTA = 'delta'
+
+# Bounds on what a client may ask for in its hello
+ACK_EVERY_RANGE = (1, 1000)
+ACK_MS_RANGE = (1, 5000)
+
+
+def is_hello(message):
+    return isinstance(message, dict) and message.get(OP_KEY) == OP_HELLO
+
+
+def throttle_message(decision, seq=None):
+    """Tell a client its frames are being dropped by admission control, and for how long"""
+    reason, retry_after = decision
+    message = {OP_KEY: 'throttle', 'reason': reason, 'retry_after_ms': math.ceil(retry_after * 1000)}
+    if seq is not None:
+        message['seq'] = seq
+    return json.dumps(message)
+
+
+def _bounded(value, default, bounds):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return default
+    return min(max(value, bounds[0]), bounds[1])
+
+
+class IngestStream:
+    """Protocol state for one WebSocket connection after its hello"""
+
+    def __init__(self, hello, ack_every, ack_ms):
+        session = hello.get(SESSION_KEY)
+        self.client_session = None if session is None else str(session)[:128]
+        self.subscribe = bool(hello.get('subscribe', True))
+        self.ack_every = _bounded(hello.get('ack_every'), ack_every, ACK_EVERY_RANGE)
+        self.ack_interval = _bounded(hello.get('ack_ms'), ack_ms, ACK_MS_RANGE) / 1000.0
+        self.last_seq = None
+        self.frames = 0
+        self.stale = 0
+        self.invalid = 0
+        self.throttled = 0
+        # admission.SocketThrottle set by the server, and the throttle message waiting to go out
+        self.throttle = None
+        self.notice = None
+        self._unacked = 0
+        self._first_unacked_at = None
+        self._urgent = False
+
+    def welcome(self, robot_session):
+        tracker = robot_session.sequence
+        with tracker.lock:
+            # This client's own session, however many others have sent since
+            self.last_seq = tracker.last_seq_for(self.client_session)
+        return json.dumps({
+            OP_KEY: 'welcome',
+            'protocol': PROTOCOL_VERSION,
+            'session': self.client_session,
+            'last_seq': self.last_seq,
+            'version': robot_session.state_store.version,
+            'ack_every': self.ack_every,
+            'ack_ms': round(self.ack_interval * 1000),
+            'binary': FORMAT_BINARY
+        })
+
+    def receive(self, robot_session, data, now):
+        """Apply one frame (JSON text or bin1 bytes); returns the versions it created [(version, delta)]"""
+        self._count_frame()
+        if isinstance(data, (bytes, bytearray)) and data[:1] != b'{':
+            seq = peek_sequence(data)
+            if seq is not None and self._is_stale(robot_session, seq):
+                # Duplicate or late: dropped without decoding
+                return self._result('stale', [])
+            try:
+                frame = decode(bytes(data))
+            except (ValueError, UnicodeDecodeError):
+                return self._result('invalid', [])
+        else:
+            try:
+                frame = json.loads(data)
+            except ValueError:
+                return self._result('invalid', [])
+            if not isinstance(frame, dict) or frame.pop(OP_KEY, OP_DELTA) != OP_DELTA:
+                return self._result('invalid', [])
+
+        if self.throttle is not None and not self._admit(robot_session, frame):
+            return self._result('throttled', [])
+
+        if self.client_session is not None:
+            frame[SESSION_KEY] = self.client_session
+        created, report = ingest_batch(robot_session, [frame], now)
+        self.last_seq = report['last_seq']
+        if report['stale']:
+            return self._result('stale', created)
+        if report['invalid']:
+            return self._result('invalid', created)
+        if any('stopped' in delta for _, delta in created):
+            self._urgent = True
+        return self._result('applied', created)
+
+    def _admit(self, robot_session, frame):
+        admitted, decision = self.throttle.admit(is_urgent(frame, robot_session.state_store.peek('stopped')))
+        if decision is not None:
+            self.notice = throttle_message(decision, self.last_seq)
+        return admitted
+
+    def _is_stale(self, robot_session, seq):
+        tracker = robot_session.sequence
+        with tracker.lock:
+            return tracker.is_stale(self.client_session, seq)
+
+    def _count_frame(self):
+        if not self._unacked:
+            self._first_unacked_at = time.monotonic()
+        self._unacked += 1
+        self.frames += 1
+
+    def _result(self, result, created):
+        if result == 'stale':
+            self.stale += 1
+        elif result == 'invalid':
+            self.invalid += 1
+        elif result == 'throttled':
+            self.throttled += 1
+        metrics.WS_FRAMES.inc(result)
+        return created
+
+    def ack_timeout(self, now=None):
+        """Seconds until an ack is due (0 if it is due now), or None with nothing to acknowledge"""
+        if not self._unacked:
+            return None
+        if self._urgent or self._unacked >= self.ack_every:
+            return 0.0
+        return max(0.0, self._first_unacked_at + self.ack_interval - (now or time.monotonic()))
+
+    def ack(self, version):
+        """Cumulative ack for everything received so far"""
+        payload = json.dumps({
+            OP_KEY: 'ack',
+            'seq': self.last_seq,
+            'version': version,
+            'frames': self.frames,
+            'stale': self.stale,
+            'invalid': self.invalid,
+            'throttled': self.throttled
+        })
+        self._unacked = 0
+        self._first_unacked_at = None
+        self._urgent = False
+        metrics.WS_ACKS.inc()
+        return payload